@@ -0,0 +1,85 @@
+"""
+Benchmark compiling independent modules from several threads.
+
+Each module is parsed, optimized and emitted as object code in its own
+LLVM context.  With the "context" lock mode, the threads don't serialize
+on the global llvmlite lock and the throughput scales with the number
+of cores.
+"""
+
+import os
+import sys
+import threading
+from time import perf_counter
+
+from llvmlite import binding as llvm
+from llvmlite import ir
+
+llvm.initialize()
+llvm.initialize_native_target()
+llvm.initialize_native_asmprinter()
+
+
+def make_ir(nfuncs=20):
+    i64 = ir.IntType(64)
+    mod = ir.Module()
+    mod.triple = llvm.get_default_triple()
+    for n in range(nfuncs):
+        fn = ir.Function(mod, ir.FunctionType(i64, [i64, i64]),
+                         name="poly{0}".format(n))
+        builder = ir.IRBuilder(fn.append_basic_block())
+        x, y = fn.args
+        acc = x
+        for k in range(50):
+            acc = builder.add(builder.mul(acc, x), y)
+            acc = builder.xor(acc, i64(k * n + 1))
+        builder.ret(acc)
+    return str(mod)
+
+
+def compile_modules(llvmir, count, target, opt, lock_mode):
+    tm = target.create_target_machine(opt=opt)
+    for _ in range(count):
+        context = llvm.create_context(lock_mode)
+        mod = llvm.parse_assembly(llvmir, context)
+        with llvm.create_module_pass_manager() as pm:
+            with llvm.create_pass_manager_builder() as pmb:
+                pmb.opt_level = opt
+                pmb.populate(pm)
+            pm.run(mod)
+        tm.emit_object(mod)
+        mod.close()
+
+
+def run(nthreads, modules_per_thread, llvmir, target, lock_mode, opt=2):
+    threads = [threading.Thread(target=compile_modules,
+                                args=(llvmir, modules_per_thread, target,
+                                      opt, lock_mode))
+               for _ in range(nthreads)]
+    t = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dt = perf_counter() - t
+    return nthreads * modules_per_thread / dt
+
+
+if __name__ == "__main__":
+    # Usage: parallel_compile.py [global|context] [max threads]
+    lock_mode = sys.argv[1] if len(sys.argv) > 1 else 'context'
+    if len(sys.argv) > 2:
+        maxthreads = int(sys.argv[2])
+    else:
+        maxthreads = os.cpu_count() or 1
+    llvmir = make_ir()
+    target = llvm.Target.from_default_triple()
+    print("lock mode: {0}".format(lock_mode))
+    base = None
+    nthreads = 1
+    while nthreads <= maxthreads:
+        rate = run(nthreads, 8, llvmir, target, lock_mode)
+        base = base or rate
+        print("{0:3d} threads: {1:7.1f} modules/s ({2:.2f}x)"
+              .format(nthreads, rate, rate / base))
+        nthreads *= 2
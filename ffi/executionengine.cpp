@@ -12,6 +12,7 @@
 #include "llvm/ExecutionEngine/ObjectCache.h"
 #include "llvm/Support/Memory.h"
 
+#include <cstdint>
 #include <cstdio>
 #include <memory>
 
@@ -233,8 +234,9 @@ public:
     }
 
     // MCJIT will call this function before compiling any module
-    // MCJIT takes ownership of both the MemoryBuffer object and the memory
-    // to which it refers.
+    // MCJIT takes ownership of the MemoryBuffer object, but not of the
+    // memory to which it refers: the caller keeps it alive as long as
+    // the execution engine.
     virtual std::unique_ptr<llvm::MemoryBuffer> getObject(const llvm::Module* M)
     {
         std::unique_ptr<llvm::MemoryBuffer> res = nullptr;
@@ -244,11 +246,13 @@ public:
 
             getobject_func(user_data, &data);
             if (data.buf_ptr && data.buf_len > 0) {
-                // Assume the returned string was allocated
-                // with LLVMPY_CreateByteString
-                res = llvm::MemoryBuffer::getMemBufferCopy(
-                    llvm::StringRef(data.buf_ptr, data.buf_len));
-                LLVMPY_DisposeString(data.buf_ptr);
+                llvm::StringRef buf(data.buf_ptr, data.buf_len);
+                if (reinterpret_cast<uintptr_t>(data.buf_ptr) % 16) {
+                    // Object file parsing needs an aligned buffer
+                    res = llvm::MemoryBuffer::getMemBufferCopy(buf);
+                } else {
+                    res = llvm::MemoryBuffer::getMemBuffer(buf, "", false);
+                }
             }
         }
         return res;
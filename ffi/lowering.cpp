@@ -0,0 +1,1467 @@
+/*
+ * Direct construction of a LLVM module from a llvmlite.ir module.
+ *
+ * The Python side (llvmlite/binding/lowering.py) walks the llvmlite.ir
+ * objects and encodes them as a flat stream of 64-bit integer records,
+ * plus a table holding all the strings.  This file decodes that stream
+ * and builds the corresponding llvm::Module, which avoids formatting the
+ * module to textual IR and parsing it back.
+ *
+ * Each record is laid out as [code, nops, op0, op1, ...].  Types, values
+ * and metadata nodes are referred to by their index in separate tables.
+ * Strings are referred to by an (offset, length) pair into the string
+ * table.  Values are given an explicit id by the record defining them;
+ * a value used before its definition (e.g. by a phi node) is first
+ * declared by a REC_FORWARD record.
+ *
+ * The record codes below must be kept in sync with lowering.py.
+ */
+
+#include "core.h"
+
+#include "llvm/ADT/StringMap.h"
+#include "llvm/AsmParser/Parser.h"
+#include "llvm/AsmParser/SlotMapping.h"
+#include "llvm/IR/Attributes.h"
+#include "llvm/IR/AutoUpgrade.h"
+#include "llvm/IR/Constants.h"
+#include "llvm/IR/DerivedTypes.h"
+#include "llvm/IR/IRBuilder.h"
+#include "llvm/IR/InlineAsm.h"
+#include "llvm/IR/Instructions.h"
+#include "llvm/IR/LLVMContext.h"
+#include "llvm/IR/Metadata.h"
+#include "llvm/IR/Module.h"
+#include "llvm/IR/NoFolder.h"
+#include "llvm/Support/SourceMgr.h"
+#include "llvm/Support/raw_ostream.h"
+
+#include <cstring>
+#include <string>
+#include <vector>
+
+using namespace llvm;
+
+namespace {
+
+enum RecordCode {
+    // Types
+    REC_TYPE_VOID = 1,
+    REC_TYPE_LABEL = 2,
+    REC_TYPE_METADATA = 3,
+    REC_TYPE_HALF = 4,
+    REC_TYPE_FLOAT = 5,
+    REC_TYPE_DOUBLE = 6,
+    REC_TYPE_INT = 7,           // [width]
+    REC_TYPE_POINTER = 8,       // [pointee, addrspace]
+    REC_TYPE_ARRAY = 9,         // [element, count]
+    REC_TYPE_VECTOR = 10,       // [element, count]
+    REC_TYPE_STRUCT = 11,       // [packed, elements...]
+    REC_TYPE_NAMED = 12,        // [name]
+    REC_TYPE_BODY = 13,         // [type, packed, elements...]
+    REC_TYPE_FUNCTION = 14,     // [return, vararg, args...]
+
+    // Module and global values
+    REC_MODULE = 20,            // [triple, datalayout]
+    REC_GLOBALVAR = 21,         // [id, type, addrspace, name]
+    REC_FUNCTION = 22,          // [id, fnty, name]
+    REC_LINKAGE = 23,           // [id, linkage]
+    REC_STORAGE = 24,           // [id, storage class]
+    REC_UNNAMED_ADDR = 25,      // [id]
+    REC_CONSTANT = 26,          // [id]
+    REC_ALIGN = 27,             // [id, align]
+    REC_INITIALIZER = 28,       // [id, value]
+    REC_CCONV = 29,             // [id, cconv]
+    REC_ATTRIBUTE = 30,         // [id, index, name, value]
+    REC_PERSONALITY = 31,       // [id, fn]
+    REC_ARGUMENT = 32,          // [fn, argno, id, name]
+    REC_BLOCK = 33,             // [id, fn, name]
+    REC_FORWARD = 34,           // [id, type]
+    REC_POSITION = 35,          // [block]
+    REC_GLOBAL_MD = 36,         // [id, kind, md]
+
+    // Constants and other non-instruction values
+    REC_CST_INT = 40,           // [id, type, words...]
+    REC_CST_FP = 41,            // [id, type, double bits]
+    REC_CST_NULL = 42,          // [id, type]
+    REC_CST_UNDEF = 43,         // [id, type]
+    REC_CST_AGGREGATE = 44,     // [id, type, elements...]
+    REC_CST_DATA = 45,          // [id, type, data]
+    REC_CST_TEXT = 46,          // [id, text]
+    REC_CST_BLOCKADDR = 47,     // [id, fn, block]
+    REC_INLINE_ASM = 48,        // [id, fnty, side effect, asm, constraint]
+    REC_MD_AS_VALUE = 49,       // [id, md]
+
+    // Metadata
+    REC_MD_STRING = 60,         // [md, string]
+    REC_MD_VALUE = 61,          // [md, value]
+    REC_MD_NODE = 62,           // [md, mds... (-1 for null)]
+    REC_MD_NAMED = 63,          // [name, mds...]
+    REC_MD_ATTACH = 64,         // [instr, kind, md]
+
+    // Instructions: [id, name, ...]
+    REC_INST_BINOP = 80,        // [opcode, flags, lhs, rhs]
+    REC_INST_CAST = 81,         // [opcode, value, type]
+    REC_INST_ICMP = 82,         // [predicate, lhs, rhs]
+    REC_INST_FCMP = 83,         // [predicate, flags, lhs, rhs]
+    REC_INST_SELECT = 84,       // [cond, lhs, rhs]
+    REC_INST_LOAD = 85,         // [type, ptr, align]
+    REC_INST_STORE = 86,        // [value, ptr, align]
+    REC_INST_LOAD_ATOMIC = 87,  // [type, ptr, ordering, align]
+    REC_INST_STORE_ATOMIC = 88, // [value, ptr, ordering, align]
+    REC_INST_ALLOCA = 89,       // [type, count or -1, align]
+    REC_INST_GEP = 90,          // [type, inbounds, ptr, indices...]
+    REC_INST_PHI = 91,          // [type, (value, block)...]
+    REC_INST_CALL = 92,         // [fnty, callee, cconv, tail, flags, args...]
+    REC_INST_INVOKE = 93,       // [fnty, callee, cconv, normal, unwind,
+                                //  args...]
+    REC_INST_RET = 94,          // [value or -1]
+    REC_INST_BR = 95,           // [block]
+    REC_INST_CONDBR = 96,       // [cond, iftrue, iffalse]
+    REC_INST_SWITCH = 97,       // [value, default, (value, block)...]
+    REC_INST_INDIRECTBR = 98,   // [address, blocks...]
+    REC_INST_RESUME = 99,       // [value]
+    REC_INST_UNREACHABLE = 100, // []
+    REC_INST_EXTRACTVALUE = 101,    // [aggregate, indices...]
+    REC_INST_INSERTVALUE = 102,     // [aggregate, value, indices...]
+    REC_INST_EXTRACTELEMENT = 103,  // [vector, index]
+    REC_INST_INSERTELEMENT = 104,   // [vector, value, index]
+    REC_INST_SHUFFLEVECTOR = 105,   // [vector1, vector2, mask]
+    REC_INST_ATOMICRMW = 106,   // [op, ptr, value, ordering]
+    REC_INST_CMPXCHG = 107,     // [ptr, cmp, value, ordering, failordering]
+    REC_INST_FENCE = 108,       // [ordering, scope (length -1 for none)]
+    REC_INST_LANDINGPAD = 109,  // [type, cleanup, clauses...]
+    REC_INST_CALL_ATTR = 110,   // [call, name]
+};
+
+// Flag bits shared by binary operators, comparisons and calls
+enum {
+    FLAG_NUW = 1 << 0,
+    FLAG_NSW = 1 << 1,
+    FLAG_EXACT = 1 << 2,
+    FLAG_FAST = 1 << 8,
+    FLAG_NNAN = 1 << 9,
+    FLAG_NINF = 1 << 10,
+    FLAG_NSZ = 1 << 11,
+    FLAG_ARCP = 1 << 12,
+    FLAG_CONTRACT = 1 << 13,
+    FLAG_AFN = 1 << 14,
+    FLAG_REASSOC = 1 << 15,
+};
+
+const Instruction::BinaryOps binary_opcodes[] = {
+    Instruction::Add, Instruction::FAdd, Instruction::Sub, Instruction::FSub,
+    Instruction::Mul, Instruction::FMul, Instruction::UDiv,
+    Instruction::SDiv, Instruction::FDiv, Instruction::URem,
+    Instruction::SRem, Instruction::FRem, Instruction::Shl,
+    Instruction::LShr, Instruction::AShr, Instruction::And, Instruction::Or,
+    Instruction::Xor,
+};
+
+const Instruction::CastOps cast_opcodes[] = {
+    Instruction::Trunc, Instruction::ZExt, Instruction::SExt,
+    Instruction::FPTrunc, Instruction::FPExt, Instruction::FPToUI,
+    Instruction::FPToSI, Instruction::UIToFP, Instruction::SIToFP,
+    Instruction::PtrToInt, Instruction::IntToPtr, Instruction::BitCast,
+    Instruction::AddrSpaceCast,
+};
+
+const AtomicRMWInst::BinOp rmw_opcodes[] = {
+    AtomicRMWInst::Xchg, AtomicRMWInst::Add, AtomicRMWInst::Sub,
+    AtomicRMWInst::And, AtomicRMWInst::Nand, AtomicRMWInst::Or,
+    AtomicRMWInst::Xor, AtomicRMWInst::Max, AtomicRMWInst::Min,
+    AtomicRMWInst::UMax, AtomicRMWInst::UMin, AtomicRMWInst::FAdd,
+    AtomicRMWInst::FSub,
+};
+
+const AtomicOrdering atomic_orderings[] = {
+    AtomicOrdering::Unordered, AtomicOrdering::Monotonic,
+    AtomicOrdering::Acquire, AtomicOrdering::Release,
+    AtomicOrdering::AcquireRelease, AtomicOrdering::SequentiallyConsistent,
+};
+
+template <typename T, size_t N>
+size_t array_size(const T (&)[N]) { return N; }
+
+// Copy the raw *data* (in the host byte order) to a vector of elements,
+// as the data may not be suitably aligned.
+template <typename T>
+std::vector<T> data_elements(StringRef data) {
+    std::vector<T> elems(data.size() / sizeof(T));
+    if (!elems.empty())
+        memcpy(elems.data(), data.data(), data.size());
+    return elems;
+}
+
+template <typename T>
+Constant *int_data_array(Type *elty, StringRef data) {
+    std::vector<T> elems = data_elements<T>(data);
+    return ConstantDataArray::get(elty->getContext(), elems);
+}
+
+template <typename T>
+Constant *fp_data_array(Type *elty, StringRef data) {
+    std::vector<T> elems = data_elements<T>(data);
+#if LLVM_VERSION_MAJOR >= 11
+    return ConstantDataArray::getFP(elty, elems);
+#else
+    return ConstantDataArray::getFP(elty->getContext(), elems);
+#endif
+}
+
+// An array of integers or floating-point numbers out of its raw data
+Constant *data_array(Type *elty, StringRef data) {
+    bool is_int = elty->isIntegerTy();
+    switch (elty->getPrimitiveSizeInBits()) {
+    case 16:
+        return is_int ? int_data_array<uint16_t>(elty, data)
+                      : fp_data_array<uint16_t>(elty, data);
+    case 32:
+        return is_int ? int_data_array<uint32_t>(elty, data)
+                      : fp_data_array<uint32_t>(elty, data);
+    case 64:
+        return is_int ? int_data_array<uint64_t>(elty, data)
+                      : fp_data_array<uint64_t>(elty, data);
+    default:
+        return int_data_array<uint8_t>(elty, data);
+    }
+}
+
+/*
+ * LLVM is built without exceptions, so errors are recorded in the
+ * ModuleLowering object: operand accessors return a null value (or 0)
+ * after recording the first error, and record handlers check `failed`
+ * before building anything out of the operands.
+ */
+class ModuleLowering {
+public:
+    ModuleLowering(LLVMContext &ctx, const int64_t *code, size_t ncode,
+                   const char *strtab, size_t nstrtab)
+        : ctx(ctx), builder(ctx), code(code), ncode(ncode),
+          strtab(strtab), nstrtab(nstrtab), failed(false)
+    { }
+
+    ~ModuleLowering() {
+        // Leftover placeholders only exist on error
+        for (size_t i = 0; i < placeholders.size(); ++i) {
+            if (placeholders[i]) {
+                placeholders[i]->replaceAllUsesWith(
+                    UndefValue::get(placeholders[i]->getType()));
+                delete placeholders[i];
+            }
+        }
+    }
+
+    Module *run();
+
+    const std::string &error() const {
+        return errmsg;
+    }
+
+private:
+    LLVMContext &ctx;
+    IRBuilder<NoFolder> builder;
+    const int64_t *code;
+    size_t ncode;
+    const char *strtab;
+    size_t nstrtab;
+
+    bool failed;
+    std::string errmsg;
+
+    std::unique_ptr<Module> module;
+    std::vector<Type*> types;
+    std::vector<Value*> values;
+    std::vector<Argument*> placeholders;
+    std::vector<Metadata*> mds;
+    SlotMapping slots;
+
+    // Current record
+    int64_t rec;
+    const int64_t *ops;
+    size_t nops;
+
+    void fail(const std::string &msg) {
+        if (!failed) {
+            failed = true;
+            errmsg = msg + " (record " + std::to_string(rec) + ")";
+        }
+    }
+
+    int64_t op(size_t i) {
+        if (i >= nops) {
+            fail("truncated record");
+            return 0;
+        }
+        return ops[i];
+    }
+
+    StringRef str(size_t i) {
+        int64_t off = op(i), len = op(i + 1);
+        if (off < 0 || len < 0 || (size_t) (off + len) > nstrtab) {
+            fail("invalid string reference");
+            return StringRef();
+        }
+        return StringRef(strtab + off, len);
+    }
+
+    Type *type(size_t i) {
+        int64_t idx = op(i);
+        if (idx < 0 || (size_t) idx >= types.size()) {
+            fail("invalid type reference");
+            return nullptr;
+        }
+        return types[idx];
+    }
+
+    Value *value(size_t i) {
+        int64_t idx = op(i);
+        if (idx < 0 || (size_t) idx >= values.size() || !values[idx]) {
+            fail("invalid value reference " + std::to_string(idx));
+            return nullptr;
+        }
+        return values[idx];
+    }
+
+    template <typename T>
+    T *value_as(size_t i, const char *what) {
+        T *res = dyn_cast_or_null<T>(value(i));
+        if (!res)
+            fail(std::string("expected ") + what);
+        return res;
+    }
+
+    Metadata *md(size_t i) {
+        int64_t idx = op(i);
+        if (idx == -1)
+            return nullptr;
+        if (idx < 0 || (size_t) idx >= mds.size() || !mds[idx]) {
+            fail("invalid metadata reference");
+            return nullptr;
+        }
+        return mds[idx];
+    }
+
+    MDNode *md_node(size_t i) {
+        MDNode *node = dyn_cast_or_null<MDNode>(md(i));
+        if (!node)
+            fail("expected a metadata node");
+        return node;
+    }
+
+    AtomicOrdering ordering(size_t i) {
+        int64_t idx = op(i);
+        if (idx < 0 || (size_t) idx >= array_size(atomic_orderings)) {
+            fail("invalid atomic ordering");
+            return AtomicOrdering::NotAtomic;
+        }
+        return atomic_orderings[idx];
+    }
+
+    // Check a property of *ty* (which is null if an error occurred
+    // while decoding it), return whether lowering can go on.
+    bool check_type(Type *ty, bool valid, const char *msg) {
+        if (ty && !valid)
+            fail(msg);
+        return !failed;
+    }
+
+    void define(int64_t idx, Value *v) {
+        if (idx < 0) {
+            fail("invalid value id");
+            return;
+        }
+        if ((size_t) idx >= values.size()) {
+            values.resize(idx + 1, nullptr);
+            placeholders.resize(idx + 1, nullptr);
+        }
+        Argument *fwd = placeholders[idx];
+        if (fwd) {
+            if (fwd->getType() != v->getType()) {
+                fail("forward reference has a different type");
+                return;
+            }
+            fwd->replaceAllUsesWith(v);
+            delete fwd;
+            placeholders[idx] = nullptr;
+        } else if (values[idx]) {
+            fail("value defined twice");
+            return;
+        }
+        values[idx] = v;
+    }
+
+    void define_md(int64_t idx, Metadata *m) {
+        if (idx < 0) {
+            fail("invalid metadata id");
+            return;
+        }
+        if ((size_t) idx >= mds.size())
+            mds.resize(idx + 1, nullptr);
+        mds[idx] = m;
+    }
+
+    static FastMathFlags fastmath_flags(int64_t flags) {
+        FastMathFlags fmf;
+        if (flags & FLAG_FAST) fmf.setFast();
+        if (flags & FLAG_NNAN) fmf.setNoNaNs();
+        if (flags & FLAG_NINF) fmf.setNoInfs();
+        if (flags & FLAG_NSZ) fmf.setNoSignedZeros();
+        if (flags & FLAG_ARCP) fmf.setAllowReciprocal();
+        if (flags & FLAG_CONTRACT) fmf.setAllowContract(true);
+        if (flags & FLAG_AFN) fmf.setApproxFunc();
+        if (flags & FLAG_REASSOC) fmf.setAllowReassoc();
+        return fmf;
+    }
+
+    void set_fastmath(Instruction *inst, int64_t flags) {
+        if (!(flags & ~(FLAG_NUW | FLAG_NSW | FLAG_EXACT)))
+            return;
+        if (!isa<FPMathOperator>(inst)) {
+            fail("fast-math flags on a non floating-point instruction");
+            return;
+        }
+        inst->setFastMathFlags(fastmath_flags(flags));
+    }
+
+    template <typename T>
+    void set_alignment(T *obj, int64_t align) {
+        if (align <= 0)
+            return;
+        if (align & (align - 1)) {
+            fail("alignment is not a power of 2");
+            return;
+        }
+#if LLVM_VERSION_MAJOR >= 11
+        obj->setAlignment(Align(align));
+#else
+        obj->setAlignment(MaybeAlign(align));
+#endif
+    }
+
+    Attribute make_attribute(StringRef name, int64_t val, Type *ty);
+
+    void lower_record();
+    void lower_type();
+    void lower_global();
+    void lower_constant();
+    void lower_metadata();
+    void lower_instruction();
+    Value *lower_call();
+};
+
+
+Attribute
+ModuleLowering::make_attribute(StringRef name, int64_t val, Type *ty)
+{
+    if (name == "align" || name == "alignstack") {
+        if (val <= 0 || (val & (val - 1))) {
+            fail("alignment is not a power of 2");
+            return Attribute();
+        }
+        if (name == "align")
+            return Attribute::getWithAlignment(ctx, Align(val));
+        return Attribute::getWithStackAlignment(ctx, Align(val));
+    }
+    if (name == "dereferenceable")
+        return Attribute::getWithDereferenceableBytes(ctx, val);
+    if (name == "dereferenceable_or_null")
+        return Attribute::getWithDereferenceableOrNullBytes(ctx, val);
+    Attribute::AttrKind kind = Attribute::getAttrKindFromName(name);
+    if (kind == Attribute::None) {
+        fail("unknown attribute " + name.str());
+        return Attribute();
+    }
+#if LLVM_VERSION_MAJOR >= 12
+    // Mimic the upgrade of untyped attributes done by the IR parser
+    if (Attribute::isTypeAttrKind(kind)) {
+        PointerType *pty = dyn_cast_or_null<PointerType>(ty);
+        if (!pty) {
+            fail("attribute " + name.str() + " requires a pointer type");
+            return Attribute();
+        }
+        return Attribute::get(ctx, kind, pty->getElementType());
+    }
+#endif
+    return Attribute::get(ctx, kind);
+}
+
+void
+ModuleLowering::lower_type()
+{
+    Type *res = nullptr;
+    switch (rec) {
+    case REC_TYPE_VOID:
+        res = Type::getVoidTy(ctx);
+        break;
+    case REC_TYPE_LABEL:
+        res = Type::getLabelTy(ctx);
+        break;
+    case REC_TYPE_METADATA:
+        res = Type::getMetadataTy(ctx);
+        break;
+    case REC_TYPE_HALF:
+        res = Type::getHalfTy(ctx);
+        break;
+    case REC_TYPE_FLOAT:
+        res = Type::getFloatTy(ctx);
+        break;
+    case REC_TYPE_DOUBLE:
+        res = Type::getDoubleTy(ctx);
+        break;
+    case REC_TYPE_INT: {
+        int64_t width = op(0);
+        if (width < IntegerType::MIN_INT_BITS ||
+                width > IntegerType::MAX_INT_BITS)
+            fail("invalid integer width");
+        if (failed)
+            return;
+        res = IntegerType::get(ctx, width);
+        break;
+    }
+    case REC_TYPE_POINTER: {
+        Type *elem = type(0);
+        int64_t addrspace = op(1);
+        if (!check_type(elem, elem && PointerType::isValidElementType(elem),
+                        "invalid pointer element type"))
+            return;
+        res = PointerType::get(elem, addrspace);
+        break;
+    }
+    case REC_TYPE_ARRAY:
+    case REC_TYPE_VECTOR: {
+        Type *elem = type(0);
+        int64_t count = op(1);
+        if (rec == REC_TYPE_ARRAY) {
+            if (!check_type(elem, elem && ArrayType::isValidElementType(elem),
+                            "invalid array element type"))
+                return;
+            res = ArrayType::get(elem, count);
+        } else {
+            if (!check_type(elem, elem && VectorType::isValidElementType(elem),
+                            "invalid vector element type"))
+                return;
+            res = VectorType::get(elem, count, false);
+        }
+        break;
+    }
+    case REC_TYPE_STRUCT:
+    case REC_TYPE_BODY: {
+        bool is_body = rec == REC_TYPE_BODY;
+        size_t first = is_body ? 2 : 1;
+        std::vector<Type*> elems;
+        for (size_t i = first; i < nops; ++i) {
+            Type *elem = type(i);
+            if (!check_type(elem, elem && StructType::isValidElementType(elem),
+                            "invalid structure element type"))
+                return;
+            elems.push_back(elem);
+        }
+        bool packed = op(first - 1) != 0;
+        if (!is_body) {
+            if (failed)
+                return;
+            res = StructType::get(ctx, elems, packed);
+            break;
+        }
+        StructType *ty = dyn_cast_or_null<StructType>(type(0));
+        if (!ty || !ty->isOpaque())
+            fail("expected an opaque identified structure type");
+        if (failed)
+            return;
+        ty->setBody(elems, packed);
+        return;
+    }
+    case REC_TYPE_NAMED: {
+        StringRef name = str(0);
+        if (failed)
+            return;
+        StructType *ty = StructType::create(ctx, name);
+        slots.NamedTypes[name] = ty;
+        res = ty;
+        break;
+    }
+    case REC_TYPE_FUNCTION: {
+        Type *ret = type(0);
+        bool vararg = op(1) != 0;
+        if (!check_type(ret, ret && FunctionType::isValidReturnType(ret),
+                        "invalid function return type"))
+            return;
+        std::vector<Type*> args;
+        for (size_t i = 2; i < nops; ++i) {
+            Type *arg = type(i);
+            if (!check_type(arg, arg && FunctionType::isValidArgumentType(arg),
+                            "invalid function argument type"))
+                return;
+            args.push_back(arg);
+        }
+        res = FunctionType::get(ret, args, vararg);
+        break;
+    }
+    }
+    types.push_back(res);
+}
+
+void
+ModuleLowering::lower_global()
+{
+    switch (rec) {
+    case REC_MODULE: {
+        StringRef triple = str(0), datalayout = str(2);
+        if (failed)
+            return;
+        module->setTargetTriple(triple);
+        module->setDataLayout(datalayout);
+        return;
+    }
+    case REC_GLOBALVAR: {
+        Type *ty = type(1);
+        int64_t addrspace = op(2);
+        StringRef name = str(3);
+        if (!check_type(ty, ty && PointerType::isValidElementType(ty) &&
+                            !ty->isFunctionTy(),
+                        "invalid global variable type"))
+            return;
+        GlobalVariable *gv = new GlobalVariable(
+            *module, ty, false, GlobalValue::ExternalLinkage, nullptr,
+            name, nullptr, GlobalValue::NotThreadLocal, addrspace);
+        return define(op(0), gv);
+    }
+    case REC_FUNCTION: {
+        FunctionType *fnty = dyn_cast_or_null<FunctionType>(type(1));
+        StringRef name = str(2);
+        if (!fnty)
+            fail("expected a function type");
+        if (failed)
+            return;
+        return define(op(0), Function::Create(
+            fnty, GlobalValue::ExternalLinkage, name, module.get()));
+    }
+    case REC_LINKAGE:
+    case REC_STORAGE:
+    case REC_UNNAMED_ADDR: {
+        GlobalValue *gv = value_as<GlobalValue>(0, "a global value");
+        int64_t kind = rec == REC_UNNAMED_ADDR ? 0 : op(1);
+        if (failed)
+            return;
+        if (rec == REC_LINKAGE)
+            gv->setLinkage((GlobalValue::LinkageTypes) kind);
+        else if (rec == REC_STORAGE)
+            gv->setDLLStorageClass((GlobalValue::DLLStorageClassTypes) kind);
+        else
+            gv->setUnnamedAddr(GlobalValue::UnnamedAddr::Global);
+        return;
+    }
+    case REC_CONSTANT:
+    case REC_ALIGN:
+    case REC_INITIALIZER: {
+        GlobalVariable *gv = value_as<GlobalVariable>(0,
+                                                      "a global variable");
+        if (rec == REC_CONSTANT) {
+            if (!failed)
+                gv->setConstant(true);
+        } else if (rec == REC_ALIGN) {
+            int64_t align = op(1);
+            if (!failed)
+                set_alignment(gv, align);
+        } else {
+            Constant *init = value_as<Constant>(1, "a constant");
+            if (failed)
+                return;
+            if (init->getType() != gv->getValueType()) {
+                fail("initializer type mismatch");
+                return;
+            }
+            gv->setInitializer(init);
+        }
+        return;
+    }
+    case REC_CCONV:
+    case REC_PERSONALITY: {
+        Function *fn = value_as<Function>(0, "a function");
+        if (rec == REC_CCONV) {
+            int64_t cconv = op(1);
+            if (!failed)
+                fn->setCallingConv(cconv);
+        } else {
+            Constant *pers = value_as<Constant>(1, "a constant");
+            if (!failed)
+                fn->setPersonalityFn(pers);
+        }
+        return;
+    }
+    case REC_ATTRIBUTE: {
+        Function *fn = value_as<Function>(0, "a function");
+        int64_t index = op(1);
+        StringRef name = str(2);
+        int64_t val = op(4);
+        if (failed)
+            return;
+        Type *ty = nullptr;
+        if (index == 0) {
+            ty = fn->getReturnType();
+        } else if (index > 0) {
+            if ((size_t) index > fn->arg_size()) {
+                fail("invalid argument index");
+                return;
+            }
+            ty = fn->getFunctionType()->getParamType(index - 1);
+        }
+        Attribute attr = make_attribute(name, val, ty);
+        if (failed)
+            return;
+        unsigned attr_index = index < 0
+                              ? (unsigned) AttributeList::FunctionIndex
+                              : (unsigned) index;
+#if LLVM_VERSION_MAJOR >= 14
+        fn->addAttributeAtIndex(attr_index, attr);
+#else
+        fn->addAttribute(attr_index, attr);
+#endif
+        return;
+    }
+    case REC_ARGUMENT: {
+        Function *fn = value_as<Function>(0, "a function");
+        int64_t argno = op(1);
+        StringRef name = str(3);
+        if (failed)
+            return;
+        if (argno < 0 || (size_t) argno >= fn->arg_size()) {
+            fail("invalid argument number");
+            return;
+        }
+        Argument *arg = fn->arg_begin() + argno;
+        arg->setName(name);
+        return define(op(2), arg);
+    }
+    case REC_BLOCK: {
+        Function *fn = value_as<Function>(1, "a function");
+        StringRef name = str(2);
+        if (failed)
+            return;
+        return define(op(0), BasicBlock::Create(ctx, name, fn));
+    }
+    case REC_FORWARD: {
+        int64_t idx = op(0);
+        Type *ty = type(1);
+        if (idx < 0)
+            fail("invalid value id");
+        if (!check_type(ty, ty && ty->isFirstClassType(),
+                        "invalid forward reference type"))
+            return;
+        if ((size_t) idx >= values.size()) {
+            values.resize(idx + 1, nullptr);
+            placeholders.resize(idx + 1, nullptr);
+        }
+        if (values[idx]) {
+            fail("forward reference to an already defined value");
+            return;
+        }
+        placeholders[idx] = new Argument(ty);
+        values[idx] = placeholders[idx];
+        return;
+    }
+    case REC_POSITION: {
+        BasicBlock *bb = value_as<BasicBlock>(0, "a basic block");
+        if (!failed)
+            builder.SetInsertPoint(bb);
+        return;
+    }
+    case REC_GLOBAL_MD: {
+        GlobalObject *go = value_as<GlobalObject>(0, "a global object");
+        StringRef kind = str(1);
+        MDNode *node = md_node(3);
+        if (!failed)
+            go->setMetadata(kind, node);
+        return;
+    }
+    default:
+        fail("unknown record code");
+    }
+}
+
+void
+ModuleLowering::lower_constant()
+{
+    switch (rec) {
+    case REC_CST_INT: {
+        IntegerType *ty = dyn_cast_or_null<IntegerType>(type(1));
+        if (!ty)
+            fail("expected an integer type");
+        if (nops < 3)
+            fail("truncated record");
+        if (failed)
+            return;
+        std::vector<uint64_t> words;
+        for (size_t i = 2; i < nops; ++i)
+            words.push_back((uint64_t) ops[i]);
+        return define(op(0), ConstantInt::get(
+            ty, APInt(ty->getBitWidth(), words)));
+    }
+    case REC_CST_FP: {
+        Type *ty = type(1);
+        int64_t bits = op(2);
+        if (!check_type(ty, ty && ty->isFloatingPointTy(),
+                        "expected a floating-point type"))
+            return;
+        double val;
+        memcpy(&val, &bits, sizeof(val));
+        return define(op(0), ConstantFP::get(ty, val));
+    }
+    case REC_CST_NULL:
+    case REC_CST_UNDEF: {
+        Type *ty = type(1);
+        if (!check_type(ty, ty && ty->isFirstClassType() && !ty->isLabelTy() &&
+                            !ty->isMetadataTy(),
+                        "invalid constant type"))
+            return;
+        if (rec == REC_CST_NULL)
+            return define(op(0), Constant::getNullValue(ty));
+        return define(op(0), UndefValue::get(ty));
+    }
+    case REC_CST_AGGREGATE: {
+        Type *ty = type(1);
+        std::vector<Constant*> elems;
+        for (size_t i = 2; i < nops; ++i)
+            elems.push_back(value_as<Constant>(i, "a constant"));
+        if (failed)
+            return;
+        Constant *res = nullptr;
+        if (ArrayType *aty = dyn_cast<ArrayType>(ty)) {
+            if (elems.size() == aty->getNumElements())
+                res = ConstantArray::get(aty, elems);
+        } else if (StructType *sty = dyn_cast<StructType>(ty)) {
+            if (elems.size() == sty->getNumElements())
+                res = ConstantStruct::get(sty, elems);
+        } else if (isa<VectorType>(ty)) {
+            if (!elems.empty())
+                res = ConstantVector::get(elems);
+        }
+        if (!res || res->getType() != ty) {
+            fail("invalid aggregate constant");
+            return;
+        }
+        return define(op(0), res);
+    }
+    case REC_CST_DATA: {
+        // The data is in the host byte order
+        ArrayType *ty = dyn_cast_or_null<ArrayType>(type(1));
+        StringRef data = str(2);
+        Type *elty = ty ? ty->getElementType() : nullptr;
+        if (!elty || !ConstantDataSequential::isElementTypeCompatible(elty) ||
+                data.size() != ty->getNumElements() *
+                                (elty->getPrimitiveSizeInBits() / 8))
+            fail("expected an array type of the data length");
+        if (failed)
+            return;
+        if (elty->isIntegerTy(8))
+            return define(op(0),
+                          ConstantDataArray::getString(ctx, data, false));
+        return define(op(0), data_array(elty, data));
+    }
+    case REC_CST_TEXT: {
+        // A constant only available in its textual form, e.g. a
+        // constant expression.  The string table isn't NUL-terminated,
+        // which the parser requires, hence the copy.
+        std::string text = str(1).str();
+        if (failed)
+            return;
+        SMDiagnostic err;
+        Constant *c = parseConstantValue(text, err, *module, &slots);
+        if (!c) {
+            std::string osbuf;
+            raw_string_ostream os(osbuf);
+            err.print("", os);
+            fail(os.str());
+            return;
+        }
+        return define(op(0), c);
+    }
+    case REC_CST_BLOCKADDR: {
+        Function *fn = value_as<Function>(1, "a function");
+        BasicBlock *bb = value_as<BasicBlock>(2, "a basic block");
+        if (failed)
+            return;
+        if (bb->getParent() != fn) {
+            fail("block does not belong to function");
+            return;
+        }
+        return define(op(0), BlockAddress::get(fn, bb));
+    }
+    case REC_INLINE_ASM: {
+        FunctionType *fnty = dyn_cast_or_null<FunctionType>(type(1));
+        bool side_effect = op(2) != 0;
+        StringRef asmstr = str(3), constraint = str(5);
+        if (!fnty)
+            fail("expected a function type");
+        if (failed)
+            return;
+        return define(op(0), InlineAsm::get(fnty, asmstr, constraint,
+                                            side_effect));
+    }
+    case REC_MD_AS_VALUE: {
+        Metadata *m = md(1);
+        if (!m)
+            fail("expected metadata");
+        if (failed)
+            return;
+        return define(op(0), MetadataAsValue::get(ctx, m));
+    }
+    default:
+        fail("unknown record code");
+    }
+}
+
+void
+ModuleLowering::lower_metadata()
+{
+    switch (rec) {
+    case REC_MD_STRING: {
+        StringRef s = str(1);
+        if (!failed)
+            define_md(op(0), MDString::get(ctx, s));
+        return;
+    }
+    case REC_MD_VALUE: {
+        Value *v = value(1);
+        if (!failed)
+            define_md(op(0), ValueAsMetadata::get(v));
+        return;
+    }
+    case REC_MD_NODE: {
+        std::vector<Metadata*> elems;
+        for (size_t i = 1; i < nops; ++i)
+            elems.push_back(md(i));
+        if (!failed)
+            define_md(op(0), MDNode::get(ctx, elems));
+        return;
+    }
+    case REC_MD_NAMED: {
+        StringRef name = str(0);
+        std::vector<MDNode*> elems;
+        for (size_t i = 2; i < nops; ++i)
+            elems.push_back(md_node(i));
+        if (failed)
+            return;
+        NamedMDNode *nmd = module->getOrInsertNamedMetadata(name);
+        for (size_t i = 0; i < elems.size(); ++i)
+            nmd->addOperand(elems[i]);
+        return;
+    }
+    case REC_MD_ATTACH: {
+        Instruction *inst = value_as<Instruction>(0, "an instruction");
+        StringRef kind = str(1);
+        MDNode *node = md_node(3);
+        if (!failed)
+            inst->setMetadata(kind, node);
+        return;
+    }
+    default:
+        fail("unknown record code");
+    }
+}
+
+Value *
+ModuleLowering::lower_call()
+{
+    // Operands start after [id, name]
+    const size_t A = 3;
+    bool is_invoke = rec == REC_INST_INVOKE;
+    FunctionType *fnty = dyn_cast_or_null<FunctionType>(type(A));
+    Value *callee = value(A + 1);
+    int64_t cconv = op(A + 2);
+    std::vector<Value*> args;
+    for (size_t i = A + 5; i < nops; ++i)
+        args.push_back(value(i));
+    if (!fnty)
+        fail("expected a function type");
+    if (failed)
+        return nullptr;
+    if (!callee->getType()->isPointerTy()) {
+        fail("callee is not a pointer");
+        return nullptr;
+    }
+    if (args.size() < fnty->getNumParams() ||
+            (!fnty->isVarArg() && args.size() != fnty->getNumParams())) {
+        fail("wrong number of call arguments");
+        return nullptr;
+    }
+    for (size_t i = 0; i < fnty->getNumParams(); ++i) {
+        if (args[i]->getType() != fnty->getParamType(i)) {
+            fail("call argument type mismatch");
+            return nullptr;
+        }
+    }
+    if (is_invoke) {
+        BasicBlock *normal = value_as<BasicBlock>(A + 3, "a basic block");
+        BasicBlock *unwind = value_as<BasicBlock>(A + 4, "a basic block");
+        if (failed)
+            return nullptr;
+        InvokeInst *inv = builder.CreateInvoke(fnty, callee, normal, unwind,
+                                               args);
+        inv->setCallingConv(cconv);
+        return inv;
+    }
+    bool tail = op(A + 3) != 0;
+    int64_t flags = op(A + 4);
+    CallInst *call = builder.CreateCall(fnty, callee, args);
+    call->setCallingConv(cconv);
+    call->setTailCall(tail);
+    set_fastmath(call, flags);
+    return call;
+}
+
+void
+ModuleLowering::lower_instruction()
+{
+    // Instruction-specific operands start after [id, name]
+    const size_t A = 3;
+    Value *res = nullptr;
+
+    if (rec == REC_INST_CALL_ATTR) {
+        CallBase *call = value_as<CallBase>(0, "a call instruction");
+        StringRef name = str(1);
+        if (failed)
+            return;
+        Attribute attr = make_attribute(name, 0, nullptr);
+        if (failed)
+            return;
+#if LLVM_VERSION_MAJOR >= 14
+        call->addFnAttr(attr);
+#else
+        call->addAttribute(AttributeList::FunctionIndex, attr);
+#endif
+        return;
+    }
+
+    if (!builder.GetInsertBlock()) {
+        fail("instruction outside of a basic block");
+        return;
+    }
+
+    switch (rec) {
+    case REC_INST_BINOP: {
+        int64_t opc = op(A);
+        int64_t flags = op(A + 1);
+        Value *lhs = value(A + 2), *rhs = value(A + 3);
+        if (opc < 0 || (size_t) opc >= array_size(binary_opcodes))
+            fail("invalid binary opcode");
+        if (failed)
+            return;
+        if (lhs->getType() != rhs->getType()) {
+            fail("binary operands have different types");
+            return;
+        }
+        BinaryOperator *bo = BinaryOperator::Create(binary_opcodes[opc],
+                                                    lhs, rhs);
+        builder.Insert(bo);
+        if (flags & FLAG_NUW) bo->setHasNoUnsignedWrap();
+        if (flags & FLAG_NSW) bo->setHasNoSignedWrap();
+        if (flags & FLAG_EXACT) bo->setIsExact();
+        set_fastmath(bo, flags);
+        res = bo;
+        break;
+    }
+    case REC_INST_CAST: {
+        int64_t opc = op(A);
+        Value *val = value(A + 1);
+        Type *ty = type(A + 2);
+        if (opc < 0 || (size_t) opc >= array_size(cast_opcodes))
+            fail("invalid cast opcode");
+        if (failed)
+            return;
+        if (!CastInst::castIsValid(cast_opcodes[opc], val, ty)) {
+            fail("invalid cast");
+            return;
+        }
+        res = builder.CreateCast(cast_opcodes[opc], val, ty);
+        break;
+    }
+    case REC_INST_ICMP:
+    case REC_INST_FCMP: {
+        bool is_fcmp = rec == REC_INST_FCMP;
+        size_t base = is_fcmp ? A + 2 : A + 1;
+        CmpInst::Predicate pred = (CmpInst::Predicate) op(A);
+        int64_t flags = is_fcmp ? op(A + 1) : 0;
+        Value *lhs = value(base), *rhs = value(base + 1);
+        if (is_fcmp ? !CmpInst::isFPPredicate(pred)
+                    : !CmpInst::isIntPredicate(pred))
+            fail("invalid comparison predicate");
+        if (failed)
+            return;
+        if (lhs->getType() != rhs->getType()) {
+            fail("comparison operands have different types");
+            return;
+        }
+        if (is_fcmp) {
+            Instruction *cmp = cast<Instruction>(
+                builder.CreateFCmp(pred, lhs, rhs));
+            set_fastmath(cmp, flags);
+            res = cmp;
+        } else {
+            res = builder.CreateICmp(pred, lhs, rhs);
+        }
+        break;
+    }
+    case REC_INST_SELECT: {
+        Value *cond = value(A), *lhs = value(A + 1), *rhs = value(A + 2);
+        if (failed)
+            return;
+        if (SelectInst::areInvalidOperands(cond, lhs, rhs)) {
+            fail("invalid select operands");
+            return;
+        }
+        res = builder.CreateSelect(cond, lhs, rhs);
+        break;
+    }
+    case REC_INST_LOAD:
+    case REC_INST_LOAD_ATOMIC: {
+        bool is_atomic = rec == REC_INST_LOAD_ATOMIC;
+        Type *ty = type(A);
+        Value *ptr = value(A + 1);
+        AtomicOrdering order = is_atomic ? ordering(A + 2)
+                                         : AtomicOrdering::NotAtomic;
+        int64_t align = op(is_atomic ? A + 3 : A + 2);
+        if (failed)
+            return;
+        if (!ptr->getType()->isPointerTy()) {
+            fail("load from a non-pointer value");
+            return;
+        }
+        LoadInst *ld = builder.CreateLoad(ty, ptr);
+        if (is_atomic)
+            ld->setAtomic(order);
+        set_alignment(ld, align);
+        res = ld;
+        break;
+    }
+    case REC_INST_STORE:
+    case REC_INST_STORE_ATOMIC: {
+        bool is_atomic = rec == REC_INST_STORE_ATOMIC;
+        Value *val = value(A), *ptr = value(A + 1);
+        AtomicOrdering order = is_atomic ? ordering(A + 2)
+                                         : AtomicOrdering::NotAtomic;
+        int64_t align = op(is_atomic ? A + 3 : A + 2);
+        if (failed)
+            return;
+        if (!ptr->getType()->isPointerTy()) {
+            fail("store to a non-pointer value");
+            return;
+        }
+        StoreInst *st = builder.CreateStore(val, ptr);
+        if (is_atomic)
+            st->setAtomic(order);
+        set_alignment(st, align);
+        res = st;
+        break;
+    }
+    case REC_INST_ALLOCA: {
+        Type *ty = type(A);
+        Value *count = op(A + 1) >= 0 ? value(A + 1) : nullptr;
+        int64_t align = op(A + 2);
+        if (!check_type(ty, ty && ty->isSized(), "alloca of an unsized type"))
+            return;
+        AllocaInst *al = builder.CreateAlloca(ty, count);
+        set_alignment(al, align);
+        res = al;
+        break;
+    }
+    case REC_INST_GEP: {
+        Type *ty = type(A);
+        bool inbounds = op(A + 1) != 0;
+        Value *ptr = value(A + 2);
+        std::vector<Value*> indices;
+        for (size_t i = A + 3; i < nops; ++i)
+            indices.push_back(value(i));
+        if (failed)
+            return;
+        if (!ptr->getType()->isPointerTy() ||
+                !GetElementPtrInst::getIndexedType(ty, indices)) {
+            fail("invalid getelementptr operands");
+            return;
+        }
+        if (inbounds)
+            res = builder.CreateInBoundsGEP(ty, ptr, indices);
+        else
+            res = builder.CreateGEP(ty, ptr, indices);
+        break;
+    }
+    case REC_INST_PHI: {
+        Type *ty = type(A);
+        std::vector<Value*> vals;
+        std::vector<BasicBlock*> blocks;
+        for (size_t i = A + 1; i + 1 < nops; i += 2) {
+            vals.push_back(value(i));
+            blocks.push_back(value_as<BasicBlock>(i + 1, "a basic block"));
+        }
+        if (failed)
+            return;
+        PHINode *phi = builder.CreatePHI(ty, vals.size());
+        for (size_t i = 0; i < vals.size(); ++i)
+            phi->addIncoming(vals[i], blocks[i]);
+        res = phi;
+        break;
+    }
+    case REC_INST_CALL:
+    case REC_INST_INVOKE:
+        res = lower_call();
+        break;
+    case REC_INST_RET: {
+        Value *val = op(A) >= 0 ? value(A) : nullptr;
+        if (failed)
+            return;
+        res = val ? builder.CreateRet(val) : builder.CreateRetVoid();
+        break;
+    }
+    case REC_INST_BR: {
+        BasicBlock *dest = value_as<BasicBlock>(A, "a basic block");
+        if (failed)
+            return;
+        res = builder.CreateBr(dest);
+        break;
+    }
+    case REC_INST_CONDBR: {
+        Value *cond = value(A);
+        BasicBlock *iftrue = value_as<BasicBlock>(A + 1, "a basic block");
+        BasicBlock *iffalse = value_as<BasicBlock>(A + 2, "a basic block");
+        if (failed)
+            return;
+        res = builder.CreateCondBr(cond, iftrue, iffalse);
+        break;
+    }
+    case REC_INST_SWITCH: {
+        Value *val = value(A);
+        BasicBlock *dflt = value_as<BasicBlock>(A + 1, "a basic block");
+        std::vector<ConstantInt*> cases;
+        std::vector<BasicBlock*> dests;
+        for (size_t i = A + 2; i + 1 < nops; i += 2) {
+            cases.push_back(value_as<ConstantInt>(i, "an integer constant"));
+            dests.push_back(value_as<BasicBlock>(i + 1, "a basic block"));
+        }
+        if (failed)
+            return;
+        SwitchInst *sw = builder.CreateSwitch(val, dflt, cases.size());
+        for (size_t i = 0; i < cases.size(); ++i)
+            sw->addCase(cases[i], dests[i]);
+        res = sw;
+        break;
+    }
+    case REC_INST_INDIRECTBR: {
+        Value *addr = value(A);
+        std::vector<BasicBlock*> dests;
+        for (size_t i = A + 1; i < nops; ++i)
+            dests.push_back(value_as<BasicBlock>(i, "a basic block"));
+        if (failed)
+            return;
+        IndirectBrInst *ibr = builder.CreateIndirectBr(addr, dests.size());
+        for (size_t i = 0; i < dests.size(); ++i)
+            ibr->addDestination(dests[i]);
+        res = ibr;
+        break;
+    }
+    case REC_INST_RESUME: {
+        Value *val = value(A);
+        if (failed)
+            return;
+        res = builder.CreateResume(val);
+        break;
+    }
+    case REC_INST_UNREACHABLE:
+        res = builder.CreateUnreachable();
+        break;
+    case REC_INST_EXTRACTVALUE:
+    case REC_INST_INSERTVALUE: {
+        bool is_insert = rec == REC_INST_INSERTVALUE;
+        Value *agg = value(A);
+        Value *val = is_insert ? value(A + 1) : nullptr;
+        std::vector<unsigned> indices;
+        for (size_t i = is_insert ? A + 2 : A + 1; i < nops; ++i)
+            indices.push_back(ops[i]);
+        if (failed)
+            return;
+        Type *ty = ExtractValueInst::getIndexedType(agg->getType(), indices);
+        if (!ty || (is_insert && ty != val->getType())) {
+            fail("invalid aggregate indices");
+            return;
+        }
+        if (is_insert)
+            res = builder.CreateInsertValue(agg, val, indices);
+        else
+            res = builder.CreateExtractValue(agg, indices);
+        break;
+    }
+    case REC_INST_EXTRACTELEMENT: {
+        Value *vec = value(A), *idx = value(A + 1);
+        if (failed)
+            return;
+        if (!ExtractElementInst::isValidOperands(vec, idx)) {
+            fail("invalid extractelement operands");
+            return;
+        }
+        res = builder.CreateExtractElement(vec, idx);
+        break;
+    }
+    case REC_INST_INSERTELEMENT: {
+        Value *vec = value(A), *val = value(A + 1), *idx = value(A + 2);
+        if (failed)
+            return;
+        if (!InsertElementInst::isValidOperands(vec, val, idx)) {
+            fail("invalid insertelement operands");
+            return;
+        }
+        res = builder.CreateInsertElement(vec, val, idx);
+        break;
+    }
+    case REC_INST_SHUFFLEVECTOR: {
+        Value *v1 = value(A), *v2 = value(A + 1), *mask = value(A + 2);
+        if (failed)
+            return;
+        if (!ShuffleVectorInst::isValidOperands(v1, v2, mask)) {
+            fail("invalid shufflevector operands");
+            return;
+        }
+        res = builder.CreateShuffleVector(v1, v2, mask);
+        break;
+    }
+    case REC_INST_ATOMICRMW: {
+        int64_t opc = op(A);
+        Value *ptr = value(A + 1), *val = value(A + 2);
+        AtomicOrdering order = ordering(A + 3);
+        if (opc < 0 || (size_t) opc >= array_size(rmw_opcodes))
+            fail("invalid atomicrmw operation");
+        if (failed)
+            return;
+        res = builder.CreateAtomicRMW(rmw_opcodes[opc], ptr, val,
+#if LLVM_VERSION_MAJOR >= 13
+                                      MaybeAlign(),
+#endif
+                                      order);
+        break;
+    }
+    case REC_INST_CMPXCHG: {
+        Value *ptr = value(A), *cmp = value(A + 1), *val = value(A + 2);
+        AtomicOrdering order = ordering(A + 3);
+        AtomicOrdering failorder = ordering(A + 4);
+        if (failed)
+            return;
+        res = builder.CreateAtomicCmpXchg(ptr, cmp, val,
+#if LLVM_VERSION_MAJOR >= 13
+                                          MaybeAlign(),
+#endif
+                                          order, failorder);
+        break;
+    }
+    case REC_INST_FENCE: {
+        AtomicOrdering order = ordering(A);
+        SyncScope::ID ssid = SyncScope::System;
+        if (op(A + 2) >= 0) {
+            StringRef scope = str(A + 1);
+            if (!failed)
+                ssid = ctx.getOrInsertSyncScopeID(scope);
+        }
+        if (failed)
+            return;
+        res = builder.CreateFence(order, ssid);
+        break;
+    }
+    case REC_INST_LANDINGPAD: {
+        Type *ty = type(A);
+        bool cleanup = op(A + 1) != 0;
+        std::vector<Constant*> clauses;
+        for (size_t i = A + 2; i < nops; ++i)
+            clauses.push_back(value_as<Constant>(i, "a constant"));
+        if (failed)
+            return;
+        LandingPadInst *lp = builder.CreateLandingPad(ty, clauses.size());
+        lp->setCleanup(cleanup);
+        for (size_t i = 0; i < clauses.size(); ++i)
+            lp->addClause(clauses[i]);
+        res = lp;
+        break;
+    }
+    default:
+        fail("unknown record code");
+        return;
+    }
+    if (!res)
+        return;
+    StringRef name = str(1);
+    if (failed)
+        return;
+    if (!name.empty() && !res->getType()->isVoidTy())
+        res->setName(name);
+    define(op(0), res);
+}
+
+void
+ModuleLowering::lower_record()
+{
+    if (rec < REC_MODULE)
+        lower_type();
+    else if (rec < REC_CST_INT)
+        lower_global();
+    else if (rec < REC_MD_STRING)
+        lower_constant();
+    else if (rec < REC_INST_BINOP)
+        lower_metadata();
+    else
+        lower_instruction();
+}
+
+Module *
+ModuleLowering::run()
+{
+    // Use the same module identifier as parseAssemblyString()
+    module.reset(new Module("<string>", ctx));
+    size_t pos = 0;
+    while (pos < ncode) {
+        rec = code[pos];
+        if (pos + 2 > ncode || code[pos + 1] < 0 ||
+                pos + 2 + code[pos + 1] > ncode) {
+            fail("truncated record stream");
+            return nullptr;
+        }
+        nops = code[pos + 1];
+        ops = code + pos + 2;
+        lower_record();
+        if (failed)
+            return nullptr;
+        pos += 2 + nops;
+    }
+    for (size_t i = 0; i < placeholders.size(); ++i) {
+        if (placeholders[i]) {
+            fail("use of undefined value " + std::to_string(i));
+            return nullptr;
+        }
+    }
+    // Apply the same upgrades as the assembly parser, e.g. of the
+    // declarations of intrinsics whose signature changed
+    for (auto it = module->begin(); it != module->end(); )
+        UpgradeCallsToIntrinsic(&*it++);
+    UpgradeDebugInfo(*module);
+    UpgradeModuleFlags(*module);
+    UpgradeSectionAttributes(*module);
+    return module.release();
+}
+
+} // end anonymous namespace
+
+
+extern "C" {
+
+API_EXPORT(LLVMModuleRef)
+LLVMPY_LowerModule(LLVMContextRef context,
+                   const int64_t *code, size_t ncode,
+                   const char *strtab, size_t nstrtab,
+                   const char **outmsg)
+{
+    ModuleLowering lowering(*unwrap(context), code, ncode, strtab, nstrtab);
+    Module *m = lowering.run();
+    if (!m) {
+        *outmsg = LLVMPY_CreateString(lowering.error().c_str());
+        return NULL;
+    }
+    return wrap(m);
+}
+
+} // end extern "C"
@@ -0,0 +1,345 @@
+/*
+ * An execution engine based on the ORC LLJIT and LLLazyJIT classes.
+ *
+ * Unlike MCJIT, modules can be added to the JIT at any time and are
+ * compiled on the first lookup of one of their symbols.  With the lazy
+ * variant, each function is only compiled when it is first called,
+ * through a compile-on-demand stub.  Modules can be removed from the JIT,
+ * which frees their code memory.  Compilation can run in the background
+ * on the JIT's compile threads, see LLVMPY_LLJITLookupAsync().
+ */
+
+#include "core.h"
+#include "llvm-c/TargetMachine.h"
+
+#include "llvm/Bitcode/BitcodeReader.h"
+#include "llvm/Bitcode/BitcodeWriter.h"
+#include "llvm/ExecutionEngine/Orc/ExecutionUtils.h"
+#include "llvm/ExecutionEngine/Orc/LLJIT.h"
+#include "llvm/ExecutionEngine/Orc/ThreadSafeModule.h"
+#include "llvm/IR/LLVMContext.h"
+#include "llvm/IR/Module.h"
+#include "llvm/MC/SubtargetFeature.h"
+#include "llvm/Support/MemoryBuffer.h"
+#include "llvm/Support/raw_ostream.h"
+#include "llvm/Target/TargetMachine.h"
+
+#include <atomic>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <vector>
+
+using namespace llvm;
+using namespace llvm::orc;
+
+namespace llvm {
+
+inline TargetMachine *unwrap(LLVMTargetMachineRef TM) {
+    return reinterpret_cast<TargetMachine *>(TM);
+}
+
+} // end namespace llvm
+
+struct OrcJIT {
+    std::unique_ptr<LLJIT> jit;
+    LLLazyJIT *lazy; // same object as jit, or nullptr
+    std::atomic<unsigned> module_count;
+    // The errors reported by the session while materializing symbols,
+    // which are not returned by the lookup
+    std::mutex errors_lock;
+    std::string session_errors;
+};
+
+/*
+ * Each module is added to its own JITDylib, whose symbols are re-exported
+ * by the main JITDylib.  Removing a module removes its JITDylib, or
+ * clears it for LLLazyJIT (see LLVMPY_LLJITRemoveModule).
+ */
+struct OrcModuleHandle {
+    JITDylib *jd;
+#if LLVM_VERSION_MAJOR >= 13
+    // The tracker of the re-exports in the main JITDylib
+    ResourceTrackerSP tracker;
+#endif
+};
+
+namespace {
+
+static void set_error(Error err, const char **OutError) {
+    *OutError = LLVMPY_CreateString(toString(std::move(err)).c_str());
+}
+
+/*
+ * Return the error message *err*, followed by the errors reported by the
+ * session since the last call.
+ */
+static std::string lookup_error(OrcJIT *JIT, Error err) {
+    std::string msg = toString(std::move(err));
+    std::lock_guard<std::mutex> guard(JIT->errors_lock);
+    msg += JIT->session_errors;
+    JIT->session_errors.clear();
+    return msg;
+}
+
+/*
+ * Copy the module *M* to a new context, so that the JIT can compile it
+ * independently of the caller's context and module.
+ */
+static Expected<ThreadSafeModule> copy_module(Module &M) {
+    SmallVector<char, 0> buf;
+    raw_svector_ostream os(buf);
+    WriteBitcodeToFile(M, os);
+
+    auto ctx = std::make_unique<LLVMContext>();
+    auto mod = parseBitcodeFile(
+        MemoryBufferRef(StringRef(buf.data(), buf.size()), ""), *ctx);
+    if (!mod)
+        return mod.takeError();
+    return ThreadSafeModule(std::move(*mod), std::move(ctx));
+}
+
+template <typename Builder>
+static Error configure_builder(Builder &builder, TargetMachine *TM,
+                               unsigned NumCompileThreads) {
+    builder.setNumCompileThreads(NumCompileThreads);
+    if (TM) {
+        JITTargetMachineBuilder jtmb(TM->getTargetTriple());
+        jtmb.setCPU(TM->getTargetCPU().str());
+        jtmb.setFeatures(TM->getTargetFeatureString());
+        jtmb.setRelocationModel(TM->getRelocationModel());
+        jtmb.setCodeModel(TM->getCodeModel());
+        jtmb.setCodeGenOptLevel(TM->getOptLevel());
+        builder.setJITTargetMachineBuilder(std::move(jtmb));
+    } else {
+        auto jtmb = JITTargetMachineBuilder::detectHost();
+        if (!jtmb)
+            return jtmb.takeError();
+        builder.setJITTargetMachineBuilder(std::move(*jtmb));
+    }
+    return Error::success();
+}
+
+template <typename JITType, typename Builder>
+static Expected<std::unique_ptr<JITType>>
+create_jit(TargetMachine *TM, unsigned NumCompileThreads) {
+    Builder builder;
+    if (auto err = configure_builder(builder, TM, NumCompileThreads))
+        return std::move(err);
+    return builder.create();
+}
+
+} // end anonymous namespace
+
+extern "C" {
+
+API_EXPORT(OrcJIT *)
+LLVMPY_CreateLLJIT(LLVMTargetMachineRef TM, int Lazy,
+                   unsigned NumCompileThreads, const char **OutError) {
+    std::unique_ptr<OrcJIT> res(new OrcJIT());
+    res->lazy = nullptr;
+    res->module_count = 0;
+    if (Lazy) {
+        auto jit = create_jit<LLLazyJIT, LLLazyJITBuilder>(unwrap(TM),
+                                                           NumCompileThreads);
+        if (!jit) {
+            set_error(jit.takeError(), OutError);
+            return nullptr;
+        }
+        // Only compile the functions actually called
+        (*jit)->getCompileOnDemandLayer().setPartitionFunction(
+            CompileOnDemandLayer::compileRequested);
+        res->lazy = jit->get();
+        res->jit = std::move(*jit);
+    } else {
+        auto jit = create_jit<LLJIT, LLJITBuilder>(unwrap(TM),
+                                                   NumCompileThreads);
+        if (!jit) {
+            set_error(jit.takeError(), OutError);
+            return nullptr;
+        }
+        res->jit = std::move(*jit);
+    }
+
+    // Resolve the symbols not defined by the JITted modules in the
+    // current process, like MCJIT does
+    auto gen = DynamicLibrarySearchGenerator::GetForCurrentProcess(
+        res->jit->getDataLayout().getGlobalPrefix());
+    if (!gen) {
+        set_error(gen.takeError(), OutError);
+        return nullptr;
+    }
+    res->jit->getMainJITDylib().addGenerator(std::move(*gen));
+
+    OrcJIT *jit = res.get();
+    res->jit->getExecutionSession().setErrorReporter([jit](Error err) {
+        std::lock_guard<std::mutex> guard(jit->errors_lock);
+        jit->session_errors += "\n" + toString(std::move(err));
+    });
+    return res.release();
+}
+
+API_EXPORT(void)
+LLVMPY_DisposeLLJIT(OrcJIT *JIT) { delete JIT; }
+
+API_EXPORT(OrcModuleHandle *)
+LLVMPY_LLJITAddModule(OrcJIT *JIT, LLVMModuleRef M, const char **OutError) {
+    LLJIT &jit = *JIT->jit;
+    ExecutionSession &es = jit.getExecutionSession();
+    JITDylib &main = jit.getMainJITDylib();
+
+    auto tsm = copy_module(*unwrap(M));
+    if (!tsm) {
+        set_error(tsm.takeError(), OutError);
+        return nullptr;
+    }
+    auto jd = es.createJITDylib("module." +
+                                std::to_string(JIT->module_count++));
+    if (!jd) {
+        set_error(jd.takeError(), OutError);
+        return nullptr;
+    }
+    // The module's symbols are resolved in the main JITDylib, which
+    // re-exports the symbols of all modules.
+    jd->addToLinkOrder(main);
+    SymbolAliasMap aliases;
+    tsm->withModuleDo([&](Module &mod) {
+        for (GlobalValue &gv : mod.global_values()) {
+            if (gv.isDeclaration() || gv.hasLocalLinkage() ||
+                gv.hasAvailableExternallyLinkage())
+                continue;
+            auto name = jit.mangleAndIntern(gv.getName());
+            aliases[name] = SymbolAliasMapEntry(
+                name, JITSymbolFlags::fromGlobalValue(gv));
+        }
+    });
+
+    std::unique_ptr<OrcModuleHandle> handle(new OrcModuleHandle());
+    handle->jd = &*jd;
+    Error err = JIT->lazy ? JIT->lazy->addLazyIRModule(*jd, std::move(*tsm))
+                          : jit.addIRModule(*jd, std::move(*tsm));
+    if (!err) {
+#if LLVM_VERSION_MAJOR >= 13
+        handle->tracker = main.createResourceTracker();
+        err = main.define(reexports(*jd, std::move(aliases)),
+                          handle->tracker);
+#else
+        err = main.define(reexports(*jd, std::move(aliases)));
+#endif
+    }
+    if (err) {
+        set_error(std::move(err), OutError);
+        return nullptr;
+    }
+    return handle.release();
+}
+
+API_EXPORT(int)
+LLVMPY_LLJITRemoveModule(OrcJIT *JIT, OrcModuleHandle *Handle,
+                         const char **OutError) {
+#if LLVM_VERSION_MAJOR >= 13
+    ExecutionSession &es = JIT->jit->getExecutionSession();
+    Error err = Handle->tracker->remove();
+    if (err) {
+        set_error(std::move(err), OutError);
+        return 1;
+    }
+    // Free the code of the module, and the JITDylib bookkeeping when
+    // possible.  The compile-on-demand layer of LLLazyJIT compiles the
+    // function bodies in a separate JITDylib, and keeps a reference to
+    // the module's JITDylib: the latter is only cleared in that case.
+    std::string impl_name(Handle->jd->getName());
+    impl_name += ".impl";
+#if LLVM_VERSION_MAJOR >= 14
+    if (JIT->lazy)
+        err = Handle->jd->clear();
+    else
+        err = es.removeJITDylib(*Handle->jd);
+    if (!err && JIT->lazy) {
+        if (JITDylib *impl = es.getJITDylibByName(impl_name))
+            err = es.removeJITDylib(*impl);
+    }
+#else
+    err = Handle->jd->clear();
+    if (!err && JIT->lazy) {
+        if (JITDylib *impl = es.getJITDylibByName(impl_name))
+            err = impl->clear();
+    }
+#endif
+    Handle->jd = nullptr;
+    if (err) {
+        set_error(std::move(err), OutError);
+        return 1;
+    }
+    return 0;
+#else
+    *OutError = LLVMPY_CreateString(
+        "removing modules from the JIT requires LLVM 13 or later");
+    return 1;
+#endif
+}
+
+API_EXPORT(void)
+LLVMPY_LLJITDisposeModuleHandle(OrcModuleHandle *Handle) { delete Handle; }
+
+API_EXPORT(uint64_t)
+LLVMPY_LLJITLookup(OrcJIT *JIT, const char *Name, const char **OutError) {
+    auto sym = JIT->jit->lookup(Name);
+    if (!sym) {
+        std::string msg = lookup_error(JIT, sym.takeError());
+        *OutError = LLVMPY_CreateString(msg.c_str());
+        return 0;
+    }
+#if LLVM_VERSION_MAJOR >= 15
+    return sym->getValue();
+#else
+    return sym->getAddress();
+#endif
+}
+
+typedef void (*LookupCallback)(size_t Key, const char *Error,
+                               const uint64_t *Addresses);
+
+/*
+ * Look up the symbols *Names* without waiting for their compilation,
+ * which is done by the compile threads of the JIT, if any.  *Callback*
+ * is called with *Key* and either the addresses of the symbols (in the
+ * order of *Names*) or an error message, from the thread completing the
+ * lookup.
+ */
+API_EXPORT(void)
+LLVMPY_LLJITLookupAsync(OrcJIT *JIT, const char **Names, size_t Count,
+                        LookupCallback Callback, size_t Key) {
+    LLJIT &jit = *JIT->jit;
+    SymbolLookupSet symbols;
+    std::vector<SymbolStringPtr> order;
+    for (size_t i = 0; i < Count; ++i) {
+        auto name = jit.mangleAndIntern(Names[i]);
+        symbols.add(name);
+        order.push_back(std::move(name));
+    }
+    auto on_complete = [JIT, order, Callback, Key](Expected<SymbolMap> res) {
+        if (!res) {
+            std::string msg = lookup_error(JIT, res.takeError());
+            Callback(Key, msg.c_str(), nullptr);
+            return;
+        }
+        std::vector<uint64_t> addresses;
+        for (auto &name : order) {
+#if LLVM_VERSION_MAJOR >= 17
+            addresses.push_back((*res)[name].getAddress().getValue());
+#else
+            addresses.push_back((*res)[name].getAddress());
+#endif
+        }
+        Callback(Key, nullptr, addresses.data());
+    };
+    jit.getExecutionSession().lookup(
+        LookupKind::Static,
+        makeJITDylibSearchOrder(&jit.getMainJITDylib(),
+                                JITDylibLookupFlags::MatchAllSymbols),
+        std::move(symbols), SymbolState::Ready, std::move(on_complete),
+        NoDependenciesToRegister);
+}
+
+} // end extern "C"
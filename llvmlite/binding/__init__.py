@@ -14,4 +14,7 @@ from .value import *
 from .analysis import *
 from .object_file import *
 from .context import *
+from .lowering import *
+from .batch import *
+from .objectcache import *
 
@@ -0,0 +1,172 @@
+"""
+Compilation of many independent modules in parallel.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from llvmlite import ir
+from llvmlite.binding.context import create_context
+from llvmlite.binding.initfini import (initialize, initialize_all_targets,
+                                       initialize_all_asmprinters)
+from llvmlite.binding.lowering import lower_module
+from llvmlite.binding.module import ModuleRef, parse_assembly, parse_bitcode
+from llvmlite.binding.passmanagers import create_module_pass_manager
+from llvmlite.binding.targets import Target
+from llvmlite.binding.transforms import create_pass_manager_builder
+
+
+class CompileManyError(RuntimeError):
+    """
+    Raised by compile_many() when some of the modules failed to compile.
+
+    *errors* maps the index of each failed module to its error message,
+    *results* holds the object code of all modules (None for the failed
+    ones).
+    """
+
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        msg = "\n".join("module #{0}: {1}".format(i, errors[i])
+                        for i in sorted(errors))
+        super(CompileManyError, self).__init__(
+            "{0} module(s) failed to compile\n{1}".format(len(errors), msg))
+
+
+class _TargetMachines(object):
+    """
+    The target machines of the workers of a batch.  Target machines can't
+    be shared between threads: each worker thread creates its own, and
+    close() disposes of all of them at the end of the batch.
+    """
+
+    def __init__(self, creation_args):
+        self._creation_args = creation_args
+        self._machines = {}
+
+    def get(self):
+        key = threading.get_ident()
+        tm = self._machines.get(key)
+        if tm is None:
+            triple, options = self._creation_args
+            tm = Target.from_triple(triple).create_target_machine(**options)
+            self._machines[key] = tm
+        return tm
+
+    def close(self):
+        for tm in self._machines.values():
+            tm.close()
+        self._machines.clear()
+
+
+# The target machines of a worker process, disposed of when the process
+# exits at the end of the batch
+_worker_machines = None
+
+
+def _initialize_worker(creation_args):
+    global _worker_machines
+    initialize()
+    initialize_all_targets()
+    initialize_all_asmprinters()
+    _worker_machines = _TargetMachines(creation_args)
+
+
+def _compile_one(source, opt_level, machines=None):
+    """
+    Compile *source* to object code, with a target machine from
+    *machines* (those of the worker process by default).  Returns a
+    (success, object code or error message) tuple.
+    """
+    try:
+        tm = (machines or _worker_machines).get()
+        # A separate context per module allows compiling concurrently
+        context = create_context('context')
+        if isinstance(source, ir.Module):
+            mod = lower_module(source, context)
+        elif isinstance(source, bytes):
+            mod = parse_bitcode(source, context)
+        else:
+            mod = parse_assembly(source, context)
+        with create_module_pass_manager() as pm:
+            tm.add_analysis_passes(pm)
+            with create_pass_manager_builder() as pmb:
+                pmb.opt_level = opt_level
+                pmb.populate(pm)
+            pm.run(mod)
+        obj = tm.emit_object(mod)
+        mod.close()
+        return True, obj
+    except Exception as e:
+        return False, str(e)
+
+
+def compile_many(modules, target_machine, opt_level=2, jobs=None,
+                 executor='thread'):
+    """
+    Compile the independent *modules* to object code for *target_machine*
+    and return the list of object codes (bytes objects), in the same order.
+
+    Each module can be a string of LLVM IR, a bytes object of LLVM bitcode,
+    a llvmlite.ir.Module or a ModuleRef (which is left untouched).  Modules
+    are parsed, optimized at *opt_level* and emitted in parallel using
+    *jobs* workers (defaults to the number of CPUs), either threads
+    (*executor* "thread") or processes ("process").
+
+    If some modules fail to compile, CompileManyError is raised after all
+    the modules have been processed.
+    """
+    if executor not in ('thread', 'process'):
+        raise ValueError("invalid executor: {0!r}".format(executor))
+    creation_args = target_machine._creation_args
+    if creation_args is None:
+        raise ValueError("target machine must be created with "
+                         "Target.create_target_machine()")
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    sources = []
+    for mod in modules:
+        if isinstance(mod, ModuleRef):
+            # Avoid sharing the module's context with the workers
+            mod = mod.as_bitcode()
+        elif isinstance(mod, ir.Module) and executor == 'process':
+            # Bitcode is more compact to send and faster to parse
+            try:
+                mod = mod.as_bitcode()
+            except NotImplementedError:
+                mod = str(mod)
+        sources.append(mod)
+
+    nsources = len(sources)
+    args = (sources, [opt_level] * nsources)
+    if executor == 'thread':
+        machines = _TargetMachines(creation_args)
+        args += ([machines] * nsources,)
+        try:
+            if jobs == 1:
+                outcomes = list(map(_compile_one, *args))
+            else:
+                with ThreadPoolExecutor(max_workers=jobs) as pool:
+                    outcomes = list(pool.map(_compile_one, *args))
+        finally:
+            machines.close()
+    else:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_initialize_worker,
+                                 initargs=(creation_args,)) as pool:
+            outcomes = list(pool.map(_compile_one, *args))
+
+    results = []
+    errors = {}
+    for i, (ok, res) in enumerate(outcomes):
+        if ok:
+            results.append(res)
+        else:
+            results.append(None)
+            errors[i] = res
+    if errors:
+        raise CompileManyError(errors, results)
+    return results
@@ -1,8 +1,19 @@
 from llvmlite.binding import ffi
 
 
-def create_context():
-    return ContextRef(ffi.lib.LLVMPY_ContextCreate())
+def create_context(lock_mode='global'):
+    """
+    Create a new LLVM context.  With *lock_mode* "context", the context
+    gets its own lock: calls operating on its modules (parsing, running
+    module passes, emitting code) don't serialize with calls on other
+    contexts and can run concurrently from several threads.
+    """
+    if lock_mode not in ('global', 'context'):
+        raise ValueError("invalid lock mode: {0!r}".format(lock_mode))
+    context = ContextRef(ffi.lib.LLVMPY_ContextCreate())
+    if lock_mode == 'context':
+        context._llvm_lock = ffi.lib._lock.new_context_lock()
+    return context
 
 
 def get_global_context():
@@ -10,9 +21,19 @@ def get_global_context():
 
 
 class ContextRef(ffi.ObjectRef):
+    # The lock taken by calls on this context, None for the global lock
+    _llvm_lock = None
+
     def __init__(self, context_ptr):
         super(ContextRef, self).__init__(context_ptr)
 
+    @property
+    def lock_mode(self):
+        """
+        The lock mode of this context, either "global" or "context".
+        """
+        return 'global' if self._llvm_lock is None else 'context'
+
     def _dispose(self):
         ffi.lib.LLVMPY_ContextDispose(self)
 
@@ -27,3 +48,4 @@ ffi.lib.LLVMPY_GetGlobalContext.restype = ffi.LLVMContextRef
 ffi.lib.LLVMPY_ContextCreate.restype = ffi.LLVMContextRef
 
 ffi.lib.LLVMPY_ContextDispose.argtypes = [ffi.LLVMContextRef]
+ffi.lib.LLVMPY_ContextDispose.context_arg = 0
@@ -1,6 +1,8 @@
-from ctypes import (POINTER, c_char_p, c_bool, c_void_p,
-                    c_int, c_uint64, c_size_t, CFUNCTYPE, string_at, cast,
-                    py_object, Structure)
+from concurrent.futures import Future
+from ctypes import (POINTER, addressof, c_char, c_char_p, c_bool, c_void_p,
+                    c_int, c_uint, c_uint64, c_size_t, CFUNCTYPE, string_at,
+                    cast, py_object, Structure)
+import itertools
 
 from llvmlite.binding import ffi, targets, object_file
 
@@ -24,6 +26,22 @@ def create_mcjit_compiler(module, target_machine):
     return ExecutionEngine(engine, module=module)
 
 
+def create_lljit_compiler(target_machine=None, lazy=False,
+                          num_compile_threads=0):
+    """
+    Create an OrcJIT engine based on the ORC LLJIT, generating code for
+    *target_machine* (the host if None).  If *lazy* is true, each function
+    is only compiled when it is first called.  If *num_compile_threads*
+    is non-zero, the code is compiled by a pool of native threads.
+    """
+    with ffi.OutputString() as outerr:
+        jit = ffi.lib.LLVMPY_CreateLLJIT(target_machine, lazy,
+                                         num_compile_threads, outerr)
+        if not jit:
+            raise RuntimeError(str(outerr))
+    return OrcJIT(jit)
+
+
 def check_jit_execution():
     """
     Check the system allows execution of in-memory JITted functions.
@@ -51,6 +69,9 @@ class ExecutionEngine(ffi.ObjectRef):
         """
         self._modules = set([module])
         self._td = None
+        # Buffers returned by the object cache, used by LLVM without
+        # copying: they must live as long as the engine.
+        self._object_cache_buffers = []
         module._owned = True
         ffi.ObjectRef.__init__(self, ptr)
 
@@ -155,13 +176,19 @@ class ExecutionEngine(ffi.ObjectRef):
 
         ffi.lib.LLVMPY_MCJITAddObjectFile(self, obj_file)
 
-    def set_object_cache(self, notify_func=None, getbuffer_func=None):
+    def set_object_cache(self, notify_func=None, getbuffer_func=None,
+                         notify_memoryview=False):
         """
         Set the object cache "notifyObjectCompiled" and "getBuffer"
         callbacks to the given Python functions.
+
+        If *notify_memoryview* is true, *notify_func* is passed a
+        memoryview of the object code owned by LLVM instead of a bytes
+        copy; it is only valid during the call.
         """
         self._object_cache_notify = notify_func
         self._object_cache_getbuffer = getbuffer_func
+        self._object_cache_notify_memoryview = notify_memoryview
         # Lifetime of the object cache is managed by us.
         self._object_cache = _ObjectCacheRef(self)
         # Note this doesn't keep a reference to self, to avoid reference
@@ -177,14 +204,21 @@ class ExecutionEngine(ffi.ObjectRef):
         module_ptr = data.contents.module_ptr
         buf_ptr = data.contents.buf_ptr
         buf_len = data.contents.buf_len
-        buf = string_at(buf_ptr, buf_len)
         module = self._find_module_ptr(module_ptr)
         if module is None:
             # The LLVM EE should only give notifications for modules
             # known by us.
             raise RuntimeError("object compilation notification "
                                "for unknown module %s" % (module_ptr,))
-        self._object_cache_notify(module, buf)
+        if not self._object_cache_notify_memoryview:
+            self._object_cache_notify(module, string_at(buf_ptr, buf_len))
+            return
+        buf = memoryview((c_char * buf_len).from_address(buf_ptr)).cast('B')
+        try:
+            self._object_cache_notify(module, buf)
+        finally:
+            # Don't let the callback keep a dangling view
+            buf.release()
 
     def _raw_object_cache_getbuffer(self, data):
         """
@@ -202,9 +236,22 @@ class ExecutionEngine(ffi.ObjectRef):
 
         buf = self._object_cache_getbuffer(module)
         if buf is not None:
-            # Create a copy, which will be freed by the caller
-            data[0].buf_ptr = ffi.lib.LLVMPY_CreateByteString(buf, len(buf))
-            data[0].buf_len = len(buf)
+            # LLVM uses the buffer without copying it
+            if isinstance(buf, bytes):
+                ptr = cast(c_char_p(buf), c_void_p).value
+                size = len(buf)
+            else:
+                view = memoryview(buf).cast('B')
+                size = view.nbytes
+                try:
+                    buf = (c_char * size).from_buffer(view)
+                except TypeError:
+                    # Read-only buffer
+                    buf = (c_char * size).from_buffer_copy(view)
+                ptr = addressof(buf)
+            self._object_cache_buffers.append(buf)
+            data[0].buf_ptr = ptr
+            data[0].buf_len = size
 
     def _dispose(self):
         # The modules will be cleaned up by the EE
@@ -215,6 +262,109 @@ class ExecutionEngine(ffi.ObjectRef):
         self._modules.clear()
         self._object_cache = None
         self._capi.LLVMPY_DisposeExecutionEngine(self)
+        self._object_cache_buffers = []
+
+
+class OrcJIT(ffi.ObjectRef):
+    """
+    A JIT based on ORC.  Unlike ExecutionEngine, modules can be added at
+    any time, and are compiled when one of their symbols is looked up.
+    The modules are copied, so that they remain owned by the caller.
+    """
+
+    def __init__(self, ptr):
+        self._handles = set()
+        ffi.ObjectRef.__init__(self, ptr)
+
+    def add_module(self, module):
+        """
+        Add a copy of *module* to the JIT.  Return an OrcModuleHandle
+        which can be passed to remove_module().
+        """
+        with ffi.OutputString() as outerr:
+            ptr = ffi.lib.LLVMPY_LLJITAddModule(self, module, outerr)
+            if not ptr:
+                raise RuntimeError(str(outerr))
+        handle = OrcModuleHandle(ptr)
+        self._handles.add(handle)
+        return handle
+
+    def remove_module(self, handle):
+        """
+        Remove the module of *handle* from the JIT, and free its code.
+        """
+        if handle not in self._handles:
+            raise KeyError("module not added to this JIT")
+        with ffi.OutputString() as outerr:
+            if ffi.lib.LLVMPY_LLJITRemoveModule(self, handle, outerr):
+                raise RuntimeError(str(outerr))
+        self._handles.remove(handle)
+        handle.close()
+
+    def get_function_address(self, name):
+        """
+        Return the address of the function named *name* as an integer,
+        compiling it if needed.  RuntimeError is raised if the symbol
+        doesn't exist or fails to compile.
+        """
+        with ffi.OutputString() as outerr:
+            addr = ffi.lib.LLVMPY_LLJITLookup(self, name.encode("ascii"),
+                                              outerr)
+            if not addr:
+                raise RuntimeError(str(outerr))
+        return addr
+
+    get_global_value_address = get_function_address
+
+    def lookup_async(self, names):
+        """
+        Return a concurrent.futures.Future resolving to a dict mapping
+        each symbol name in *names* to its address.  The symbols are
+        compiled in the background by the compile threads of the JIT; if
+        there are none, they are compiled before returning.
+
+        The callbacks added to the future may run on a compile thread, and
+        shouldn't wait for the JIT.
+        """
+        names = list(dict.fromkeys(names))
+        future = Future()
+        future.set_running_or_notify_cancel()
+        key = next(_lookup_keys)
+        _pending_lookups[key] = (future, names)
+        cnames = (c_char_p * len(names))(*[n.encode("ascii") for n in names])
+        ffi.lib.LLVMPY_LLJITLookupAsync(self, cnames, len(names),
+                                        _lookup_c_hook, key)
+        return future
+
+    @staticmethod
+    def _raw_lookup_callback(key, error, addresses):
+        """
+        Low-level lookup_async() callback, called from the thread which
+        completed the lookup.
+        """
+        future, names = _pending_lookups.pop(key)
+        if error is not None:
+            future.set_exception(RuntimeError(error.decode("utf8")))
+        else:
+            future.set_result({name: addresses[i]
+                               for i, name in enumerate(names)})
+
+    def _dispose(self):
+        # Waits for the compile threads.
+        # The handles must be released before the JIT
+        for handle in self._handles:
+            handle.close()
+        self._handles.clear()
+        self._capi.LLVMPY_DisposeLLJIT(self)
+
+
+class OrcModuleHandle(ffi.ObjectRef):
+    """
+    A module added to an OrcJIT.
+    """
+
+    def _dispose(self):
+        self._capi.LLVMPY_LLJITDisposeModuleHandle(self)
 
 
 class _ObjectCacheRef(ffi.ObjectRef):
@@ -286,6 +436,62 @@ ffi.lib.LLVMPY_MCJITAddObjectFile.argtypes = [
     ffi.LLVMObjectFileRef
 ]
 
+ffi.lib.LLVMPY_CreateLLJIT.argtypes = [
+    ffi.LLVMTargetMachineRef,
+    c_int,
+    c_uint,
+    POINTER(c_char_p),
+]
+ffi.lib.LLVMPY_CreateLLJIT.restype = ffi.LLVMOrcJITRef
+
+ffi.lib.LLVMPY_DisposeLLJIT.argtypes = [ffi.LLVMOrcJITRef]
+# Waits for the compile threads, whose callbacks may use llvmlite
+ffi.lib.LLVMPY_DisposeLLJIT.threadsafe = True
+
+ffi.lib.LLVMPY_LLJITAddModule.argtypes = [
+    ffi.LLVMOrcJITRef,
+    ffi.LLVMModuleRef,
+    POINTER(c_char_p),
+]
+ffi.lib.LLVMPY_LLJITAddModule.restype = ffi.LLVMOrcModuleHandleRef
+ffi.lib.LLVMPY_LLJITAddModule.context_arg = 1
+
+ffi.lib.LLVMPY_LLJITRemoveModule.argtypes = [
+    ffi.LLVMOrcJITRef,
+    ffi.LLVMOrcModuleHandleRef,
+    POINTER(c_char_p),
+]
+ffi.lib.LLVMPY_LLJITRemoveModule.restype = c_int
+
+ffi.lib.LLVMPY_LLJITDisposeModuleHandle.argtypes = [
+    ffi.LLVMOrcModuleHandleRef
+]
+
+ffi.lib.LLVMPY_LLJITLookup.argtypes = [
+    ffi.LLVMOrcJITRef,
+    c_char_p,
+    POINTER(c_char_p),
+]
+ffi.lib.LLVMPY_LLJITLookup.restype = c_uint64
+# The JIT has its own locking, and compiles in its own contexts
+ffi.lib.LLVMPY_LLJITLookup.threadsafe = True
+
+_LookupCallback = CFUNCTYPE(None, c_size_t, c_char_p, POINTER(c_uint64))
+
+ffi.lib.LLVMPY_LLJITLookupAsync.argtypes = [
+    ffi.LLVMOrcJITRef,
+    POINTER(c_char_p),
+    c_size_t,
+    _LookupCallback,
+    c_size_t,
+]
+ffi.lib.LLVMPY_LLJITLookupAsync.threadsafe = True
+
+# The (future, names) of the pending lookup_async() calls, by key
+_pending_lookups = {}
+_lookup_keys = itertools.count()
+_lookup_c_hook = _LookupCallback(OrcJIT._raw_lookup_callback)
+
 
 class _ObjectCacheData(Structure):
     _fields_ = [
@@ -317,6 +523,3 @@ ffi.lib.LLVMPY_DisposeObjectCache.argtypes = [ffi.LLVMObjectCacheRef]
 
 ffi.lib.LLVMPY_SetObjectCache.argtypes = [ffi.LLVMExecutionEngineRef,
                                           ffi.LLVMObjectCacheRef]
-
-ffi.lib.LLVMPY_CreateByteString.restype = c_void_p
-ffi.lib.LLVMPY_CreateByteString.argtypes = [c_void_p, c_size_t]
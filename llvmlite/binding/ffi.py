@@ -37,6 +37,8 @@ LLVMTypesIterator = _make_opaque_ref("LLVMTypesIterator")
 LLVMObjectCacheRef = _make_opaque_ref("LLVMObjectCache")
 LLVMObjectFileRef = _make_opaque_ref("LLVMObjectFile")
 LLVMSectionIteratorRef = _make_opaque_ref("LLVMSectionIterator")
+LLVMOrcJITRef = _make_opaque_ref("LLVMOrcJIT")
+LLVMOrcModuleHandleRef = _make_opaque_ref("LLVMOrcModuleHandle")
 
 
 class _LLVMLock:
@@ -48,11 +50,18 @@ class _LLVMLock:
     Also, callbacks can be attached so that every time the lock is acquired
     and released the corresponding callbacks will be invoked.
     """
-    def __init__(self):
+    def __init__(self, cblist=None):
         # The reentrant lock is needed for callbacks that re-enter
         # the Python interpreter.
         self._lock = threading.RLock()
-        self._cblist = []
+        # Per-context locks share the callbacks of the global lock
+        self._cblist = cblist if cblist is not None else []
+
+    def new_context_lock(self):
+        """Create a separate lock for calls on a single LLVM context,
+        invoking the same callbacks as this lock.
+        """
+        return _LLVMLock(self._cblist)
 
     def register(self, acq_fn, rel_fn):
         """Register callbacks that are invoked immediately after the lock is
@@ -123,14 +132,37 @@ class _lib_fn_wrapper(object):
     """Wraps and duck-types a ctypes.CFUNCTYPE to provide
     automatic locking when the wrapped function is called.
 
-    TODO: we can add methods to mark the function as threadsafe
-          and remove the locking-step on call when marked.
+    Functions which don't touch any shared LLVM state can be marked as
+    ``threadsafe``, they are then called without taking any lock.
+    Functions only touching the objects of a single LLVM context can
+    set ``context_arg`` to the index of the argument identifying that
+    context (a context, or an object with a ``_context`` such as a
+    module); they then take the lock of that context instead of the
+    global lock (see create_context()).
     """
-    __slots__ = ['_lock', '_cfn']
+    __slots__ = ['_lock', '_cfn', '_threadsafe', '_context_arg']
 
     def __init__(self, lock, cfn):
         self._lock = lock
         self._cfn = cfn
+        self._threadsafe = False
+        self._context_arg = None
+
+    @property
+    def threadsafe(self):
+        return self._threadsafe
+
+    @threadsafe.setter
+    def threadsafe(self, threadsafe):
+        self._threadsafe = bool(threadsafe)
+
+    @property
+    def context_arg(self):
+        return self._context_arg
+
+    @context_arg.setter
+    def context_arg(self, index):
+        self._context_arg = index
 
     @property
     def argtypes(self):
@@ -148,8 +180,17 @@ class _lib_fn_wrapper(object):
     def restype(self, restype):
         self._cfn.restype = restype
 
+    def _get_lock(self, args):
+        if self._context_arg is None:
+            return self._lock
+        obj = args[self._context_arg]
+        context = getattr(obj, '_context', obj)
+        return getattr(context, '_llvm_lock', None) or self._lock
+
     def __call__(self, *args, **kwargs):
-        with self._lock:
+        if self._threadsafe:
+            return self._cfn(*args, **kwargs)
+        with self._get_lock(args):
             return self._cfn(*args, **kwargs)
 
 
@@ -195,6 +236,13 @@ else:
 
 lib = _lib_wrapper(lib)
 
+lib.LLVMPY_CreateByteString.restype = ctypes.c_void_p
+lib.LLVMPY_CreateByteString.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+
+# Functions not touching any shared LLVM state
+lib.LLVMPY_CreateByteString.threadsafe = True
+lib.LLVMPY_DisposeString.threadsafe = True
+
 
 def register_lock_callback(acq_fn, rel_fn):
     """Register callback functions for lock acquire and release.
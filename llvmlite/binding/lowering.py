@@ -0,0 +1,922 @@
+"""
+Direct lowering of llvmlite.ir modules to LLVM modules, without going
+through the textual IR.
+"""
+
+import re
+import struct
+from array import array
+from ctypes import POINTER, c_char_p, c_int64, c_size_t
+
+from llvmlite.ir import instructions, types, values
+from llvmlite.binding import ffi
+from llvmlite.binding.context import get_global_context
+from llvmlite.binding.module import ModuleRef, parse_assembly
+
+
+# Record codes, keep in sync with ffi/lowering.cpp
+
+_REC_TYPE_VOID = 1
+_REC_TYPE_LABEL = 2
+_REC_TYPE_METADATA = 3
+_REC_TYPE_HALF = 4
+_REC_TYPE_FLOAT = 5
+_REC_TYPE_DOUBLE = 6
+_REC_TYPE_INT = 7
+_REC_TYPE_POINTER = 8
+_REC_TYPE_ARRAY = 9
+_REC_TYPE_VECTOR = 10
+_REC_TYPE_STRUCT = 11
+_REC_TYPE_NAMED = 12
+_REC_TYPE_BODY = 13
+_REC_TYPE_FUNCTION = 14
+
+_REC_MODULE = 20
+_REC_GLOBALVAR = 21
+_REC_FUNCTION = 22
+_REC_LINKAGE = 23
+_REC_STORAGE = 24
+_REC_UNNAMED_ADDR = 25
+_REC_CONSTANT = 26
+_REC_ALIGN = 27
+_REC_INITIALIZER = 28
+_REC_CCONV = 29
+_REC_ATTRIBUTE = 30
+_REC_PERSONALITY = 31
+_REC_ARGUMENT = 32
+_REC_BLOCK = 33
+_REC_FORWARD = 34
+_REC_POSITION = 35
+_REC_GLOBAL_MD = 36
+
+_REC_CST_INT = 40
+_REC_CST_FP = 41
+_REC_CST_NULL = 42
+_REC_CST_UNDEF = 43
+_REC_CST_AGGREGATE = 44
+_REC_CST_DATA = 45
+_REC_CST_TEXT = 46
+_REC_CST_BLOCKADDR = 47
+_REC_INLINE_ASM = 48
+_REC_MD_AS_VALUE = 49
+
+_REC_MD_STRING = 60
+_REC_MD_VALUE = 61
+_REC_MD_NODE = 62
+_REC_MD_NAMED = 63
+_REC_MD_ATTACH = 64
+
+_REC_INST_BINOP = 80
+_REC_INST_CAST = 81
+_REC_INST_ICMP = 82
+_REC_INST_FCMP = 83
+_REC_INST_SELECT = 84
+_REC_INST_LOAD = 85
+_REC_INST_STORE = 86
+_REC_INST_LOAD_ATOMIC = 87
+_REC_INST_STORE_ATOMIC = 88
+_REC_INST_ALLOCA = 89
+_REC_INST_GEP = 90
+_REC_INST_PHI = 91
+_REC_INST_CALL = 92
+_REC_INST_INVOKE = 93
+_REC_INST_RET = 94
+_REC_INST_BR = 95
+_REC_INST_CONDBR = 96
+_REC_INST_SWITCH = 97
+_REC_INST_INDIRECTBR = 98
+_REC_INST_RESUME = 99
+_REC_INST_UNREACHABLE = 100
+_REC_INST_EXTRACTVALUE = 101
+_REC_INST_INSERTVALUE = 102
+_REC_INST_EXTRACTELEMENT = 103
+_REC_INST_INSERTELEMENT = 104
+_REC_INST_SHUFFLEVECTOR = 105
+_REC_INST_ATOMICRMW = 106
+_REC_INST_CMPXCHG = 107
+_REC_INST_FENCE = 108
+_REC_INST_LANDINGPAD = 109
+_REC_INST_CALL_ATTR = 110
+
+_FLAGS = {
+    'nuw': 1 << 0,
+    'nsw': 1 << 1,
+    'exact': 1 << 2,
+    'fast': 1 << 8,
+    'nnan': 1 << 9,
+    'ninf': 1 << 10,
+    'nsz': 1 << 11,
+    'arcp': 1 << 12,
+    'contract': 1 << 13,
+    'afn': 1 << 14,
+    'reassoc': 1 << 15,
+}
+
+_BINOPS = {name: i for i, name in enumerate([
+    'add', 'fadd', 'sub', 'fsub', 'mul', 'fmul', 'udiv', 'sdiv', 'fdiv',
+    'urem', 'srem', 'frem', 'shl', 'lshr', 'ashr', 'and', 'or', 'xor'])}
+
+_CASTOPS = {name: i for i, name in enumerate([
+    'trunc', 'zext', 'sext', 'fptrunc', 'fpext', 'fptoui', 'fptosi',
+    'uitofp', 'sitofp', 'ptrtoint', 'inttoptr', 'bitcast',
+    'addrspacecast'])}
+
+_RMWOPS = {name: i for i, name in enumerate([
+    'xchg', 'add', 'sub', 'and', 'nand', 'or', 'xor', 'max', 'min', 'umax',
+    'umin', 'fadd', 'fsub'])}
+
+_ORDERINGS = {name: i for i, name in enumerate([
+    'unordered', 'monotonic', 'acquire', 'release', 'acq_rel', 'seq_cst'])}
+
+# llvm::CmpInst::Predicate
+_FCMP_PREDICATES = {name: i for i, name in enumerate([
+    'false', 'oeq', 'ogt', 'oge', 'olt', 'ole', 'one', 'ord', 'uno', 'ueq',
+    'ugt', 'uge', 'ult', 'ule', 'une', 'true'])}
+
+_ICMP_PREDICATES = {name: 32 + i for i, name in enumerate([
+    'eq', 'ne', 'ugt', 'uge', 'ult', 'ule', 'sgt', 'sge', 'slt', 'sle'])}
+
+# llvm::GlobalValue::LinkageTypes
+_LINKAGES = {
+    '': 0,
+    'external': 0,
+    'available_externally': 1,
+    'linkonce': 2,
+    'linkonce_odr': 3,
+    'weak': 4,
+    'weak_odr': 5,
+    'appending': 6,
+    'internal': 7,
+    'private': 8,
+    'extern_weak': 9,
+    'common': 10,
+}
+
+# llvm::GlobalValue::DLLStorageClassTypes
+_STORAGE_CLASSES = {
+    '': 0,
+    'dllimport': 1,
+    'dllexport': 2,
+}
+
+# llvm::CallingConv
+_CALLING_CONVENTIONS = {
+    '': 0,
+    'ccc': 0,
+    'fastcc': 8,
+    'coldcc': 9,
+    'ghccc': 10,
+    'webkit_jscc': 12,
+    'anyregcc': 13,
+    'preserve_mostcc': 14,
+    'preserve_allcc': 15,
+    'swiftcc': 16,
+    'cxx_fast_tlscc': 17,
+    'x86_stdcallcc': 64,
+    'x86_fastcallcc': 65,
+    'arm_apcscc': 66,
+    'arm_aapcscc': 67,
+    'arm_aapcs_vfpcc': 68,
+    'msp430_intrcc': 69,
+    'x86_thiscallcc': 70,
+    'ptx_kernel': 71,
+    'ptx_device': 72,
+    'spir_func': 75,
+    'spir_kernel': 76,
+    'intel_ocl_bicc': 77,
+    'x86_64_sysvcc': 78,
+    'win64cc': 79,
+    'x86_vectorcallcc': 80,
+}
+
+_ESCAPE_RE = re.compile(br'\\(\\|[0-9a-fA-F]{2})')
+
+_double_to_int64 = struct.Struct('d').pack
+_int64_from_bytes = struct.Struct('q').unpack
+
+
+def _data_element_supported(ty):
+    """
+    Whether arrays of *ty* can be lowered as raw data.
+    """
+    if isinstance(ty, types.IntType):
+        return ty.width in (8, 16, 32, 64)
+    return isinstance(ty, types._BaseFloatType)
+
+
+def _unescape(text):
+    """
+    Unescape *text* the same way the LLVM lexer handles quoted strings.
+    """
+    text = text.encode('utf-8')
+    if b'\\' not in text:
+        return text
+
+    def repl(m):
+        s = m.group(1)
+        if s == b'\\':
+            return s
+        return bytes([int(s, 16)])
+
+    return _ESCAPE_RE.sub(repl, text)
+
+
+class _Unsupported(Exception):
+    """
+    The module uses a construct the lowering doesn't handle.
+    """
+
+
+class _ModuleEncoder(object):
+    """
+    Encode a llvmlite.ir module as the record stream understood by
+    LLVMPY_LowerModule().
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.code = array('q')
+        self.strtab = bytearray()
+        self.strings = {}
+        self.type_ids = {}
+        self.value_ids = {}
+        self.md_ids = {}
+        # Keep alive all objects whose id() is used as a key
+        self.keepalive = []
+        self.defined = set()
+        self.instr_encoders = {
+            instructions.Instruction: self._encode_binop,
+            instructions.CastInstr: self._encode_cast,
+            instructions.ICMPInstr: self._encode_icmp,
+            instructions.FCMPInstr: self._encode_fcmp,
+            instructions.SelectInstr: self._encode_select,
+            instructions.LoadInstr: self._encode_load,
+            instructions.StoreInstr: self._encode_store,
+            instructions.LoadAtomicInstr: self._encode_load_atomic,
+            instructions.StoreAtomicInstr: self._encode_store_atomic,
+            instructions.AllocaInstr: self._encode_alloca,
+            instructions.GEPInstr: self._encode_gep,
+            instructions.PhiInstr: self._encode_phi,
+            instructions.CallInstr: self._encode_call,
+            instructions.InvokeInstr: self._encode_invoke,
+            instructions.Ret: self._encode_ret,
+            instructions.Branch: self._encode_branch,
+            instructions.ConditionalBranch: self._encode_branch,
+            instructions.IndirectBranch: self._encode_indirectbr,
+            instructions.SwitchInstr: self._encode_switch,
+            instructions.Resume: self._encode_branch,
+            instructions.Unreachable: self._encode_unreachable,
+            instructions.ExtractValue: self._encode_extractvalue,
+            instructions.InsertValue: self._encode_insertvalue,
+            instructions.ExtractElement: self._encode_extractelement,
+            instructions.InsertElement: self._encode_insertelement,
+            instructions.ShuffleVector: self._encode_shufflevector,
+            instructions.AtomicRMW: self._encode_atomicrmw,
+            instructions.CmpXchg: self._encode_cmpxchg,
+            instructions.Fence: self._encode_fence,
+            instructions.LandingPadInstr: self._encode_landingpad,
+        }
+
+    def encode(self):
+        """
+        Return a (code, strtab) tuple.
+        """
+        module = self.module
+        emit = self._emit
+        emit(_REC_MODULE, *(self._string(module.triple) +
+                            self._string(module.data_layout)))
+        self._encode_identified_types()
+        globs = module._get_exported_globals()
+        for gv in globs:
+            self._declare_global(gv)
+        for gv in globs:
+            if isinstance(gv, values.Function):
+                self._declare_function_body(gv)
+        for gv in globs:
+            if isinstance(gv, values.Function):
+                self._encode_function_attributes(gv)
+            else:
+                self._encode_global_variable(gv)
+        for gv in globs:
+            if isinstance(gv, values.Function):
+                self._encode_function_body(gv)
+        for name, nmd in module.namedmetadata.items():
+            mds = [self._metadata(md) for md in nmd.operands]
+            emit(_REC_MD_NAMED, *(self._string(name) + tuple(mds)))
+        return self.code, bytes(self.strtab)
+
+    def _emit(self, rec, *ops):
+        code = self.code
+        code.append(rec)
+        code.append(len(ops))
+        code.extend(ops)
+
+    def _string(self, s):
+        """
+        Return the (offset, length) of *s* in the string table.
+        """
+        try:
+            return self.strings[s]
+        except KeyError:
+            if isinstance(s, str):
+                data = s.encode('utf-8')
+            else:
+                data = bytes(s)
+            ref = self.strings[s] = (len(self.strtab), len(data))
+            self.strtab += data
+            return ref
+
+    #
+    # Types
+    #
+
+    def _type(self, ty):
+        key = str(ty)
+        try:
+            return self.type_ids[key]
+        except KeyError:
+            pass
+        if isinstance(ty, types.IntType):
+            self._emit(_REC_TYPE_INT, ty.width)
+        elif isinstance(ty, types.PointerType):
+            self._emit(_REC_TYPE_POINTER, self._type(ty.pointee),
+                       ty.addrspace)
+        elif isinstance(ty, types.DoubleType):
+            self._emit(_REC_TYPE_DOUBLE)
+        elif isinstance(ty, types.FloatType):
+            self._emit(_REC_TYPE_FLOAT)
+        elif isinstance(ty, types.HalfType):
+            self._emit(_REC_TYPE_HALF)
+        elif isinstance(ty, types.VoidType):
+            self._emit(_REC_TYPE_VOID)
+        elif isinstance(ty, types.LabelType):
+            self._emit(_REC_TYPE_LABEL)
+        elif isinstance(ty, types.MetaDataType):
+            self._emit(_REC_TYPE_METADATA)
+        elif isinstance(ty, types.FunctionType):
+            ops = [self._type(ty.return_type), int(ty.var_arg)]
+            ops += [self._type(arg) for arg in ty.args]
+            self._emit(_REC_TYPE_FUNCTION, *ops)
+        elif isinstance(ty, types.ArrayType):
+            self._emit(_REC_TYPE_ARRAY, self._type(ty.element), ty.count)
+        elif isinstance(ty, types.VectorType):
+            self._emit(_REC_TYPE_VECTOR, self._type(ty.element), ty.count)
+        elif isinstance(ty, types.LiteralStructType):
+            ops = [int(ty.packed)] + [self._type(el) for el in ty.elements]
+            self._emit(_REC_TYPE_STRUCT, *ops)
+        else:
+            # Including identified types from another context
+            raise _Unsupported(ty)
+        tid = self.type_ids[key] = len(self.type_ids)
+        return tid
+
+    def _encode_identified_types(self):
+        idtypes = list(self.module.get_identified_types().values())
+        # Declare all identified types first, as they can be recursive
+        for ty in idtypes:
+            self._emit(_REC_TYPE_NAMED, *self._string(ty.name))
+            self.type_ids[str(ty)] = len(self.type_ids)
+        for ty in idtypes:
+            if not ty.is_opaque:
+                ops = [self.type_ids[str(ty)], int(ty.packed)]
+                ops += [self._type(el) for el in ty.elements]
+                self._emit(_REC_TYPE_BODY, *ops)
+
+    #
+    # Values
+    #
+
+    def _new_id(self, v):
+        vid = self.value_ids[id(v)] = len(self.value_ids)
+        self.keepalive.append(v)
+        return vid
+
+    def _define(self, v):
+        """
+        Return the id of value *v*, which is being defined.
+        """
+        key = id(v)
+        self.defined.add(key)
+        try:
+            return self.value_ids[key]
+        except KeyError:
+            return self._new_id(v)
+
+    def _value(self, v):
+        try:
+            return self.value_ids[id(v)]
+        except KeyError:
+            pass
+        if isinstance(v, values.Constant):
+            return self._constant(v)
+        elif isinstance(v, instructions.Instruction):
+            # Used before being defined
+            vid = self._new_id(v)
+            self._emit(_REC_FORWARD, vid, self._type(v.type))
+            return vid
+        elif isinstance(v, values.BlockAddress):
+            fn = self._value(v.function)
+            blk = self._value(v.basic_block)
+            vid = self._new_id(v)
+            self._emit(_REC_CST_BLOCKADDR, vid, fn, blk)
+            return vid
+        elif isinstance(v, instructions.InlineAsm):
+            fnty = self._type(v.function_type)
+            ops = (self._string(_unescape(v.asm)) +
+                   self._string(_unescape(v.constraint)))
+            vid = self._new_id(v)
+            self._emit(_REC_INLINE_ASM, vid, fnty, int(v.side_effect), *ops)
+            return vid
+        elif isinstance(v, values.MetaDataArgument):
+            md = self._new_md(v)
+            self._emit(_REC_MD_VALUE, md, self._value(v.wrapped_value))
+            vid = self._new_id(v)
+            self._emit(_REC_MD_AS_VALUE, vid, md)
+            return vid
+        elif isinstance(v, (values.MDValue, values.MetaDataString)):
+            md = self._metadata(v)
+            vid = self._new_id(v)
+            self._emit(_REC_MD_AS_VALUE, vid, md)
+            return vid
+        else:
+            # Including global values and blocks from other modules
+            raise _Unsupported(v)
+
+    def _constant(self, c):
+        ty = c.type
+        tid = self._type(ty)
+        val = c.constant
+        if isinstance(c, values.FormattedConstant):
+            return self._text_constant(c, "{0} {1}".format(ty, val))
+        elif val is None:
+            vid = self._new_id(c)
+            self._emit(_REC_CST_NULL, vid, tid)
+        elif val is values.Undefined:
+            vid = self._new_id(c)
+            self._emit(_REC_CST_UNDEF, vid, tid)
+        elif isinstance(ty, types.IntType) and isinstance(val, int):
+            width = ty.width
+            val = int(val) & ((1 << width) - 1)
+            if width <= 64:
+                if val >= 1 << 63:
+                    val -= 1 << 64
+                words = (val,)
+            else:
+                words = []
+                while True:
+                    word = val & 0xffffffffffffffff
+                    if word >= 1 << 63:
+                        word -= 1 << 64
+                    words.append(word)
+                    val >>= 64
+                    if not val:
+                        break
+            vid = self._new_id(c)
+            self._emit(_REC_CST_INT, vid, tid, *words)
+        elif (isinstance(ty, types._BaseFloatType) and
+              isinstance(val, (int, float))):
+            if isinstance(ty, types.HalfType):
+                val = types._as_half(val)
+            elif isinstance(ty, types.FloatType):
+                val = types._as_float(val)
+            bits, = _int64_from_bytes(_double_to_int64(val))
+            vid = self._new_id(c)
+            self._emit(_REC_CST_FP, vid, tid, bits)
+        elif isinstance(val, bytearray):
+            data = self._string(bytes(val))
+            vid = self._new_id(c)
+            self._emit(_REC_CST_DATA, vid, tid, *data)
+        elif (isinstance(val, (list, tuple)) and
+              isinstance(ty, (types.Aggregate, types.VectorType))):
+            elems = [self._value(el) for el in val]
+            vid = self._new_id(c)
+            self._emit(_REC_CST_AGGREGATE, vid, tid, *elems)
+        elif (isinstance(val, values.DataArray) and
+              _data_element_supported(val.element)):
+            vid = self._data_array(c, ty, val.data)
+        else:
+            return self._text_constant(c, str(c))
+        return vid
+
+    def _data_array(self, owner, ty, data):
+        """
+        Emit the raw *data* of a constant of array type *ty*: the innermost
+        arrays are emitted as data records, the outer dimensions as
+        aggregates of those.
+        """
+        tid = self._type(ty)
+        if isinstance(ty.element, types.ArrayType):
+            rowsize = len(data) // ty.count if ty.count else 0
+            elems = [self._data_array(None, ty.element, data[i:i + rowsize])
+                     for i in range(0, len(data), rowsize or 1)]
+            vid = self._new_id(owner if owner is not None else object())
+            self._emit(_REC_CST_AGGREGATE, vid, tid, *elems)
+        else:
+            ref = self._string(data)
+            vid = self._new_id(owner if owner is not None else object())
+            self._emit(_REC_CST_DATA, vid, tid, *ref)
+        return vid
+
+    def _text_constant(self, c, text):
+        ops = self._string(text)
+        vid = self._new_id(c)
+        self._emit(_REC_CST_TEXT, vid, *ops)
+        return vid
+
+    #
+    # Metadata
+    #
+
+    def _new_md(self, v):
+        md = self.md_ids[id(v)] = len(self.md_ids)
+        self.keepalive.append(v)
+        return md
+
+    def _metadata(self, v):
+        try:
+            return self.md_ids[id(v)]
+        except KeyError:
+            pass
+        if isinstance(v, values.MDValue):
+            ops = []
+            for op in v.operands:
+                if isinstance(op.type, types.MetaDataType):
+                    if isinstance(op, values.Constant) and op.constant is None:
+                        ops.append(-1)
+                    else:
+                        ops.append(self._metadata(op))
+                elif isinstance(op, (values.Constant, values.GlobalValue)):
+                    md = self._new_md(op)
+                    self._emit(_REC_MD_VALUE, md, self._value(op))
+                    ops.append(md)
+                else:
+                    raise _Unsupported(op)
+            md = self._new_md(v)
+            self._emit(_REC_MD_NODE, md, *ops)
+        elif isinstance(v, values.MetaDataString):
+            s = v.string
+            if isinstance(s, str):
+                s = s.encode('ascii')
+            ops = self._string(s)
+            md = self._new_md(v)
+            self._emit(_REC_MD_STRING, md, *ops)
+        else:
+            # Including debug information (DIValue)
+            raise _Unsupported(v)
+        return md
+
+    def _encode_attached_metadata(self, vid, obj, rec=_REC_MD_ATTACH):
+        for kind, md in obj.metadata.items():
+            md = self._metadata(md)
+            self._emit(rec, vid, *(self._string(kind) + (md,)))
+
+    #
+    # Global values
+    #
+
+    def _declare_global(self, gv):
+        name = self._string(gv.name)
+        if isinstance(gv, values.Function):
+            fnty = self._type(gv.ftype)
+            self._emit(_REC_FUNCTION, self._define(gv), fnty, *name)
+        elif isinstance(gv, values.GlobalVariable):
+            ty = self._type(gv.value_type)
+            self._emit(_REC_GLOBALVAR, self._define(gv), ty, gv.addrspace,
+                       *name)
+        else:
+            raise _Unsupported(gv)
+
+    def _encode_linkage(self, vid, gv, linkage):
+        try:
+            linkage = _LINKAGES[linkage]
+            storage_class = _STORAGE_CLASSES[gv.storage_class]
+        except KeyError:
+            raise _Unsupported(gv)
+        if linkage:
+            self._emit(_REC_LINKAGE, vid, linkage)
+        if storage_class:
+            self._emit(_REC_STORAGE, vid, storage_class)
+
+    def _encode_global_variable(self, gv):
+        vid = self.value_ids[id(gv)]
+        self._encode_linkage(vid, gv, gv.linkage)
+        if gv.unnamed_addr:
+            self._emit(_REC_UNNAMED_ADDR, vid)
+        if gv.global_constant:
+            self._emit(_REC_CONSTANT, vid)
+        if gv.align is not None:
+            self._emit(_REC_ALIGN, vid, gv.align)
+        init = gv.initializer
+        if init is not None:
+            if init.type != gv.value_type:
+                raise TypeError("got initializer of type %s "
+                                "for global value type %s"
+                                % (init.type, gv.value_type))
+            self._emit(_REC_INITIALIZER, vid, self._value(init))
+        elif gv.linkage not in ('', 'external', 'extern_weak'):
+            # Like GlobalVariable.descr(), use 'undef' for non-external
+            # linkage
+            undef = gv.value_type(values.Undefined)
+            self._emit(_REC_INITIALIZER, vid, self._value(undef))
+
+    def _encode_attribute(self, vid, index, name, value=0):
+        self._emit(_REC_ATTRIBUTE, vid, index,
+                   *(self._string(name) + (value,)))
+
+    def _encode_argument_attributes(self, vid, index, attrs):
+        for attr in attrs:
+            self._encode_attribute(vid, index, attr)
+        for attr in ('align', 'dereferenceable', 'dereferenceable_or_null'):
+            value = getattr(attrs, attr)
+            if value:
+                self._encode_attribute(vid, index, attr, value)
+
+    def _encode_function_attributes(self, fn):
+        vid = self.value_ids[id(fn)]
+        self._encode_linkage(vid, fn, fn.linkage)
+        try:
+            cconv = _CALLING_CONVENTIONS[fn.calling_convention]
+        except KeyError:
+            raise _Unsupported(fn.calling_convention)
+        if cconv:
+            self._emit(_REC_CCONV, vid, cconv)
+        attrs = fn.attributes
+        for attr in attrs:
+            self._encode_attribute(vid, -1, attr)
+        if attrs.alignstack:
+            self._encode_attribute(vid, -1, 'alignstack', attrs.alignstack)
+        if attrs.personality is not None:
+            self._emit(_REC_PERSONALITY, vid, self._value(attrs.personality))
+        self._encode_argument_attributes(vid, 0, fn.return_value.attributes)
+        for i, arg in enumerate(fn.args):
+            self._encode_argument_attributes(vid, i + 1, arg.attributes)
+        self._encode_attached_metadata(vid, fn, _REC_GLOBAL_MD)
+
+    def _declare_function_body(self, fn):
+        fid = self.value_ids[id(fn)]
+        emit = self._emit
+        for i, arg in enumerate(fn.args):
+            emit(_REC_ARGUMENT, fid, i, self._define(arg),
+                 *self._string(arg.name))
+        for blk in fn.blocks:
+            emit(_REC_BLOCK, self._define(blk), fid,
+                 *self._string(blk.name))
+
+    def _encode_function_body(self, fn):
+        value_ids = self.value_ids
+        encoders = self.instr_encoders
+        for blk in fn.blocks:
+            self._emit(_REC_POSITION, value_ids[id(blk)])
+            for instr in blk.instructions:
+                try:
+                    encode = encoders[type(instr)]
+                except KeyError:
+                    raise _Unsupported(instr)
+                if (type(instr) is instructions.PhiInstr and
+                        any(val is instr for val, blk in instr.incomings)):
+                    # A phi node using itself, in a loop: declare it
+                    # before the record defining it refers to it
+                    self._value(instr)
+                vid = self._define(instr)
+                if isinstance(instr.type, types.VoidType):
+                    name = (0, 0)
+                else:
+                    name = self._string(instr.name)
+                encode(instr, vid, name)
+                # Avoids creating the instruction's metadata dict
+                if instr._metadata:
+                    self._encode_attached_metadata(vid, instr)
+
+    #
+    # Instructions
+    #
+
+    def _flags(self, flags):
+        res = 0
+        for flag in flags:
+            try:
+                res |= _FLAGS[flag]
+            except KeyError:
+                raise _Unsupported(flag)
+        return res
+
+    def _encode_binop(self, instr, vid, name):
+        try:
+            opcode = _BINOPS[instr.opname]
+        except KeyError:
+            raise _Unsupported(instr.opname)
+        lhs, rhs = instr.operands
+        ops = (opcode, self._flags(instr._flags or ()),
+               self._value(lhs), self._value(rhs))
+        self._emit(_REC_INST_BINOP, vid, *(name + ops))
+
+    def _encode_cast(self, instr, vid, name):
+        try:
+            opcode = _CASTOPS[instr.opname]
+        except KeyError:
+            raise _Unsupported(instr.opname)
+        val, = instr.operands
+        ops = (opcode, self._value(val), self._type(instr.type))
+        self._emit(_REC_INST_CAST, vid, *(name + ops))
+
+    def _encode_icmp(self, instr, vid, name):
+        lhs, rhs = instr.operands
+        ops = (_ICMP_PREDICATES[instr.op], self._value(lhs), self._value(rhs))
+        self._emit(_REC_INST_ICMP, vid, *(name + ops))
+
+    def _encode_fcmp(self, instr, vid, name):
+        lhs, rhs = instr.operands
+        ops = (_FCMP_PREDICATES[instr.op], self._flags(instr._flags or ()),
+               self._value(lhs), self._value(rhs))
+        self._emit(_REC_INST_FCMP, vid, *(name + ops))
+
+    def _encode_select(self, instr, vid, name):
+        ops = tuple(self._value(op) for op in instr.operands)
+        self._emit(_REC_INST_SELECT, vid, *(name + ops))
+
+    def _encode_load(self, instr, vid, name):
+        ptr, = instr.operands
+        ops = (self._type(instr.type), self._value(ptr), instr.align or 0)
+        self._emit(_REC_INST_LOAD, vid, *(name + ops))
+
+    def _encode_store(self, instr, vid, name):
+        val, ptr = instr.operands
+        ops = (self._value(val), self._value(ptr),
+               getattr(instr, 'align', None) or 0)
+        self._emit(_REC_INST_STORE, vid, *(name + ops))
+
+    def _encode_load_atomic(self, instr, vid, name):
+        ptr, = instr.operands
+        ops = (self._type(instr.type), self._value(ptr),
+               _ORDERINGS[instr.ordering], instr.align)
+        self._emit(_REC_INST_LOAD_ATOMIC, vid, *(name + ops))
+
+    def _encode_store_atomic(self, instr, vid, name):
+        val, ptr = instr.operands
+        ops = (self._value(val), self._value(ptr),
+               _ORDERINGS[instr.ordering], instr.align)
+        self._emit(_REC_INST_STORE_ATOMIC, vid, *(name + ops))
+
+    def _encode_alloca(self, instr, vid, name):
+        count = self._value(instr.operands[0]) if instr.operands else -1
+        ops = (self._type(instr.type.pointee), count, instr.align or 0)
+        self._emit(_REC_INST_ALLOCA, vid, *(name + ops))
+
+    def _encode_gep(self, instr, vid, name):
+        ptr = instr.pointer
+        ops = [self._type(ptr.type.pointee), int(instr.inbounds),
+               self._value(ptr)]
+        ops += [self._value(idx) for idx in instr.indices]
+        self._emit(_REC_INST_GEP, vid, *(name + tuple(ops)))
+
+    def _encode_phi(self, instr, vid, name):
+        ops = [self._type(instr.type)]
+        for val, blk in instr.incomings:
+            ops.append(self._value(val))
+            ops.append(self._value(blk))
+        self._emit(_REC_INST_PHI, vid, *(name + tuple(ops)))
+
+    def _encode_callee(self, instr):
+        callee = instr.callee
+        try:
+            cconv = _CALLING_CONVENTIONS[instr.cconv or '']
+        except KeyError:
+            raise _Unsupported(instr.cconv)
+        return (self._type(callee.function_type), self._value(callee), cconv)
+
+    def _encode_call_attributes(self, instr, vid):
+        for attr in instr.attributes:
+            self._emit(_REC_INST_CALL_ATTR, vid, *self._string(attr))
+
+    def _encode_call(self, instr, vid, name):
+        ops = self._encode_callee(instr)
+        ops += (int(bool(instr.tail)), self._flags(instr.fastmath))
+        ops += tuple(self._value(arg) for arg in instr.args)
+        self._emit(_REC_INST_CALL, vid, *(name + ops))
+        self._encode_call_attributes(instr, vid)
+
+    def _encode_invoke(self, instr, vid, name):
+        if instr.fastmath:
+            raise _Unsupported(instr)
+        ops = self._encode_callee(instr)
+        ops += (self._value(instr.normal_to), self._value(instr.unwind_to))
+        ops += tuple(self._value(arg) for arg in instr.args)
+        self._emit(_REC_INST_INVOKE, vid, *(name + ops))
+        self._encode_call_attributes(instr, vid)
+
+    def _encode_ret(self, instr, vid, name):
+        val = instr.return_value
+        ops = (self._value(val) if val is not None else -1,)
+        self._emit(_REC_INST_RET, vid, *(name + ops))
+
+    def _encode_branch(self, instr, vid, name):
+        ops = tuple(self._value(op) for op in instr.operands)
+        if instr.opname == 'resume':
+            rec = _REC_INST_RESUME
+        elif len(ops) == 1:
+            rec = _REC_INST_BR
+        else:
+            rec = _REC_INST_CONDBR
+        self._emit(rec, vid, *(name + ops))
+
+    def _encode_indirectbr(self, instr, vid, name):
+        ops = [self._value(instr.address)]
+        ops += [self._value(blk) for blk in instr.destinations]
+        self._emit(_REC_INST_INDIRECTBR, vid, *(name + tuple(ops)))
+
+    def _encode_switch(self, instr, vid, name):
+        ops = [self._value(instr.value), self._value(instr.default)]
+        for val, blk in instr.cases:
+            ops.append(self._value(val))
+            ops.append(self._value(blk))
+        self._emit(_REC_INST_SWITCH, vid, *(name + tuple(ops)))
+
+    def _encode_unreachable(self, instr, vid, name):
+        self._emit(_REC_INST_UNREACHABLE, vid, *name)
+
+    def _encode_extractvalue(self, instr, vid, name):
+        ops = (self._value(instr.aggregate),) + tuple(instr.indices)
+        self._emit(_REC_INST_EXTRACTVALUE, vid, *(name + ops))
+
+    def _encode_insertvalue(self, instr, vid, name):
+        ops = ((self._value(instr.aggregate), self._value(instr.value)) +
+               tuple(instr.indices))
+        self._emit(_REC_INST_INSERTVALUE, vid, *(name + ops))
+
+    def _encode_extractelement(self, instr, vid, name):
+        ops = tuple(self._value(op) for op in instr.operands)
+        self._emit(_REC_INST_EXTRACTELEMENT, vid, *(name + ops))
+
+    def _encode_insertelement(self, instr, vid, name):
+        ops = tuple(self._value(op) for op in instr.operands)
+        self._emit(_REC_INST_INSERTELEMENT, vid, *(name + ops))
+
+    def _encode_shufflevector(self, instr, vid, name):
+        ops = tuple(self._value(op) for op in instr.operands)
+        self._emit(_REC_INST_SHUFFLEVECTOR, vid, *(name + ops))
+
+    def _encode_atomicrmw(self, instr, vid, name):
+        ptr, val = instr.operands
+        ops = (_RMWOPS[instr.operation], self._value(ptr), self._value(val),
+               _ORDERINGS[instr.ordering])
+        self._emit(_REC_INST_ATOMICRMW, vid, *(name + ops))
+
+    def _encode_cmpxchg(self, instr, vid, name):
+        ops = tuple(self._value(op) for op in instr.operands)
+        ops += (_ORDERINGS[instr.ordering], _ORDERINGS[instr.failordering])
+        self._emit(_REC_INST_CMPXCHG, vid, *(name + ops))
+
+    def _encode_fence(self, instr, vid, name):
+        if instr.targetscope is None:
+            scope = (0, -1)
+        else:
+            scope = self._string(instr.targetscope)
+        ops = (_ORDERINGS[instr.ordering],) + scope
+        self._emit(_REC_INST_FENCE, vid, *(name + ops))
+
+    def _encode_landingpad(self, instr, vid, name):
+        ops = [self._type(instr.type), int(instr.cleanup)]
+        ops += [self._value(clause.value) for clause in instr.clauses]
+        self._emit(_REC_INST_LANDINGPAD, vid, *(name + tuple(ops)))
+
+
+def lower_module(module, context=None):
+    """
+    Create a ModuleRef from the llvmlite.ir Module *module*.
+
+    This gives the same result as ``parse_assembly(str(module))`` but
+    builds the LLVM module directly from the IR objects, which avoids
+    formatting and parsing back the textual IR.  Modules using constructs
+    not supported by direct lowering (such as debug information metadata)
+    are transparently lowered through the textual IR.
+    """
+    if context is None:
+        context = get_global_context()
+    try:
+        code, strtab = _ModuleEncoder(module).encode()
+    except _Unsupported:
+        return parse_assembly(str(module), context)
+
+    codebuf = (c_int64 * len(code)).from_buffer(code)
+    with ffi.OutputString() as errmsg:
+        mod = ModuleRef(
+            ffi.lib.LLVMPY_LowerModule(context, codebuf, len(code),
+                                       strtab, len(strtab), errmsg),
+            context)
+        if errmsg:
+            mod.close()
+            raise RuntimeError("LLVM IR lowering error\n{0}".format(errmsg))
+    return mod
+
+
+# =============================================================================
+# Set function FFI
+
+ffi.lib.LLVMPY_LowerModule.argtypes = [ffi.LLVMContextRef,
+                                       POINTER(c_int64),
+                                       c_size_t,
+                                       c_char_p,
+                                       c_size_t,
+                                       POINTER(c_char_p)]
+ffi.lib.LLVMPY_LowerModule.restype = ffi.LLVMModuleRef
+ffi.lib.LLVMPY_LowerModule.context_arg = 0
@@ -272,19 +272,25 @@ ffi.lib.LLVMPY_ParseAssembly.argtypes = [ffi.LLVMContextRef,
                                          c_char_p,
                                          POINTER(c_char_p)]
 ffi.lib.LLVMPY_ParseAssembly.restype = ffi.LLVMModuleRef
+ffi.lib.LLVMPY_ParseAssembly.context_arg = 0
 
 ffi.lib.LLVMPY_ParseBitcode.argtypes = [ffi.LLVMContextRef,
                                         c_char_p, c_size_t,
                                         POINTER(c_char_p)]
 ffi.lib.LLVMPY_ParseBitcode.restype = ffi.LLVMModuleRef
+ffi.lib.LLVMPY_ParseBitcode.context_arg = 0
 
 ffi.lib.LLVMPY_DisposeModule.argtypes = [ffi.LLVMModuleRef]
+ffi.lib.LLVMPY_DisposeModule.context_arg = 0
 
 ffi.lib.LLVMPY_PrintModuleToString.argtypes = [ffi.LLVMModuleRef,
                                                POINTER(c_char_p)]
+ffi.lib.LLVMPY_PrintModuleToString.context_arg = 0
+
 ffi.lib.LLVMPY_WriteBitcodeToString.argtypes = [ffi.LLVMModuleRef,
                                                 POINTER(c_char_p),
                                                 POINTER(c_size_t)]
+ffi.lib.LLVMPY_WriteBitcodeToString.context_arg = 0
 
 ffi.lib.LLVMPY_GetNamedFunction.argtypes = [ffi.LLVMModuleRef,
                                             c_char_p]
@@ -293,6 +299,7 @@ ffi.lib.LLVMPY_GetNamedFunction.restype = ffi.LLVMValueRef
 ffi.lib.LLVMPY_VerifyModule.argtypes = [ffi.LLVMModuleRef,
                                         POINTER(c_char_p)]
 ffi.lib.LLVMPY_VerifyModule.restype = c_bool
+ffi.lib.LLVMPY_VerifyModule.context_arg = 0
 
 ffi.lib.LLVMPY_GetDataLayout.argtypes = [ffi.LLVMModuleRef, POINTER(c_char_p)]
 ffi.lib.LLVMPY_SetDataLayout.argtypes = [ffi.LLVMModuleRef, c_char_p]
@@ -332,6 +339,7 @@ ffi.lib.LLVMPY_TypesIterNext.restype = ffi.LLVMTypeRef
 
 ffi.lib.LLVMPY_CloneModule.argtypes = [ffi.LLVMModuleRef]
 ffi.lib.LLVMPY_CloneModule.restype = ffi.LLVMModuleRef
+ffi.lib.LLVMPY_CloneModule.context_arg = 0
 
 ffi.lib.LLVMPY_GetModuleName.argtypes = [ffi.LLVMModuleRef]
 ffi.lib.LLVMPY_GetModuleName.restype = c_char_p
@@ -0,0 +1,179 @@
+"""
+A persistent object cache for execution engines.
+"""
+
+import hashlib
+import mmap
+import os
+import tempfile
+
+from llvmlite.binding.initfini import llvm_version_info
+
+
+class DiskObjectCache(object):
+    """
+    An object cache storing the object code compiled by an ExecutionEngine
+    in the directory *path*, so that it can be reused by later processes::
+
+        cache = DiskObjectCache(path, target_machine, pmb)
+        engine.set_object_cache(cache.notify, cache.getbuffer,
+                                notify_memoryview=True)
+
+    Entries are keyed by a hash of the module bitcode, the LLVM version,
+    the settings of *target_machine* (triple, CPU name and features...)
+    and, if given, those of the PassManagerBuilder *pmb* used to optimize
+    the modules.
+
+    Entries are written atomically, so that several processes can share
+    the same directory.  If *max_size* is given, the least recently used
+    entries are evicted to keep the total size below *max_size* bytes.
+    """
+
+    _suffix = '.o'
+    _temp_prefix = '.tmp-'
+
+    def __init__(self, path, target_machine, pmb=None, max_size=None):
+        self._path = path
+        self._max_size = max_size
+        self._key_prefix = self._compute_key_prefix(target_machine, pmb)
+        # The key of the modules being compiled, computed in getbuffer()
+        self._pending_keys = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def path(self):
+        """
+        The directory of the cache entries.
+        """
+        return self._path
+
+    def _compute_key_prefix(self, target_machine, pmb):
+        parts = ['llvm', '.'.join(map(str, llvm_version_info)),
+                 'triple', target_machine.triple]
+        creation_args = target_machine._creation_args
+        if creation_args is not None:
+            _, options = creation_args
+            for name in sorted(options):
+                parts += [name, str(options[name])]
+        if pmb is not None:
+            parts += ['opt_level', str(pmb.opt_level),
+                      'size_level', str(pmb.size_level),
+                      'inlining_threshold', str(pmb._inlining_threshold),
+                      'disable_unroll_loops', str(pmb.disable_unroll_loops),
+                      'loop_vectorize', str(pmb.loop_vectorize),
+                      'slp_vectorize', str(pmb.slp_vectorize)]
+        return '\0'.join(parts).encode('utf-8')
+
+    def _key(self, module):
+        h = hashlib.sha256(self._key_prefix)
+        h.update(b'\0')
+        h.update(module.as_bitcode())
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._path, key + self._suffix)
+
+    def getbuffer(self, module):
+        """
+        The "getBuffer" callback: return the cached object code for
+        *module*, or None.  Except on Windows (where mapped files can't
+        be evicted), the object code is a copy-on-write memory map of the
+        entry, which LLVM can use without copying.
+        """
+        key = self._key(module)
+        filename = self._entry_path(key)
+        try:
+            with open(filename, 'rb') as f:
+                if os.name == 'nt':
+                    data = f.read()
+                else:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except FileNotFoundError:
+            self._pending_keys[module] = key
+            self.misses += 1
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def notify(self, module, buf):
+        """
+        The "notifyObjectCompiled" callback: store the object code *buf*
+        (a bytes-like object) compiled for *module*.
+        """
+        key = self._pending_keys.pop(module, None)
+        if key is None:
+            key = self._key(module)
+        self._write_atomic(self._entry_path(key), buf)
+        if self._max_size is not None:
+            self.evict(self._max_size)
+
+    def _write_atomic(self, filename, data):
+        fd, tmpname = tempfile.mkstemp(prefix=self._temp_prefix,
+                                       dir=self._path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # Readers either see the whole entry or no entry at all
+            os.replace(tmpname, filename)
+        except BaseException:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            raise
+
+    def _entries(self):
+        """
+        Return a list of (mtime, size, filename) tuples for all entries.
+        """
+        entries = []
+        with os.scandir(self._path) as it:
+            for entry in it:
+                # Also skips temporary files
+                if not entry.name.endswith(self._suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # Removed by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    @property
+    def size(self):
+        """
+        The total size in bytes of the cache entries.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used entries until the total size of the
+        cache is at most *max_size* bytes.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, filename in entries:
+            if total <= max_size:
+                break
+            try:
+                os.unlink(filename)
+            except FileNotFoundError:
+                # Removed by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove all the cache entries.
+        """
+        self.evict(0)
@@ -249,6 +249,7 @@ ffi.lib.LLVMPY_DisposePassManager.argtypes = [ffi.LLVMPassManagerRef]
 ffi.lib.LLVMPY_RunPassManager.argtypes = [ffi.LLVMPassManagerRef,
                                           ffi.LLVMModuleRef]
 ffi.lib.LLVMPY_RunPassManager.restype = c_bool
+ffi.lib.LLVMPY_RunPassManager.context_arg = 1
 
 ffi.lib.LLVMPY_InitializeFunctionPassManager.argtypes = [ffi.LLVMPassManagerRef]
 ffi.lib.LLVMPY_InitializeFunctionPassManager.restype = c_bool
@@ -251,12 +251,20 @@ class Target(ffi.ObjectRef):
                                                 int(jit),
                                                 )
         if tm:
-            return TargetMachine(tm)
+            tm = TargetMachine(tm)
+            # Allow creating an equivalent target machine, e.g. in
+            # another thread or process
+            tm._creation_args = (self._triple,
+                                 dict(cpu=cpu, features=features, opt=opt,
+                                      reloc=reloc, codemodel=codemodel,
+                                      printmc=printmc, jit=jit))
+            return tm
         else:
             raise RuntimeError("Cannot create target machine")
 
 
 class TargetMachine(ffi.ObjectRef):
+    _creation_args = None
 
     def _dispose(self):
         self._capi.LLVMPY_DisposeTargetMachine(self)
@@ -426,14 +434,18 @@ ffi.lib.LLVMPY_TargetMachineEmitToMemory.argtypes = [
     POINTER(c_char_p),
 ]
 ffi.lib.LLVMPY_TargetMachineEmitToMemory.restype = ffi.LLVMMemoryBufferRef
+ffi.lib.LLVMPY_TargetMachineEmitToMemory.context_arg = 1
 
 ffi.lib.LLVMPY_GetBufferStart.argtypes = [ffi.LLVMMemoryBufferRef]
 ffi.lib.LLVMPY_GetBufferStart.restype = c_void_p
+ffi.lib.LLVMPY_GetBufferStart.threadsafe = True
 
 ffi.lib.LLVMPY_GetBufferSize.argtypes = [ffi.LLVMMemoryBufferRef]
 ffi.lib.LLVMPY_GetBufferSize.restype = c_size_t
+ffi.lib.LLVMPY_GetBufferSize.threadsafe = True
 
 ffi.lib.LLVMPY_DisposeMemoryBuffer.argtypes = [ffi.LLVMMemoryBufferRef]
+ffi.lib.LLVMPY_DisposeMemoryBuffer.threadsafe = True
 
 ffi.lib.LLVMPY_CreateTargetMachineData.argtypes = [
     ffi.LLVMTargetMachineRef,
@@ -9,6 +9,7 @@ def create_pass_manager_builder():
 
 class PassManagerBuilder(ffi.ObjectRef):
     __slots__ = ()
+    _inlining_threshold = None
 
     def __init__(self, ptr=None):
         if ptr is None:
@@ -49,6 +50,7 @@ class PassManagerBuilder(ffi.ObjectRef):
     def inlining_threshold(self, threshold):
         ffi.lib.LLVMPY_PassManagerBuilderUseInlinerWithThreshold(
             self, threshold)
+        self._inlining_threshold = threshold
 
     @property
     def disable_unroll_loops(self):
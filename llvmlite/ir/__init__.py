@@ -9,3 +9,4 @@ from .builder import *
 from .instructions import *
 from .transforms import *
 from .context import Context, global_context
+from .verifier import VerificationError
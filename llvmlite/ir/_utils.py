@@ -1,65 +1,454 @@
-from collections import defaultdict
+import collections.abc
+import contextlib
+import gc
+import itertools
+import re
+
+
+# The suffixes appended by deduplication
+_SUFFIX_RE = re.compile(r"[1-9][0-9]*$")
 
 
 class DuplicatedNameError(NameError):
     pass
 
 
+@contextlib.contextmanager
+def _gc_paused():
+    # The cyclic garbage collector would be triggered many times, in vain,
+    # while the objects of a large module are walked or created
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
 class NameScope(object):
-    def __init__(self):
+    """
+    A scope of unique names.
+
+    Names produced by deduplication ("<hint>.<N>") are not stored: a
+    counter per hint records the suffixes handed out, so that allocating
+    a name takes amortized constant time and memory.  In *numeric* mode,
+    the names deduplicated from an empty hint are returned as integers,
+    to be formatted as ".<N>" only when needed (see format_name()).
+    """
+
+    def __init__(self, numeric=False):
         self._useset = set([''])
-        self._basenamemap = defaultdict(int)
+        # The last suffix handed out for each hint
+        self._basenamemap = {}
+        self.numeric = numeric
 
     def is_used(self, name):
-        return name in self._useset
+        if isinstance(name, int):
+            name = self.format_name(name)
+        if name in self._useset:
+            return True
+        basename, dot, suffix = name.rpartition('.')
+        if not dot or not _SUFFIX_RE.match(suffix):
+            return False
+        return int(suffix) <= self._basenamemap.get(basename, 0)
 
     def register(self, name, deduplicate=False):
         if deduplicate:
-            name = self.deduplicate(name)
+            if not self.is_used(name):
+                self._useset.add(name)
+                return name
+            ident = self._next_ident(name)
+            self._basenamemap[name] = ident
+            if self.numeric and name == '':
+                return ident
+            return "{0}.{1}".format(name, ident)
         elif self.is_used(name):
             raise DuplicatedNameError(name)
         self._useset.add(name)
         return name
 
+    def register_unnamed(self, count):
+        """
+        Register *count* names deduplicated from an empty hint, as as many
+        calls to register('', deduplicate=True) would, and return them.
+        """
+        useset = self._useset
+        numeric = self.numeric
+        ident = self._basenamemap.get('', 0)
+        names = []
+        append = names.append
+        for _ in range(count):
+            ident += 1
+            name = ".{0}".format(ident)
+            # Skip the suffixes explicitly registered
+            while name in useset:
+                ident += 1
+                name = ".{0}".format(ident)
+            append(ident if numeric else name)
+        self._basenamemap[''] = ident
+        return names
+
     def deduplicate(self, name):
-        basename = name
-        while self.is_used(name):
-            ident = self._basenamemap[basename] + 1
-            self._basenamemap[basename] = ident
-            name = "{0}.{1}".format(basename, ident)
+        """
+        Return a name based on *name* that isn't used in this scope,
+        without reserving it.
+        """
+        if not self.is_used(name):
+            return name
+        return "{0}.{1}".format(name, self._next_ident(name))
+
+    def _next_ident(self, basename):
+        ident = self._basenamemap.get(basename, 0) + 1
+        # Skip the suffixes explicitly registered
+        useset = self._useset
+        while "{0}.{1}".format(basename, ident) in useset:
+            ident += 1
+        return ident
+
+    @staticmethod
+    def format_name(name):
+        """
+        Return the string of *name*, a name returned by register().
+        """
+        if isinstance(name, int):
+            return ".{0}".format(name)
         return name
 
     def get_child(self):
-        return type(self)(parent=self)
+        return type(self)(numeric=self.numeric)
+
+
+class _InvalidatingList(list):
+    """
+    A list calling *owner*._invalidate() whenever it is mutated, so that
+    the owner can drop its cached textual representation.
+    """
+
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner, iterable=()):
+        super(_InvalidatingList, self).__init__(iterable)
+        self._owner = owner
+
+    def __reduce__(self):
+        return (type(self), (self._owner, list(self)))
+
+
+def _make_invalidating_method(name):
+    meth = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        self._owner._invalidate()
+        return meth(self, *args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__',
+              'append', 'extend', 'insert', 'pop', 'remove', 'clear',
+              'reverse', 'sort'):
+    setattr(_InvalidatingList, _name, _make_invalidating_method(_name))
+del _name
+
+
+class _ChunkedList(collections.abc.MutableSequence):
+    """
+    A list calling *owner*._invalidate() whenever it is mutated, like
+    _InvalidatingList, but stored as a sequence of chunks of bounded size,
+    so that inserting or deleting an item doesn't move all the items after
+    it.  The chunk of the last access is remembered: accesses close to it,
+    such as successive insertions at the position of a builder, take a
+    constant time, other accesses walk the chunks from there.
+
+    The number of mutations which removed, replaced or moved items is
+    counted in _removals, so that e.g. a builder can tell whether the
+    instructions it remembers are still in place.
+    """
+
+    __slots__ = ('_owner', '_chunks', '_len', '_hint', '_hint_start',
+                 '_removals')
+
+    # The maximum number of items in a chunk
+    chunk_size = 256
+
+    def __init__(self, owner, iterable=()):
+        self._owner = owner
+        self._removals = 0
+        self._reset(list(iterable))
+
+    def _reset(self, items):
+        size = self.chunk_size // 2
+        self._chunks = [items[i:i + size]
+                        for i in range(0, len(items), size)] or [[]]
+        self._len = len(items)
+        # The chunk of the last access, and the index of its first item
+        self._hint = 0
+        self._hint_start = 0
+
+    def _find(self, index):
+        """
+        Return the number of the chunk containing the item at *index* (or
+        where to insert an item at *index*), and the index of its first
+        item.
+        """
+        chunks = self._chunks
+        k = self._hint
+        start = self._hint_start
+        while index < start:
+            k -= 1
+            start -= len(chunks[k])
+        last = len(chunks) - 1
+        while k < last and index >= start + len(chunks[k]):
+            start += len(chunks[k])
+            k += 1
+        self._hint = k
+        self._hint_start = start
+        return k, start
+
+    def _split(self, k):
+        # Split the chunk *k* if too large; the hint remains valid
+        chunk = self._chunks[k]
+        if len(chunk) > self.chunk_size:
+            size = self.chunk_size // 2
+            self._chunks[k:k + 1] = [chunk[i:i + size]
+                                     for i in range(0, len(chunk), size)]
+
+    def _drop_if_empty(self, k, start):
+        chunks = self._chunks
+        if not chunks[k] and len(chunks) > 1:
+            del chunks[k]
+            if k:
+                self._hint = k - 1
+                self._hint_start = start - len(chunks[k - 1])
+            else:
+                self._hint = self._hint_start = 0
+
+    def _normalize_slice(self, index):
+        start, stop, step = index.indices(self._len)
+        if step == 1:
+            return start, max(start, stop)
+        return None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __reversed__(self):
+        for chunk in reversed(self._chunks):
+            for item in reversed(chunk):
+                yield item
+
+    def __contains__(self, value):
+        return any(value in chunk for chunk in self._chunks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list index out of range")
+        k, start = self._find(index)
+        return self._chunks[k][index - start]
+
+    def __setitem__(self, index, value):
+        self._owner._invalidate()
+        if isinstance(index, slice):
+            bounds = self._normalize_slice(index)
+            if bounds is None or bounds[0] != bounds[1]:
+                items = list(self)
+                items[index] = value
+                self._removals += 1
+                self._reset(items)
+                return
+            # Insertion of several items, e.g. "lst[i:i] = items"
+            value = list(value)
+            k, start = self._find(bounds[0])
+            offset = bounds[0] - start
+            self._chunks[k][offset:offset] = value
+            self._len += len(value)
+            self._split(k)
+            return
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list assignment index out of range")
+        k, start = self._find(index)
+        self._chunks[k][index - start] = value
+        self._removals += 1
+
+    def __delitem__(self, index):
+        self._owner._invalidate()
+        self._removals += 1
+        if isinstance(index, slice):
+            items = list(self)
+            del items[index]
+            self._reset(items)
+            return
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list assignment index out of range")
+        k, start = self._find(index)
+        del self._chunks[k][index - start]
+        self._len -= 1
+        self._drop_if_empty(k, start)
+
+    def insert(self, index, value):
+        self._owner._invalidate()
+        if index >= self._len:
+            # Fast path for appending
+            chunk = self._chunks[-1]
+            chunk.append(value)
+            self._len += 1
+            if len(chunk) > self.chunk_size:
+                self._split(len(self._chunks) - 1)
+            return
+        if index < 0:
+            index = max(0, index + self._len)
+        elif index > self._len:
+            index = self._len
+        k, start = self._find(index)
+        self._chunks[k].insert(index - start, value)
+        self._len += 1
+        self._split(k)
+
+    def append(self, value):
+        self.insert(self._len, value)
+
+    def extend(self, values):
+        self[self._len:] = values
+
+    def index(self, value, start=0, stop=None):
+        if start or stop is not None:
+            return list(self).index(value, start, stop)
+        first = 0
+        for k, chunk in enumerate(self._chunks):
+            if value in chunk:
+                self._hint = k
+                self._hint_start = first
+                return first + chunk.index(value)
+            first += len(chunk)
+        raise ValueError("{0!r} is not in list".format(value))
+
+    def find_near(self, value):
+        """
+        Like index(), but search the chunks from the one of the last access
+        outwards, so that looking up an item close to it takes a constant
+        time.  *value* should appear only once.
+        """
+        chunks = self._chunks
+        before = self._hint
+        before_start = self._hint_start
+        after = before + 1
+        after_start = before_start + len(chunks[before])
+        while before >= 0 or after < len(chunks):
+            for k, start in ((before, before_start), (after, after_start)):
+                if 0 <= k < len(chunks) and value in chunks[k]:
+                    self._hint = k
+                    self._hint_start = start
+                    return start + chunks[k].index(value)
+            if before >= 0:
+                before -= 1
+                before_start -= len(chunks[before]) if before >= 0 else 0
+            if after < len(chunks):
+                after_start += len(chunks[after])
+                after += 1
+        raise ValueError("{0!r} is not in list".format(value))
+
+    def count(self, value):
+        return sum(chunk.count(value) for chunk in self._chunks)
+
+    def clear(self):
+        self._owner._invalidate()
+        self._removals += 1
+        self._reset([])
+
+    def reverse(self):
+        self._owner._invalidate()
+        self._removals += 1
+        self._reset(list(reversed(self)))
+
+    def sort(self, key=None, reverse=False):
+        self._owner._invalidate()
+        self._removals += 1
+        items = list(self)
+        items.sort(key=key, reverse=reverse)
+        self._reset(items)
+
+    # Like slicing, copying and concatenating return plain lists
+
+    def copy(self):
+        return list(self)
+
+    def __add__(self, other):
+        if isinstance(other, (list, _ChunkedList)):
+            return list(self) + list(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + list(self)
+        return NotImplemented
+
+    def __mul__(self, n):
+        return list(self) * n
+
+    __rmul__ = __mul__
+
+    def __imul__(self, n):
+        self._owner._invalidate()
+        self._reset(list(self) * n)
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, _ChunkedList):
+            other = list(other)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return (type(self), (self._owner, list(self)))
 
 
 class _StrCaching(object):
+    __slots__ = ()
 
     def _clear_string_cache(self):
         try:
-            del self.__cached_str
+            del self._cached_str
         except AttributeError:
             pass
 
     def __str__(self):
         try:
-            return self.__cached_str
+            return self._cached_str
         except AttributeError:
-            s = self.__cached_str = self._to_string()
+            s = self._cached_str = self._to_string()
             return s
 
 
 class _StringReferenceCaching(object):
+    __slots__ = ()
 
     def get_reference(self):
         try:
-            return self.__cached_refstr
+            return self._cached_refstr
         except AttributeError:
-            s = self.__cached_refstr = self._get_reference()
+            s = self._cached_refstr = self._get_reference()
             return s
 
 
 class _HasMetadata(object):
+    __slots__ = ()
 
     def set_metadata(self, name, node):
         """
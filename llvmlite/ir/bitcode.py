@@ -0,0 +1,1529 @@
+"""
+Writing llvmlite.ir modules as LLVM bitcode, in pure Python: neither the
+textual IR nor LLVM itself are involved.
+"""
+
+import re
+import struct
+import sys
+
+from llvmlite.ir import instructions, types, values
+
+
+# Bitstream abbreviation ids and operand encodings
+
+_END_BLOCK = 0
+_ENTER_SUBBLOCK = 1
+_DEFINE_ABBREV = 2
+_UNABBREV_RECORD = 3
+
+_ENCODING_FIXED = 1
+_ENCODING_VBR = 2
+_ENCODING_ARRAY = 3
+_ENCODING_BLOB = 5
+
+# Block ids
+
+_MODULE_BLOCK = 8
+_PARAMATTR_BLOCK = 9
+_PARAMATTR_GROUP_BLOCK = 10
+_CONSTANTS_BLOCK = 11
+_FUNCTION_BLOCK = 12
+_IDENTIFICATION_BLOCK = 13
+_VALUE_SYMTAB_BLOCK = 14
+_METADATA_BLOCK = 15
+_METADATA_ATTACHMENT_BLOCK = 16
+_TYPE_BLOCK = 17
+_METADATA_KIND_BLOCK = 22
+_STRTAB_BLOCK = 23
+_SYNC_SCOPE_NAMES_BLOCK = 26
+
+# Record codes
+
+_IDENTIFICATION_STRING = 1
+_IDENTIFICATION_EPOCH = 2
+
+_MODULE_VERSION = 1
+_MODULE_TRIPLE = 2
+_MODULE_DATALAYOUT = 3
+_MODULE_GLOBALVAR = 7
+_MODULE_FUNCTION = 8
+
+_PARAMATTR_ENTRY = 2
+_PARAMATTR_GROUP_ENTRY = 3
+
+_TYPE_NUMENTRY = 1
+_TYPE_VOID = 2
+_TYPE_FLOAT = 3
+_TYPE_DOUBLE = 4
+_TYPE_LABEL = 5
+_TYPE_OPAQUE = 6
+_TYPE_INTEGER = 7
+_TYPE_POINTER = 8
+_TYPE_HALF = 10
+_TYPE_ARRAY = 11
+_TYPE_VECTOR = 12
+_TYPE_METADATA = 16
+_TYPE_STRUCT_ANON = 18
+_TYPE_STRUCT_NAME = 19
+_TYPE_STRUCT_NAMED = 20
+_TYPE_FUNCTION = 21
+
+_CST_SETTYPE = 1
+_CST_NULL = 2
+_CST_UNDEF = 3
+_CST_INTEGER = 4
+_CST_WIDE_INTEGER = 5
+_CST_FLOAT = 6
+_CST_AGGREGATE = 7
+_CST_STRING = 8
+_CST_CE_CAST = 11
+_CST_CE_GEP = 12
+_CST_BLOCKADDRESS = 21
+_CST_DATA = 22
+_CST_INLINEASM = 23
+
+_METADATA_STRING = 1
+_METADATA_VALUE = 2
+_METADATA_NODE = 3
+_METADATA_NAME = 4
+_METADATA_KIND = 6
+_METADATA_NAMED_NODE = 10
+_METADATA_ATTACHMENT = 11
+_METADATA_GLOBAL_DECL_ATTACHMENT = 36
+
+_VST_ENTRY = 1
+_VST_BBENTRY = 2
+
+_STRTAB_BLOB = 1
+
+_SYNC_SCOPE_NAME = 1
+
+_FUNC_DECLAREBLOCKS = 1
+_FUNC_BINOP = 2
+_FUNC_CAST = 3
+_FUNC_EXTRACTELT = 6
+_FUNC_INSERTELT = 7
+_FUNC_SHUFFLEVEC = 8
+_FUNC_RET = 10
+_FUNC_BR = 11
+_FUNC_SWITCH = 12
+_FUNC_INVOKE = 13
+_FUNC_UNREACHABLE = 15
+_FUNC_PHI = 16
+_FUNC_ALLOCA = 19
+_FUNC_LOAD = 20
+_FUNC_EXTRACTVAL = 26
+_FUNC_INSERTVAL = 27
+_FUNC_CMP2 = 28
+_FUNC_VSELECT = 29
+_FUNC_INDIRECTBR = 31
+_FUNC_CALL = 34
+_FUNC_FENCE = 36
+_FUNC_ATOMICRMW = 38
+_FUNC_RESUME = 39
+_FUNC_LOADATOMIC = 41
+_FUNC_GEP = 43
+_FUNC_STORE = 44
+_FUNC_STOREATOMIC = 45
+_FUNC_CMPXCHG = 46
+_FUNC_LANDINGPAD = 47
+
+# Operand encodings
+
+_BINOPS = {
+    'add': 0, 'fadd': 0, 'sub': 1, 'fsub': 1, 'mul': 2, 'fmul': 2,
+    'udiv': 3, 'sdiv': 4, 'fdiv': 4, 'urem': 5, 'srem': 6, 'frem': 6,
+    'shl': 7, 'lshr': 8, 'ashr': 9, 'and': 10, 'or': 11, 'xor': 12,
+}
+
+_CASTOPS = {name: i for i, name in enumerate([
+    'trunc', 'zext', 'sext', 'fptoui', 'fptosi', 'uitofp', 'sitofp',
+    'fptrunc', 'fpext', 'ptrtoint', 'inttoptr', 'bitcast',
+    'addrspacecast'])}
+
+_RMWOPS = {name: i for i, name in enumerate([
+    'xchg', 'add', 'sub', 'and', 'nand', 'or', 'xor', 'max', 'min', 'umax',
+    'umin', 'fadd', 'fsub'])}
+
+_ORDERINGS = {name: i + 1 for i, name in enumerate([
+    'unordered', 'monotonic', 'acquire', 'release', 'acq_rel', 'seq_cst'])}
+
+_FCMP_PREDICATES = {name: i for i, name in enumerate([
+    'false', 'oeq', 'ogt', 'oge', 'olt', 'ole', 'one', 'ord', 'uno', 'ueq',
+    'ugt', 'uge', 'ult', 'ule', 'une', 'true'])}
+
+_ICMP_PREDICATES = {name: 32 + i for i, name in enumerate([
+    'eq', 'ne', 'ugt', 'uge', 'ult', 'ule', 'sgt', 'sge', 'slt', 'sle'])}
+
+# Wrapping flags of integer operations, exactness of divisions and shifts
+_OPERATION_FLAGS = {'nuw': 1, 'nsw': 2, 'exact': 1}
+
+_FASTMATH_FLAGS = {
+    'fast': 1 << 0,
+    'nnan': 1 << 1,
+    'ninf': 1 << 2,
+    'nsz': 1 << 3,
+    'arcp': 1 << 4,
+    'contract': 1 << 5,
+    'afn': 1 << 6,
+    'reassoc': 1 << 7,
+}
+
+_LINKAGES = {
+    '': 0,
+    'external': 0,
+    'appending': 2,
+    'internal': 3,
+    'extern_weak': 7,
+    'common': 8,
+    'private': 9,
+    'available_externally': 12,
+    'weak': 16,
+    'weak_odr': 17,
+    'linkonce': 18,
+    'linkonce_odr': 19,
+}
+
+_STORAGE_CLASSES = {
+    '': 0,
+    'dllimport': 1,
+    'dllexport': 2,
+}
+
+_CALLING_CONVENTIONS = {
+    '': 0,
+    'ccc': 0,
+    'fastcc': 8,
+    'coldcc': 9,
+    'ghccc': 10,
+    'webkit_jscc': 12,
+    'anyregcc': 13,
+    'preserve_mostcc': 14,
+    'preserve_allcc': 15,
+    'swiftcc': 16,
+    'cxx_fast_tlscc': 17,
+    'x86_stdcallcc': 64,
+    'x86_fastcallcc': 65,
+    'arm_apcscc': 66,
+    'arm_aapcscc': 67,
+    'arm_aapcs_vfpcc': 68,
+    'msp430_intrcc': 69,
+    'x86_thiscallcc': 70,
+    'ptx_kernel': 71,
+    'ptx_device': 72,
+    'spir_func': 75,
+    'spir_kernel': 76,
+    'intel_ocl_bicc': 77,
+    'x86_64_sysvcc': 78,
+    'win64cc': 79,
+    'x86_vectorcallcc': 80,
+}
+
+# Attribute kinds
+_ATTRIBUTES = {
+    'align': 1,
+    'alwaysinline': 2,
+    'byval': 3,
+    'inlinehint': 4,
+    'inreg': 5,
+    'minsize': 6,
+    'naked': 7,
+    'nest': 8,
+    'noalias': 9,
+    'nobuiltin': 10,
+    'nocapture': 11,
+    'noduplicate': 12,
+    'noimplicitfloat': 13,
+    'noinline': 14,
+    'nonlazybind': 15,
+    'noredzone': 16,
+    'noreturn': 17,
+    'nounwind': 18,
+    'optsize': 19,
+    'readnone': 20,
+    'readonly': 21,
+    'returned': 22,
+    'returns_twice': 23,
+    'signext': 24,
+    'alignstack': 25,
+    'ssp': 26,
+    'sspreq': 27,
+    'sspstrong': 28,
+    'sret': 29,
+    'sanitize_address': 30,
+    'sanitize_thread': 31,
+    'sanitize_memory': 32,
+    'uwtable': 33,
+    'zeroext': 34,
+    'builtin': 35,
+    'cold': 36,
+    'optnone': 37,
+    'inalloca': 38,
+    'nonnull': 39,
+    'jumptable': 40,
+    'dereferenceable': 41,
+    'dereferenceable_or_null': 42,
+    'argmemonly': 45,
+    'norecurse': 48,
+    'inaccessiblememonly': 49,
+    'inaccessiblemem_or_argmemonly': 50,
+}
+# The spelling used by llvmlite.ir for "sspreq"
+_ATTRIBUTES['sspreg'] = _ATTRIBUTES['sspreq']
+
+# The attribute indices of the function and of its return value
+_FUNCTION_INDEX = 0xffffffff
+_RETURN_INDEX = 0
+
+_LANDINGPAD_CLAUSES = {'catch': 0, 'filter': 1}
+
+# Sync scope ids, in the order of the sync scope names block
+_SYNC_SCOPES = ['singlethread', '']
+_SYSTEM_SCOPE = 1
+
+_ESCAPE_RE = re.compile(br'\\(\\|[0-9a-fA-F]{2})')
+
+_half = struct.Struct('<e')
+_float = struct.Struct('<f')
+_double = struct.Struct('<d')
+
+_MASK32 = 0xffffffff
+_MASK64 = 0xffffffffffffffff
+
+
+def _unescape(text):
+    """
+    Unescape *text* the same way the LLVM lexer handles quoted strings.
+    """
+    text = text.encode('utf-8')
+    if b'\\' not in text:
+        return text
+
+    def repl(m):
+        s = m.group(1)
+        if s == b'\\':
+            return s
+        return bytes([int(s, 16)])
+
+    return _ESCAPE_RE.sub(repl, text)
+
+
+def _signed(value):
+    """
+    Encode the signed 64-bit *value* with its sign in the lowest bit.
+    """
+    if value >= 0:
+        return value << 1
+    # The most negative value is encoded as "-0"
+    return ((-value << 1) | 1) & _MASK64
+
+
+def _chars(s):
+    if isinstance(s, str):
+        s = s.encode('utf-8')
+    return list(s)
+
+
+class _BitstreamWriter(object):
+    """
+    A writer of the LLVM bitstream container format: bits are accumulated
+    in a Python integer and flushed as little-endian 32-bit words.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.cur = 0
+        self.nbits = 0
+        self.width = 2
+        self.abbrevs = {}
+        self.blocks = []
+
+    def getvalue(self):
+        assert not self.blocks and not self.nbits
+        return bytes(self.buf)
+
+    def _flush(self):
+        nbytes = (self.nbits >> 5) << 2
+        if nbytes:
+            self.buf += (self.cur & ((1 << (nbytes << 3)) - 1)).to_bytes(
+                nbytes, 'little')
+            self.cur >>= nbytes << 3
+            self.nbits -= nbytes << 3
+
+    def write(self, value, nbits):
+        self.cur |= value << self.nbits
+        self.nbits += nbits
+        if self.nbits >= 256:
+            self._flush()
+
+    def write_vbr(self, value, nbits):
+        hi = 1 << (nbits - 1)
+        if value < hi:
+            self.write(value, nbits)
+            return
+        mask = hi - 1
+        cur = self.cur
+        pos = self.nbits
+        while value >= hi:
+            cur |= ((value & mask) | hi) << pos
+            pos += nbits
+            value >>= nbits - 1
+        self.cur = cur | (value << pos)
+        self.nbits = pos + nbits
+        if self.nbits >= 256:
+            self._flush()
+
+    def align32(self):
+        pad = -self.nbits & 31
+        self.nbits += pad
+        self._flush()
+
+    def enter_block(self, block_id, width=4):
+        self.write(_ENTER_SUBBLOCK, self.width)
+        self.write_vbr(block_id, 8)
+        self.write_vbr(width, 4)
+        self.align32()
+        # The block size in words, filled in by exit_block()
+        pos = len(self.buf)
+        self.buf += bytes(4)
+        self.blocks.append((self.width, self.abbrevs, pos))
+        self.width = width
+        self.abbrevs = {}
+
+    def exit_block(self):
+        self.write(_END_BLOCK, self.width)
+        self.align32()
+        self.width, self.abbrevs, pos = self.blocks.pop()
+        size = (len(self.buf) - pos - 4) >> 2
+        self.buf[pos:pos + 4] = size.to_bytes(4, 'little')
+
+    def record(self, code, ops=()):
+        """
+        Write an unabbreviated record: the code, the number of operands and
+        the operands as 6-bit VBRs.
+        """
+        # The hot loop of the writer, with write_vbr() inlined.  The bits
+        # of the record are gathered in a small integer, which is cheaper
+        # than or'ing each operand into the pending bits.
+        bits = _UNABBREV_RECORD
+        pos = self.width
+        for value in (code, len(ops)):
+            while value >= 32:
+                bits |= ((value & 31) | 32) << pos
+                pos += 6
+                value >>= 5
+            bits |= value << pos
+            pos += 6
+        for value in ops:
+            while value >= 32:
+                bits |= ((value & 31) | 32) << pos
+                pos += 6
+                value >>= 5
+            bits |= value << pos
+            pos += 6
+            if pos >= 512:
+                self.write(bits, pos)
+                bits = pos = 0
+        self.write(bits, pos)
+
+    def _abbrev(self, key, ops):
+        """
+        Return the id of the abbreviation *key* in the current block,
+        defining it from *ops* (a sequence of (encoding, value) pairs, with
+        a None encoding for literals) on first use.
+        """
+        try:
+            return self.abbrevs[key]
+        except KeyError:
+            pass
+        self.write(_DEFINE_ABBREV, self.width)
+        self.write_vbr(len(ops), 5)
+        for encoding, value in ops:
+            if encoding is None:
+                self.write(1, 1)
+                self.write_vbr(value, 8)
+            else:
+                self.write(0, 1)
+                self.write(encoding, 3)
+                if value is not None:
+                    self.write_vbr(value, 5)
+        abbrev = self.abbrevs[key] = 4 + len(self.abbrevs)
+        return abbrev
+
+    def array_record(self, code, data, itemsize):
+        """
+        Write a record whose operands are the little-endian unsigned
+        integers of *itemsize* bytes in the bytestring *data*.
+        """
+        nbits = itemsize * 8
+        abbrev = self._abbrev((code, 'array', nbits),
+                              [(None, code), (_ENCODING_ARRAY, None),
+                               (_ENCODING_FIXED, nbits)])
+        self.write(abbrev, self.width)
+        self.write_vbr(len(data) // itemsize, 6)
+        # Fixed-width operands are packed without padding: the whole
+        # array is a single integer of the bitstream
+        self._flush()
+        self.cur |= int.from_bytes(data, 'little') << self.nbits
+        self.nbits += len(data) * 8
+        self._flush()
+
+    def name_record(self, code, value, name):
+        """
+        Write a record made of the integer *value* and the characters of
+        *name*, e.g. a symbol table entry.
+        """
+        name = name.encode('utf-8')
+        abbrev = self._abbrev((code, 'name'),
+                              [(None, code), (_ENCODING_VBR, 8),
+                               (_ENCODING_ARRAY, None),
+                               (_ENCODING_FIXED, 8)])
+        self.write(abbrev, self.width)
+        self.write_vbr(value, 8)
+        self.write_vbr(len(name), 6)
+        self.cur |= int.from_bytes(name, 'little') << self.nbits
+        self.nbits += len(name) * 8
+        if self.nbits >= 256:
+            self._flush()
+
+    def blob_record(self, code, data):
+        abbrev = self._abbrev((code, 'blob'),
+                              [(None, code), (_ENCODING_BLOB, None)])
+        self.write(abbrev, self.width)
+        self.write_vbr(len(data), 6)
+        self.align32()
+        self.buf += data
+        self.buf += bytes(-len(data) & 3)
+
+
+_LOCAL_VALUES = (instructions.Instruction, values.Argument, values.Block,
+                 values._Undefined)
+
+
+class _ModuleWriter(object):
+    """
+    Write a llvmlite.ir module as LLVM bitcode.
+
+    Like LLVM's own writer, all types, constants, metadata and attributes
+    are enumerated first, then the blocks are written using their ids.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.type_ids = {}
+        self.types = []
+        # Ids of global values and constants.  Constants are compared
+        # structurally, other values by identity.
+        self.value_ids = {}
+        self.constants = []
+        self.md_ids = {}
+        self.mds = []
+        self.local_mds = {}
+        self.md_kinds = {}
+        self.attr_groups = {}
+        self.attr_lists = {}
+        self.function_attrs = {}
+        self.sync_scopes = {name: i for i, name in enumerate(_SYNC_SCOPES)}
+        self.strtab = bytearray()
+        self.globals = []
+        self.functions = []
+
+    def write(self):
+        self._enumerate()
+        w = self.w = _BitstreamWriter()
+        w.buf += b'BC\xc0\xde'
+        w.enter_block(_IDENTIFICATION_BLOCK, 5)
+        w.record(_IDENTIFICATION_STRING, _chars("llvmlite"))
+        w.record(_IDENTIFICATION_EPOCH, [0])
+        w.exit_block()
+        w.enter_block(_MODULE_BLOCK, 3)
+        w.record(_MODULE_VERSION, [2])
+        self._write_attributes()
+        self._write_types()
+        if self.module.triple:
+            w.record(_MODULE_TRIPLE, _chars(self.module.triple))
+        if self.module.data_layout:
+            w.record(_MODULE_DATALAYOUT, _chars(self.module.data_layout))
+        self._write_global_values()
+        self._write_constants()
+        self._write_metadata_kinds()
+        self._write_module_metadata()
+        self._write_sync_scopes()
+        for fn in self.functions:
+            if fn.blocks:
+                self._write_function(fn)
+        w.exit_block()
+        w.enter_block(_STRTAB_BLOCK, 3)
+        w.blob_record(_STRTAB_BLOB, bytes(self.strtab))
+        w.exit_block()
+        return w.getvalue()
+
+    #
+    # Enumeration
+    #
+
+    def _enumerate(self):
+        module = self.module
+        for gv in module._get_exported_globals():
+            if isinstance(gv, values.Function):
+                self.functions.append(gv)
+            elif isinstance(gv, values.GlobalVariable):
+                self.globals.append(gv)
+            else:
+                raise NotImplementedError("global value {0!r}".format(gv))
+        for gv in self.globals + self.functions:
+            self.value_ids[gv] = len(self.value_ids)
+            self._type(gv.type)
+        # Like the textual IR, create all the identified types of the module
+        for ty in module.get_identified_types().values():
+            self._type(ty)
+        for gv in self.globals:
+            self._type(gv.value_type)
+            init = self._initializer(gv)
+            if init is not None:
+                self._value(init)
+        for fn in self.functions:
+            self._enumerate_function(fn)
+        for nmd in module.namedmetadata.values():
+            for md in nmd.operands:
+                self._metadata(md)
+        self.num_module_values = len(self.value_ids)
+
+    def _initializer(self, gv):
+        init = gv.initializer
+        if init is not None:
+            if init.type != gv.value_type:
+                raise TypeError("got initializer of type %s "
+                                "for global value type %s"
+                                % (init.type, gv.value_type))
+        elif gv.linkage not in ('', 'external', 'extern_weak'):
+            # Like GlobalVariable.descr(), use 'undef' for non-external
+            # linkage
+            init = gv.value_type(values.Undefined)
+        return init
+
+    def _type(self, ty):
+        type_ids = self.type_ids
+        if ty in type_ids:
+            return
+        if isinstance(ty, types.IdentifiedStructType):
+            # Identified structs can be forward-referenced, which allows
+            # recursive types: mark it as being enumerated
+            type_ids[ty] = None
+            if not ty.is_opaque:
+                for el in ty.elements:
+                    self._type(el)
+        elif isinstance(ty, types.PointerType):
+            self._type(ty.pointee)
+        elif isinstance(ty, (types.ArrayType, types.VectorType)):
+            self._type(ty.element)
+        elif isinstance(ty, types.LiteralStructType):
+            for el in ty.elements:
+                self._type(el)
+        elif isinstance(ty, types.FunctionType):
+            self._type(ty.return_type)
+            for arg in ty.args:
+                self._type(arg)
+        elif not isinstance(ty, (types.IntType, types._BaseFloatType,
+                                 types.VoidType, types.MetaDataType)):
+            raise NotImplementedError("type {0}".format(ty))
+        if type_ids.get(ty) is None:
+            type_ids[ty] = len(self.types)
+            self.types.append(ty)
+
+    def _value(self, v):
+        """
+        Enumerate the types, constants and metadata used by value *v*.
+        """
+        if isinstance(v.type, types.MetaDataType):
+            if isinstance(v, values.MetaDataArgument):
+                wrapped = v.wrapped_value
+                self._value(wrapped)
+                if isinstance(wrapped, (values.Constant, values.GlobalValue)):
+                    self._metadata(v)
+                else:
+                    # Function-local metadata
+                    self.local_mds.setdefault(v.wrapped_value, None)
+            else:
+                self._metadata(v)
+            self._type(v.type)
+            return
+        if v in self.value_ids:
+            return
+        if isinstance(v, values.Constant):
+            self._constant(v)
+        elif isinstance(v, values.BlockAddress):
+            self._type(v.function.type)
+            self._add_constant(v, v.type)
+        elif isinstance(v, instructions.InlineAsm):
+            self._add_constant(v, v.function_type.as_pointer())
+        elif isinstance(v, (instructions.Instruction, values.Argument)):
+            self._type(v.type)
+        else:
+            raise NotImplementedError("value {0!r}".format(v))
+
+    def _add_constant(self, c, ty):
+        self._type(ty)
+        self.value_ids[c] = len(self.value_ids)
+        self.constants.append((c, ty))
+
+    def _constant(self, c):
+        val = c.constant
+        if isinstance(c, values.FormattedConstant):
+            expr = c._expr
+            if expr is None:
+                raise NotImplementedError("formatted constant {0}".format(c))
+            operand = expr[1]
+            self._value(operand)
+            if expr[0] == 'getelementptr':
+                self._type(operand.type.pointee)
+                for idx in expr[2]:
+                    self._value(idx)
+        elif isinstance(val, (list, tuple)):
+            for el in val:
+                self._value(el)
+        elif (isinstance(val, values.DataArray) and len(val.shape) > 1 and
+              len(val.data)):
+            for row in self._data_rows(c):
+                self._value(row)
+        self._add_constant(c, c.type)
+
+    def _data_rows(self, c):
+        """
+        The constants of the rows of the multi-dimensional DataArray
+        constant *c*.
+        """
+        data = c.constant
+        rowtype = c.type.element
+        shape = data.shape[1:]
+        rowsize = len(data.data) // c.type.count
+        rows = [values.DataArray(data.data[i:i + rowsize], data.element, shape)
+                for i in range(0, len(data.data), rowsize)]
+        return [values.Constant(rowtype, row) for row in rows]
+
+    def _metadata(self, md):
+        """
+        Enumerate the module-level metadata *md* and return its id.
+        """
+        if isinstance(md, values.MetaDataArgument):
+            key = ('value', md.wrapped_value)
+        else:
+            key = md
+        try:
+            return self.md_ids[key]
+        except KeyError:
+            pass
+        if isinstance(md, values.MDValue):
+            for op in md.operands:
+                if isinstance(op.type, types.MetaDataType):
+                    if not (isinstance(op, values.Constant) and
+                            op.constant is None):
+                        self._metadata(op)
+                elif isinstance(op, (values.Constant, values.GlobalValue)):
+                    self._value(op)
+                    self._metadata(values.MetaDataArgument(op))
+                else:
+                    raise NotImplementedError("metadata operand {0!r}"
+                                              .format(op))
+        elif isinstance(md, values.MetaDataArgument):
+            self._type(md.wrapped_value.type)
+        elif not isinstance(md, values.MetaDataString):
+            # Including debug information (DIValue)
+            raise NotImplementedError("metadata {0!r}".format(md))
+        mdid = self.md_ids[key] = len(self.mds)
+        self.mds.append(md)
+        return mdid
+
+    def _attachments(self, metadata):
+        for kind, md in metadata.items():
+            if kind not in self.md_kinds:
+                self.md_kinds[kind] = len(self.md_kinds)
+            self._metadata(md)
+
+    def _attribute_list(self, groups):
+        """
+        Return the id of the attribute list made of *groups*, a list of
+        (index, attribute operands) pairs, or 0 if it is empty.
+        """
+        grpids = []
+        for index, ops in groups:
+            if not ops:
+                continue
+            key = (index, tuple(ops))
+            grpid = self.attr_groups.get(key)
+            if grpid is None:
+                grpid = self.attr_groups[key] = len(self.attr_groups) + 1
+            grpids.append(grpid)
+        if not grpids:
+            return 0
+        key = tuple(grpids)
+        listid = self.attr_lists.get(key)
+        if listid is None:
+            listid = self.attr_lists[key] = len(self.attr_lists) + 1
+        return listid
+
+    def _attribute_ops(self, attrs, **ints):
+        ops = []
+        for attr in attrs:
+            ops += [0, _ATTRIBUTES[attr]]
+        for attr, value in sorted(ints.items()):
+            if value:
+                ops += [1, _ATTRIBUTES[attr], value]
+        return ops
+
+    def _argument_attribute_ops(self, attrs):
+        return self._attribute_ops(
+            attrs, align=attrs.align, dereferenceable=attrs.dereferenceable,
+            dereferenceable_or_null=attrs.dereferenceable_or_null)
+
+    def _enumerate_function(self, fn):
+        self._type(fn.ftype)
+        attrs = fn.attributes
+        groups = [(_FUNCTION_INDEX,
+                   self._attribute_ops(attrs, alignstack=attrs.alignstack)),
+                  (_RETURN_INDEX,
+                   self._argument_attribute_ops(fn.return_value.attributes))]
+        for i, arg in enumerate(fn.args):
+            groups.append((i + 1, self._argument_attribute_ops(
+                arg.attributes)))
+        self.function_attrs[fn] = self._attribute_list(groups)
+        if attrs.personality is not None:
+            self._value(attrs.personality)
+        if fn.metadata:
+            self._attachments(fn.metadata)
+
+        value = self._value
+        type_ids = self.type_ids
+        enumerators = _INSTRUCTION_ENUMERATORS
+        for blk in fn.blocks:
+            for instr in blk.instructions:
+                if instr.type not in type_ids:
+                    self._type(instr.type)
+                for op in instr.operands:
+                    # The types of local values are enumerated with their
+                    # definition
+                    if not isinstance(op, _LOCAL_VALUES):
+                        value(op)
+                enumerate_extra = enumerators.get(type(instr))
+                if enumerate_extra is not None:
+                    enumerate_extra(self, instr)
+                # Avoids creating the instruction's metadata dict
+                if instr._metadata:
+                    self._attachments(instr._metadata)
+
+    # The types and values used by instructions besides their operands
+
+    def _enumerate_call(self, instr):
+        self._type(instr.callee.function_type)
+        self._call_attributes(instr)
+
+    def _enumerate_gep(self, instr):
+        self._type(instr.pointer.type.pointee)
+
+    def _enumerate_alloca(self, instr):
+        self._type(instr.type.pointee)
+        if not instr.operands:
+            self._value(types.IntType(32)(1))
+
+    def _enumerate_phi(self, instr):
+        for val, _ in instr.incomings:
+            self._value(val)
+
+    def _enumerate_switch(self, instr):
+        for val, _ in instr.cases:
+            self._value(val)
+
+    def _enumerate_landingpad(self, instr):
+        for clause in instr.clauses:
+            self._value(clause.value)
+
+    def _enumerate_shufflevector(self, instr):
+        vector1, vector2, _ = instr.operands
+        if vector2 is values.Undefined:
+            self._value(vector1.type(values.Undefined))
+
+    def _enumerate_fence(self, instr):
+        scope = instr.targetscope
+        if scope is not None and scope not in self.sync_scopes:
+            self.sync_scopes[scope] = len(self.sync_scopes)
+
+    #
+    # Module-level blocks
+    #
+
+    def _write_attributes(self):
+        if not self.attr_groups:
+            return
+        w = self.w
+        w.enter_block(_PARAMATTR_GROUP_BLOCK, 3)
+        for (index, ops), grpid in self.attr_groups.items():
+            w.record(_PARAMATTR_GROUP_ENTRY, [grpid, index] + list(ops))
+        w.exit_block()
+        w.enter_block(_PARAMATTR_BLOCK, 3)
+        for grpids in self.attr_lists:
+            w.record(_PARAMATTR_ENTRY, grpids)
+        w.exit_block()
+
+    def _write_types(self):
+        w = self.w
+        ids = self.type_ids
+        w.enter_block(_TYPE_BLOCK, 4)
+        w.record(_TYPE_NUMENTRY, [len(self.types)])
+        for ty in self.types:
+            if isinstance(ty, types.IntType):
+                w.record(_TYPE_INTEGER, [ty.width])
+            elif isinstance(ty, types.PointerType):
+                w.record(_TYPE_POINTER, [ids[ty.pointee], ty.addrspace])
+            elif isinstance(ty, types.DoubleType):
+                w.record(_TYPE_DOUBLE)
+            elif isinstance(ty, types.FloatType):
+                w.record(_TYPE_FLOAT)
+            elif isinstance(ty, types.HalfType):
+                w.record(_TYPE_HALF)
+            elif isinstance(ty, types.VoidType):
+                w.record(_TYPE_VOID)
+            elif isinstance(ty, types.MetaDataType):
+                w.record(_TYPE_METADATA)
+            elif isinstance(ty, types.FunctionType):
+                w.record(_TYPE_FUNCTION,
+                         [int(ty.var_arg), ids[ty.return_type]] +
+                         [ids[arg] for arg in ty.args])
+            elif isinstance(ty, types.ArrayType):
+                w.record(_TYPE_ARRAY, [ty.count, ids[ty.element]])
+            elif isinstance(ty, types.VectorType):
+                w.record(_TYPE_VECTOR, [ty.count, ids[ty.element]])
+            elif isinstance(ty, types.LiteralStructType):
+                w.record(_TYPE_STRUCT_ANON, [int(ty.packed)] +
+                         [ids[el] for el in ty.elements])
+            else:
+                w.record(_TYPE_STRUCT_NAME, _chars(ty.name))
+                if ty.is_opaque:
+                    w.record(_TYPE_OPAQUE, [0])
+                else:
+                    w.record(_TYPE_STRUCT_NAMED, [int(ty.packed)] +
+                             [ids[el] for el in ty.elements])
+        w.exit_block()
+
+    def _name(self, gv):
+        name = gv.name.encode('utf-8')
+        offset = len(self.strtab)
+        self.strtab += name
+        return [offset, len(name)]
+
+    def _write_global_values(self):
+        w = self.w
+        type_ids = self.type_ids
+        value_ids = self.value_ids
+        for gv in self.globals:
+            init = self._initializer(gv)
+            flags = (gv.addrspace << 2) | 2 | int(bool(gv.global_constant))
+            align = gv.align.bit_length() if gv.align else 0
+            w.record(_MODULE_GLOBALVAR, self._name(gv) + [
+                type_ids[gv.value_type], flags,
+                value_ids[init] + 1 if init is not None else 0,
+                _LINKAGES[gv.linkage], align, 0, 0, 0, int(gv.unnamed_addr),
+                0, _STORAGE_CLASSES[gv.storage_class]])
+        for fn in self.functions:
+            personality = fn.attributes.personality
+            w.record(_MODULE_FUNCTION, self._name(fn) + [
+                type_ids[fn.ftype],
+                _CALLING_CONVENTIONS[fn.calling_convention],
+                int(not fn.blocks), _LINKAGES[fn.linkage],
+                self.function_attrs[fn],
+                0, 0, 0, 0, 0, 0, 0, 0, 0,
+                value_ids[personality] + 1 if personality is not None else 0])
+
+    def _write_constants(self):
+        if not self.constants:
+            return
+        w = self.w
+        type_ids = self.type_ids
+        value_ids = self.value_ids
+        w.enter_block(_CONSTANTS_BLOCK, 4)
+        cur_type = None
+        for c, ty in self.constants:
+            tid = type_ids[ty]
+            if tid != cur_type:
+                w.record(_CST_SETTYPE, [tid])
+                cur_type = tid
+            if isinstance(c, values.BlockAddress):
+                fn = c.function
+                w.record(_CST_BLOCKADDRESS, [
+                    type_ids[fn.type], value_ids[fn],
+                    fn.blocks.index(c.basic_block)])
+                continue
+            elif isinstance(c, instructions.InlineAsm):
+                asm = _unescape(c.asm)
+                constraint = _unescape(c.constraint)
+                w.record(_CST_INLINEASM,
+                         [int(bool(c.side_effect)), len(asm)] + list(asm) +
+                         [len(constraint)] + list(constraint))
+                continue
+            val = c.constant
+            if isinstance(c, values.FormattedConstant):
+                self._write_constant_expr(c._expr)
+            elif val is None:
+                w.record(_CST_NULL)
+            elif val is values.Undefined:
+                w.record(_CST_UNDEF)
+            elif isinstance(ty, types.IntType):
+                val = int(val) & ((1 << ty.width) - 1)
+                if ty.width <= 64:
+                    if val >= 1 << 63:
+                        val -= 1 << 64
+                    w.record(_CST_INTEGER, [_signed(val)])
+                else:
+                    words = []
+                    while True:
+                        word = val & _MASK64
+                        if word >= 1 << 63:
+                            word -= 1 << 64
+                        words.append(_signed(word))
+                        val >>= 64
+                        if not val:
+                            break
+                    w.record(_CST_WIDE_INTEGER, words)
+            elif isinstance(ty, types.DoubleType):
+                bits = int.from_bytes(_double.pack(val), 'little')
+                w.record(_CST_FLOAT, [bits])
+            elif isinstance(ty, types.FloatType):
+                bits = int.from_bytes(_float.pack(types._as_float(val)),
+                                      'little')
+                w.record(_CST_FLOAT, [bits])
+            elif isinstance(ty, types.HalfType):
+                bits = int.from_bytes(_half.pack(types._as_half(val)),
+                                      'little')
+                w.record(_CST_FLOAT, [bits])
+            elif isinstance(val, bytearray):
+                if val:
+                    w.array_record(_CST_STRING, val, 1)
+                else:
+                    w.record(_CST_NULL)
+            elif isinstance(val, (list, tuple)):
+                if val:
+                    w.record(_CST_AGGREGATE, [value_ids[el] for el in val])
+                else:
+                    w.record(_CST_NULL)
+            elif isinstance(val, values.DataArray):
+                self._write_data_array(c)
+            else:
+                raise NotImplementedError("constant {0!r}".format(c))
+        w.exit_block()
+
+    def _write_constant_expr(self, expr):
+        w = self.w
+        type_ids = self.type_ids
+        value_ids = self.value_ids
+        opname, operand = expr[:2]
+        if opname == 'getelementptr':
+            ops = [type_ids[operand.type.pointee],
+                   type_ids[operand.type], value_ids[operand]]
+            for idx in expr[2]:
+                ops += [type_ids[idx.type], value_ids[idx]]
+            w.record(_CST_CE_GEP, ops)
+        else:
+            w.record(_CST_CE_CAST, [_CASTOPS[opname],
+                                    type_ids[operand.type],
+                                    value_ids[operand]])
+
+    def _write_data_array(self, c):
+        w = self.w
+        data = c.constant
+        if not data.data:
+            w.record(_CST_NULL)
+        elif len(data.shape) > 1:
+            w.record(_CST_AGGREGATE,
+                     [self.value_ids[row] for row in self._data_rows(c)])
+        else:
+            itemsize = data._itemsize(data.element)
+            if itemsize not in (1, 2, 4, 8):
+                raise NotImplementedError("data array of {0}"
+                                          .format(data.element))
+            buf = data.data
+            if sys.byteorder == 'big' and itemsize > 1:
+                buf = values._byteswap(buf, itemsize)
+            code = _CST_STRING if itemsize == 1 else _CST_DATA
+            w.array_record(code, buf, itemsize)
+
+    def _write_metadata_kinds(self):
+        if not self.md_kinds:
+            return
+        w = self.w
+        w.enter_block(_METADATA_KIND_BLOCK, 3)
+        for kind, kindid in self.md_kinds.items():
+            w.record(_METADATA_KIND, [kindid] + _chars(kind))
+        w.exit_block()
+
+    def _write_module_metadata(self):
+        decls = [fn for fn in self.functions
+                 if fn.metadata and not fn.blocks]
+        if not (self.mds or self.module.namedmetadata or decls):
+            return
+        w = self.w
+        md_ids = self.md_ids
+        w.enter_block(_METADATA_BLOCK, 3)
+        for md in self.mds:
+            if isinstance(md, values.MetaDataString):
+                w.record(_METADATA_STRING, _chars(md.string))
+            elif isinstance(md, values.MetaDataArgument):
+                val = md.wrapped_value
+                w.record(_METADATA_VALUE, [self.type_ids[val.type],
+                                           self.value_ids[val]])
+            else:
+                ops = []
+                for op in md.operands:
+                    if not isinstance(op.type, types.MetaDataType):
+                        op = values.MetaDataArgument(op)
+                    elif isinstance(op, values.Constant):
+                        # null
+                        ops.append(0)
+                        continue
+                    ops.append(self._metadata(op) + 1)
+                w.record(_METADATA_NODE, ops)
+        for name, nmd in self.module.namedmetadata.items():
+            w.record(_METADATA_NAME, _chars(name))
+            w.record(_METADATA_NAMED_NODE,
+                     [md_ids[md] for md in nmd.operands])
+        for fn in decls:
+            w.record(_METADATA_GLOBAL_DECL_ATTACHMENT,
+                     [self.value_ids[fn]] + self._attachment_ops(fn.metadata))
+        w.exit_block()
+
+    def _attachment_ops(self, metadata):
+        ops = []
+        for kind, md in metadata.items():
+            ops += [self.md_kinds[kind], self.md_ids[md]]
+        return ops
+
+    def _write_sync_scopes(self):
+        if len(self.sync_scopes) == len(_SYNC_SCOPES):
+            return
+        w = self.w
+        w.enter_block(_SYNC_SCOPE_NAMES_BLOCK, 2)
+        for name in self.sync_scopes:
+            w.record(_SYNC_SCOPE_NAME, _chars(name))
+        w.exit_block()
+
+    #
+    # Functions
+    #
+
+    def _write_function(self, fn):
+        w = self.w
+        local_ids = {}
+        vid = self.num_module_values
+        for arg in fn.args:
+            local_ids[arg] = vid
+            vid += 1
+        self.block_ids = block_ids = {}
+        for blk in fn.blocks:
+            block_ids[blk] = len(block_ids)
+            for instr in blk.instructions:
+                if not isinstance(instr.type, types.VoidType):
+                    local_ids[instr] = vid
+                    vid += 1
+
+        w.enter_block(_FUNCTION_BLOCK, 4)
+        w.record(_FUNC_DECLAREBLOCKS, [len(fn.blocks)])
+        self._write_function_metadata(local_ids)
+
+        # Local values are numbered along with the module-level ones while
+        # the function is written
+        value_ids = self.value_ids
+        value_ids.update(local_ids)
+
+        self.inst_id = self.num_module_values + len(fn.args)
+        encoders = _INSTRUCTION_ENCODERS
+        attachments = []
+        index = 0
+        for blk in fn.blocks:
+            for instr in blk.instructions:
+                try:
+                    encode = encoders[type(instr)]
+                except KeyError:
+                    raise NotImplementedError("instruction {0!r}"
+                                              .format(instr))
+                code, ops = encode(self, instr)
+                w.record(code, ops)
+                if instr._metadata:
+                    attachments.append(
+                        [index] + self._attachment_ops(instr._metadata))
+                if not isinstance(instr.type, types.VoidType):
+                    self.inst_id += 1
+                index += 1
+        for value in local_ids:
+            del value_ids[value]
+
+        w.enter_block(_VALUE_SYMTAB_BLOCK, 4)
+        for value, vid in local_ids.items():
+            name = value.name
+            if name:
+                w.name_record(_VST_ENTRY, vid, name)
+        for blk, bbid in block_ids.items():
+            name = blk.name
+            if name:
+                w.name_record(_VST_BBENTRY, bbid, name)
+        w.exit_block()
+
+        if fn.metadata or attachments:
+            w.enter_block(_METADATA_ATTACHMENT_BLOCK, 3)
+            if fn.metadata:
+                w.record(_METADATA_ATTACHMENT,
+                         self._attachment_ops(fn.metadata))
+            for ops in attachments:
+                w.record(_METADATA_ATTACHMENT, ops)
+            w.exit_block()
+        w.exit_block()
+
+    def _write_function_metadata(self, local_ids):
+        """
+        Write the metadata wrapping the function's arguments and
+        instructions, and number it after the module-level metadata.
+        """
+        self.fn_md_ids = fn_md_ids = {}
+        ops = []
+        for value in self.local_mds:
+            vid = local_ids.get(value)
+            if vid is not None:
+                fn_md_ids[value] = len(self.mds) + len(fn_md_ids)
+                ops.append([self.type_ids[value.type], vid])
+        if ops:
+            w = self.w
+            w.enter_block(_METADATA_BLOCK, 3)
+            for op in ops:
+                w.record(_METADATA_VALUE, op)
+            w.exit_block()
+
+    def _vid(self, v):
+        vid = self.value_ids.get(v)
+        if vid is not None:
+            return vid
+        # Metadata operands of calls
+        if isinstance(v, values.MetaDataArgument):
+            vid = self.fn_md_ids.get(v.wrapped_value)
+            if vid is not None:
+                return vid
+        return self._metadata(v)
+
+    def _push(self, ops, v):
+        vid = self.value_ids.get(v)
+        if vid is None:
+            vid = self._vid(v)
+        ops.append((self.inst_id - vid) & _MASK32)
+
+    def _push_with_type(self, ops, v):
+        vid = self.value_ids.get(v)
+        if vid is None:
+            vid = self._vid(v)
+        ops.append((self.inst_id - vid) & _MASK32)
+        if vid >= self.inst_id:
+            # A forward reference
+            ops.append(self.type_ids[v.type])
+
+    def _flags(self, flags, table):
+        res = 0
+        for flag in flags or ():
+            res |= table[flag]
+        return res
+
+    def _encode_binop(self, instr):
+        try:
+            opcode = _BINOPS[instr.opname]
+        except KeyError:
+            raise NotImplementedError("instruction {0!r}".format(instr))
+        lhs, rhs = instr.operands
+        ops = []
+        self._push_with_type(ops, lhs)
+        self._push(ops, rhs)
+        ops.append(opcode)
+        flags = instr._flags
+        if flags:
+            if flags[0] in _OPERATION_FLAGS:
+                ops.append(self._flags(flags, _OPERATION_FLAGS))
+            else:
+                ops.append(self._flags(flags, _FASTMATH_FLAGS))
+        return _FUNC_BINOP, ops
+
+    def _encode_cast(self, instr):
+        ops = []
+        self._push_with_type(ops, instr.operands[0])
+        ops += [self.type_ids[instr.type], _CASTOPS[instr.opname]]
+        return _FUNC_CAST, ops
+
+    def _encode_compare(self, instr):
+        lhs, rhs = instr.operands
+        ops = []
+        self._push_with_type(ops, lhs)
+        self._push(ops, rhs)
+        if isinstance(instr, instructions.ICMPInstr):
+            ops.append(_ICMP_PREDICATES[instr.op])
+        else:
+            ops.append(_FCMP_PREDICATES[instr.op])
+            if instr._flags:
+                ops.append(self._flags(instr._flags, _FASTMATH_FLAGS))
+        return _FUNC_CMP2, ops
+
+    def _encode_select(self, instr):
+        cond, lhs, rhs = instr.operands
+        ops = []
+        self._push_with_type(ops, lhs)
+        self._push(ops, rhs)
+        self._push_with_type(ops, cond)
+        return _FUNC_VSELECT, ops
+
+    def _align(self, instr):
+        align = getattr(instr, 'align', None)
+        return align.bit_length() if align else 0
+
+    def _encode_load(self, instr):
+        ops = []
+        self._push_with_type(ops, instr.operands[0])
+        ops += [self.type_ids[instr.type], self._align(instr), 0]
+        if isinstance(instr, instructions.LoadAtomicInstr):
+            ops += [_ORDERINGS[instr.ordering], _SYSTEM_SCOPE]
+            return _FUNC_LOADATOMIC, ops
+        return _FUNC_LOAD, ops
+
+    def _encode_store(self, instr):
+        val, ptr = instr.operands
+        ops = []
+        self._push_with_type(ops, ptr)
+        self._push_with_type(ops, val)
+        ops += [self._align(instr), 0]
+        if isinstance(instr, instructions.StoreAtomicInstr):
+            ops += [_ORDERINGS[instr.ordering], _SYSTEM_SCOPE]
+            return _FUNC_STOREATOMIC, ops
+        return _FUNC_STORE, ops
+
+    def _encode_alloca(self, instr):
+        if instr.operands:
+            count = instr.operands[0]
+        else:
+            count = types.IntType(32)(1)
+        # The explicit type flag
+        align = self._align(instr) | 1 << 6
+        return _FUNC_ALLOCA, [self.type_ids[instr.type.pointee],
+                              self.type_ids[count.type], self._vid(count),
+                              align]
+
+    def _encode_gep(self, instr):
+        ptr = instr.pointer
+        ops = [int(bool(instr.inbounds)), self.type_ids[ptr.type.pointee]]
+        self._push_with_type(ops, ptr)
+        for idx in instr.indices:
+            self._push_with_type(ops, idx)
+        return _FUNC_GEP, ops
+
+    def _encode_phi(self, instr):
+        ops = [self.type_ids[instr.type]]
+        block_ids = self.block_ids
+        for val, blk in instr.incomings:
+            rel = self.inst_id - self._vid(val)
+            ops += [_signed(rel), block_ids[blk]]
+        return _FUNC_PHI, ops
+
+    def _call_operands(self, instr, ops):
+        callee = instr.callee
+        fnty = callee.function_type
+        ops.append(self.type_ids[fnty])
+        self._push_with_type(ops, callee)
+        nparams = len(fnty.args)
+        for i, arg in enumerate(instr.args):
+            if i < nparams:
+                self._push(ops, arg)
+            else:
+                self._push_with_type(ops, arg)
+        return ops
+
+    def _call_attributes(self, instr):
+        return self._attribute_list(
+            [(_FUNCTION_INDEX, self._attribute_ops(instr.attributes))])
+
+    def _encode_call(self, instr):
+        cconv = _CALLING_CONVENTIONS[instr.cconv or '']
+        fmf = self._flags(instr.fastmath, _FASTMATH_FLAGS)
+        # The tail, explicit type and fast-math flags
+        flags = (cconv << 1) | int(bool(instr.tail)) | 1 << 15
+        ops = [self._call_attributes(instr)]
+        if fmf:
+            ops += [flags | 1 << 17, fmf]
+        else:
+            ops.append(flags)
+        return _FUNC_CALL, self._call_operands(instr, ops)
+
+    def _encode_invoke(self, instr):
+        cconv = _CALLING_CONVENTIONS[instr.cconv or '']
+        block_ids = self.block_ids
+        # The explicit type flag
+        ops = [self._call_attributes(instr), cconv | 1 << 13,
+               block_ids[instr.normal_to], block_ids[instr.unwind_to]]
+        return _FUNC_INVOKE, self._call_operands(instr, ops)
+
+    def _encode_ret(self, instr):
+        ops = []
+        if instr.return_value is not None:
+            self._push_with_type(ops, instr.return_value)
+        return _FUNC_RET, ops
+
+    def _encode_branch(self, instr):
+        if instr.opname == 'resume':
+            # IRBuilder.resume() creates a Branch
+            return self._encode_resume(instr)
+        return _FUNC_BR, [self.block_ids[instr.operands[0]]]
+
+    def _encode_cbranch(self, instr):
+        cond, iftrue, iffalse = instr.operands
+        ops = [self.block_ids[iftrue], self.block_ids[iffalse]]
+        self._push(ops, cond)
+        return _FUNC_BR, ops
+
+    def _encode_switch(self, instr):
+        block_ids = self.block_ids
+        ops = [self.type_ids[instr.value.type]]
+        self._push(ops, instr.value)
+        ops.append(block_ids[instr.default])
+        for val, blk in instr.cases:
+            ops += [self.value_ids[val], block_ids[blk]]
+        return _FUNC_SWITCH, ops
+
+    def _encode_indirectbr(self, instr):
+        ops = [self.type_ids[instr.address.type]]
+        self._push(ops, instr.address)
+        ops += [self.block_ids[blk] for blk in instr.destinations]
+        return _FUNC_INDIRECTBR, ops
+
+    def _encode_resume(self, instr):
+        ops = []
+        self._push_with_type(ops, instr.operands[0])
+        return _FUNC_RESUME, ops
+
+    def _encode_unreachable(self, instr):
+        return _FUNC_UNREACHABLE, []
+
+    def _encode_extractvalue(self, instr):
+        ops = []
+        self._push_with_type(ops, instr.aggregate)
+        ops += instr.indices
+        return _FUNC_EXTRACTVAL, ops
+
+    def _encode_insertvalue(self, instr):
+        ops = []
+        self._push_with_type(ops, instr.aggregate)
+        self._push_with_type(ops, instr.value)
+        ops += instr.indices
+        return _FUNC_INSERTVAL, ops
+
+    def _encode_extractelement(self, instr):
+        vector, index = instr.operands
+        ops = []
+        self._push_with_type(ops, vector)
+        self._push_with_type(ops, index)
+        return _FUNC_EXTRACTELT, ops
+
+    def _encode_insertelement(self, instr):
+        vector, value, index = instr.operands
+        ops = []
+        self._push_with_type(ops, vector)
+        self._push(ops, value)
+        self._push_with_type(ops, index)
+        return _FUNC_INSERTELT, ops
+
+    def _encode_shufflevector(self, instr):
+        vector1, vector2, mask = instr.operands
+        if vector2 is values.Undefined:
+            vector2 = vector1.type(values.Undefined)
+        ops = []
+        self._push_with_type(ops, vector1)
+        self._push(ops, vector2)
+        self._push_with_type(ops, mask)
+        return _FUNC_SHUFFLEVEC, ops
+
+    def _encode_atomicrmw(self, instr):
+        ptr, val = instr.operands
+        ops = []
+        self._push_with_type(ops, ptr)
+        self._push(ops, val)
+        ops += [_RMWOPS[instr.operation], 0, _ORDERINGS[instr.ordering],
+                _SYSTEM_SCOPE]
+        return _FUNC_ATOMICRMW, ops
+
+    def _encode_cmpxchg(self, instr):
+        ptr, cmp, val = instr.operands
+        ops = []
+        self._push_with_type(ops, ptr)
+        self._push_with_type(ops, cmp)
+        self._push(ops, val)
+        ops += [0, _ORDERINGS[instr.ordering], _SYSTEM_SCOPE,
+                _ORDERINGS[instr.failordering], 0]
+        return _FUNC_CMPXCHG, ops
+
+    def _encode_fence(self, instr):
+        scope = instr.targetscope
+        ssid = _SYSTEM_SCOPE if scope is None else self.sync_scopes[scope]
+        return _FUNC_FENCE, [_ORDERINGS[instr.ordering], ssid]
+
+    def _encode_landingpad(self, instr):
+        ops = [self.type_ids[instr.type], int(bool(instr.cleanup)),
+               len(instr.clauses)]
+        for clause in instr.clauses:
+            ops.append(_LANDINGPAD_CLAUSES[clause.kind])
+            self._push_with_type(ops, clause.value)
+        return _FUNC_LANDINGPAD, ops
+
+
+_INSTRUCTION_ENUMERATORS = {
+    instructions.CallInstr: _ModuleWriter._enumerate_call,
+    instructions.InvokeInstr: _ModuleWriter._enumerate_call,
+    instructions.GEPInstr: _ModuleWriter._enumerate_gep,
+    instructions.AllocaInstr: _ModuleWriter._enumerate_alloca,
+    instructions.PhiInstr: _ModuleWriter._enumerate_phi,
+    instructions.SwitchInstr: _ModuleWriter._enumerate_switch,
+    instructions.LandingPadInstr: _ModuleWriter._enumerate_landingpad,
+    instructions.ShuffleVector: _ModuleWriter._enumerate_shufflevector,
+    instructions.Fence: _ModuleWriter._enumerate_fence,
+}
+
+_INSTRUCTION_ENCODERS = {
+    instructions.Instruction: _ModuleWriter._encode_binop,
+    instructions.CastInstr: _ModuleWriter._encode_cast,
+    instructions.ICMPInstr: _ModuleWriter._encode_compare,
+    instructions.FCMPInstr: _ModuleWriter._encode_compare,
+    instructions.SelectInstr: _ModuleWriter._encode_select,
+    instructions.LoadInstr: _ModuleWriter._encode_load,
+    instructions.StoreInstr: _ModuleWriter._encode_store,
+    instructions.LoadAtomicInstr: _ModuleWriter._encode_load,
+    instructions.StoreAtomicInstr: _ModuleWriter._encode_store,
+    instructions.AllocaInstr: _ModuleWriter._encode_alloca,
+    instructions.GEPInstr: _ModuleWriter._encode_gep,
+    instructions.PhiInstr: _ModuleWriter._encode_phi,
+    instructions.CallInstr: _ModuleWriter._encode_call,
+    instructions.InvokeInstr: _ModuleWriter._encode_invoke,
+    instructions.Ret: _ModuleWriter._encode_ret,
+    instructions.Branch: _ModuleWriter._encode_branch,
+    instructions.ConditionalBranch: _ModuleWriter._encode_cbranch,
+    instructions.IndirectBranch: _ModuleWriter._encode_indirectbr,
+    instructions.SwitchInstr: _ModuleWriter._encode_switch,
+    instructions.Resume: _ModuleWriter._encode_resume,
+    instructions.Unreachable: _ModuleWriter._encode_unreachable,
+    instructions.ExtractValue: _ModuleWriter._encode_extractvalue,
+    instructions.InsertValue: _ModuleWriter._encode_insertvalue,
+    instructions.ExtractElement: _ModuleWriter._encode_extractelement,
+    instructions.InsertElement: _ModuleWriter._encode_insertelement,
+    instructions.ShuffleVector: _ModuleWriter._encode_shufflevector,
+    instructions.AtomicRMW: _ModuleWriter._encode_atomicrmw,
+    instructions.CmpXchg: _ModuleWriter._encode_cmpxchg,
+    instructions.Fence: _ModuleWriter._encode_fence,
+    instructions.LandingPadInstr: _ModuleWriter._encode_landingpad,
+}
+
+
+def write_bitcode(module):
+    """
+    Return the LLVM bitcode of the llvmlite.ir Module *module*, as a bytes
+    object.
+
+    NotImplementedError is raised if the module uses a construct the
+    writer doesn't support, such as debug information metadata.
+    """
+    return _ModuleWriter(module).write()
@@ -1,7 +1,8 @@
 import contextlib
 import functools
 
-from llvmlite.ir import instructions, types, values
+from llvmlite.ir import folding, instructions, types, values
+from llvmlite.ir._utils import _gc_paused
 
 _CMP_MAP = {
     '>': 'gt',
@@ -20,8 +21,19 @@ def _binop(opname, cls=instructions.Instruction):
             if lhs.type != rhs.type:
                 raise ValueError("Operands must be the same type, got (%s, %s)"
                                  % (lhs.type, rhs.type))
-            instr = cls(self.block, lhs.type, opname, (lhs, rhs), name, flags)
-            self._insert(instr)
+            if self.fold_constants:
+                folded = folding.fold_binop(opname, lhs, rhs, flags)
+                if folded is not None:
+                    return folded
+            key = None
+            if self._cse_caches is not None:
+                key = (opname, lhs, rhs, tuple(flags))
+                instr = self._cse_lookup(key)
+                if instr is not None:
+                    return instr
+            instr = cls(self.block, lhs.type, opname, (lhs, rhs), name,
+                        flags)
+            self._insert(instr, key)
             return instr
 
         return wrapped
@@ -148,8 +160,18 @@ def _castop(opname, cls=instructions.CastInstr):
         def wrapped(self, val, typ, name=''):
             if val.type == typ:
                 return val
+            if self.fold_constants:
+                folded = folding.fold_cast(opname, val, typ)
+                if folded is not None:
+                    return folded
+            key = None
+            if self._cse_caches is not None:
+                key = (opname, val, typ)
+                instr = self._cse_lookup(key)
+                if instr is not None:
+                    return instr
             instr = cls(self.block, opname, val, typ, name)
-            self._insert(instr)
+            self._insert(instr, key)
             return instr
 
         return wrapped
@@ -157,6 +179,15 @@ def _castop(opname, cls=instructions.CastInstr):
     return wrap
 
 
+# The instructions emit_many() can create, by opname
+_BATCH_BINOPS = instructions._BINARY_OPNAMES
+_BATCH_CASTS = frozenset(['trunc', 'zext', 'sext', 'fptrunc', 'fpext',
+                          'bitcast', 'addrspacecast', 'fptoui', 'uitofp',
+                          'fptosi', 'sitofp', 'ptrtoint', 'inttoptr'])
+_BATCH_COMPARES = {'icmp': instructions.ICMPInstr,
+                   'fcmp': instructions.FCMPInstr}
+
+
 def _label_suffix(label, suffix):
     """Returns (label + suffix) or a truncated version if it's too long.
     Parameters
@@ -174,10 +205,63 @@ def _label_suffix(label, suffix):
 
 
 class IRBuilder(object):
-    def __init__(self, block=None):
+    def __init__(self, block=None, fold_constants=False, cse=False):
         self._block = block
         self._anchor = len(block.instructions) if block else 0
         self.debug_metadata = None
+        # Whether operations on constants give constants rather than
+        # instructions
+        self.fold_constants = fold_constants
+        # The pure instructions emitted in each block, by opname and
+        # operands, if common subexpressions are eliminated, along with
+        # the block's count of removals when the cache was created
+        self._cse_caches = {} if cse else None
+
+    @property
+    def cse(self):
+        """
+        Whether the pure instructions (arithmetic, casts, comparisons,
+        select and gep) are reused rather than emitted again in a block,
+        when their opname, operands and flags are identical.
+        """
+        return self._cse_caches is not None
+
+    @cse.setter
+    def cse(self, enable):
+        if enable != self.cse:
+            self._cse_caches = {} if enable else None
+
+    def _cse_cache(self):
+        """
+        Return the CSE cache of the current block.  It is dropped if
+        instructions were removed, replaced or moved in the block since
+        it was created, e.g. by Block.replace() or eliminate_dead_code():
+        the instructions it refers to might not be in place anymore.
+        """
+        block = self._block
+        removals = block.instructions._removals
+        entry = self._cse_caches.get(block)
+        if entry is None or entry[0] != removals:
+            entry = self._cse_caches[block] = (removals, {})
+        return entry[1]
+
+    def _cse_lookup(self, key):
+        return self._cse_cache().get(key)
+
+    def _check_cse_cache(self):
+        """
+        Drop the CSE cache of the current block, unless the instructions
+        it refers to are all before the current position, i.e. at the end
+        of the block or right before its terminator.
+        """
+        caches = self._cse_caches
+        if caches is not None:
+            block = self._block
+            end = len(block.instructions)
+            if block.terminator is not None:
+                end -= 1
+            if self._anchor < end:
+                caches.pop(block, None)
 
     @property
     def block(self):
@@ -208,7 +292,8 @@ class IRBuilder(object):
         is also changed to the instruction's basic block.
         """
         self._block = instr.parent
-        self._anchor = self._block.instructions.index(instr)
+        self._anchor = self._block.instructions.find_near(instr)
+        self._check_cse_cache()
 
     def position_after(self, instr):
         """
@@ -216,7 +301,8 @@ class IRBuilder(object):
         is also changed to the instruction's basic block.
         """
         self._block = instr.parent
-        self._anchor = self._block.instructions.index(instr) + 1
+        self._anchor = self._block.instructions.find_near(instr) + 1
+        self._check_cse_cache()
 
     def position_at_start(self, block):
         """
@@ -224,6 +310,7 @@ class IRBuilder(object):
         """
         self._block = block
         self._anchor = 0
+        self._check_cse_cache()
 
     def position_at_end(self, block):
         """
@@ -231,6 +318,7 @@ class IRBuilder(object):
         """
         self._block = block
         self._anchor = len(block.instructions)
+        self._check_cse_cache()
 
     def append_basic_block(self, name=''):
         """
@@ -241,8 +329,10 @@ class IRBuilder(object):
 
     def remove(self, instr):
         """Remove the given instruction."""
-        idx = self._block.instructions.index(instr)
+        idx = self._block.instructions.find_near(instr)
         del self._block.instructions[idx]
+        if self.module.track_uses:
+            instr._drop_uses()
         if self._block.terminator == instr:
             self._block.terminator = None
         if self._anchor > idx:
@@ -335,11 +425,13 @@ class IRBuilder(object):
 
         self.position_at_end(bbend)
 
-    def _insert(self, instr):
+    def _insert(self, instr, cse_key=None):
         if self.debug_metadata is not None and 'dbg' not in instr.metadata:
             instr.metadata['dbg'] = self.debug_metadata
         self._block.instructions.insert(self._anchor, instr)
         self._anchor += 1
+        if cse_key is not None:
+            self._cse_cache()[cse_key] = instr
 
     def _set_terminator(self, term):
         assert not self.block.is_terminated
@@ -552,8 +644,18 @@ class IRBuilder(object):
             raise ValueError("invalid comparison %r for icmp" % (cmpop,))
         if cmpop not in ('==', '!='):
             op = prefix + op
+        if self.fold_constants:
+            folded = folding.fold_icmp(op, lhs, rhs)
+            if folded is not None:
+                return folded
+        key = None
+        if self._cse_caches is not None:
+            key = ('icmp', op, lhs, rhs, ())
+            instr = self._cse_lookup(key)
+            if instr is not None:
+                return instr
         instr = instructions.ICMPInstr(self.block, op, lhs, rhs, name=name)
-        self._insert(instr)
+        self._insert(instr, key)
         return instr
 
     def icmp_signed(self, cmpop, lhs, rhs, name=''):
@@ -574,6 +676,22 @@ class IRBuilder(object):
         """
         return self._icmp('u', cmpop, lhs, rhs, name)
 
+    def _fcmp(self, op, lhs, rhs, name, flags):
+        if self.fold_constants and op in instructions.FCMPInstr.VALID_OP:
+            folded = folding.fold_fcmp(op, lhs, rhs, flags)
+            if folded is not None:
+                return folded
+        key = None
+        if self._cse_caches is not None:
+            key = ('fcmp', op, lhs, rhs, tuple(flags))
+            instr = self._cse_lookup(key)
+            if instr is not None:
+                return instr
+        instr = instructions.FCMPInstr(
+            self.block, op, lhs, rhs, name=name, flags=flags)
+        self._insert(instr, key)
+        return instr
+
     def fcmp_ordered(self, cmpop, lhs, rhs, name='', flags=[]):
         """
         Floating-point ordered comparison:
@@ -585,10 +703,7 @@ class IRBuilder(object):
             op = 'o' + _CMP_MAP[cmpop]
         else:
             op = cmpop
-        instr = instructions.FCMPInstr(
-            self.block, op, lhs, rhs, name=name, flags=flags)
-        self._insert(instr)
-        return instr
+        return self._fcmp(op, lhs, rhs, name, flags)
 
     def fcmp_unordered(self, cmpop, lhs, rhs, name='', flags=[]):
         """
@@ -601,18 +716,25 @@ class IRBuilder(object):
             op = 'u' + _CMP_MAP[cmpop]
         else:
             op = cmpop
-        instr = instructions.FCMPInstr(
-            self.block, op, lhs, rhs, name=name, flags=flags)
-        self._insert(instr)
-        return instr
+        return self._fcmp(op, lhs, rhs, name, flags)
 
     def select(self, cond, lhs, rhs, name=''):
         """
         Ternary select operator:
             name = cond ? lhs : rhs
         """
-        instr = instructions.SelectInstr(self.block, cond, lhs, rhs, name=name)
-        self._insert(instr)
+        if (self.fold_constants and type(cond) is values.Constant
+                and isinstance(cond.constant, int)):
+            return lhs if cond.constant & 1 else rhs
+        key = None
+        if self._cse_caches is not None:
+            key = ('select', cond, lhs, rhs)
+            instr = self._cse_lookup(key)
+            if instr is not None:
+                return instr
+        instr = instructions.SelectInstr(self.block, cond, lhs, rhs,
+                                         name=name)
+        self._insert(instr, key)
         return instr
 
     #
@@ -710,6 +832,128 @@ class IRBuilder(object):
             name = (typ) value
         """
 
+    #
+    # Batch APIs
+    #
+
+    def emit_many(self, ops):
+        """
+        Emit the sequence of simple instructions described by *ops* at the
+        current position, and return the list of their results.  This is
+        much faster than calling the corresponding methods one by one, e.g.
+        for long straight-line code.
+
+        Each item of *ops* is a tuple:
+        - (opname, (lhs, rhs)) for a binary operation, *opname* being the
+          name of the corresponding method (e.g. 'add' or 'fmul');
+        - (opname, (value,), typ) for a cast to *typ* (e.g. 'sext');
+        - ('icmp', (lhs, rhs), op) or ('fcmp', (lhs, rhs), op) for a
+          comparison, *op* being a LLVM condition code (e.g. 'slt');
+        - ('select', (cond, lhs, rhs)).
+        An operand is either a value, or an integer indexing the list of
+        results (e.g. -1 for the result of the previous item).  The
+        instructions are unnamed.
+        """
+        with _gc_paused():
+            return self._emit_many(ops)
+
+    def _emit_many(self, ops):
+        block = self._block
+        fn = block.parent
+        dbg = self.debug_metadata
+        fold = self.fold_constants
+        cse = self._cse_cache() if self._cse_caches is not None else None
+        Constant = values.Constant
+        results = []
+        append = results.append
+        instrs = []
+        # The instructions are created without running their constructors,
+        # as the checks are done here, and named all at once
+        for op in ops:
+            opname = op[0]
+            operands = [results[v] if v.__class__ is int else v
+                        for v in op[1]]
+            folded = None
+            if opname in _BATCH_BINOPS:
+                lhs, rhs = operands
+                typ = lhs.type
+                if typ is not rhs.type and typ != rhs.type:
+                    raise ValueError("Operands must be the same type, "
+                                     "got (%s, %s)" % (typ, rhs.type))
+                if fold and type(lhs) is Constant and type(rhs) is Constant:
+                    folded = folding.fold_binop(opname, lhs, rhs)
+                cls = instructions.Instruction
+            elif opname in _BATCH_CASTS:
+                [val] = operands
+                typ = op[2]
+                if val.type == typ:
+                    append(val)
+                    continue
+                if fold and type(val) is Constant:
+                    folded = folding.fold_cast(opname, val, typ)
+                cls = instructions.CastInstr
+            elif opname in _BATCH_COMPARES:
+                cls = _BATCH_COMPARES[opname]
+                lhs, rhs = operands
+                cond = op[2]
+                if cond not in cls.VALID_OP:
+                    raise ValueError("invalid comparison %r for %s"
+                                     % (cond, opname))
+                if isinstance(lhs.type, types.VectorType):
+                    typ = types.VectorType(types.IntType(1), lhs.type.count)
+                else:
+                    typ = types.IntType(1)
+                if fold and type(lhs) is Constant and type(rhs) is Constant:
+                    if opname == 'icmp':
+                        folded = folding.fold_icmp(cond, lhs, rhs)
+                    else:
+                        folded = folding.fold_fcmp(cond, lhs, rhs)
+            elif opname == 'select':
+                cond, lhs, rhs = operands
+                typ = lhs.type
+                if typ != rhs.type:
+                    raise ValueError("Operands must be the same type, "
+                                     "got (%s, %s)" % (typ, rhs.type))
+                if (fold and type(cond) is Constant
+                        and isinstance(cond.constant, int)):
+                    folded = lhs if cond.constant & 1 else rhs
+                cls = instructions.SelectInstr
+            else:
+                raise ValueError("unsupported instruction %r" % (opname,))
+            if folded is not None:
+                append(folded)
+                continue
+            if cse is not None:
+                if opname in _BATCH_BINOPS:
+                    key = (opname, lhs, rhs, ())
+                elif opname in _BATCH_CASTS:
+                    key = (opname, val, typ)
+                elif opname in _BATCH_COMPARES:
+                    key = (opname, cond, lhs, rhs, ())
+                else:
+                    key = ('select', cond, lhs, rhs)
+                instr = cse.get(key)
+                if instr is not None:
+                    append(instr)
+                    continue
+            instr = cls._new_unnamed(block, typ, opname, operands)
+            if opname in _BATCH_COMPARES:
+                instr.op = cond
+            if dbg is not None:
+                instr.metadata['dbg'] = dbg
+            instrs.append(instr)
+            append(instr)
+            if cse is not None:
+                cse[key] = instr
+
+        names = fn.scope.register_unnamed(len(instrs))
+        for instr, name in zip(instrs, names):
+            instr._name = name
+        anchor = self._anchor
+        block.instructions[anchor:anchor] = instrs
+        self._anchor = anchor + len(instrs)
+        return results
+
     #
     # Memory APIs
     #
@@ -901,9 +1145,15 @@ class IRBuilder(object):
         Compute effective address (getelementptr):
             name = getelementptr ptr, <indices...>
         """
+        key = None
+        if self._cse_caches is not None:
+            key = ('gep', ptr, tuple(indices), inbounds)
+            instr = self._cse_lookup(key)
+            if instr is not None:
+                return instr
         instr = instructions.GEPInstr(self.block, ptr, indices,
                                       inbounds=inbounds, name=name)
-        self._insert(instr)
+        self._insert(instr, key)
         return instr
 
     # Vector Operations APIs
@@ -0,0 +1,328 @@
+"""
+Folding of instructions on constants, used by IRBuilder when constant
+folding is enabled.
+
+The folding functions return the resulting Constant, or None when the
+instruction can't be folded: its operands are not simple constants, or
+its result would be poison or undefined behaviour (e.g. a signed
+overflow of an "add nsw", or a division by zero), which is left for
+LLVM to deal with.
+"""
+
+import math
+import operator
+import struct
+
+from llvmlite.ir import types
+from llvmlite.ir.values import Constant
+
+
+_FLOAT_FORMATS = {
+    types.HalfType: 'e',
+    types.FloatType: 'f',
+}
+
+# The number of bits of the significand of the floating-point types
+_FLOAT_PRECISIONS = {
+    types.HalfType: 11,
+    types.FloatType: 24,
+    types.DoubleType: 53,
+}
+
+
+def _int_operand(value):
+    """
+    Return the Python integer of *value* if it is a scalar integer
+    constant, else None.
+    """
+    if (type(value) is Constant and isinstance(value.type, types.IntType)
+            and isinstance(value.constant, int)):
+        # Two's complement, as an unsigned integer
+        return value.constant & ((1 << value.type.width) - 1)
+    return None
+
+
+def _float_operand(value):
+    """
+    Return the Python float of *value* if it is a scalar floating-point
+    constant, else None.
+    """
+    if (type(value) is Constant
+            and isinstance(value.type, types._BaseFloatType)
+            and isinstance(value.constant, (int, float))):
+        return _round(value.type, float(value.constant))
+    return None
+
+
+def _signed(value, width):
+    if value >> (width - 1):
+        return value - (1 << width)
+    return value
+
+
+def _round(typ, value):
+    """
+    Round the double *value* to the precision of the floating-point *typ*.
+    """
+    fmt = _FLOAT_FORMATS.get(type(typ))
+    if fmt is None or math.isnan(value) or math.isinf(value):
+        return value
+    try:
+        return struct.unpack(fmt, struct.pack(fmt, value))[0]
+    except OverflowError:
+        # Rounds to infinity
+        return math.copysign(math.inf, value)
+
+
+def _int_to_float(typ, value):
+    """
+    Convert the integer *value* to the floating-point *typ*, rounding to
+    nearest even.
+    """
+    precision = _FLOAT_PRECISIONS[type(typ)]
+    mag = abs(value)
+    shift = mag.bit_length() - precision
+    if shift > 0:
+        # Round the significand directly, as rounding to double first
+        # could round twice
+        mag, rem = divmod(mag, 1 << shift)
+        half = 1 << (shift - 1)
+        if rem > half or (rem == half and mag & 1):
+            mag += 1
+        mag <<= shift
+    return _round(typ, math.copysign(float(mag), value))
+
+
+def _int_constant(typ, value):
+    """
+    Create a constant of the integer *typ* from the unsigned *value*,
+    truncated to the width of *typ*.
+    """
+    width = typ.width
+    value &= (1 << width) - 1
+    if width == 1:
+        return Constant(typ, bool(value))
+    return Constant(typ, _signed(value, width))
+
+
+def _fold_int_binop(opname, typ, a, b, flags):
+    width = typ.width
+    mask = (1 << width) - 1
+    sa = _signed(a, width)
+    sb = _signed(b, width)
+    smin = -(1 << (width - 1))
+    smax = (1 << (width - 1)) - 1
+    flags = set(flags)
+
+    if opname in ('add', 'sub', 'mul'):
+        op = getattr(operator, opname)
+        res = op(a, b)
+        if 'nuw' in flags and not 0 <= res <= mask:
+            return None
+        if 'nsw' in flags and not smin <= op(sa, sb) <= smax:
+            return None
+        return res
+    elif opname in ('udiv', 'urem'):
+        if b == 0:
+            return None
+        res = a // b if opname == 'udiv' else a % b
+        if 'exact' in flags and a % b:
+            return None
+        return res
+    elif opname in ('sdiv', 'srem'):
+        if sb == 0 or (sa == smin and sb == -1):
+            return None
+        # Division truncating towards zero
+        quot = abs(sa) // abs(sb)
+        if (sa < 0) != (sb < 0):
+            quot = -quot
+        rem = sa - quot * sb
+        if 'exact' in flags and rem:
+            return None
+        return quot if opname == 'sdiv' else rem
+    elif opname in ('shl', 'lshr', 'ashr'):
+        if b >= width:
+            return None
+        if opname == 'shl':
+            res = a << b
+            if 'nuw' in flags and res > mask:
+                return None
+            if 'nsw' in flags and _signed(res & mask, width) >> b != sa:
+                return None
+            return res
+        if 'exact' in flags and a & ((1 << b) - 1):
+            return None
+        return a >> b if opname == 'lshr' else sa >> b
+    elif opname == 'and':
+        return a & b
+    elif opname == 'or':
+        return a | b
+    elif opname == 'xor':
+        return a ^ b
+    return None
+
+
+_FLOAT_BINOPS = {
+    'fadd': operator.add,
+    'fsub': operator.sub,
+    'fmul': operator.mul,
+}
+
+
+def _fold_float_binop(opname, a, b):
+    res = _fold_float_binop_raw(opname, a, b)
+    if res is not None and math.isnan(res):
+        # Like LLVM, propagate a NaN operand, else give the default NaN
+        # (the hardware's may have its sign bit set)
+        res = a if math.isnan(a) else b if math.isnan(b) else math.nan
+    return res
+
+
+def _fold_float_binop_raw(opname, a, b):
+    if opname in _FLOAT_BINOPS:
+        # Python's float arithmetic is IEEE double arithmetic
+        return _FLOAT_BINOPS[opname](a, b)
+    elif opname == 'fdiv':
+        # Python raises on divisions by zero
+        if b == 0.0:
+            if a == 0.0 or math.isnan(a):
+                return math.nan
+            return math.copysign(math.inf, a) * math.copysign(1.0, b)
+        return a / b
+    elif opname == 'frem':
+        if b == 0.0 or math.isinf(a) or math.isnan(a) or math.isnan(b):
+            return math.nan
+        # fmod() is exact and has the sign of the dividend, like frem
+        return math.fmod(a, b)
+    return None
+
+
+def _check_fastmath(flags, values):
+    """
+    Whether the fast-math *flags* allow the given operand and result
+    *values*, rather than make them poison.
+    """
+    flags = set(flags)
+    if flags & {'fast', 'nnan'} and any(math.isnan(v) for v in values):
+        return False
+    if flags & {'fast', 'ninf'} and any(math.isinf(v) for v in values):
+        return False
+    return True
+
+
+def fold_binop(opname, lhs, rhs, flags=()):
+    """
+    Fold the binary operation *opname* (e.g. "add") on the constants
+    *lhs* and *rhs*, with the given instruction *flags*.
+    """
+    typ = lhs.type
+    a = _int_operand(lhs)
+    b = _int_operand(rhs)
+    if a is not None and b is not None:
+        res = _fold_int_binop(opname, typ, a, b, flags)
+        return None if res is None else _int_constant(typ, res)
+    a = _float_operand(lhs)
+    b = _float_operand(rhs)
+    if a is not None and b is not None:
+        res = _fold_float_binop(opname, a, b)
+        if res is None:
+            return None
+        res = _round(typ, res)
+        if not _check_fastmath(flags, (a, b, res)):
+            return None
+        return Constant(typ, res)
+    return None
+
+
+_INT_PREDICATES = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+}
+
+
+def fold_icmp(op, lhs, rhs):
+    """
+    Fold the integer comparison with the condition code *op* (e.g. "slt")
+    of the constants *lhs* and *rhs*.
+    """
+    a = _int_operand(lhs)
+    b = _int_operand(rhs)
+    if a is None or b is None or lhs.type != rhs.type:
+        return None
+    if op[0] == 's':
+        width = lhs.type.width
+        a = _signed(a, width)
+        b = _signed(b, width)
+        op = op[1:]
+    elif op[0] == 'u':
+        op = op[1:]
+    return Constant(types.IntType(1), _INT_PREDICATES[op](a, b))
+
+
+def fold_fcmp(op, lhs, rhs, flags=()):
+    """
+    Fold the floating-point comparison with the condition code *op* (e.g.
+    "olt") of the constants *lhs* and *rhs*.
+    """
+    a = _float_operand(lhs)
+    b = _float_operand(rhs)
+    if (a is None or b is None or lhs.type != rhs.type
+            or not _check_fastmath(flags, (a, b))):
+        return None
+    unordered = math.isnan(a) or math.isnan(b)
+    if op in ('false', 'true'):
+        res = op == 'true'
+    elif op == 'ord':
+        res = not unordered
+    elif op == 'uno':
+        res = unordered
+    elif unordered:
+        res = op[0] == 'u'
+    else:
+        res = _INT_PREDICATES[op[1:]](a, b)
+    return Constant(types.IntType(1), res)
+
+
+def fold_cast(opname, value, typ):
+    """
+    Fold the cast *opname* (e.g. "sext") of the constant *value* to *typ*.
+    """
+    if isinstance(value.type, types.IntType):
+        a = _int_operand(value)
+        if a is None:
+            return None
+        width = value.type.width
+        if opname in ('trunc', 'zext') and isinstance(typ, types.IntType):
+            return _int_constant(typ, a)
+        elif opname == 'sext' and isinstance(typ, types.IntType):
+            return _int_constant(typ, _signed(a, width))
+        elif (opname in ('uitofp', 'sitofp')
+              and isinstance(typ, types._BaseFloatType)):
+            if opname == 'sitofp':
+                a = _signed(a, width)
+            return Constant(typ, _int_to_float(typ, a))
+        return None
+    x = _float_operand(value)
+    if x is None:
+        return None
+    if opname in ('fptrunc', 'fpext') and isinstance(typ,
+                                                     types._BaseFloatType):
+        return Constant(typ, _round(typ, x))
+    elif opname in ('fptoui', 'fptosi') and isinstance(typ, types.IntType):
+        if math.isnan(x) or math.isinf(x):
+            return None
+        res = int(x)
+        width = typ.width
+        if opname == 'fptoui':
+            low, high = 0, (1 << width) - 1
+        else:
+            low, high = -(1 << (width - 1)), (1 << (width - 1)) - 1
+        if not low <= res <= high:
+            # Poison
+            return None
+        return _int_constant(typ, res)
+    return None
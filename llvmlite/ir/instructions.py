@@ -9,15 +9,96 @@ from llvmlite.ir.values import (Block, Function, Value, NamedValue, Constant,
 from llvmlite.ir._utils import _HasMetadata
 
 
+# The opnames of the binary arithmetic and bitwise operations, which the
+# builder emits as plain Instruction objects
+_BINARY_OPNAMES = frozenset(['shl', 'lshr', 'ashr', 'add', 'fadd', 'sub',
+                             'fsub', 'mul', 'fmul', 'udiv', 'sdiv', 'fdiv',
+                             'urem', 'srem', 'frem', 'or', 'and', 'xor'])
+
+
 class Instruction(NamedValue, _HasMetadata):
+    __slots__ = ('opname', '_operands', '_flags', '_metadata')
+
     def __init__(self, parent, typ, opname, operands, name='', flags=()):
         super(Instruction, self).__init__(parent, typ, name=name)
         assert isinstance(parent, Block)
         assert isinstance(flags, (tuple, list))
+        self._init_instruction(opname, operands, flags)
+
+    def _init_instruction(self, opname, operands, flags):
         self.opname = opname
-        self.operands = operands
-        self.flags = list(flags)
-        self.metadata = {}
+        self._operands = operands
+        if self.parent.module.track_uses:
+            self._record_uses()
+        # Most instructions have neither flags nor metadata: the containers
+        # are created on demand.
+        self._flags = list(flags) if flags else None
+        self._metadata = None
+
+    @classmethod
+    def _new_unnamed(cls, parent, typ, opname, operands):
+        """
+        Create an instruction of this class without running its
+        constructor, for callers which already checked the operands
+        (see IRBuilder.emit_many()).  The caller must set the subclass
+        specific fields, and _name once registered in the function's
+        scope.
+        """
+        self = cls.__new__(cls)
+        self.parent = parent
+        self.type = typ
+        self._init_instruction(opname, operands, ())
+        return self
+
+    @property
+    def operands(self):
+        return self._operands
+
+    @operands.setter
+    def operands(self, operands):
+        if self.parent.module.track_uses:
+            self._drop_uses()
+            self._operands = operands
+            self._record_uses()
+        else:
+            self._operands = operands
+
+    def _used_values(self):
+        """
+        The values whose uses are tracked, i.e. those replace_usage()
+        can replace.
+        """
+        return self._operands
+
+    def _record_uses(self):
+        for op in self._used_values():
+            if isinstance(op, Value):
+                op._add_use(self)
+
+    def _drop_uses(self):
+        for op in self._used_values():
+            if isinstance(op, Value):
+                op._remove_use(self)
+
+    @property
+    def flags(self):
+        if self._flags is None:
+            self._flags = []
+        return self._flags
+
+    @flags.setter
+    def flags(self, flags):
+        self._flags = flags
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
 
     @property
     def function(self):
@@ -29,14 +110,27 @@ class Instruction(NamedValue, _HasMetadata):
 
     def descr(self, buf):
         opname = self.opname
-        if self.flags:
-            opname = ' '.join([opname] + self.flags)
+        if self._flags:
+            opname = ' '.join([opname] + self._flags)
         operands = ', '.join([op.get_reference() for op in self.operands])
         typ = self.type
         metadata = self._stringify_metadata(leading_comma=True)
         buf.append("{0} {1} {2}{3}\n"
                    .format(opname, typ, operands, metadata))
 
+    def _clear_string_cache(self):
+        super(Instruction, self)._clear_string_cache()
+        self.parent._invalidate()
+
+    def set_metadata(self, name, node):
+        super(Instruction, self).set_metadata(name, node)
+        self._clear_string_cache()
+
+    def _stringify_metadata(self, leading_comma=False):
+        if not self._metadata:
+            return ''
+        return super(Instruction, self)._stringify_metadata(leading_comma)
+
     def replace_usage(self, old, new):
         if old in self.operands:
             ops = []
@@ -62,6 +156,8 @@ class FastMathFlags(AttributeSet):
 
 
 class CallInstr(Instruction):
+    __slots__ = ('cconv', 'tail', 'fastmath', 'attributes')
+
     def __init__(self, parent, func, args, name='', cconv=None, tail=False,
                  fastmath=(), attrs=()):
         self.cconv = (func.calling_convention
@@ -87,6 +183,9 @@ class CallInstr(Instruction):
 
         super(CallInstr, self).__init__(parent, func.function_type.return_type,
                                         "call", [func] + list(args), name=name)
+        # Calling a function with a deferred body requires its definition
+        if isinstance(func, Function) and func._deferred_body is not None:
+            func.materialize()
 
     @property
     def callee(self):
@@ -94,7 +193,10 @@ class CallInstr(Instruction):
 
     @callee.setter
     def callee(self, newcallee):
-        self.operands[0] = newcallee
+        self.operands = [newcallee] + list(self.operands[1:])
+        self._clear_string_cache()
+        if isinstance(newcallee, Function):
+            newcallee.materialize()
 
     @property
     def args(self):
@@ -141,6 +243,8 @@ class CallInstr(Instruction):
 
 
 class InvokeInstr(CallInstr):
+    __slots__ = ('normal_to', 'unwind_to')
+
     def __init__(self, parent, func, args, normal_to, unwind_to, name='',
                  cconv=None):
         assert isinstance(normal_to, Block)
@@ -160,6 +264,8 @@ class InvokeInstr(CallInstr):
 
 
 class Terminator(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent, opname, operands):
         super(Terminator, self).__init__(parent, types.VoidType(), opname,
                                          operands)
@@ -173,6 +279,7 @@ class Terminator(Instruction):
 
 
 class PredictableInstr(Instruction):
+    __slots__ = ()
 
     def set_weights(self, weights):
         operands = [MetaDataString(self.module, "branch_weights")]
@@ -185,6 +292,8 @@ class PredictableInstr(Instruction):
 
 
 class Ret(Terminator):
+    __slots__ = ()
+
     def __init__(self, parent, opname, return_value=None):
         operands = [return_value] if return_value is not None else []
         super(Ret, self).__init__(parent, opname, operands)
@@ -209,14 +318,16 @@ class Ret(Terminator):
 
 
 class Branch(Terminator):
-    pass
+    __slots__ = ()
 
 
 class ConditionalBranch(PredictableInstr, Terminator):
-    pass
+    __slots__ = ()
 
 
 class IndirectBranch(PredictableInstr, Terminator):
+    __slots__ = ('destinations',)
+
     def __init__(self, parent, opname, addr):
         super(IndirectBranch, self).__init__(parent, opname, [addr])
         self.destinations = []
@@ -228,6 +339,7 @@ class IndirectBranch(PredictableInstr, Terminator):
     def add_destination(self, block):
         assert isinstance(block, Block)
         self.destinations.append(block)
+        self._clear_string_cache()
 
     def descr(self, buf):
         destinations = ["label {0}".format(blk.get_reference())
@@ -241,6 +353,7 @@ class IndirectBranch(PredictableInstr, Terminator):
 
 
 class SwitchInstr(PredictableInstr, Terminator):
+    __slots__ = ('default', 'cases')
 
     def __init__(self, parent, opname, val, default):
         super(SwitchInstr, self).__init__(parent, opname, [val])
@@ -256,6 +369,7 @@ class SwitchInstr(PredictableInstr, Terminator):
         if not isinstance(val, Value):
             val = Constant(self.value.type, val)
         self.cases.append((val, block))
+        self._clear_string_cache()
 
     def descr(self, buf):
         cases = ["{0} {1}, label {2}".format(val.type, val.get_reference(),
@@ -271,10 +385,12 @@ class SwitchInstr(PredictableInstr, Terminator):
 
 
 class Resume(Terminator):
-    pass
+    __slots__ = ()
 
 
 class SelectInstr(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent, cond, lhs, rhs, name=''):
         assert lhs.type == rhs.type
         super(SelectInstr, self).__init__(parent, lhs.type, "select",
@@ -302,6 +418,8 @@ class SelectInstr(Instruction):
 
 
 class CompareInstr(Instruction):
+    __slots__ = ('op',)
+
     # Define the following in subclasses
     OPNAME = 'invalid-compare'
     VALID_OP = {}
@@ -325,7 +443,7 @@ class CompareInstr(Instruction):
     def descr(self, buf):
         buf.append("{opname}{flags} {op} {ty} {lhs}, {rhs} {meta}\n".format(
             opname=self.opname,
-            flags=''.join(' ' + it for it in self.flags),
+            flags=''.join(' ' + it for it in self._flags or ()),
             op=self.op,
             ty=self.operands[0].type,
             lhs=self.operands[0].get_reference(),
@@ -335,6 +453,8 @@ class CompareInstr(Instruction):
 
 
 class ICMPInstr(CompareInstr):
+    __slots__ = ()
+
     OPNAME = 'icmp'
     VALID_OP = {
         'eq': 'equal',
@@ -352,6 +472,8 @@ class ICMPInstr(CompareInstr):
 
 
 class FCMPInstr(CompareInstr):
+    __slots__ = ()
+
     OPNAME = 'fcmp'
     VALID_OP = {
         'false': 'no comparison, always returns false',
@@ -376,6 +498,8 @@ class FCMPInstr(CompareInstr):
 
 
 class CastInstr(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent, op, val, typ, name=''):
         super(CastInstr, self).__init__(parent, typ, op, [val], name=name)
 
@@ -390,6 +514,7 @@ class CastInstr(Instruction):
 
 
 class LoadInstr(Instruction):
+    __slots__ = ('align',)
 
     def __init__(self, parent, ptr, name=''):
         super(LoadInstr, self).__init__(parent, ptr.type.pointee, "load",
@@ -412,6 +537,8 @@ class LoadInstr(Instruction):
 
 
 class StoreInstr(Instruction):
+    __slots__ = ('align',)
+
     def __init__(self, parent, val, ptr):
         super(StoreInstr, self).__init__(parent, types.VoidType(), "store",
                                          [val, ptr])
@@ -433,6 +560,8 @@ class StoreInstr(Instruction):
 
 
 class LoadAtomicInstr(Instruction):
+    __slots__ = ('ordering', 'align')
+
     def __init__(self, parent, ptr, ordering, align, name=''):
         super(LoadAtomicInstr, self).__init__(parent, ptr.type.pointee,
                                               "load atomic", [ptr], name=name)
@@ -452,6 +581,8 @@ class LoadAtomicInstr(Instruction):
 
 
 class StoreAtomicInstr(Instruction):
+    __slots__ = ('ordering', 'align')
+
     def __init__(self, parent, val, ptr, ordering, align):
         super(StoreAtomicInstr, self).__init__(parent, types.VoidType(),
                                                "store atomic", [val, ptr])
@@ -472,6 +603,8 @@ class StoreAtomicInstr(Instruction):
 
 
 class AllocaInstr(Instruction):
+    __slots__ = ('align',)
+
     def __init__(self, parent, typ, count, name):
         operands = [count] if count else ()
         super(AllocaInstr, self).__init__(parent, typ.as_pointer(), "alloca",
@@ -485,11 +618,13 @@ class AllocaInstr(Instruction):
             buf.append(", {0} {1}".format(op.type, op.get_reference()))
         if self.align is not None:
             buf.append(", align {0}".format(self.align))
-        if self.metadata:
+        if self._metadata:
             buf.append(self._stringify_metadata(leading_comma=True))
 
 
 class GEPInstr(Instruction):
+    __slots__ = ('pointer', 'indices', 'inbounds')
+
     def __init__(self, parent, ptr, indices, inbounds, name):
         typ = ptr.type
         lasttyp = None
@@ -527,9 +662,11 @@ class GEPInstr(Instruction):
 
 
 class PhiInstr(Instruction):
+    __slots__ = ('incomings',)
+
     def __init__(self, parent, typ, name):
-        super(PhiInstr, self).__init__(parent, typ, "phi", (), name=name)
         self.incomings = []
+        super(PhiInstr, self).__init__(parent, typ, "phi", (), name=name)
 
     def descr(self, buf):
         incs = ', '.join('[{0}, {1}]'.format(v.get_reference(),
@@ -541,16 +678,30 @@ class PhiInstr(Instruction):
                    self._stringify_metadata(leading_comma=True),
                    ))
 
+    def _used_values(self):
+        return [val for val, blk in self.incomings]
+
     def add_incoming(self, value, block):
         assert isinstance(block, Block)
         self.incomings.append((value, block))
+        self._clear_string_cache()
+        if isinstance(value, Value) and self.parent.module.track_uses:
+            value._add_use(self)
 
     def replace_usage(self, old, new):
+        tracked = self.parent.module.track_uses
+        if tracked:
+            self._drop_uses()
         self.incomings = [((new if val is old else val), blk)
                           for (val, blk) in self.incomings]
+        if tracked:
+            self._record_uses()
+        self._clear_string_cache()
 
 
 class ExtractElement(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent, vector, index, name=''):
         if not isinstance(vector.type, types.VectorType):
             raise TypeError("vector needs to be of VectorType.")
@@ -568,6 +719,8 @@ class ExtractElement(Instruction):
 
 
 class InsertElement(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent, vector, value, index, name=''):
         if not isinstance(vector.type, types.VectorType):
             raise TypeError("vector needs to be of VectorType.")
@@ -589,6 +742,8 @@ class InsertElement(Instruction):
 
 
 class ShuffleVector(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent, vector1, vector2, mask, name=''):
         if not isinstance(vector1.type, types.VectorType):
             raise TypeError("vector1 needs to be of VectorType.")
@@ -621,6 +776,8 @@ class ShuffleVector(Instruction):
 
 
 class ExtractValue(Instruction):
+    __slots__ = ('aggregate', 'indices')
+
     def __init__(self, parent, agg, indices, name=''):
         typ = agg.type
         try:
@@ -648,6 +805,8 @@ class ExtractValue(Instruction):
 
 
 class InsertValue(Instruction):
+    __slots__ = ('aggregate', 'value', 'indices')
+
     def __init__(self, parent, agg, elem, indices, name=''):
         typ = agg.type
         try:
@@ -678,6 +837,8 @@ class InsertValue(Instruction):
 
 
 class Unreachable(Instruction):
+    __slots__ = ()
+
     def __init__(self, parent):
         super(Unreachable, self).__init__(parent, types.VoidType(),
                                           "unreachable", (), name='')
@@ -710,6 +871,8 @@ class InlineAsm(object):
 
 
 class AtomicRMW(Instruction):
+    __slots__ = ('operation', 'ordering')
+
     def __init__(self, parent, op, ptr, val, ordering, name):
         super(AtomicRMW, self).__init__(parent, val.type, "atomicrmw",
                                         (ptr, val), name=name)
@@ -736,6 +899,8 @@ class CmpXchg(Instruction):
     older llvm versions.
     """
 
+    __slots__ = ('ordering', 'failordering')
+
     def __init__(self, parent, ptr, cmp, val, ordering, failordering, name):
         outtype = types.LiteralStructType([val.type, types.IntType(1)])
         super(CmpXchg, self).__init__(parent, outtype, "cmpxchg",
@@ -784,6 +949,8 @@ class FilterClause(_LandingPadClause):
 
 
 class LandingPadInstr(Instruction):
+    __slots__ = ('cleanup', 'clauses')
+
     def __init__(self, parent, typ, name='', cleanup=False):
         super(LandingPadInstr, self).__init__(parent, typ, "landingpad", [],
                                               name=name)
@@ -793,6 +960,7 @@ class LandingPadInstr(Instruction):
     def add_clause(self, clause):
         assert isinstance(clause, _LandingPadClause)
         self.clauses.append(clause)
+        self._clear_string_cache()
 
     def descr(self, buf):
         fmt = "landingpad {type}{cleanup}{clauses}\n"
@@ -812,6 +980,8 @@ class Fence(Instruction):
     fence [syncscope("<target-scope>")] <ordering>  ; yields void
     """
 
+    __slots__ = ('ordering', 'targetscope')
+
     VALID_FENCE_ORDERINGS = {"acquire", "release", "acq_rel", "seq_cst"}
 
     def __init__(self, parent, ordering, targetscope=None, name=''):
@@ -17,6 +17,34 @@ class Module(object):
         self.namedmetadata = {}
         # Cache for metadata node deduplication
         self._metadatacache = {}
+        self._track_uses = False
+        # Whether the unnamed values of functions created afterwards are
+        # numbered without storing their names as strings
+        self.numeric_names = False
+        # Functions whose body is deferred and not built yet
+        self._deferred_functions = collections.OrderedDict()
+
+    @property
+    def track_uses(self):
+        """
+        Whether the uses of values by the instructions of this module are
+        tracked, enabling Value.uses and Value.replace_all_uses_with().
+        """
+        return self._track_uses
+
+    @track_uses.setter
+    def track_uses(self, enable):
+        enable = bool(enable)
+        if enable == self._track_uses:
+            return
+        for fn in self.functions:
+            for block in fn.basic_blocks:
+                for instr in block.instructions:
+                    if enable:
+                        instr._record_uses()
+                    else:
+                        instr._drop_uses()
+        self._track_uses = enable
 
     def _fix_metadata_operands(self, operands):
         fixed_ops = []
@@ -201,6 +229,79 @@ class Module(object):
             _error()
         return values.Function(self, fnty, name=name)
 
+    def _get_exported_globals(self):
+        """
+        Build the deferred functions visible outside of this module, and
+        those the built code refers to (by calling them or using them as
+        values, e.g. as callbacks), and return the list of global values
+        to export: the remaining deferred functions are left out.
+        """
+        deferred = self._deferred_functions
+        if not deferred:
+            return list(self.globals.values())
+        pending = [fn for fn in deferred
+                   if fn.linkage not in ('internal', 'private')]
+        scanned = set()
+        while True:
+            for fn in pending:
+                fn.materialize()
+            if not deferred:
+                return list(self.globals.values())
+            pending = self._find_deferred_references(scanned)
+            if not pending:
+                break
+        return [gv for gv in self.globals.values() if gv not in deferred]
+
+    def _find_deferred_references(self, scanned):
+        """
+        Return the deferred functions referred to by the global values
+        and metadata not in the *scanned* set, and add those to it.
+        """
+        deferred = self._deferred_functions
+        pending = []
+        for gv in self.globals.values():
+            if gv in scanned or gv in deferred:
+                continue
+            scanned.add(gv)
+            if isinstance(gv, values.GlobalVariable):
+                pending.append(gv.initializer)
+            elif isinstance(gv, values.Function):
+                pending.append(gv.attributes.personality)
+                for bb in gv.blocks:
+                    for instr in bb.instructions:
+                        pending.extend(instr._used_values())
+        for md in self.metadata:
+            if md not in scanned:
+                scanned.add(md)
+                pending.extend(md.operands)
+        found = collections.OrderedDict()
+        while pending:
+            value = pending.pop()
+            if isinstance(value, values.Function):
+                if value in deferred:
+                    found[value] = None
+            elif isinstance(value, values.FormattedConstant):
+                # Constant expressions, such as a bitcast function
+                if value._expr is not None:
+                    pending.extend(value._expr[1:])
+            elif isinstance(value, values.Constant):
+                if isinstance(value.constant, (list, tuple)):
+                    pending.extend(value.constant)
+            elif isinstance(value, values.MetaDataArgument):
+                pending.append(value.wrapped_value)
+            elif isinstance(value, tuple):
+                pending.extend(value)
+        return list(found)
+
+    def materialize_all(self):
+        """
+        Build the bodies of all the deferred functions of this module.
+        """
+        deferred = self._deferred_functions
+        while deferred:
+            for fn in list(deferred):
+                fn.materialize()
+
     def get_identified_types(self):
         return self.context.identified_types
 
@@ -209,7 +310,7 @@ class Module(object):
         lines = [it.get_declaration()
                  for it in self.get_identified_types().values()]
         # Global values (including function definitions)
-        lines += [str(v) for v in self.globals.values()]
+        lines += [str(v) for v in self._get_exported_globals()]
         return lines
 
     def _get_metadata_lines(self):
@@ -230,6 +331,110 @@ class Module(object):
         # For testing
         return "\n".join(self._get_metadata_lines())
 
+    def _iter_global_chunks(self, gv):
+        if isinstance(gv, values.Function):
+            # Functions are emitted a basic block at a time, so that
+            # the text of a large function never exists as a whole.
+            buf = []
+            gv.descr_prototype(buf)
+            yield "".join(buf)
+            if gv.blocks:
+                yield "{\n"
+                for blk in gv.blocks:
+                    buf = []
+                    blk.descr(buf)
+                    yield "".join(buf)
+                yield "}\n"
+        elif isinstance(gv, values.GlobalVariable):
+            # The initializer may be a large byte string, which is
+            # escaped a chunk at a time.
+            yield "{0} = ".format(gv.get_reference())
+            for chunk in gv._iter_descr_chunks():
+                yield chunk
+        else:
+            yield str(gv)
+
+    def iter_text_chunks(self):
+        """
+        Iterate over the textual IR of this module as a sequence of strings.
+        Concatenating all the chunks gives the same text as ``str(module)``,
+        but the whole text is never held in memory at once.
+        """
+        # Header
+        yield '; ModuleID = "%s"\n' % (self.name,)
+        yield 'target triple = "%s"\n' % (self.triple,)
+        yield 'target datalayout = "%s"\n' % (self.data_layout,)
+        # Body
+        for it in self.get_identified_types().values():
+            yield "\n"
+            yield it.get_declaration()
+        for gv in self._get_exported_globals():
+            yield "\n"
+            for chunk in self._iter_global_chunks(gv):
+                yield chunk
+        # Metadata
+        for k, v in self.namedmetadata.items():
+            yield "\n"
+            yield "!{name} = !{{ {operands} }}".format(
+                name=k, operands=', '.join(i.get_reference()
+                                           for i in v.operands))
+        for md in self.metadata:
+            yield "\n"
+            yield str(md)
+
+    def write_to(self, fp):
+        """
+        Write the textual IR of this module to the file-like object *fp*
+        (opened in text mode), one chunk at a time.  See iter_text_chunks().
+        """
+        write = fp.write
+        for chunk in self.iter_text_chunks():
+            write(chunk)
+
+    def as_bitcode(self):
+        """
+        Return the LLVM bitcode of this module as a bytes object, written
+        directly from the IR objects: neither LLVM nor the textual IR are
+        involved.  NotImplementedError is raised for the few constructs
+        the bitcode writer doesn't support (such as debug information).
+        """
+        from llvmlite.ir.bitcode import write_bitcode
+        return write_bitcode(self)
+
+    def verify(self):
+        """
+        Verify this module in pure Python, in a time linear in its size,
+        raising VerificationError on the first problem found: blocks not
+        terminated, phi nodes not matching the predecessors of their
+        block, ill-typed operands of the common instructions, or uses not
+        dominated by their definition.  LLVM's verifier checks much
+        more, but only after the module is formatted and parsed.
+        """
+        from llvmlite.ir.verifier import verify_module
+        verify_module(self)
+
+    def serialize(self):
+        """
+        Return a compact binary serialization of this module as a bytes
+        object, e.g. for caching it on disk.  Module.deserialize() loads
+        it back.  All the deferred functions are built first.
+        """
+        self.materialize_all()
+        from llvmlite.ir.serialization import serialize_module
+        return serialize_module(self)
+
+    @classmethod
+    def deserialize(cls, data, context=None):
+        """
+        Load a module from *data*, as returned by serialize(): a bytes
+        object or any object supporting the buffer protocol, such as a
+        memory map.  The identified types of the module are created in
+        *context* (the global context by default).  Only load data from
+        trusted sources.
+        """
+        from llvmlite.ir.serialization import deserialize_module
+        return deserialize_module(data, context)
+
     def __repr__(self):
         lines = []
         # Header
@@ -0,0 +1,498 @@
+"""
+A compact binary serialization of llvmlite.ir modules, for caching
+partially built IR between runs.
+
+The object graph of a module is flattened into tables:
+
+- an atom table of the Python scalars (strings, numbers, bytes...);
+- a type table, describing types structurally so that they are interned
+  again when loaded;
+- a table of the classes of the IR objects, and of their layouts (the
+  names of the attributes stored);
+- the records of the IR objects, i.e. their layout and the ids of their
+  attribute values (and of their items, for containers), as a single
+  array of integers.
+
+An id is the index of a value in one of the tables, tagged with the
+table in its two lowest bits.  The tables are stored with the marshal
+module, behind a header giving the format version.
+
+Loading creates the objects without calling their constructors, and
+restores their state as it was: in particular, the names are not
+registered again in the name scopes, which are restored as well.
+Caches (such as the text of the instructions) are not saved.
+"""
+
+import array
+import importlib
+import marshal
+import operator
+import struct
+import sys
+
+from llvmlite.ir import types, values
+from llvmlite.ir._utils import _gc_paused
+from llvmlite.ir.context import Context, global_context
+
+
+_MAGIC = b'LLIR'
+_HEADER = struct.Struct('<4sH')
+
+# The version of the format, to be bumped on incompatible changes
+FORMAT_VERSION = 1
+
+# The tags of the ids
+_ATOM = 0
+_TYPE = 1
+_OBJECT = 2
+_SPECIAL = 3
+
+# The kinds of objects
+_PLAIN = 0
+_TUPLE = 1
+_LIST = 2
+_BYTEARRAY = 3
+_SET = 4
+_DICT = 5
+
+_MISSING = object()
+
+_ATOM_CLASSES = frozenset([type(None), bool, int, float, str, bytes])
+
+# Attributes which are not saved (the uses of the values are recorded
+# again when loading), and attributes holding a cache which is reset
+_SKIPPED = frozenset(['__dict__', '__weakref__', '_uses', '_cached_str',
+                      '_cached_refstr'])
+_RESET = frozenset(['_key', '_hash', '_cached_descr', '_cached_body'])
+
+# Special ids: Undefined, the context the module is loaded in, and the
+# value of the unset slots
+_UNDEFINED_ID = 0 << 2 | _SPECIAL
+_CONTEXT_ID = 1 << 2 | _SPECIAL
+_MISSING_ID = 2 << 2 | _SPECIAL
+
+
+def _type_record(ty):
+    """
+    Return the record describing *ty* (other than an identified struct)
+    in the type table, with the types it refers to left as type objects.
+    """
+    cls = getattr(ty, '_interned_class', type(ty))
+    if cls is types.IntType:
+        return ('int', ty.width)
+    elif cls is types.PointerType:
+        return ('pointer', ty.pointee, ty.addrspace)
+    elif cls is types.FunctionType:
+        return ('function', ty.return_type, tuple(ty.args), ty.var_arg)
+    elif cls is types.ArrayType:
+        return ('array', ty.element, ty.count)
+    elif cls is types.VectorType:
+        return ('vector', ty.element, ty.count)
+    elif cls is types.LiteralStructType:
+        return ('struct', tuple(ty.elements), ty.packed)
+    else:
+        return (_SIMPLE_TYPE_NAMES[cls],)
+
+
+_SIMPLE_TYPES = {
+    'void': types.VoidType,
+    'label': types.LabelType,
+    'metadata': types.MetaDataType,
+    'half': types.HalfType,
+    'float': types.FloatType,
+    'double': types.DoubleType,
+}
+
+_SIMPLE_TYPE_NAMES = dict((cls, name) for name, cls in _SIMPLE_TYPES.items())
+
+_STRUCTURAL_TYPES = frozenset([types.IntType, types.PointerType,
+                               types.FunctionType, types.ArrayType,
+                               types.VectorType, types.LiteralStructType]
+                              + list(_SIMPLE_TYPE_NAMES))
+
+
+class _Serializer(object):
+
+    def __init__(self):
+        self.atoms = []
+        self.atom_ids = {}
+        self.types = []
+        self.type_ids = {}
+        self.type_records = {}
+        self.classes = []
+        self.class_ids = {}
+        self.class_info = {}
+        self.layouts = []
+        self.layout_ids = {}
+        self.records = []
+        # The ids of the values seen, by identity
+        self.memo = {id(_MISSING): _MISSING_ID}
+        self.objects = []
+        # The objects whose record is to be written
+        self.pending = []
+
+    def serialize(self, module):
+        root = self.ref(module)
+        # The identified types are all part of the module's text
+        for ty in module.get_identified_types().values():
+            self.type_id(ty)
+        ref = self.ref
+        write_object = self.write_object
+        pending = self.pending
+        while pending:
+            index, obj = pending.pop()
+            self.records[index] = write_object(obj, ref)
+
+        data = array.array('I')
+        size = max(len(self.atoms), len(self.types), len(self.records))
+        if data.itemsize < 4 or size >= 1 << 30:
+            data = array.array('Q')
+        for rec in self.records:
+            data.extend(rec)
+        payload = (tuple(self.atoms), tuple(self.types), tuple(self.classes),
+                   tuple(self.layouts), data.typecode, sys.byteorder,
+                   data.tobytes(), root)
+        return _HEADER.pack(_MAGIC, FORMAT_VERSION) + marshal.dumps(payload)
+
+    def ref(self, value):
+        """
+        Return the id of *value*.
+        """
+        i = self.memo.get(id(value))
+        if i is not None:
+            return i
+        # The values memoized by identity are kept alive, so that their
+        # identity isn't reused
+        self.objects.append(value)
+        cls = type(value)
+        if cls in _ATOM_CLASSES:
+            if cls is float:
+                # Keep -0.0 and the NaN payloads apart
+                key = (cls, struct.pack('<d', value))
+            else:
+                key = (cls, value)
+            i = self.atom_ids.get(key)
+            if i is None:
+                i = self.atom_ids[key] = len(self.atoms) << 2 | _ATOM
+                self.atoms.append(value)
+        elif (cls in _STRUCTURAL_TYPES or cls is types.IdentifiedStructType
+              or isinstance(value, types._ByNameType)):
+            i = self.type_id(value)
+        elif value is values.Undefined:
+            i = _UNDEFINED_ID
+        elif cls is Context:
+            i = _CONTEXT_ID
+        elif cls is tuple:
+            # Tuples are written after their items, so that they can be
+            # created from them when loading
+            memo_get = self.memo.get
+            items = [memo_get(id(v)) for v in value]
+            if None in items:
+                items = [self.ref(v) if i is None else i
+                         for v, i in zip(value, items)]
+            rec = [self.layout(cls, (), _TUPLE), len(value)]
+            rec += items
+            i = len(self.records) << 2 | _OBJECT
+            self.records.append(rec)
+        else:
+            index = len(self.records)
+            i = index << 2 | _OBJECT
+            self.records.append(None)
+            self.pending.append((index, value))
+        self.memo[id(value)] = i
+        return i
+
+    def type_id(self, ty):
+        """
+        Return the id of type *ty*, adding it to the type table.
+        """
+        try:
+            return self.type_ids[ty]
+        except KeyError:
+            pass
+        if type(ty) is types.IdentifiedStructType:
+            # Added before its elements, which may refer to it
+            index = len(self.types)
+            i = self.type_ids[ty] = index << 2 | _TYPE
+            self.types.append(None)
+            elems = ty.elements
+            if elems is not None:
+                elems = tuple([self.type_id(t) >> 2 for t in elems])
+            self.types[index] = ('identified', ty.name, ty.packed, elems)
+            return i
+        rec = tuple([self.type_id(x) >> 2 if isinstance(x, types.Type)
+                     else tuple([self.type_id(t) >> 2 for t in x])
+                     if isinstance(x, tuple) else x
+                     for x in _type_record(ty)])
+        try:
+            i = self.type_records[rec]
+        except KeyError:
+            i = self.type_records[rec] = len(self.types) << 2 | _TYPE
+            self.types.append(rec)
+        self.type_ids[ty] = i
+        return i
+
+    def layout(self, cls, names, kind):
+        key = (cls, names)
+        try:
+            return self.layout_ids[key]
+        except KeyError:
+            pass
+        try:
+            class_index = self.class_ids[cls]
+        except KeyError:
+            qualname = cls.__qualname__
+            if '<locals>' in qualname:
+                raise TypeError("cannot serialize instances of local class "
+                                "{0!r}".format(cls))
+            class_index = self.class_ids[cls] = len(self.classes)
+            self.classes.append((cls.__module__, qualname))
+        i = self.layout_ids[key] = len(self.layouts)
+        self.layouts.append((class_index, names, kind))
+        return i
+
+    def get_class_info(self, cls):
+        """
+        Return the kind of the instances of *cls*, the names of their
+        slots to save and a getter of their values, the names in their
+        layout, the ids of the values of their reset slots and their layout
+        (None if they have a __dict__).
+        """
+        if issubclass(cls, dict):
+            kind = _DICT
+        elif issubclass(cls, set):
+            kind = _SET
+        elif issubclass(cls, list):
+            kind = _LIST
+        elif cls is bytearray:
+            kind = _BYTEARRAY
+        elif cls.__module__ == 'builtins' or issubclass(cls, (tuple,
+                                                              frozenset)):
+            raise TypeError("cannot serialize {0!r} object".format(
+                cls.__name__))
+        else:
+            kind = _PLAIN
+        slots = []
+        for klass in reversed(cls.__mro__):
+            names = klass.__dict__.get('__slots__', ())
+            if isinstance(names, str):
+                names = (names,)
+            slots += [name for name in names
+                      if name not in _SKIPPED and name not in slots]
+        reset = tuple([name for name in slots if name in _RESET])
+        slots = tuple([name for name in slots if name not in _RESET])
+        # The reset slots come first in the layout of the instances
+        reset_ids = [self.ref(None)] * len(reset)
+        names = reset + slots
+        if cls.__dictoffset__ != 0:
+            # The layout also depends on the instance's __dict__
+            layout = None
+        else:
+            layout = self.layout(cls, names, kind)
+        if len(slots) > 1:
+            getter = operator.attrgetter(*slots)
+        else:
+            def getter(obj):
+                return tuple([getattr(obj, name) for name in slots])
+        info = self.class_info[cls] = (kind, slots, getter, names,
+                                       reset_ids, layout)
+        return info
+
+    def write_object(self, obj, ref):
+        """
+        Return the record of *obj*.
+        """
+        cls = type(obj)
+        try:
+            info = self.class_info[cls]
+        except KeyError:
+            info = self.get_class_info(cls)
+        kind, slots, getter, names, reset_ids, layout = info
+        memo_get = self.memo.get
+        try:
+            vals = getter(obj)
+        except AttributeError:
+            # Some slots are unset
+            vals = [getattr(obj, name, _MISSING) for name in slots]
+        ids = [memo_get(id(v)) for v in vals]
+        if None in ids:
+            ids = [ref(v) if i is None else i for v, i in zip(vals, ids)]
+        if layout is None:
+            names = list(names)
+            for name, value in obj.__dict__.items():
+                if name in _SKIPPED:
+                    continue
+                names.append(name)
+                ids.append(ref(None if name in _RESET else value))
+            layout = self.layout(cls, tuple(names), kind)
+        rec = [layout]
+        rec += reset_ids
+        rec += ids
+        if kind == _DICT:
+            rec.append(len(obj))
+            for k, v in obj.items():
+                rec.append(ref(k))
+                rec.append(ref(v))
+        elif kind == _BYTEARRAY:
+            rec += [1, ref(bytes(obj))]
+        elif kind != _PLAIN:
+            rec.append(len(obj))
+            items = [memo_get(id(v)) for v in obj]
+            if None in items:
+                items = [ref(v) if i is None else i
+                         for v, i in zip(obj, items)]
+            rec += items
+        return rec
+
+
+def _find_class(module, qualname):
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _load_types(records, context):
+    tys = [None] * len(records)
+    # Identified structs first, since they may be referred to before their
+    # record
+    for i, rec in enumerate(records):
+        if rec[0] == 'identified':
+            tys[i] = context.get_identified_type(rec[1])
+    for i, rec in enumerate(records):
+        kind = rec[0]
+        if kind == 'int':
+            tys[i] = types.IntType(rec[1])
+        elif kind == 'pointer':
+            tys[i] = types.PointerType(tys[rec[1]], rec[2])
+        elif kind == 'function':
+            tys[i] = types.FunctionType(tys[rec[1]], [tys[t] for t in rec[2]],
+                                        rec[3])
+        elif kind == 'array':
+            tys[i] = types.ArrayType(tys[rec[1]], rec[2])
+        elif kind == 'vector':
+            tys[i] = types.VectorType(tys[rec[1]], rec[2])
+        elif kind == 'struct':
+            tys[i] = types.LiteralStructType([tys[t] for t in rec[1]],
+                                             rec[2])
+        elif kind != 'identified':
+            tys[i] = _SIMPLE_TYPES[kind]()
+    for i, rec in enumerate(records):
+        if rec[0] != 'identified' or rec[3] is None:
+            continue
+        ty = tys[i]
+        elems = tuple([tys[t] for t in rec[3]])
+        if ty.is_opaque:
+            ty.set_body(*elems)
+            ty.packed = rec[2]
+        elif ty.elements != elems or ty.packed != rec[2]:
+            raise ValueError("identified type {0!r} is already defined "
+                             "differently in the context".format(ty.name))
+    return tys
+
+
+def deserialize_module(data, context=None):
+    """
+    Load a module serialized by serialize_module() from *data*, a bytes
+    object or any object supporting the buffer protocol (such as a memory
+    map).  Its identified types are created in *context*, the global
+    context by default.
+    """
+    if context is None:
+        context = global_context
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise ValueError("not a serialized llvmlite.ir module")
+    magic, version = _HEADER.unpack_from(view)
+    if magic != _MAGIC:
+        raise ValueError("not a serialized llvmlite.ir module")
+    if version != FORMAT_VERSION:
+        raise ValueError("unsupported serialization format version {0} "
+                         "(expected {1})".format(version, FORMAT_VERSION))
+    try:
+        (atoms, type_records, classes, layouts, typecode, byteorder, data,
+         root) = marshal.loads(view[_HEADER.size:])
+    except (EOFError, TypeError, ValueError):
+        raise ValueError("corrupted serialized llvmlite.ir module")
+
+    with _gc_paused():
+        return _load(atoms, type_records, classes, layouts, typecode,
+                     byteorder, data, root, context)
+
+
+def _load(atoms, type_records, classes, layouts, typecode, byteorder, data,
+          root, context):
+    tys = _load_types(type_records, context)
+    classes = [_find_class(*cls) for cls in classes]
+    layouts = [(classes[c], names, kind) for c, names, kind in layouts]
+    ids = array.array(typecode)
+    ids.frombytes(data)
+    if byteorder != sys.byteorder:
+        ids.byteswap()
+    ids = ids.tolist()
+
+    # Create all the objects, then the tuples (whose items precede them),
+    # then fill in the attributes of the objects, and last the items of
+    # the containers, since adding an object to a set or dict may hash it.
+    objs = []
+    tables = (atoms, tys, objs, (values.Undefined, context))
+    tuples = []
+    plain = []
+    containers = []
+    pos = 0
+    end = len(ids)
+    while pos < end:
+        cls, names, kind = layouts[ids[pos]]
+        pos += 1
+        start = pos
+        pos += len(names)
+        if kind == _TUPLE:
+            count = ids[pos]
+            tuples.append((len(objs), pos + 1, pos + 1 + count))
+            pos += 1 + count
+            objs.append(None)
+            continue
+        obj = cls.__new__(cls)
+        objs.append(obj)
+        if names:
+            plain.append((obj, names, start))
+        if kind != _PLAIN:
+            count = ids[pos]
+            if kind == _DICT:
+                count *= 2
+            containers.append((obj, kind, pos + 1, pos + 1 + count))
+            pos += 1 + count
+
+    for index, start, stop in tuples:
+        objs[index] = tuple([tables[i & 3][i >> 2] for i in ids[start:stop]])
+    for obj, names, start in plain:
+        for name, i in zip(names, ids[start:start + len(names)]):
+            if i != _MISSING_ID:
+                setattr(obj, name, tables[i & 3][i >> 2])
+    containers.sort(key=lambda c: c[1] >= _SET)
+    for obj, kind, start, stop in containers:
+        items = [tables[i & 3][i >> 2] for i in ids[start:stop]]
+        if kind == _LIST:
+            list.extend(obj, items)
+        elif kind == _BYTEARRAY:
+            obj.extend(items[0])
+        elif kind == _SET:
+            set.update(obj, items)
+        else:
+            for k, v in zip(items[::2], items[1::2]):
+                obj[k] = v
+    root = tables[root & 3][root >> 2]
+    if root._track_uses:
+        root._track_uses = False
+        root.track_uses = True
+    return root
+
+
+def serialize_module(module):
+    """
+    Serialize *module* to a bytes object, from which deserialize_module()
+    can create it again.  TypeError is raised if some object referred to
+    by the module can't be serialized.
+    """
+    with _gc_paused():
+        return _Serializer().serialize(module)
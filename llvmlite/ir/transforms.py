@@ -1,4 +1,5 @@
-from llvmlite.ir import CallInstr
+from llvmlite.ir import CallInstr, instructions, values
+from llvmlite.ir.verifier import _successors
 
 
 class Visitor(object):
@@ -62,3 +63,169 @@ def replace_all_calls(mod, orig, repl):
     rc = ReplaceCalls(orig, repl)
     rc.visit(mod)
     return rc.calls
+
+
+# The instructions without side effects, which can be removed when their
+# result is unused (besides the arithmetic instructions below).
+# Loads are included: llvmlite can't emit volatile loads, and LLVM deletes
+# unused non-volatile loads as well.  Atomic loads are a separate class
+# (LoadAtomicInstr), which isn't listed as they order memory accesses.
+_PURE_INSTRUCTIONS = (
+    instructions.CastInstr, instructions.CompareInstr,
+    instructions.SelectInstr, instructions.GEPInstr, instructions.PhiInstr,
+    instructions.ExtractElement, instructions.InsertElement,
+    instructions.ShuffleVector, instructions.ExtractValue,
+    instructions.InsertValue, instructions.AllocaInstr,
+    instructions.LoadInstr,
+)
+
+# The opnames of the plain Instruction objects without side effects: other
+# opnames may be custom instructions built by the user
+_PURE_OPNAMES = instructions._BINARY_OPNAMES | frozenset(['fneg'])
+
+
+def _is_pure(instr):
+    if type(instr) is instructions.Instruction:
+        return instr.opname in _PURE_OPNAMES
+    return isinstance(instr, _PURE_INSTRUCTIONS)
+
+
+def _address_taken_blocks(module):
+    """
+    Return the set of the blocks whose address is used by a blockaddress
+    constant, in an instruction or a global variable's initializer.
+    """
+    blocks = set()
+    pending = []
+    for func in module.functions:
+        for bb in func.blocks:
+            for instr in bb.instructions:
+                pending.extend(instr._used_values())
+    for gv in module.global_values:
+        if isinstance(gv, values.GlobalVariable):
+            pending.append(gv.initializer)
+    while pending:
+        value = pending.pop()
+        if isinstance(value, values.BlockAddress):
+            blocks.add(value.basic_block)
+        elif (isinstance(value, values.Constant)
+              and isinstance(value.constant, (list, tuple))):
+            pending.extend(value.constant)
+    return blocks
+
+
+class DeadCodeElimination(Visitor):
+    """
+    Remove the blocks unreachable from the entry block of their function,
+    then the instructions without side effects whose result is unused,
+    as well as the instructions only used by those.  This runs in linear
+    time.
+
+    Blocks whose address is taken are kept.  Functions whose body is
+    deferred are left alone.
+    """
+
+    def __init__(self):
+        super(DeadCodeElimination, self).__init__()
+        self.removed_blocks = []
+        self.removed_instructions = []
+
+    def visit(self, module):
+        self._address_taken = _address_taken_blocks(module)
+        self._track_uses = module.track_uses
+        super(DeadCodeElimination, self).visit(module)
+
+    def visit_Function(self, func):
+        if not func.blocks:
+            return
+        self._prune_blocks(func)
+        # Count the uses of the instructions of the remaining blocks
+        self._uses = {}
+        self._candidates = []
+        super(DeadCodeElimination, self).visit_Function(func)
+        self._remove_dead_instructions(func)
+
+    def visit_Instruction(self, instr):
+        uses = self._uses
+        for op in instr._used_values():
+            if isinstance(op, values.MetaDataArgument):
+                op = op.wrapped_value
+            if isinstance(op, instructions.Instruction):
+                uses[op] = uses.get(op, 0) + 1
+        if _is_pure(instr):
+            self._candidates.append(instr)
+
+    def _prune_blocks(self, func):
+        blocks = func.blocks
+        reachable = set([blocks[0]])
+        reachable.update(bb for bb in self._address_taken
+                         if bb.parent is func)
+        pending = list(reachable)
+        while pending:
+            bb = pending.pop()
+            if not bb.instructions:
+                continue
+            for succ in _successors(bb.instructions[-1]):
+                if succ not in reachable:
+                    reachable.add(succ)
+                    pending.append(succ)
+        if len(reachable) == len(blocks):
+            return
+        removed = [bb for bb in blocks if bb not in reachable]
+        blocks[:] = [bb for bb in blocks if bb in reachable]
+        self.removed_blocks.extend(removed)
+        if self._track_uses:
+            for bb in removed:
+                for instr in bb.instructions:
+                    instr._drop_uses()
+        # Forget the incoming values of the phi nodes from removed blocks
+        removed = set(removed)
+        for bb in blocks:
+            for instr in bb.instructions:
+                if not isinstance(instr, instructions.PhiInstr):
+                    break
+                incomings = [(val, blk) for val, blk in instr.incomings
+                             if blk not in removed]
+                if len(incomings) != len(instr.incomings):
+                    if self._track_uses:
+                        instr._drop_uses()
+                    instr.incomings = incomings
+                    if self._track_uses:
+                        instr._record_uses()
+                    instr._clear_string_cache()
+
+    def _remove_dead_instructions(self, func):
+        uses = self._uses
+        pending = [instr for instr in self._candidates if instr not in uses]
+        dead = set()
+        while pending:
+            instr = pending.pop()
+            if instr in dead:
+                continue
+            dead.add(instr)
+            self.removed_instructions.append(instr)
+            for op in instr._used_values():
+                if isinstance(op, instructions.Instruction):
+                    count = uses[op] - 1
+                    uses[op] = count
+                    if count == 0 and _is_pure(op):
+                        pending.append(op)
+            if self._track_uses:
+                instr._drop_uses()
+        if not dead:
+            return
+        for bb in func.blocks:
+            instrs = bb.instructions
+            kept = [instr for instr in instrs if instr not in dead]
+            if len(kept) != len(instrs):
+                instrs[:] = kept
+
+
+def eliminate_dead_code(mod):
+    """Remove the unreachable blocks and the unused instructions without
+    side effects of the functions of module `mod`.
+    Returns the lists of the removed blocks and instructions.
+    """
+    dce = DeadCodeElimination()
+    dce.visit(mod)
+    return dce.removed_blocks, dce.removed_instructions
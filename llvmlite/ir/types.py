@@ -2,7 +2,10 @@
 Classes that are LLVM types
 """
 
+import operator
 import struct
+import threading
+import weakref
 
 from llvmlite.ir._utils import _StrCaching
 
@@ -27,9 +30,6 @@ class Type(_StrCaching):
     def as_pointer(self, addrspace=0):
         return PointerType(self, addrspace)
 
-    def __ne__(self, other):
-        return not (self == other)
-
     def _get_ll_pointer_type(self, target_data, context=None):
         """
         Convert this type object to an LLVM type.
@@ -82,19 +82,140 @@ class Type(_StrCaching):
         return Constant(self, value)
 
 
-class MetaDataType(Type):
+# The interned types, keyed by their class and constructor arguments.
+# Like LLVM's, types are kept alive forever, except those built over
+# identified struct types, which die with their struct (and its context).
+_type_cache = {}
+_struct_type_cache = weakref.WeakValueDictionary()
+_type_cache_lock = threading.Lock()
 
-    def _to_string(self):
-        return "metadata"
 
-    def as_pointer(self):
-        raise TypeError
+def _cache_key(arg):
+    """
+    Return the key of the constructor argument *arg* in the type cache.
+    Identified struct types are compared by name, but types built over
+    different identified structs of the same name (e.g. from different
+    contexts) must be distinct, so they and the types built over them are
+    keyed by identity.  Their id can't be reused while the type is in the
+    cache, as the type keeps them alive.
+    """
+    if isinstance(arg, (IdentifiedStructType, _ByNameType)):
+        return (IdentifiedStructType, id(arg))
+    elif type(arg) is tuple:
+        # Most tuples don't need a new key
+        for item in arg:
+            if isinstance(item, (IdentifiedStructType, _ByNameType)) or (
+                    type(item) is tuple and _cache_key(item) is not item):
+                return tuple([_cache_key(a) for a in arg])
+    return arg
+
+
+class _InternedType(Type):
+    """
+    The base class for types whose instances are interned ("hash-consed"):
+    equal types are the same object, so that they are compared and hashed
+    by identity.  Subclasses implement __new__ by calling _intern() with
+    the normalized constructor arguments, and _init() to initialize new
+    instances from them.
+
+    Types built over identified struct types are interned per struct
+    object, but are compared structurally, like identified struct types
+    (see _ByNameType).
+    """
+
+    @classmethod
+    def _intern(cls, *args):
+        keyargs = _cache_key(args)
+        key = (cls,) + keyargs
+        cache = _type_cache if keyargs is args else _struct_type_cache
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        with _type_cache_lock:
+            # Another thread may have created the type meanwhile
+            self = cache.get(key)
+            if self is None:
+                if keyargs is args:
+                    self = super(_InternedType, cls).__new__(cls)
+                else:
+                    self = super(_InternedType, cls).__new__(
+                        _ByNameType._subclass(cls))
+                    self._intern_args = args
+                    self._hash = hash((cls,) + args)
+                self._init(*args)
+                cache[key] = self
+            return self
+
+    def _init(self):
+        pass
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _interned_field(name, doc=None):
+    """
+    Return a read-only property for the field *name* of an interned type,
+    stored in the '_' + *name* attribute.  As equal types are the same
+    object, setting a field would change all of them.
+    """
+    def fset(self, value):
+        cls = getattr(self, '_interned_class', type(self))
+        raise AttributeError("types are immutable, create a new %s instead "
+                             "of setting %r" % (cls.__name__, name))
+
+    return property(operator.attrgetter('_' + name), fset, doc=doc)
+
+
+class _ByNameType(object):
+    """
+    A mixin for the interned types built over identified struct types.
+    As identified struct types are compared by name, such types are equal
+    to the types built the same way over identified struct types of the
+    same name, e.g. after unpickling.  The other interned types don't
+    need these slower comparisons.
+    """
+
+    _subclasses = {}
+
+    @classmethod
+    def _subclass(cls, base):
+        try:
+            return cls._subclasses[base]
+        except KeyError:
+            sub = cls._subclasses[base] = type(
+                base.__name__, (cls, base),
+                {'__module__': base.__module__, '_interned_class': base})
+            return sub
 
     def __eq__(self, other):
-        return isinstance(other, MetaDataType)
+        return self is other or (type(other) is type(self)
+                                 and self._intern_args == other._intern_args)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(MetaDataType)
+        return self._hash
+
+    def __reduce__(self):
+        return self._interned_class, self.__getnewargs__()
+
+
+class MetaDataType(_InternedType):
+
+    def __new__(cls):
+        return cls._intern()
+
+    def _to_string(self):
+        return "metadata"
+
+    def as_pointer(self):
+        raise TypeError
 
 
 class LabelType(Type):
@@ -106,17 +227,26 @@ class LabelType(Type):
         return "label"
 
 
-class PointerType(Type):
+class PointerType(_InternedType):
     """
     The type of all pointer values.
     """
     is_pointer = True
     null = 'null'
 
-    def __init__(self, pointee, addrspace=0):
+    def __new__(cls, pointee, addrspace=0):
         assert not isinstance(pointee, VoidType)
-        self.pointee = pointee
-        self.addrspace = addrspace
+        return cls._intern(pointee, addrspace)
+
+    pointee = _interned_field('pointee')
+    addrspace = _interned_field('addrspace')
+
+    def _init(self, pointee, addrspace):
+        self._pointee = pointee
+        self._addrspace = addrspace
+
+    def __getnewargs__(self):
+        return self.pointee, self.addrspace
 
     def _to_string(self):
         if self.addrspace != 0:
@@ -124,16 +254,6 @@ class PointerType(Type):
         else:
             return "{0}*".format(self.pointee)
 
-    def __eq__(self, other):
-        if isinstance(other, PointerType):
-            return (self.pointee, self.addrspace) == (other.pointee,
-                                                      other.addrspace)
-        else:
-            return False
-
-    def __hash__(self):
-        return hash(PointerType)
-
     def gep(self, i):
         """
         Resolve the type of the i-th element (for getelementptr lookups).
@@ -147,30 +267,37 @@ class PointerType(Type):
         return 'p%d%s' % (self.addrspace, self.pointee.intrinsic_name)
 
 
-class VoidType(Type):
+class VoidType(_InternedType):
     """
     The type for empty values (e.g. a function returning no value).
     """
 
+    def __new__(cls):
+        return cls._intern()
+
     def _to_string(self):
         return 'void'
 
-    def __eq__(self, other):
-        return isinstance(other, VoidType)
-
-    def __hash__(self):
-        return hash(VoidType)
 
-
-class FunctionType(Type):
+class FunctionType(_InternedType):
     """
     The type for functions.
     """
 
-    def __init__(self, return_type, args, var_arg=False):
-        self.return_type = return_type
-        self.args = tuple(args)
-        self.var_arg = var_arg
+    def __new__(cls, return_type, args, var_arg=False):
+        return cls._intern(return_type, tuple(args), bool(var_arg))
+
+    return_type = _interned_field('return_type')
+    args = _interned_field('args')
+    var_arg = _interned_field('var_arg')
+
+    def _init(self, return_type, args, var_arg):
+        self._return_type = return_type
+        self._args = args
+        self._var_arg = var_arg
+
+    def __getnewargs__(self):
+        return self.return_type, self.args, self.var_arg
 
     def _to_string(self):
         if self.args:
@@ -184,18 +311,8 @@ class FunctionType(Type):
         else:
             return '{0} ()'.format(self.return_type)
 
-    def __eq__(self, other):
-        if isinstance(other, FunctionType):
-            return (self.return_type == other.return_type and
-                    self.args == other.args and self.var_arg == other.var_arg)
-        else:
-            return False
 
-    def __hash__(self):
-        return hash(FunctionType)
-
-
-class IntType(Type):
+class IntType(_InternedType):
     """
     The type for integers.
     """
@@ -203,40 +320,26 @@ class IntType(Type):
     _instance_cache = {}
 
     def __new__(cls, bits):
-        # Cache all common integer types
-        if 0 <= bits <= 128:
-            try:
-                return cls._instance_cache[bits]
-            except KeyError:
-                inst = cls._instance_cache[bits] = cls.__new(bits)
-                return inst
-        return cls.__new(bits)
-
-    @classmethod
-    def __new(cls, bits):
+        # Fast path for the most common types
+        try:
+            return cls._instance_cache[bits]
+        except KeyError:
+            pass
         assert isinstance(bits, int) and bits >= 0
-        self = super(IntType, cls).__new__(cls)
-        self.width = bits
-        return self
+        inst = cls._instance_cache[bits] = cls._intern(bits)
+        return inst
+
+    width = _interned_field('width')
+
+    def _init(self, bits):
+        self._width = bits
 
     def __getnewargs__(self):
         return self.width,
 
-    def __copy__(self):
-        return self
-
     def _to_string(self):
         return 'i%u' % (self.width,)
 
-    def __eq__(self, other):
-        if isinstance(other, IntType):
-            return self.width == other.width
-        else:
-            return False
-
-    def __hash__(self):
-        return hash(IntType)
-
     def format_constant(self, val):
         if isinstance(val, bool):
             return str(val).lower()
@@ -291,11 +394,11 @@ class _BaseFloatType(Type):
     def __new__(cls):
         return cls._instance_cache
 
-    def __eq__(self, other):
-        return isinstance(other, type(self))
+    def __copy__(self):
+        return self
 
-    def __hash__(self):
-        return hash(type(self))
+    def __deepcopy__(self, memo):
+        return self
 
     @classmethod
     def _create_instance(cls):
@@ -363,14 +466,23 @@ class _Repeat(object):
             raise IndexError(item)
 
 
-class VectorType(Type):
+class VectorType(_InternedType):
     """
     The type for vectors of primitive data items (e.g. "<f32 x 4>").
     """
 
-    def __init__(self, element, count):
-        self.element = element
-        self.count = count
+    def __new__(cls, element, count):
+        return cls._intern(element, count)
+
+    element = _interned_field('element')
+    count = _interned_field('count')
+
+    def _init(self, element, count):
+        self._element = element
+        self._count = count
+
+    def __getnewargs__(self):
+        return self.element, self.count
 
     @property
     def elements(self):
@@ -382,17 +494,6 @@ class VectorType(Type):
     def _to_string(self):
         return "<%d x %s>" % (self.count, self.element)
 
-    def __eq__(self, other):
-        if isinstance(other, VectorType):
-            return self.element == other.element and self.count == other.count
-
-    def __hash__(self):
-        # TODO: why does this not take self.element/self.count into account?
-        return hash(VectorType)
-
-    def __copy__(self):
-        return self
-
     def format_constant(self, value):
         itemstring = ", " .join(["{0} {1}".format(x.type, x.get_reference())
                                  for x in value])
@@ -432,14 +533,23 @@ class Aggregate(Type):
                 for ty, val in zip(self.elements, values)]
 
 
-class ArrayType(Aggregate):
+class ArrayType(Aggregate, _InternedType):
     """
     The type for fixed-size homogenous arrays (e.g. "[f32 x 3]").
     """
 
-    def __init__(self, element, count):
-        self.element = element
-        self.count = count
+    def __new__(cls, element, count):
+        return cls._intern(element, count)
+
+    element = _interned_field('element')
+    count = _interned_field('count')
+
+    def _init(self, element, count):
+        self._element = element
+        self._count = count
+
+    def __getnewargs__(self):
+        return self.element, self.count
 
     @property
     def elements(self):
@@ -451,13 +561,6 @@ class ArrayType(Aggregate):
     def _to_string(self):
         return "[%d x %s]" % (self.count, self.element)
 
-    def __eq__(self, other):
-        if isinstance(other, ArrayType):
-            return self.element == other.element and self.count == other.count
-
-    def __hash__(self):
-        return hash(ArrayType)
-
     def gep(self, i):
         """
         Resolve the type of the i-th element (for getelementptr lookups).
@@ -536,7 +639,7 @@ class BaseStructType(Aggregate):
             return textrepr
 
 
-class LiteralStructType(BaseStructType):
+class LiteralStructType(BaseStructType, _InternedType):
     """
     The type of "literal" structs, i.e. structs with a literally-defined
     type (by contrast with IdentifiedStructType).
@@ -544,23 +647,28 @@ class LiteralStructType(BaseStructType):
 
     null = 'zeroinitializer'
 
-    def __init__(self, elems, packed=False):
+    def __new__(cls, elems, packed=False):
         """
         *elems* is a sequence of types to be used as members.
         *packed* controls the use of packed layout.
         """
-        self.elements = tuple(elems)
-        self.packed = packed
+        return cls._intern(tuple(elems), bool(packed))
 
-    def _to_string(self):
-        return self.structure_repr()
+    elements = _interned_field('elements')
+    packed = _interned_field('packed', """
+        A boolean attribute that indicates whether the structure uses
+        packed layout.  Read-only, since literal struct types are interned.
+        """)
 
-    def __eq__(self, other):
-        if isinstance(other, LiteralStructType):
-            return self.elements == other.elements
+    def _init(self, elems, packed):
+        self._elements = elems
+        self._packed = packed
 
-    def __hash__(self):
-        return hash(LiteralStructType)
+    def __getnewargs__(self):
+        return self.elements, self._packed
+
+    def _to_string(self):
+        return self.structure_repr()
 
 
 class IdentifiedStructType(BaseStructType):
@@ -602,9 +710,10 @@ class IdentifiedStructType(BaseStructType):
     def __eq__(self, other):
         if isinstance(other, IdentifiedStructType):
             return self.name == other.name
+        return False
 
     def __hash__(self):
-        return hash(IdentifiedStructType)
+        return hash(self.name)
 
     def set_body(self, *elems):
         if not self.is_opaque:
@@ -3,8 +3,12 @@ Classes that are LLVM values: Value, Constant...
 Instructions are in the instructions module.
 """
 
+import math
 import string
 import re
+import struct
+import sys
+from array import array
 
 from llvmlite.ir import types, _utils
 from llvmlite.ir._utils import (_StrCaching, _StringReferenceCaching,
@@ -18,7 +22,29 @@ _VALID_CHARS = (frozenset(map(ord, string.ascii_letters)) |
 _SIMPLE_IDENTIFIER_RE = re.compile(r"[-a-zA-Z$._][-a-zA-Z$._0-9]*$")
 
 
-def _escape_string(text, _map={}):
+def _make_escape_tables():
+    # Each byte is escaped to three characters: itself followed by two
+    # NUL padding bytes if it is a valid character, otherwise a backslash
+    # and two hex digits.  Each table gives one of those characters.
+    tables = bytearray(256), bytearray(256), bytearray(256)
+    for ch in range(256):
+        if ch in _VALID_CHARS:
+            tables[0][ch] = ch
+        else:
+            tables[0][ch] = ord('\\')
+            tables[1][ch], tables[2][ch] = b'%02x' % ch
+    return tuple(bytes(t) for t in tables)
+
+
+_ESCAPE_TABLES = _make_escape_tables()
+
+_VALID_BYTES = bytes(sorted(_VALID_CHARS))
+
+# The size of the chunks of byte strings escaped by _iter_escaped_chunks()
+_ESCAPE_CHUNK_SIZE = 1 << 16
+
+
+def _escape_string(text):
     """
     Escape the given bytestring for safe use as a LLVM array constant.
     """
@@ -26,15 +52,25 @@ def _escape_string(text, _map={}):
         text = text.encode('ascii')
     assert isinstance(text, (bytes, bytearray))
 
-    if not _map:
-        for ch in range(256):
-            if ch in _VALID_CHARS:
-                _map[ch] = chr(ch)
-            else:
-                _map[ch] = '\\%02x' % ch
+    if not text.translate(None, _VALID_BYTES):
+        # Nothing to escape
+        return text.decode('ascii')
+    first, second, third = _ESCAPE_TABLES
+    buf = bytearray(3 * len(text))
+    buf[0::3] = text.translate(first)
+    buf[1::3] = text.translate(second)
+    buf[2::3] = text.translate(third)
+    return buf.translate(None, b'\0').decode('ascii')
+
 
-    buf = [_map[ch] for ch in text]
-    return ''.join(buf)
+def _iter_escaped_chunks(text, chunk_size=_ESCAPE_CHUNK_SIZE):
+    """
+    Escape the given bytestring like _escape_string(), as a sequence of
+    strings escaping at most *chunk_size* bytes each.
+    """
+    view = memoryview(text)
+    for start in range(0, len(view), chunk_size):
+        yield _escape_string(view[start:start + chunk_size].tobytes())
 
 
 class _ConstOpMixin(object):
@@ -42,6 +78,8 @@ class _ConstOpMixin(object):
     A mixin defining constant operations, for use in constant-like classes.
     """
 
+    __slots__ = ()
+
     def bitcast(self, typ):
         """
         Bitcast this pointer constant to the given type.
@@ -50,7 +88,7 @@ class _ConstOpMixin(object):
             return self
         op = "bitcast ({0} {1} to {2})".format(self.type, self.get_reference(),
                                                typ)
-        return FormattedConstant(typ, op)
+        return FormattedConstant(typ, op, ('bitcast', self))
 
     def inttoptr(self, typ):
         """
@@ -66,7 +104,7 @@ class _ConstOpMixin(object):
         op = "inttoptr ({0} {1} to {2})".format(self.type,
                                                 self.get_reference(),
                                                 typ)
-        return FormattedConstant(typ, op)
+        return FormattedConstant(typ, op, ('inttoptr', self))
 
     def gep(self, indices):
         """
@@ -86,7 +124,8 @@ class _ConstOpMixin(object):
         op = "getelementptr ({0}, {1} {2}, {3})".format(
             self.type.pointee, self.type,
             self.get_reference(), ', '.join(strindices))
-        return FormattedConstant(outtype.as_pointer(self.addrspace), op)
+        return FormattedConstant(outtype.as_pointer(self.addrspace), op,
+                                 ('getelementptr', self, tuple(indices)))
 
 
 class Value(object):
@@ -94,9 +133,50 @@ class Value(object):
     The base class for all values.
     """
 
+    __slots__ = ('__weakref__', '_uses')
+
     def __repr__(self):
         return "<ir.%s type='%s' ...>" % (self.__class__.__name__, self.type,)
 
+    @property
+    def uses(self):
+        """
+        The instructions using this value as an operand.  Only the uses
+        in modules with use tracking enabled (see Module.track_uses)
+        are known.
+        """
+        try:
+            return list(self._uses)
+        except AttributeError:
+            return []
+
+    def _add_use(self, user):
+        try:
+            uses = self._uses
+        except AttributeError:
+            uses = self._uses = {}
+        # The number of operands of *user* referring to this value
+        uses[user] = uses.get(user, 0) + 1
+
+    def _remove_use(self, user):
+        uses = self._uses
+        count = uses[user] - 1
+        if count:
+            uses[user] = count
+        else:
+            del uses[user]
+
+    def replace_all_uses_with(self, new):
+        """
+        Replace this value with *new* in all the instructions using it.
+        This takes a time proportional to the number of uses, but relies
+        on use tracking (see Module.track_uses).
+        """
+        if new is self:
+            return
+        for user in self.uses:
+            user.replace_usage(self, new)
+
 
 class _Undefined(object):
     """
@@ -112,17 +192,156 @@ class _Undefined(object):
 Undefined = _Undefined()
 
 
+# Struct format codes of the integer types, by size in bytes
+_INT_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+# Buffer format codes accepted by Constant.from_ndarray()
+_FLOAT_FORMATS = {'e': types.HalfType, 'f': types.FloatType,
+                  'd': types.DoubleType}
+_SIGNED_FORMATS = 'bhilqn'
+_UNSIGNED_FORMATS = 'BHILQN?'
+
+
+class DataArray(object):
+    """
+    The raw data of a constant array of integers or floating-point
+    numbers: *data* is a bytes object holding the elements of type
+    *element* in the native byte order and C order, and *shape* the tuple
+    of the array dimensions (one dimension by default).
+
+    Data arrays are formatted and lowered without creating a Python
+    object per element.
+    """
+
+    __slots__ = ('data', 'element', 'shape')
+
+    def __init__(self, data, element, shape=None):
+        itemsize = self._itemsize(element)
+        data = bytes(data)
+        if shape is None:
+            shape = (len(data) // itemsize,)
+        shape = tuple(shape)
+        count = itemsize
+        for dim in shape:
+            count *= dim
+        if not shape or count != len(data):
+            raise ValueError("data size doesn't match the shape %r"
+                             % (shape,))
+        self.data = data
+        self.element = element
+        self.shape = shape
+
+    @staticmethod
+    def _itemsize(element):
+        if isinstance(element, types.IntType) and element.width % 8 == 0:
+            return element.width // 8
+        elif isinstance(element, types.HalfType):
+            return 2
+        elif isinstance(element, types.FloatType):
+            return 4
+        elif isinstance(element, types.DoubleType):
+            return 8
+        raise TypeError("unsupported data array element type %s"
+                        % (element,))
+
+    @property
+    def type(self):
+        """
+        The (possibly nested) array type of the data.
+        """
+        ty = self.element
+        for dim in reversed(self.shape):
+            ty = types.ArrayType(ty, dim)
+        return ty
+
+    def __eq__(self, other):
+        if isinstance(other, DataArray):
+            return (self.element == other.element and
+                    self.shape == other.shape and self.data == other.data)
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.element, self.shape, self.data))
+
+    def _format_elements(self, data):
+        """
+        Format the elements of *data* (a slice of the raw data), as
+        "<type> <value>" strings.
+        """
+        element = self.element
+        view = memoryview(data)
+        if isinstance(element, types.IntType):
+            size = element.width // 8
+            if size in _INT_FORMATS:
+                values = view.cast(_INT_FORMATS[size])
+            else:
+                # Odd sizes (e.g. i24): decode the integers one by one
+                order = sys.byteorder
+                values = [int.from_bytes(data[i:i + size], order, signed=True)
+                          for i in range(0, len(data), size)]
+            fmt = "{0} %d".format(element)
+            return [fmt % v for v in values]
+        # Floating-point constants are written as the hex representation
+        # of the equivalent double
+        if isinstance(element, types.HalfType):
+            doubles = array('d', [v for v, in struct.iter_unpack('e', data)])
+        elif isinstance(element, types.FloatType):
+            doubles = array('d', view.cast('f'))
+        else:
+            doubles = view
+        fmt = "{0} %#018x".format(element)
+        return [fmt % v for v in memoryview(doubles).cast('B').cast('Q')]
+
+    def _format(self, ty, data):
+        if not isinstance(ty.element, types.ArrayType):
+            if self.element == types.IntType(8):
+                return 'c"{0}"'.format(_escape_string(data))
+            return "[{0}]".format(", ".join(self._format_elements(data)))
+        rowsize = len(data) // ty.count if ty.count else 0
+        rows = ["{0} {1}".format(ty.element,
+                                 self._format(ty.element,
+                                              data[i:i + rowsize]))
+                for i in range(0, len(data), rowsize or 1)]
+        return "[{0}]".format(", ".join(rows))
+
+    def format(self):
+        """
+        Return the textual IR of the data, e.g. 'c"..."' for an i8 array.
+        """
+        return self._format(self.type, self.data)
+
+    def __repr__(self):
+        return "<ir.DataArray %s>" % (self.type,)
+
+
+def _byteswap(data, itemsize):
+    """
+    Reverse the byte order of each *itemsize* bytes element of *data*.
+    """
+    buf = bytearray(len(data))
+    for i in range(itemsize):
+        buf[i::itemsize] = data[itemsize - 1 - i::itemsize]
+    return bytes(buf)
+
+
 class Constant(_StrCaching, _StringReferenceCaching, _ConstOpMixin, Value):
     """
     A constant LLVM value.
     """
 
+    __slots__ = ('type', 'constant', '_cached_str', '_cached_refstr', '_key',
+                 '_hash')
+
     def __init__(self, typ, constant):
         assert isinstance(typ, types.Type)
         assert not isinstance(typ, types.VoidType)
         self.type = typ
         constant = typ.wrap_constant_value(constant)
         self.constant = constant
+        self._key = self._hash = None
 
     def _to_string(self):
         return '{0} {1}'.format(self.type, self.get_reference())
@@ -137,11 +356,34 @@ class Constant(_StrCaching, _StringReferenceCaching, _ConstOpMixin, Value):
         elif isinstance(self.constant, bytearray):
             val = 'c"{0}"'.format(_escape_string(self.constant))
 
+        elif isinstance(self.constant, DataArray):
+            val = self.constant.format()
+
         else:
             val = self.type.format_constant(self.constant)
 
         return val
 
+    def _iter_reference_chunks(self):
+        """
+        Iterate over the reference string of this constant as a sequence
+        of strings.  Large byte strings are escaped a chunk at a time,
+        without building (and caching) their whole text.
+        """
+        data = self.constant
+        if (isinstance(data, DataArray) and len(data.shape) == 1 and
+                data.element == types.IntType(8)):
+            data = data.data
+        if (isinstance(data, (bytes, bytearray)) and
+                len(data) > _ESCAPE_CHUNK_SIZE and
+                not hasattr(self, '_cached_refstr')):
+            yield 'c"'
+            for chunk in _iter_escaped_chunks(data):
+                yield chunk
+            yield '"'
+        else:
+            yield self.get_reference()
+
     @classmethod
     def literal_array(cls, elems):
         """
@@ -156,6 +398,37 @@ class Constant(_StrCaching, _StringReferenceCaching, _ConstOpMixin, Value):
                 raise TypeError("all elements must have the same type")
         return cls(types.ArrayType(ty, len(elems)), elems)
 
+    @classmethod
+    def from_ndarray(cls, arr):
+        """
+        Construct a constant array from *arr*, a NumPy array or any object
+        supporting the buffer protocol with integer, boolean or
+        floating-point elements.  Multi-dimensional arrays give nested
+        array types.  The data is stored as a DataArray, without creating
+        a Python object per element.
+        """
+        view = memoryview(arr)
+        fmt = view.format
+        byteorder = '@'
+        if fmt[:1] in '@=<>!':
+            byteorder, fmt = fmt[0], fmt[1:]
+        if fmt in _FLOAT_FORMATS:
+            element = _FLOAT_FORMATS[fmt]()
+        elif fmt in _SIGNED_FORMATS or fmt in _UNSIGNED_FORMATS:
+            element = types.IntType(8 * view.itemsize)
+        else:
+            raise TypeError("unsupported array format %r" % (view.format,))
+        if view.ndim == 0:
+            raise ValueError("expected an array with at least one dimension")
+        # In C order, whatever the layout of *arr*
+        data = view.tobytes()
+        swap = (byteorder in '>!' if sys.byteorder == 'little'
+                else byteorder == '<')
+        if swap and view.itemsize > 1:
+            data = _byteswap(data, view.itemsize)
+        data = DataArray(data, element, view.shape)
+        return cls(data.type, data)
+
     @classmethod
     def literal_struct(cls, elems):
         """
@@ -170,9 +443,43 @@ class Constant(_StrCaching, _StringReferenceCaching, _ConstOpMixin, Value):
             raise TypeError("Only pointer constant have address spaces")
         return self.type.addrspace
 
+    def _get_key(self):
+        """
+        A hashable structural equivalent of this constant, for comparing
+        and hashing it without formatting it.  Nested constants are
+        replaced with their own key, so that comparing keys doesn't call
+        back into Python.
+
+        The key includes the type, so e.g. ``i32 0`` and ``float 0.0``
+        are never equal.  Values are compared as Python values rather
+        than by their formatting: integers given for a floating-point
+        type are converted to floats, but two distinct floats rounding
+        to the same ``float`` or ``half`` value remain different keys.
+        """
+        key = self._key
+        if key is None:
+            constant = self.constant
+            if isinstance(constant, (list, tuple)):
+                constant = tuple([c._get_key() if isinstance(c, Constant)
+                                  else c for c in constant])
+            elif isinstance(constant, bytearray):
+                constant = bytes(constant)
+            elif (isinstance(constant, int) and
+                  isinstance(self.type, types._BaseFloatType)):
+                constant = float(constant)
+            if isinstance(constant, float) and constant == 0:
+                # -0.0 == 0.0, but they are different constants
+                constant = (constant, math.copysign(1.0, constant))
+            key = self._key = (self.type, constant)
+        return key
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, Constant):
-            return str(self) == str(other)
+            # Hashes are cached, which makes most mismatches cheap
+            return (hash(self) == hash(other) and
+                    self._get_key() == other._get_key())
         else:
             return False
 
@@ -180,7 +487,10 @@ class Constant(_StrCaching, _StringReferenceCaching, _ConstOpMixin, Value):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(str(self))
+        h = self._hash
+        if h is None:
+            h = self._hash = hash(self._get_key())
+        return h
 
     def __repr__(self):
         return "<ir.Constant type='%s' value=%r>" % (self.type, self.constant)
@@ -189,11 +499,18 @@ class Constant(_StrCaching, _StringReferenceCaching, _ConstOpMixin, Value):
 class FormattedConstant(Constant):
     """
     A constant with an already formatted IR representation.
+
+    *expr*, if given, describes the constant expression structurally as
+    an (opname, operand, ...) tuple, for consumers which don't parse the
+    textual IR (such as the bitcode writer).
     """
 
-    def __init__(self, typ, constant):
+    __slots__ = ('_expr',)
+
+    def __init__(self, typ, constant, expr=None):
         assert isinstance(constant, str)
         Constant.__init__(self, typ, constant)
+        self._expr = expr
 
     def _to_string(self):
         return self.constant
@@ -206,6 +523,9 @@ class NamedValue(_StrCaching, _StringReferenceCaching, Value):
     """
     The base class for named values.
     """
+
+    __slots__ = ('parent', 'type', '_name', '_cached_str', '_cached_refstr')
+
     name_prefix = '%'
     deduplicate_name = True
 
@@ -227,7 +547,7 @@ class NamedValue(_StrCaching, _StringReferenceCaching, Value):
         raise NotImplementedError
 
     def _get_name(self):
-        return self._name
+        return _utils.NameScope.format_name(self._name)
 
     def _set_name(self, name):
         name = self.parent.scope.register(name,
@@ -264,6 +584,8 @@ class MetaDataString(NamedValue):
     node.
     """
 
+    __slots__ = ('string',)
+
     def __init__(self, parent, string):
         super(MetaDataString, self).__init__(parent,
                                              types.MetaDataType(),
@@ -300,6 +622,8 @@ class MetaDataArgument(_StrCaching, _StringReferenceCaching, Value):
     automatically.
     """
 
+    __slots__ = ('type', 'wrapped_value', '_cached_str', '_cached_refstr')
+
     def __init__(self, value):
         assert isinstance(value, Value)
         assert not isinstance(value.type, types.MetaDataType)
@@ -335,6 +659,9 @@ class MDValue(NamedValue):
 
     Do not instantiate directly, use Module.add_metadata() instead.
     """
+
+    __slots__ = ('operands',)
+
     name_prefix = '!'
 
     def __init__(self, parent, values, name):
@@ -391,6 +718,9 @@ class DIValue(NamedValue):
 
     Do not instantiate directly, use Module.add_debug_info() instead.
     """
+
+    __slots__ = ('is_distinct', 'kind', 'operands')
+
     name_prefix = '!'
 
     def __init__(self, parent, is_distinct, kind, operands, name):
@@ -450,6 +780,8 @@ class GlobalValue(NamedValue, _ConstOpMixin):
     """
     A global value.
     """
+    # No __slots__: global values are few, and their instances keep a
+    # __dict__ so that users can attach attributes to them.
     name_prefix = '@'
     deduplicate_name = False
 
@@ -477,6 +809,15 @@ class GlobalVariable(GlobalValue):
         self.parent.add_global(self)
 
     def descr(self, buf):
+        buf.extend(self._iter_descr_chunks())
+        buf.append("\n")
+
+    def _iter_descr_chunks(self):
+        """
+        Iterate over the definition of this global variable (without the
+        trailing newline) as a sequence of strings.  The text of a large
+        byte string initializer is produced a chunk at a time.
+        """
         if self.global_constant:
             kind = 'constant'
         else:
@@ -489,30 +830,33 @@ class GlobalVariable(GlobalValue):
             linkage = self.linkage
 
         if linkage:
-            buf.append(linkage + " ")
+            yield linkage + " "
         if self.storage_class:
-            buf.append(self.storage_class + " ")
+            yield self.storage_class + " "
         if self.unnamed_addr:
-            buf.append("unnamed_addr ")
+            yield "unnamed_addr "
         if self.addrspace != 0:
-            buf.append('addrspace({0:d}) '.format(self.addrspace))
+            yield 'addrspace({0:d}) '.format(self.addrspace)
 
-        buf.append("{kind} {type}" .format(kind=kind, type=self.value_type))
+        yield "{kind} {type}" .format(kind=kind, type=self.value_type)
 
         if self.initializer is not None:
             if self.initializer.type != self.value_type:
                 raise TypeError("got initializer of type %s "
                                 "for global value type %s"
                                 % (self.initializer.type, self.value_type))
-            buf.append(" " + self.initializer.get_reference())
+            yield " "
+            if isinstance(self.initializer, Constant):
+                for chunk in self.initializer._iter_reference_chunks():
+                    yield chunk
+            else:
+                yield self.initializer.get_reference()
         elif linkage not in ('external', 'extern_weak'):
             # emit 'undef' for non-external linkage GV
-            buf.append(" " + self.value_type(Undefined).get_reference())
+            yield " " + self.value_type(Undefined).get_reference()
 
         if self.align is not None:
-            buf.append(", align %d" % (self.align,))
-
-        buf.append("\n")
+            yield ", align %d" % (self.align,)
 
 
 class AttributeSet(set):
@@ -594,8 +938,12 @@ class Function(GlobalValue, _HasMetadata):
         assert isinstance(ftype, types.Type)
         super(Function, self).__init__(module, ftype.as_pointer(), name=name)
         self.ftype = ftype
-        self.scope = _utils.NameScope()
-        self.blocks = []
+        self.scope = _utils.NameScope(numeric=module.numeric_names)
+        # The text of the function body, built from the text of its blocks
+        self._cached_body = None
+        # The callback building the body of the function, if deferred
+        self._deferred_body = None
+        self.blocks = _utils._InvalidatingList(self)
         self.attributes = FunctionAttributes()
         self.args = tuple([Argument(self, t)
                            for t in ftype.args])
@@ -628,6 +976,53 @@ class Function(GlobalValue, _HasMetadata):
         self.blocks.insert(before, blk)
         return blk
 
+    def defer_body(self, callback):
+        """
+        Defer the construction of the body of this function until it is
+        needed: *callback* is called with the function as argument to
+        append its blocks when the function is first called by another
+        function, when its module is exported if the function is visible
+        outside of it (i.e. not internal or private) or used as a value by
+        the built code, or when materialize() is called.  Unneeded internal
+        functions are never built, and are left out of the exported module.
+        """
+        if self.blocks:
+            raise ValueError("function {0} already has a body"
+                             .format(self.get_reference()))
+        self._deferred_body = callback
+        self.parent._deferred_functions[self] = None
+
+    @property
+    def is_deferred(self):
+        """
+        Whether the body of this function is deferred and not built yet.
+        """
+        return self._deferred_body is not None
+
+    def materialize(self):
+        """
+        Build the deferred body of this function, if any.  If the callback
+        raises, the body remains deferred.
+        """
+        callback = self._deferred_body
+        if callback is not None:
+            # Reset first, so that recursive calls don't build it again
+            self._deferred_body = None
+            del self.parent._deferred_functions[self]
+            try:
+                callback(self)
+            except BaseException:
+                # Drop the partial body and defer it again, so that the
+                # function doesn't silently become a declaration
+                if self.module.track_uses:
+                    for block in self.blocks:
+                        for instr in block.instructions:
+                            instr._drop_uses()
+                del self.blocks[:]
+                self._deferred_body = callback
+                self.parent._deferred_functions[self] = None
+                raise
+
     def descr_prototype(self, buf):
         """
         Describe the prototype ("head") of the function.
@@ -655,10 +1050,18 @@ class Function(GlobalValue, _HasMetadata):
         """
         Describe of the body of the function.
         """
-        for blk in self.blocks:
-            blk.descr(buf)
+        if self._cached_body is None:
+            body = []
+            for blk in self.blocks:
+                blk.descr(body)
+            self._cached_body = "".join(body)
+        buf.append(self._cached_body)
+
+    def _invalidate(self):
+        self._cached_body = None
 
     def descr(self, buf):
+        self.materialize()
         self.descr_prototype(buf)
         if self.blocks:
             buf.append("{\n")
@@ -672,7 +1075,7 @@ class Function(GlobalValue, _HasMetadata):
 
     @property
     def is_declaration(self):
-        return len(self.blocks) == 0
+        return len(self.blocks) == 0 and self._deferred_body is None
 
 
 class ArgumentAttributes(AttributeSet):
@@ -714,6 +1117,10 @@ class ArgumentAttributes(AttributeSet):
         self._dereferenceable_or_null = val
 
     def _to_list(self):
+        if not (self or self._align or self._dereferenceable or
+                self._dereferenceable_or_null):
+            # Fast path for the common case of an argument without attributes
+            return []
         attrs = sorted(self)
         if self.align:
             attrs.append('align {0:d}'.format(self.align))
@@ -726,6 +1133,8 @@ class ArgumentAttributes(AttributeSet):
 
 
 class _BaseArgument(NamedValue):
+    __slots__ = ('attributes',)
+
     def __init__(self, parent, typ, name=''):
         assert isinstance(typ, types.Type)
         super(_BaseArgument, self).__init__(parent, typ, name=name)
@@ -745,6 +1154,8 @@ class Argument(_BaseArgument):
     The specification of a function argument.
     """
 
+    __slots__ = ()
+
     def __str__(self):
         attrs = self.attributes._to_list()
         if attrs:
@@ -759,6 +1170,8 @@ class ReturnValue(_BaseArgument):
     The specification of a function's return value.
     """
 
+    __slots__ = ()
+
     def __str__(self):
         attrs = self.attributes._to_list()
         if attrs:
@@ -776,10 +1189,13 @@ class Block(NamedValue):
     instruction.
     """
 
+    __slots__ = ('scope', 'instructions', 'terminator', '_cached_descr')
+
     def __init__(self, parent, name=''):
         super(Block, self).__init__(parent, types.LabelType(), name=name)
         self.scope = parent.scope
-        self.instructions = []
+        self._cached_descr = None
+        self.instructions = _utils._ChunkedList(self)
         self.terminator = None
 
     @property
@@ -795,17 +1211,31 @@ class Block(NamedValue):
         return self.parent.module
 
     def descr(self, buf):
-        buf.append("{0}:\n".format(self._format_name()))
-        buf += ["  {0}\n".format(instr) for instr in self.instructions]
+        if self._cached_descr is None:
+            lines = ["{0}:\n".format(self._format_name())]
+            lines += ["  {0}\n".format(instr) for instr in self.instructions]
+            self._cached_descr = "".join(lines)
+        buf.append(self._cached_descr)
+
+    def _invalidate(self):
+        """
+        Drop the cached text of this block and of its function, after
+        a mutation.
+        """
+        self._cached_descr = None
+        self.parent._invalidate()
 
     def replace(self, old, new):
         """Replace an instruction"""
         if old.type != new.type:
             raise TypeError("new instruction has a different type")
         pos = self.instructions.index(old)
-        self.instructions.remove(old)
-        self.instructions.insert(pos, new)
+        self.instructions[pos] = new
 
+        if self.module.track_uses:
+            old._drop_uses()
+            old.replace_all_uses_with(new)
+            return
         for bb in self.parent.basic_blocks:
             for instr in bb.instructions:
                 instr.replace_usage(old, new)
@@ -826,6 +1256,8 @@ class BlockAddress(Value):
     The address of a basic block.
     """
 
+    __slots__ = ('type', 'function', 'basic_block')
+
     def __init__(self, function, basic_block):
         assert isinstance(function, Function)
         assert isinstance(basic_block, Block)
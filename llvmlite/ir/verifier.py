@@ -0,0 +1,425 @@
+"""
+Verification of llvmlite.ir modules in pure Python.
+
+This catches the common mistakes of IR generators (unterminated blocks,
+phi nodes not matching the predecessors of their block, ill-typed operands,
+uses not dominated by their definition) before the module is formatted
+and parsed by LLVM.  It doesn't replace LLVM's verifier (see
+ModuleRef.verify()), which checks much more.
+"""
+
+from llvmlite.ir import instructions, types, values
+
+
+class VerificationError(RuntimeError):
+    """
+    Raised by Module.verify() on malformed IR.
+    """
+
+
+_TERMINATORS = (instructions.Terminator, instructions.InvokeInstr,
+                instructions.Unreachable)
+
+_BINOPS = frozenset(['add', 'sub', 'mul', 'udiv', 'sdiv', 'urem', 'srem',
+                     'shl', 'lshr', 'ashr', 'and', 'or', 'xor',
+                     'fadd', 'fsub', 'fmul', 'fdiv', 'frem'])
+
+_INT_CASTS = {'trunc': -1, 'zext': 1, 'sext': 1}
+
+
+def _successors(term):
+    """
+    Return the list of the successors of the block terminated by *term*.
+    """
+    if isinstance(term, instructions.ConditionalBranch):
+        return list(term.operands[1:])
+    elif isinstance(term, instructions.Branch):
+        if term.opname == 'resume':
+            return []
+        return [term.operands[0]]
+    elif isinstance(term, instructions.SwitchInstr):
+        return [term.default] + [blk for val, blk in term.cases]
+    elif isinstance(term, instructions.IndirectBranch):
+        return list(term.destinations)
+    elif isinstance(term, instructions.InvokeInstr):
+        return [term.normal_to, term.unwind_to]
+    else:
+        return []
+
+
+def _describe(instr):
+    try:
+        return str(instr).strip()
+    except Exception:
+        # Some malformed instructions can't be formatted
+        return repr(instr)
+
+
+def _is_bool(ty):
+    if isinstance(ty, types.VectorType):
+        ty = ty.element
+    return isinstance(ty, types.IntType) and ty.width == 1
+
+
+class _FunctionVerifier(object):
+    """
+    Verify the body of function *fn*.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.block = None
+
+    def fail(self, msg, instr=None):
+        where = "in function {0}".format(self.fn.get_reference())
+        if self.block is not None:
+            where += ", block {0}".format(self.block.get_reference())
+        if instr is not None:
+            msg = "{0}: {1}".format(msg, _describe(instr))
+        raise VerificationError("{0}: {1}".format(where, msg))
+
+    def verify(self):
+        fn = self.fn
+        blocks = fn.blocks
+        self.block_ids = block_ids = {}
+        for i, block in enumerate(blocks):
+            if block.parent is not fn or block in block_ids:
+                self.block = block
+                self.fail("block doesn't belong to the function")
+            block_ids[block] = i
+        # Lay out the instructions and the control flow graph
+        self.positions = positions = {}
+        self.succs = succs = []
+        for i, block in enumerate(blocks):
+            self.block = block
+            instrs = block.instructions
+            if not instrs:
+                self.fail("empty block")
+            last = len(instrs) - 1
+            in_phis = True
+            for pos, instr in enumerate(instrs):
+                if instr.parent is not block:
+                    self.fail("instruction doesn't belong to its block", instr)
+                if isinstance(instr, _TERMINATORS) != (pos == last):
+                    if pos == last:
+                        self.fail("block is not terminated")
+                    self.fail("terminator in the middle of the block", instr)
+                if isinstance(instr, instructions.PhiInstr):
+                    if not in_phis:
+                        self.fail("phi node after a non-phi instruction",
+                                  instr)
+                else:
+                    in_phis = False
+                positions[instr] = (i, pos)
+            term = instrs[last]
+            targets = []
+            for target in _successors(term):
+                target_id = block_ids.get(target)
+                if target_id is None:
+                    self.fail("branch to a block of another function", term)
+                targets.append(target_id)
+            succs.append(targets)
+        self.preds = preds = [[] for block in blocks]
+        for i, targets in enumerate(succs):
+            for target_id in targets:
+                preds[target_id].append(i)
+        if preds[0]:
+            self.block = blocks[0]
+            self.fail("the entry block has predecessors")
+        self.compute_dominators()
+
+        # Check the instructions and their operands
+        for i, block in enumerate(blocks):
+            self.block = block
+            reachable = self.pre[i] is not None
+            for pos, instr in enumerate(block.instructions):
+                self.check_types(instr)
+                if isinstance(instr, instructions.PhiInstr):
+                    self.check_phi(instr, i, reachable)
+                    continue
+                for op in instr.operands:
+                    if isinstance(op, instructions.Instruction):
+                        self.check_def(op, instr, i, pos, reachable)
+                    elif (isinstance(op, values.Argument) and
+                            op.parent is not fn):
+                        self.fail("use of an argument of another function",
+                                  instr)
+
+    def compute_dominators(self):
+        """
+        Compute the immediate dominators of the blocks, with the algorithm
+        of Cooper, Harvey and Kennedy, and number the dominator tree so
+        that dominates() takes constant time.
+        """
+        succs = self.succs
+        preds = self.preds
+        nblocks = len(succs)
+        # Postorder of the reachable blocks
+        postorder = []
+        visited = [False] * nblocks
+        visited[0] = True
+        stack = [(0, iter(succs[0]))]
+        while stack:
+            block_id, it = stack[-1]
+            for succ in it:
+                if not visited[succ]:
+                    visited[succ] = True
+                    stack.append((succ, iter(succs[succ])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(block_id)
+        rank = [None] * nblocks
+        for n, block_id in enumerate(postorder):
+            rank[block_id] = n
+        idom = [None] * nblocks
+        idom[0] = 0
+        rpo = postorder[::-1]
+        changed = True
+        while changed:
+            changed = False
+            for block_id in rpo[1:]:
+                new = None
+                for pred in preds[block_id]:
+                    if idom[pred] is None:
+                        continue
+                    if new is None:
+                        new = pred
+                        continue
+                    # Intersect
+                    a = pred
+                    while a != new:
+                        while rank[a] < rank[new]:
+                            a = idom[a]
+                        while rank[new] < rank[a]:
+                            new = idom[new]
+                if idom[block_id] != new:
+                    idom[block_id] = new
+                    changed = True
+        # Preorder and postorder numbers in the dominator tree
+        children = [[] for i in range(nblocks)]
+        for block_id in rpo[1:]:
+            children[idom[block_id]].append(block_id)
+        self.pre = pre = [None] * nblocks
+        self.post = post = [None] * nblocks
+        counter = 0
+        stack = [(0, iter(children[0]))]
+        pre[0] = counter
+        while stack:
+            block_id, it = stack[-1]
+            for child in it:
+                counter += 1
+                pre[child] = counter
+                stack.append((child, iter(children[child])))
+                break
+            else:
+                stack.pop()
+                counter += 1
+                post[block_id] = counter
+
+    def dominates(self, a, b):
+        """
+        Whether block *a* dominates block *b* (which is reachable).
+        """
+        pre_a = self.pre[a]
+        return (pre_a is not None and pre_a <= self.pre[b] and
+                self.post[b] <= self.post[a])
+
+    def def_location(self, op, instr):
+        try:
+            return self.positions[op]
+        except KeyError:
+            if op.parent.parent is self.fn:
+                self.fail("use of an instruction which was removed from "
+                          "its block", instr)
+            self.fail("use of an instruction of another function", instr)
+
+    def check_def(self, op, instr, block_id, pos, reachable):
+        """
+        Check that the definition of *op* dominates its use by *instr*,
+        at position *pos* in block *block_id*.
+        """
+        def_block, def_pos = self.def_location(op, instr)
+        if not reachable:
+            # Anything dominates unreachable code
+            return
+        if isinstance(op, instructions.InvokeInstr):
+            # The result is only available at the normal destination
+            def_block = self.block_ids[op.normal_to]
+            def_pos = -1
+        if def_block == block_id:
+            if def_pos >= pos:
+                self.fail("instruction used before its definition", instr)
+        elif not self.dominates(def_block, block_id):
+            self.fail("definition of {0} doesn't dominate its use"
+                      .format(op.get_reference()), instr)
+
+    def check_phi(self, phi, block_id, reachable):
+        counts = {}
+        values_in = {}
+        for val, block in phi.incomings:
+            incoming_id = self.block_ids.get(block)
+            if incoming_id is None:
+                self.fail("phi node with an incoming block of another "
+                          "function", phi)
+            counts[incoming_id] = counts.get(incoming_id, 0) + 1
+            prev = values_in.setdefault(incoming_id, val)
+            if prev is not val and prev != val:
+                self.fail("phi node with different values for block {0}"
+                          .format(block.get_reference()), phi)
+            if isinstance(val, instructions.Instruction):
+                def_block, def_pos = self.def_location(val, phi)
+                if not reachable or self.pre[incoming_id] is None:
+                    continue
+                # The definition must dominate the end of the incoming block
+                if isinstance(val, instructions.InvokeInstr):
+                    normal_id = self.block_ids[val.normal_to]
+                    if (incoming_id == def_block and normal_id == block_id
+                            or self.dominates(normal_id, incoming_id)):
+                        continue
+                elif self.dominates(def_block, incoming_id):
+                    continue
+                self.fail("definition of {0} doesn't dominate its use"
+                          .format(val.get_reference()), phi)
+            elif isinstance(val, values.Argument) and val.parent is not self.fn:
+                self.fail("use of an argument of another function", phi)
+        expected = {}
+        for pred in self.preds[block_id]:
+            expected[pred] = expected.get(pred, 0) + 1
+        if counts != expected:
+            blocks = self.fn.blocks
+            for pred in expected:
+                if pred not in counts:
+                    self.fail("phi node has no entry for predecessor {0}"
+                              .format(blocks[pred].get_reference()), phi)
+            for incoming_id in counts:
+                if incoming_id not in expected:
+                    self.fail("phi node has an entry for {0}, which is not "
+                              "a predecessor"
+                              .format(blocks[incoming_id].get_reference()),
+                              phi)
+            self.fail("phi node has a wrong number of entries for a "
+                      "predecessor", phi)
+
+    def check_types(self, instr):
+        """
+        Check the types of the operands of *instr*, for the most common
+        instructions.
+        """
+        ops = instr.operands
+        for op in ops:
+            if op is not values.Undefined and not hasattr(op, 'type'):
+                self.fail("invalid operand {0!r}".format(op), instr)
+        cls = type(instr)
+        if cls is instructions.Instruction:
+            if instr.opname in _BINOPS:
+                if len(ops) != 2 or not (ops[0].type == ops[1].type ==
+                                         instr.type):
+                    self.fail("operand types don't match the result type",
+                              instr)
+        elif isinstance(instr, instructions.CallInstr):
+            self.check_call(instr)
+        elif isinstance(instr, instructions.CompareInstr):
+            if ops[0].type != ops[1].type:
+                self.fail("comparison of operands of different types", instr)
+        elif isinstance(instr, (instructions.LoadInstr,
+                                instructions.LoadAtomicInstr)):
+            ptr_type = ops[0].type
+            if (not isinstance(ptr_type, types.PointerType) or
+                    ptr_type.pointee != instr.type):
+                self.fail("load type doesn't match the pointer type", instr)
+        elif isinstance(instr, (instructions.StoreInstr,
+                                instructions.StoreAtomicInstr)):
+            val, ptr = ops
+            if (not isinstance(ptr.type, types.PointerType) or
+                    ptr.type.pointee != val.type):
+                self.fail("stored value doesn't match the pointer type",
+                          instr)
+        elif isinstance(instr, instructions.PhiInstr):
+            for val, block in instr.incomings:
+                if val.type != instr.type:
+                    self.fail("incoming value of type {0} in phi node"
+                              .format(val.type), instr)
+        elif isinstance(instr, instructions.Ret):
+            ret_type = self.fn.ftype.return_type
+            if isinstance(ret_type, types.VoidType):
+                if ops:
+                    self.fail("value returned from a void function", instr)
+            elif len(ops) != 1 or ops[0].type != ret_type:
+                self.fail("returned value doesn't match the return type",
+                          instr)
+        elif isinstance(instr, instructions.ConditionalBranch):
+            if not _is_bool(ops[0].type) or isinstance(ops[0].type,
+                                                       types.VectorType):
+                self.fail("branch condition is not an i1", instr)
+        elif isinstance(instr, instructions.SwitchInstr):
+            if not isinstance(ops[0].type, types.IntType):
+                self.fail("switch on a non-integer value", instr)
+            for val, block in instr.cases:
+                if val.type != ops[0].type:
+                    self.fail("switch case of type {0}".format(val.type),
+                              instr)
+        elif isinstance(instr, instructions.SelectInstr):
+            if not _is_bool(ops[0].type):
+                self.fail("select condition is not an i1", instr)
+            if not ops[1].type == ops[2].type == instr.type:
+                self.fail("select operand types don't match the result type",
+                          instr)
+        elif isinstance(instr, instructions.CastInstr):
+            direction = _INT_CASTS.get(instr.opname)
+            if direction is not None:
+                src, dest = ops[0].type, instr.type
+                if not (isinstance(src, types.IntType) and
+                        isinstance(dest, types.IntType) and
+                        (dest.width - src.width) * direction > 0):
+                    self.fail("invalid {0} from {1} to {2}"
+                              .format(instr.opname, src, dest), instr)
+        elif isinstance(instr, instructions.GEPInstr):
+            if not isinstance(ops[0].type, types.PointerType):
+                self.fail("getelementptr on a non-pointer value", instr)
+            for index in ops[1:]:
+                if not isinstance(index.type, types.IntType):
+                    self.fail("non-integer getelementptr index", instr)
+        elif isinstance(instr, (instructions.AtomicRMW,
+                                instructions.CmpXchg)):
+            ptr_type = ops[0].type
+            if (not isinstance(ptr_type, types.PointerType) or
+                    any(op.type != ptr_type.pointee for op in ops[1:])):
+                self.fail("operands don't match the pointer type", instr)
+
+    def check_call(self, instr):
+        callee = instr.operands[0]
+        if isinstance(callee, instructions.InlineAsm):
+            fnty = callee.function_type
+        else:
+            fnty = callee.type
+            if isinstance(fnty, types.PointerType):
+                fnty = fnty.pointee
+            if not isinstance(fnty, types.FunctionType):
+                self.fail("call of a non-function value", instr)
+        args = instr.operands[1:]
+        if (len(args) < len(fnty.args) or
+                len(args) > len(fnty.args) and not fnty.var_arg):
+            self.fail("call with a wrong number of arguments", instr)
+        for n, (arg, ty) in enumerate(zip(args, fnty.args)):
+            if arg.type != ty:
+                self.fail("argument #{0} of type {1} instead of {2}"
+                          .format(n + 1, arg.type, ty), instr)
+        if instr.type != fnty.return_type:
+            self.fail("call result type doesn't match the function type",
+                      instr)
+
+
+def verify_module(module):
+    """
+    Verify *module*, raising VerificationError on the first problem found.
+    """
+    for gv in module._get_exported_globals():
+        if isinstance(gv, values.GlobalVariable):
+            init = gv.initializer
+            if init is not None and init.type != gv.value_type:
+                raise VerificationError(
+                    "global {0} of type {1} has an initializer of type {2}"
+                    .format(gv.get_reference(), gv.value_type, init.type))
+        elif isinstance(gv, values.Function) and gv.blocks:
+            _FunctionVerifier(gv).verify()
@@ -1,16 +1,20 @@
+import array
 import ctypes
 from ctypes import CFUNCTYPE, c_int
 from ctypes.util import find_library
 import gc
 import locale
+import mmap
 import os
 import platform
 import re
+import struct
 import subprocess
 import sys
+import threading
 import unittest
 from contextlib import contextmanager
-from tempfile import mkstemp
+from tempfile import mkstemp, TemporaryDirectory
 
 from llvmlite import ir
 from llvmlite import binding as llvm
@@ -299,6 +303,15 @@ class TestMisc(BaseTest):
     def test_parse_assembly(self):
         self.module(asm_sum)
 
+    def test_create_byte_string(self):
+        # The pointer must not be truncated to a C int
+        data = b"ab\0cd" * 1000
+        ptr = ffi.lib.LLVMPY_CreateByteString(data, len(data))
+        try:
+            self.assertEqual(ctypes.string_at(ptr, len(data)), data)
+        finally:
+            ffi.lib.LLVMPY_DisposeString(ctypes.c_void_p(ptr))
+
     def test_parse_assembly_error(self):
         with self.assertRaises(RuntimeError) as cm:
             self.module(asm_parse_error)
@@ -613,6 +626,285 @@ class TestModuleRef(BaseTest):
         self.assertEqual(cloned.as_bitcode(), m.as_bitcode())
 
 
+class TestLowerModule(BaseTest):
+    """
+    Test llvm.lower_module() against parsing the textual IR.
+    """
+
+    def assert_lowers_like_text(self, mod):
+        lowered = llvm.lower_module(mod, llvm.create_context())
+        parsed = llvm.parse_assembly(str(mod), llvm.create_context())
+        self.assertEqual(str(lowered), str(parsed))
+        lowered.verify()
+
+    def test_globals(self):
+        ctx = ir.Context()
+        mod = ir.Module(context=ctx)
+        i8 = ir.IntType(8)
+        i32 = ir.IntType(32)
+        node = ctx.get_identified_type("node")
+        node.set_body(i32, node.as_pointer())
+        gv = ir.GlobalVariable(mod, i32, "counter")
+        gv.initializer = i32(5)
+        gv.align = 8
+        gv = ir.GlobalVariable(mod, ir.ArrayType(i8, 6), "msg")
+        gv.initializer = ir.Constant(gv.value_type, bytearray(b"hello\0"))
+        gv.global_constant = True
+        gv.unnamed_addr = True
+        gv.linkage = 'internal'
+        st = ir.LiteralStructType([i32, ir.DoubleType(), ir.FloatType()])
+        gv = ir.GlobalVariable(mod, st, "s")
+        gv.initializer = ir.Constant(st, [1, 2.5, 0.1])
+        gv = ir.GlobalVariable(mod, node, "n0")
+        gv.linkage = 'common'
+        gv.initializer = ir.Constant(node, None)
+        gv = ir.GlobalVariable(mod, ir.IntType(128), "big")
+        gv.initializer = ir.IntType(128)(-3)
+        gv = ir.GlobalVariable(mod, i32, "uninit")
+        gv.linkage = 'internal'
+        ir.GlobalVariable(mod, i32, "ext")
+        self.assert_lowers_like_text(mod)
+
+    def test_data_arrays(self):
+        mod = ir.Module()
+        arrays = [array.array('i', [1, -2, 3]), array.array('d', [1.5, -2.0]),
+                  array.array('f', [0.1]), bytearray(b"abc"),
+                  memoryview(array.array('h', [1, 2, 3, 4])).cast('B')
+                  .cast('h', (2, 2))]
+        for i, arr in enumerate(arrays):
+            const = ir.Constant.from_ndarray(arr)
+            gv = ir.GlobalVariable(mod, const.type, "g%d" % i)
+            gv.initializer = const
+        data = ir.DataArray(struct.pack('2e', 1.0, -0.5), ir.HalfType())
+        gv = ir.GlobalVariable(mod, data.type, "half")
+        gv.initializer = ir.Constant(data.type, data)
+        self.assert_lowers_like_text(mod)
+
+    def test_function(self):
+        mod = ir.Module()
+        i32 = ir.IntType(32)
+        dbl = ir.DoubleType()
+        vec = ir.VectorType(i32, 4)
+        glob = ir.GlobalVariable(mod, i32, "glob")
+        glob.initializer = i32(0)
+        ext = ir.Function(mod, ir.FunctionType(i32, [i32], var_arg=True),
+                          "ext")
+        ext.attributes.add('nounwind')
+        fn = ir.Function(mod, ir.FunctionType(i32, [i32, i32.as_pointer()]),
+                         "fn")
+        fn.attributes.add('noinline')
+        fn.args[1].add_attribute('nocapture')
+        fn.args[1].attributes.dereferenceable = 8
+        fn.calling_convention = 'fastcc'
+        entry = fn.append_basic_block("entry")
+        loop = fn.append_basic_block("loop")
+        exit = fn.append_basic_block("exit")
+        builder = ir.IRBuilder(entry)
+        x = builder.add(fn.args[0], i32(1), name="x", flags=['nsw'])
+        ptr = builder.alloca(i32, name="ptr")
+        builder.store(x, ptr, align=4)
+        y = builder.load(fn.args[1], name="y", align=4)
+        z = builder.load_atomic(glob, 'acquire', 4, name="z")
+        builder.store_atomic(z, glob, 'release', 4)
+        builder.atomic_rmw('add', glob, i32(1), 'seq_cst')
+        builder.cmpxchg(glob, i32(0), i32(1), 'acq_rel', 'monotonic')
+        builder.fence('seq_cst')
+        fx = builder.sitofp(x, dbl)
+        fy = builder.fmul(fx, dbl(3.0), flags=['fast'])
+        builder.fcmp_ordered('<', fx, fy)
+        sel = builder.select(builder.icmp_signed('<', x, y), x, y)
+        res = builder.call(ext, [sel, fy], tail=True)
+        builder.branch(loop)
+        builder.position_at_end(loop)
+        # The phi node uses a value defined after it
+        phi = builder.phi(i32, "i")
+        phi.add_incoming(res, entry)
+        nxt = builder.add(phi, i32(1), "next")
+        phi.add_incoming(nxt, loop)
+        builder.cbranch(builder.icmp_unsigned('<', nxt, i32(10)), loop, exit)
+        builder.position_at_end(exit)
+        v = builder.insert_element(ir.Constant(vec, ir.Undefined), nxt,
+                                   i32(0))
+        v = builder.shuffle_vector(v, v, ir.Constant(vec, [0, 0, 0, 0]))
+        elt = builder.extract_element(v, i32(1))
+        st = ir.LiteralStructType([i32, dbl])
+        agg = builder.insert_value(ir.Constant(st, None), elt, 0)
+        ret = builder.ret(builder.extract_value(agg, 0))
+        md = mod.add_metadata([i32(1), "foo", None])
+        ret.set_metadata('mymd', md)
+        mod.add_named_metadata("named", md)
+
+        fn = ir.Function(mod, ir.FunctionType(ir.VoidType(), [i32]), "sw")
+        builder = ir.IRBuilder(fn.append_basic_block())
+        case = fn.append_basic_block("case")
+        default = fn.append_basic_block("default")
+        switch = builder.switch(fn.args[0], default)
+        switch.add_case(1, case)
+        switch.add_case(i32(2), case)
+        builder.position_at_end(case)
+        builder.ret_void()
+        builder.position_at_end(default)
+        builder.unreachable()
+        self.assert_lowers_like_text(mod)
+
+    def test_exceptions(self):
+        mod = ir.Module()
+        i8p = ir.IntType(8).as_pointer()
+        i32 = ir.IntType(32)
+        pers = ir.Function(mod, ir.FunctionType(i32, [], var_arg=True),
+                           "__gxx_personality_v0")
+        thrower = ir.Function(mod, ir.FunctionType(ir.VoidType(), []),
+                              "thrower")
+        fn = ir.Function(mod, ir.FunctionType(i32, [i32]), "fn")
+        fn.attributes.personality = pers
+        fn.set_metadata('fnmd', mod.add_metadata(["x"]))
+        entry = fn.append_basic_block("entry")
+        normal = fn.append_basic_block("normal")
+        unwind = fn.append_basic_block("unwind")
+        target = fn.append_basic_block("target")
+        builder = ir.IRBuilder(entry)
+        asm = ir.InlineAsm(ir.FunctionType(i32, [i32]), "mov $1, $0",
+                           "=r,r", side_effect=True)
+        res = builder.call(asm, [fn.args[0]])
+        builder.invoke(thrower, [], normal, unwind)
+        builder.position_at_end(normal)
+        indbr = builder.branch_indirect(ir.BlockAddress(fn, target))
+        indbr.add_destination(target)
+        builder.position_at_end(unwind)
+        pad = builder.landingpad(ir.LiteralStructType([i8p, i32]),
+                                 cleanup=True)
+        pad.add_clause(ir.CatchClause(ir.Constant(i8p, None)))
+        builder.resume(pad)
+        builder.position_at_end(target)
+        builder.call(thrower, [], cconv='coldcc', attrs=['noreturn'])
+        builder.ret(res)
+        self.assert_lowers_like_text(mod)
+
+    def test_text_constants(self):
+        # Constant expressions are lowered from their text, which is
+        # followed by other strings in the string table, or not
+        mod = ir.Module()
+        i8 = ir.IntType(8)
+        i32 = ir.IntType(32)
+        arr = ir.GlobalVariable(mod, ir.ArrayType(i32, 4), "arr")
+        arr.initializer = ir.Constant(arr.value_type, [1, 2, 3, 4])
+        ptrs = ir.LiteralStructType([i8.as_pointer(), i32.as_pointer(),
+                                     i32.as_pointer()])
+        gv = ir.GlobalVariable(mod, ptrs, "ptrs")
+        gv.initializer = ir.Constant(ptrs, [
+            arr.bitcast(i8.as_pointer()),
+            arr.gep([i32(0), i32(2)]),
+            arr.gep([i32(0), i32(3)])])
+        gv = ir.GlobalVariable(mod, i32.as_pointer(), "last")
+        gv.initializer = arr.gep([i32(0), i32(1)])
+        self.assert_lowers_like_text(mod)
+
+    def test_self_referencing_phi(self):
+        mod = ir.Module()
+        i32 = ir.IntType(32)
+        fn = ir.Function(mod, ir.FunctionType(i32, [i32]), "fn")
+        entry = fn.append_basic_block("entry")
+        loop = fn.append_basic_block("loop")
+        builder = ir.IRBuilder(entry)
+        builder.branch(loop)
+        builder.position_at_end(loop)
+        phi = builder.phi(i32, "i")
+        phi.add_incoming(fn.args[0], entry)
+        phi.add_incoming(phi, loop)
+        builder.branch(loop)
+        self.assert_lowers_like_text(mod)
+
+    def test_upgrades(self):
+        # Intrinsics are upgraded like by the assembly parser
+        mod = ir.Module()
+        dbl = ir.DoubleType()
+        powi = mod.declare_intrinsic('llvm.powi', [dbl])
+        fn = ir.Function(mod, ir.FunctionType(dbl, [dbl]), "fn")
+        builder = ir.IRBuilder(fn.append_basic_block())
+        builder.ret(builder.call(powi, [fn.args[0], ir.IntType(32)(3)]))
+        self.assert_lowers_like_text(mod)
+
+    def test_fallback(self):
+        # Debug information goes through the textual IR
+        mod = ir.Module()
+        di = mod.add_debug_info("DIFile", {"filename": "a.c",
+                                           "directory": "/tmp"})
+        mod.add_named_metadata("files", di)
+        self.assert_lowers_like_text(mod)
+
+    def test_global_context(self):
+        mod = ir.Module()
+        ir.Function(mod, ir.FunctionType(ir.VoidType(), []), "foo")
+        lowered = llvm.lower_module(mod)
+        self.assertIsInstance(lowered, llvm.ModuleRef)
+        self.assertIsNotNone(lowered.get_function("foo"))
+
+
+class TestBitcodeWriter(TestLowerModule):
+    """
+    Test ir.Module.as_bitcode() against parsing the textual IR, on the
+    same modules as TestLowerModule.
+    """
+
+    def assert_lowers_like_text(self, mod):
+        bitcode = mod.as_bitcode()
+        self.assertEqual(bitcode[:4], b'BC\xc0\xde')
+        parsed = llvm.parse_bitcode(bitcode, llvm.create_context())
+        expected = llvm.parse_assembly(str(mod), llvm.create_context())
+        self.assertEqual(self.module_body(parsed),
+                         self.module_body(expected))
+        parsed.verify()
+
+    @staticmethod
+    def module_body(llmod):
+        # Bitcode has no module ID and source filename
+        return [line for line in str(llmod).splitlines()
+                if not line.startswith(('; ModuleID', 'source_filename'))]
+
+    def test_fallback(self):
+        mod = ir.Module()
+        di = mod.add_debug_info("DIFile", {"filename": "a.c",
+                                           "directory": "/tmp"})
+        mod.add_named_metadata("files", di)
+        with self.assertRaises(NotImplementedError):
+            mod.as_bitcode()
+
+    def test_global_context(self):
+        mod = ir.Module()
+        ir.Function(mod, ir.FunctionType(ir.VoidType(), []), "foo")
+        parsed = llvm.parse_bitcode(mod.as_bitcode())
+        self.assertIsNotNone(parsed.get_function("foo"))
+
+    def test_constant_expressions(self):
+        mod = ir.Module()
+        i8 = ir.IntType(8)
+        i32 = ir.IntType(32)
+        i64 = ir.IntType(64)
+        arr = ir.GlobalVariable(mod, ir.ArrayType(i32, 4), "arr")
+        arr.initializer = ir.Constant(arr.value_type, [1, 2, 3, 4])
+        ptrs = ir.LiteralStructType([i8.as_pointer(), i32.as_pointer(),
+                                     i32.as_pointer()])
+        gv = ir.GlobalVariable(mod, ptrs, "ptrs")
+        gv.initializer = ir.Constant(ptrs, [
+            arr.bitcast(i8.as_pointer()),
+            arr.gep([i32(0), i32(2)]),
+            i64(4096).inttoptr(i32.as_pointer())])
+        st = ir.LiteralStructType([ir.DoubleType(), ir.DoubleType(), i64,
+                                   ir.IntType(1), ir.HalfType()])
+        gv = ir.GlobalVariable(mod, st, "special")
+        gv.initializer = ir.Constant(st, [0.0, -0.0, -2 ** 63, True, 1.5])
+        # Function-local metadata and a custom sync scope
+        fn = ir.Function(mod, ir.FunctionType(ir.VoidType(), [i32]), "fn")
+        md_fn = mod.declare_intrinsic('llvm.dbg.value', (), ir.FunctionType(
+            ir.VoidType(), [ir.MetaDataType()] * 3))
+        builder = ir.IRBuilder(fn.append_basic_block())
+        builder.call(md_fn, [fn.args[0], mod.add_metadata(["a"]),
+                             mod.add_metadata([])])
+        builder.fence('acquire', 'agent')
+        builder.ret_void()
+        self.assert_lowers_like_text(mod)
+
+
 class JITTestMixin(object):
     """
     Mixin for ExecutionEngine tests.
@@ -797,6 +1089,76 @@ class JITTestMixin(object):
         self.assertEqual(len(notifies), 0)
         self.assertEqual(len(getbuffers), 1)
 
+    def test_object_cache_buffers(self):
+        views = []
+        buffers = []
+
+        def notify(mod, buf):
+            self.assertIsInstance(buf, memoryview)
+            views.append(buf)
+            buffers.append(bytes(buf))
+
+        mod = self.module()
+        ee = self.jit(mod)
+        ee.set_object_cache(notify, notify_memoryview=True)
+        self.assertEqual(self.get_sum(ee)(2, -5), -3)
+        self.assertEqual(len(buffers), 1)
+        # The view isn't usable after the callback
+        with self.assertRaises(ValueError):
+            views[0].tobytes()
+
+        # Any buffer-like object can be returned by getbuffer()
+        sum_buffer = buffers[0]
+        with TemporaryDirectory() as path:
+            filename = os.path.join(path, "sum.o")
+            with open(filename, "wb") as f:
+                f.write(sum_buffer)
+            with open(filename, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            for buf in [bytearray(sum_buffer), memoryview(sum_buffer),
+                        mapped]:
+                ee = self.jit(self.module(asm_mul))
+                ee.set_object_cache(getbuffer_func=lambda mod: buf)
+                self.assertEqual(self.get_sum(ee)(2, -5), -3)
+                ee.close()
+            # The engine doesn't use the map anymore
+            mapped.close()
+
+    def test_disk_object_cache(self):
+        def run(cache):
+            # A new context each time, so that identified types aren't
+            # renamed.
+            mod = self.module(context=llvm.create_context())
+            # The engine takes ownership of its target machine
+            ee = self.jit(mod, self.target_machine(jit=True))
+            ee.set_object_cache(cache.notify, cache.getbuffer,
+                                notify_memoryview=True)
+            self.assertEqual(self.get_sum(ee)(2, -5), -3)
+
+        tm = self.target_machine(jit=True)
+        with TemporaryDirectory() as path:
+            cache = llvm.DiskObjectCache(path, tm)
+            run(cache)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            self.assertGreater(cache.size, 0)
+            # A new cache instance (e.g. in a new process) finds the entry
+            cache = llvm.DiskObjectCache(path, tm)
+            run(cache)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            # Different settings give a different key
+            pmb = llvm.create_pass_manager_builder()
+            pmb.opt_level = 3
+            cache = llvm.DiskObjectCache(path, tm, pmb)
+            run(cache)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            self.assertEqual(len(os.listdir(path)), 2)
+            # Eviction
+            cache.evict(cache.size - 1)
+            self.assertEqual(len(os.listdir(path)), 1)
+            cache.clear()
+            self.assertEqual(cache.size, 0)
+            self.assertEqual(os.listdir(path), [])
+
 
 class JITWithTMTestMixin(JITTestMixin):
 
@@ -835,6 +1197,155 @@ class TestMCJit(BaseTest, JITWithTMTestMixin):
         return llvm.create_mcjit_compiler(mod, target_machine)
 
 
+asm_twice = r"""
+    ; ModuleID = '<string>'
+    target triple = "{triple}"
+
+    declare i32 @sum(i32, i32)
+
+    define i32 @twice(i32 %.1) {{
+      %.2 = call i32 @sum(i32 %.1, i32 %.1)
+      ret i32 %.2
+    }}
+    """
+
+asm_call_undefined = r"""
+    declare i32 @undefined_function(i32)
+
+    define i32 @call_undefined(i32 %.1) {{
+      %.2 = call i32 @undefined_function(i32 %.1)
+      ret i32 %.2
+    }}
+    """
+
+asm_call_abs = r"""
+    ; ModuleID = '<string>'
+    target triple = "{triple}"
+
+    declare i32 @abs(i32)
+
+    define i32 @call_abs(i32 %.1) {{
+      %.2 = call i32 @abs(i32 %.1)
+      ret i32 %.2
+    }}
+    """
+
+
+class TestOrcJIT(BaseTest):
+    """
+    Test JIT engines created with create_lljit_compiler().
+    """
+
+    def jit(self, lazy=False, num_compile_threads=0):
+        return llvm.create_lljit_compiler(
+            self.target_machine(jit=True), lazy=lazy,
+            num_compile_threads=num_compile_threads)
+
+    def get_func(self, jit, name, nargs):
+        addr = jit.get_function_address(name)
+        self.assertTrue(addr)
+        return CFUNCTYPE(c_int, *([c_int] * nargs))(addr)
+
+    def check_run_code(self, lazy):
+        with self.jit(lazy) as jit:
+            mod = self.module()
+            jit.add_module(mod)
+            # The module was copied and is still owned by us
+            self.assertFalse(mod.closed)
+            mod.close()
+            self.assertEqual(self.get_func(jit, "sum", 2)(2, -5), -3)
+            # Add a module depending on the first one
+            jit.add_module(self.module(asm_twice))
+            self.assertEqual(self.get_func(jit, "twice", 1)(21), 42)
+
+    def test_run_code(self):
+        self.check_run_code(lazy=False)
+
+    def test_run_code_lazy(self):
+        self.check_run_code(lazy=True)
+
+    def test_lazy_compilation(self):
+        # Only the functions called are compiled, so that the undefined
+        # symbol is never resolved
+        with self.jit(lazy=True) as jit:
+            jit.add_module(self.module())
+            jit.add_module(self.module(asm_twice + asm_call_undefined))
+            self.assertEqual(self.get_func(jit, "twice", 1)(4), 8)
+        with self.jit(lazy=False) as jit:
+            jit.add_module(self.module())
+            jit.add_module(self.module(asm_twice + asm_call_undefined))
+            with self.assertRaises(RuntimeError) as cm:
+                jit.get_function_address("twice")
+            self.assertIn("undefined_function", str(cm.exception))
+
+    def test_process_symbols(self):
+        # Undefined symbols are resolved in the current process
+        with self.jit() as jit:
+            jit.add_module(self.module(asm_call_abs))
+            self.assertEqual(self.get_func(jit, "call_abs", 1)(-5), 5)
+
+    def test_unknown_symbol(self):
+        with self.jit() as jit:
+            with self.assertRaises(RuntimeError) as cm:
+                jit.get_function_address("nonexistent")
+            self.assertIn("nonexistent", str(cm.exception))
+
+    @unittest.skipIf(llvm.llvm_version_info[0] < 13,
+                     "removing modules requires LLVM 13+")
+    def test_remove_module(self):
+        for lazy in (False, True):
+            with self.jit(lazy) as jit:
+                handle = jit.add_module(self.module())
+                self.assertEqual(self.get_func(jit, "sum", 2)(1, 2), 3)
+                jit.remove_module(handle)
+                self.assertTrue(handle.closed)
+                with self.assertRaises(RuntimeError):
+                    jit.get_function_address("sum")
+                with self.assertRaises(KeyError):
+                    jit.remove_module(handle)
+                # The symbol can be defined again
+                jit.add_module(self.module(asm_sum2))
+                self.assertEqual(self.get_func(jit, "sum", 2)(3, 4), 7)
+
+    def check_lookup_async(self, lazy, num_compile_threads):
+        with self.jit(lazy, num_compile_threads) as jit:
+            jit.add_module(self.module())
+            future = jit.lookup_async(["sum", "glob"])
+            jit.add_module(self.module(asm_twice))
+            futures = [jit.lookup_async(["twice", "sum"]) for _ in range(5)]
+            addrs = future.result()
+            self.assertEqual(sorted(addrs), ["glob", "sum"])
+            cfunc = CFUNCTYPE(c_int, c_int, c_int)(addrs["sum"])
+            self.assertEqual(cfunc(2, 3), 5)
+            for fut in futures:
+                addrs = fut.result()
+                self.assertEqual(sorted(addrs), ["sum", "twice"])
+                cfunc = CFUNCTYPE(c_int, c_int)(addrs["twice"])
+                self.assertEqual(cfunc(5), 10)
+            # Errors are reported through the future
+            future = jit.lookup_async(["twice", "nonexistent"])
+            with self.assertRaises(RuntimeError) as cm:
+                future.result()
+            self.assertIn("nonexistent", str(cm.exception))
+
+    def test_lookup_async(self):
+        self.check_lookup_async(lazy=False, num_compile_threads=0)
+        self.check_lookup_async(lazy=False, num_compile_threads=2)
+
+    def test_lookup_async_lazy(self):
+        self.check_lookup_async(lazy=True, num_compile_threads=0)
+        self.check_lookup_async(lazy=True, num_compile_threads=2)
+
+    def test_close(self):
+        jit = self.jit()
+        handle = jit.add_module(self.module())
+        jit.close()
+        self.assertTrue(handle.closed)
+        jit.close()
+        with self.assertRaises(ctypes.ArgumentError):
+            jit.get_function_address("sum")
+
+
 class TestValueRef(BaseTest):
 
     def test_str(self):
@@ -1117,6 +1628,77 @@ class TestTargetMachine(BaseTest):
         self.assertEqual(td.get_abi_size(gv_i32.type), pointer_size)
 
 
+class TestCompileMany(BaseTest):
+
+    def sources(self):
+        triple = llvm.get_default_triple()
+        irmod = ir.Module()
+        fn = ir.Function(irmod, ir.FunctionType(ir.VoidType(), []), "foo")
+        ir.IRBuilder(fn.append_basic_block()).ret_void()
+        return [asm_sum.format(triple=triple),
+                self.module(asm_mul).as_bitcode(),
+                irmod,
+                self.module(asm_sum2)]
+
+    def check_objects(self, objs):
+        self.assertEqual(len(objs), 4)
+        for obj, name in zip(objs, [b"sum", b"mul", b"foo", b"sum"]):
+            # The symbol name is in the object's string table
+            self.assertIn(name, obj)
+
+    def test_threads(self):
+        tm = self.target_machine(jit=False)
+        objs = llvm.compile_many(self.sources(), tm, jobs=2)
+        self.check_objects(objs)
+        # Same result as compiling serially
+        self.assertEqual(llvm.compile_many(self.sources(), tm, jobs=1), objs)
+
+    def test_processes(self):
+        tm = self.target_machine(jit=False)
+        objs = llvm.compile_many(self.sources(), tm, jobs=2,
+                                 executor='process')
+        self.check_objects(objs)
+
+    def test_errors(self):
+        tm = self.target_machine(jit=False)
+        sources = self.sources()
+        sources[1] = asm_parse_error.format(triple=llvm.get_default_triple())
+        with self.assertRaises(llvm.CompileManyError) as cm:
+            llvm.compile_many(sources, tm, jobs=2)
+        exc = cm.exception
+        self.assertEqual(list(exc.errors), [1])
+        self.assertIn("invalid operand type", exc.errors[1])
+        self.assertIsNone(exc.results[1])
+        self.assertIsInstance(exc.results[0], bytes)
+        self.assertIn("module #1", str(exc))
+
+    def test_target_machines_disposed(self):
+        from llvmlite.binding import batch
+        tm = self.target_machine(jit=False)
+        created = []
+        orig_get = batch._TargetMachines.get
+
+        def get(machines):
+            res = orig_get(machines)
+            created.append(res)
+            return res
+
+        batch._TargetMachines.get = get
+        try:
+            llvm.compile_many(self.sources(), tm, jobs=2)
+        finally:
+            batch._TargetMachines.get = orig_get
+        self.assertTrue(created)
+        # Each worker thread had its own, all closed after the batch
+        self.assertLessEqual(len(set(map(id, created))), 2)
+        self.assertTrue(all(machine.closed for machine in created))
+
+    def test_invalid_arguments(self):
+        tm = self.target_machine(jit=False)
+        with self.assertRaises(ValueError):
+            llvm.compile_many([], tm, executor='foo')
+
+
 class TestPassManagerBuilder(BaseTest):
 
     def pmb(self):
@@ -1609,5 +2191,88 @@ class TestLLVMLockCallbacks(BaseTest):
             llvm.ffi.unregister_lock_callback(acq, rel)
 
 
+class TestContextLock(BaseTest):
+    def test_lock_mode(self):
+        self.assertEqual(llvm.create_context().lock_mode, 'global')
+        self.assertEqual(llvm.get_global_context().lock_mode, 'global')
+        self.assertEqual(llvm.create_context('context').lock_mode, 'context')
+        with self.assertRaises(ValueError):
+            llvm.create_context('foo')
+
+    def test_context_lock_callbacks(self):
+        events = []
+
+        def acq():
+            events.append('acq')
+
+        def rel():
+            events.append('rel')
+
+        context = llvm.create_context('context')
+        llvm.ffi.register_lock_callback(acq, rel)
+        try:
+            self.module(context=context)
+        finally:
+            llvm.ffi.unregister_lock_callback(acq, rel)
+        self.assertIn("acq", events)
+        self.assertIn("rel", events)
+
+    def test_global_lock_not_taken(self):
+        # Calls on a context with its own lock don't wait for the
+        # global lock.
+        context = llvm.create_context('context')
+        asm = asm_sum.format(triple=llvm.get_default_triple())
+        acquired = threading.Event()
+        release = threading.Event()
+
+        def hold_global_lock():
+            with llvm.ffi.lib._lock:
+                acquired.set()
+                # Don't hang if the calls do wait for the lock
+                release.wait(timeout=30)
+
+        def use_context():
+            mod = llvm.parse_assembly(asm, context)
+            str(mod)
+            mod.close()
+
+        holder = threading.Thread(target=hold_global_lock)
+        holder.start()
+        try:
+            self.assertTrue(acquired.wait(timeout=30))
+            worker = threading.Thread(target=use_context)
+            worker.start()
+            worker.join(timeout=10)
+            finished = not worker.is_alive()
+        finally:
+            release.set()
+            holder.join()
+        worker.join()
+        self.assertTrue(finished, "calls on the context waited for the "
+                                  "global lock")
+
+    def test_parallel_compilation(self):
+        target = llvm.Target.from_default_triple()
+        results = {}
+
+        def compile(i):
+            tm = target.create_target_machine()
+            context = llvm.create_context('context')
+            mod = self.module(asm_sum, context)
+            pm = llvm.create_module_pass_manager()
+            pm.add_instruction_combining_pass()
+            pm.run(mod)
+            results[i] = tm.emit_object(mod)
+
+        threads = [threading.Thread(target=compile, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(results.values())), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
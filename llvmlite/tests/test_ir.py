@@ -2,16 +2,27 @@
 IR Construction Tests
 """
 
+import array
 import copy
+import gc
+import io
 import itertools
+import math
 import pickle
+import random
 import re
+import struct
 import textwrap
+import tracemalloc
 import unittest
+import weakref
 
 from . import TestCase
 from llvmlite import ir
 from llvmlite import binding as llvm
+from llvmlite.ir._utils import _ChunkedList
+from llvmlite.ir.values import (_VALID_CHARS, _escape_string,
+                                _iter_escaped_chunks)
 
 
 int1 = ir.IntType(1)
@@ -412,6 +423,81 @@ class TestIR(TestBase):
         self.assertInText(pat, str(mod))
         self.assert_valid_ir(mod)
 
+    def _text_chunks_module(self):
+        mod = ir.Module(name="chunks", context=ir.Context())
+        mod.triple = "x86_64-unknown-linux"
+        pair = mod.context.get_identified_type("pair")
+        pair.set_body(int32, int32)
+        gv = ir.GlobalVariable(mod, ir.ArrayType(int8, 3), "bytes")
+        gv.initializer = ir.Constant(ir.ArrayType(int8, 3),
+                                     bytearray(b"a\x00\n"))
+        fnty = ir.FunctionType(int32, [int32, pair.as_pointer()])
+        ir.Function(mod, ir.FunctionType(ir.VoidType(), []), "decl")
+        foo = ir.Function(mod, fnty, "foo")
+        builder = ir.IRBuilder(foo.append_basic_block("entry"))
+        exit = foo.append_basic_block("exit")
+        x = builder.add(foo.args[0], int32(1), "x")
+        builder.branch(exit)
+        builder.position_at_end(exit)
+        builder.ret(x)
+        mod.add_named_metadata("foo", [int32(123), "kernel"])
+        mod.add_metadata([int64(456)])
+        return mod
+
+    def test_iter_text_chunks(self):
+        mod = self._text_chunks_module()
+        chunks = list(mod.iter_text_chunks())
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertIsInstance(chunk, str)
+        self.assertEqual("".join(chunks), str(mod))
+        self.assert_valid_ir(mod)
+        # Empty module
+        mod = self.module()
+        self.assertEqual("".join(mod.iter_text_chunks()), str(mod))
+
+    def test_write_to(self):
+        mod = self._text_chunks_module()
+        fp = io.StringIO()
+        mod.write_to(fp)
+        self.assertEqual(fp.getvalue(), str(mod))
+
+    def test_iter_text_chunks_large_bytes(self):
+        # Large byte string initializers are escaped a chunk at a time
+        mod = self.module()
+        data = bytearray(range(256)) * 1024
+        gv = ir.GlobalVariable(mod, ir.ArrayType(int8, len(data)), "blob")
+        gv.initializer = ir.Constant(gv.value_type, data)
+        gv.align = 16
+        data = ir.DataArray(b'x"' * 40000, int8)
+        gv = ir.GlobalVariable(mod, data.type, "text")
+        gv.initializer = ir.Constant(data.type, data)
+        chunks = list(mod.iter_text_chunks())
+        self.assertLess(max(map(len, chunks)), 3 * len(data.data))
+        self.assertFalse(hasattr(gv.initializer, '_cached_refstr'))
+        self.assertEqual("".join(chunks), str(mod))
+        self.assertIn('@"text" = global [80000 x i8] c"x\\22x\\22', str(mod))
+        self.assert_valid_ir(mod)
+
+    def test_iter_text_chunks_other_initializers(self):
+        # Initializers which aren't Constants are formatted as references
+        mod = self.module()
+        fnty = ir.FunctionType(ir.VoidType(), ())
+        fn = ir.Function(mod, fnty, "fn")
+        bb = fn.append_basic_block("bb")
+        ir.IRBuilder(bb).ret_void()
+        gv = ir.GlobalVariable(mod, int8, "a")
+        gv.initializer = int8(1)
+        gv = ir.GlobalVariable(mod, int8.as_pointer(), "b")
+        gv.initializer = mod.get_global("a")
+        gv = ir.GlobalVariable(mod, int8.as_pointer(), "c")
+        gv.initializer = ir.BlockAddress(fn, bb)
+        text = "".join(mod.iter_text_chunks())
+        self.assertEqual(text, str(mod))
+        self.assertIn('@"b" = global i8* @"a"', text)
+        self.assertIn('@"c" = global i8* blockaddress(@"fn", %"bb")', text)
+        self.assert_valid_ir(mod)
+
 
 class TestGlobalValues(TestBase):
 
@@ -478,6 +564,61 @@ class TestGlobalValues(TestBase):
         self.assert_pickle_correctly(mod)
 
 
+class TestNameScope(TestBase):
+
+    def test_deduplicate(self):
+        scope = ir._utils.NameScope()
+        self.assertEqual(scope.register('a', deduplicate=True), 'a')
+        self.assertEqual(scope.register('a', deduplicate=True), 'a.1')
+        self.assertEqual(scope.register('', deduplicate=True), '.1')
+        # Explicitly registered names are skipped
+        scope.register('a.2')
+        self.assertEqual(scope.register('a', deduplicate=True), 'a.3')
+        # Generated names are known to be used without being stored
+        for name in ('a', 'a.1', 'a.2', 'a.3', '.1'):
+            self.assertTrue(scope.is_used(name), name)
+        for name in ('a.4', 'a.01', '.2', 'b', 'b.1'):
+            self.assertFalse(scope.is_used(name), name)
+        self.assertEqual(len(scope._useset), 3)
+        with self.assertRaises(ir._utils.DuplicatedNameError):
+            scope.register('a.1')
+        # deduplicate() doesn't reserve the name
+        self.assertEqual(scope.deduplicate('a'), 'a.4')
+        self.assertEqual(scope.deduplicate('a'), 'a.4')
+        self.assertEqual(scope.deduplicate('b'), 'b')
+
+    def test_numeric(self):
+        scope = ir._utils.NameScope(numeric=True)
+        self.assertEqual(scope.register('', deduplicate=True), 1)
+        self.assertEqual(scope.register('', deduplicate=True), 2)
+        self.assertEqual(scope.register('a', deduplicate=True), 'a')
+        self.assertTrue(scope.is_used('.2'))
+        self.assertTrue(scope.is_used(2))
+        self.assertFalse(scope.is_used(3))
+        scope.register('.3')
+        self.assertEqual(scope.register('', deduplicate=True), 4)
+        self.assertEqual(scope.format_name(4), '.4')
+
+    def test_numeric_names(self):
+        mod = self.module()
+        mod.numeric_names = True
+        fn = ir.Function(mod, ir.FunctionType(int32, (int32, int32)), 'f')
+        builder = ir.IRBuilder(fn.append_basic_block())
+        a, b = fn.args
+        c = builder.add(a, b)
+        builder.ret(builder.mul(c, b, 'd'))
+        # The return value takes the third name
+        self.assertEqual(c._name, 5)
+        self.assertEqual(c.name, '.5')
+        self.check_block(fn.entry_basic_block, """\
+            .4:
+                %".5" = add i32 %".1", %".2"
+                %"d" = mul i32 %".5", %".2"
+                ret i32 %"d"
+            """)
+        self.assert_valid_ir(mod)
+
+
 class TestBlock(TestBase):
 
     def test_attributes(self):
@@ -514,6 +655,156 @@ class TestBlock(TestBase):
                 %"e" = mul i32 %"f", %".2"
             """)
 
+    def test_replace_tracked(self):
+        block = self.block(name='my_block')
+        block.module.track_uses = True
+        builder = ir.IRBuilder(block)
+        a, b = builder.function.args[:2]
+        c = builder.add(a, b, 'c')
+        d = builder.sub(a, b, 'd')
+        e = builder.mul(d, d, 'e')
+        f = ir.Instruction(block, a.type, 'sdiv', (c, b), 'f')
+        block.replace(d, f)
+        self.check_block(block, """\
+            my_block:
+                %"c" = add i32 %".1", %".2"
+                %"f" = sdiv i32 %"c", %".2"
+                %"e" = mul i32 %"f", %"f"
+            """)
+        self.assertEqual(d.uses, [])
+        self.assertEqual(f.uses, [e])
+        self.assertEqual(a.uses, [c])
+
+    def test_instructions_sequence(self):
+        # The chunked list of instructions behaves like a list
+        class SmallChunks(_ChunkedList):
+            chunk_size = 4
+
+        class Owner(object):
+            invalidated = 0
+
+            def _invalidate(self):
+                self.invalidated += 1
+
+        owner = Owner()
+        lst = SmallChunks(owner, range(10))
+        ref = list(range(10))
+        rnd = random.Random(42)
+        mutations = 0
+        for i in range(500):
+            op = rnd.randrange(7)
+            n = len(ref)
+            if op == 0:
+                pos = rnd.randint(-n - 2, n + 2)
+                lst.insert(pos, i)
+                ref.insert(pos, i)
+            elif op == 1 and ref:
+                pos = rnd.randrange(-n, n)
+                self.assertEqual(lst.pop(pos), ref.pop(pos))
+            elif op == 2 and ref:
+                value = rnd.choice(ref)
+                self.assertEqual(lst.index(value), ref.index(value))
+                self.assertEqual(lst.find_near(value), ref.index(value))
+                lst.remove(value)
+                ref.remove(value)
+            elif op == 3:
+                pos = rnd.randint(0, n)
+                items = list(range(1000 + i, 1000 + i + rnd.randrange(12)))
+                lst[pos:pos] = items
+                ref[pos:pos] = items
+            elif op == 4 and ref:
+                pos = rnd.randrange(n)
+                lst[pos] = -i
+                ref[pos] = -i
+            elif op == 5:
+                start = rnd.randint(0, n)
+                stop = rnd.randint(start, n)
+                del lst[start:stop]
+                del ref[start:stop]
+            elif op == 6:
+                lst.append(i)
+                ref.append(i)
+            else:
+                continue
+            mutations += 1
+            self.assertEqual(len(lst), len(ref))
+            self.assertEqual(lst, ref)
+            if ref:
+                pos = rnd.randrange(len(ref))
+                self.assertEqual(lst[pos], ref[pos])
+                self.assertEqual(lst[-1], ref[-1])
+        self.assertEqual(list(reversed(lst)), ref[::-1])
+        self.assertEqual(lst[2:7], ref[2:7])
+        self.assertEqual(owner.invalidated, mutations)
+        with self.assertRaises(IndexError):
+            lst[len(ref)]
+        with self.assertRaises(ValueError):
+            lst.index('foo')
+        with self.assertRaises(ValueError):
+            lst.find_near('foo')
+        self.assertEqual(copy.copy(lst), ref)
+
+    def test_instructions_list_methods(self):
+        class SmallChunks(_ChunkedList):
+            chunk_size = 4
+
+        class Owner(object):
+            invalidated = 0
+
+            def _invalidate(self):
+                self.invalidated += 1
+
+        owner = Owner()
+        ref = [5, 3, 9, 1, 7, 2, 8, 0, 6, 4, 11, 10]
+        lst = SmallChunks(owner, ref)
+        self.assertEqual(lst[1:10:3], ref[1:10:3])
+        self.assertEqual(lst[::-2], ref[::-2])
+        copied = lst.copy()
+        self.assertIs(type(copied), list)
+        self.assertEqual(copied, ref)
+        self.assertEqual(lst + [12], ref + [12])
+        self.assertEqual([-1] + lst, [-1] + ref)
+        self.assertEqual(lst + lst, ref + ref)
+        self.assertEqual(lst * 2, ref * 2)
+        self.assertEqual(2 * lst, ref * 2)
+        self.assertTrue(lst == ref and ref == lst)
+        self.assertFalse(lst != ref)
+        self.assertNotEqual(lst, ref[:-1])
+        self.assertNotEqual(lst, tuple(ref))
+        lst.sort()
+        ref.sort()
+        self.assertEqual(lst, ref)
+        lst.sort(key=lambda x: x % 3, reverse=True)
+        ref.sort(key=lambda x: x % 3, reverse=True)
+        self.assertEqual(lst, ref)
+        lst[::2] = range(6)
+        ref[::2] = range(6)
+        self.assertEqual(lst, ref)
+        del lst[1::3]
+        del ref[1::3]
+        self.assertEqual(lst, ref)
+        lst += [20, 21]
+        lst *= 2
+        self.assertEqual(lst, (ref + [20, 21]) * 2)
+        self.assertEqual(owner.invalidated, 6)
+        with self.assertRaises(TypeError):
+            hash(lst)
+
+    def test_insert_in_large_block(self):
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block)
+        a, b = builder.function.args[:2]
+        first = [builder.add(a, b) for i in range(1000)]
+        builder.position_after(first[499])
+        middle = [builder.sub(a, b) for i in range(1000)]
+        builder.position_before(first[0])
+        start = builder.mul(a, b)
+        self.assertEqual(list(block.instructions),
+                         [start] + first[:500] + middle + first[500:])
+        for instr in middle:
+            builder.remove(instr)
+        self.assertEqual(list(block.instructions), [start] + first)
+
     def test_repr(self):
         """
         Blocks should have a useful repr()
@@ -523,6 +814,163 @@ class TestBlock(TestBase):
         self.assertEqual(repr(block), "<ir.Block 'start' of type 'label'>")
 
 
+class TestUses(TestBase):
+
+    def build(self):
+        mod = self.module()
+        mod.track_uses = True
+        fnty = ir.FunctionType(int32, (int32, int32, int1))
+        fn = ir.Function(mod, fnty, 'f')
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        return fn, builder
+
+    def test_uses(self):
+        fn, builder = self.build()
+        a, b, cond = fn.args
+        c = builder.add(a, b, 'c')
+        d = builder.mul(c, c, 'd')
+        e = builder.select(cond, c, a, 'e')
+        builder.ret(e)
+        self.assertEqual(a.uses, [c, e])
+        self.assertEqual(b.uses, [c])
+        self.assertEqual(c.uses, [d, e])
+        self.assertEqual(d.uses, [])
+        self.assertEqual(cond.uses, [e])
+        # Operand mutation updates the uses
+        d.replace_usage(c, b)
+        self.assertEqual(c.uses, [e])
+        self.assertEqual(b.uses, [c, d])
+        # Removed instructions don't use their operands anymore
+        builder.remove(d)
+        self.assertEqual(b.uses, [c])
+
+    def test_replace_all_uses_with(self):
+        fn, builder = self.build()
+        a, b, cond = fn.args
+        entry = builder.block
+        c = builder.add(a, b, 'c')
+        then = builder.append_basic_block('then')
+        merge = builder.append_basic_block('merge')
+        builder.cbranch(cond, then, merge)
+        builder.position_at_end(then)
+        d = builder.mul(c, b, 'd')
+        builder.branch(merge)
+        builder.position_at_end(merge)
+        phi = builder.phi(int32, 'p')
+        phi.add_incoming(c, entry)
+        phi.add_incoming(d, then)
+        builder.ret(phi)
+        self.assertEqual(c.uses, [d, phi])
+        c.replace_all_uses_with(a)
+        self.assertEqual(c.uses, [])
+        self.assertEqual(a.uses, [c, d, phi])
+        self.check_block(then, """\
+            then:
+                %"d" = mul i32 %".1", %".2"
+                br label %"merge"
+            """)
+        self.check_block(merge, """\
+            merge:
+                %"p" = phi i32 [%".1", %"entry"], [%"d", %"then"]
+                ret i32 %"p"
+            """)
+        # Blocks are used by the terminators
+        self.assertEqual(then.uses, [entry.terminator])
+
+    def test_call(self):
+        fn, builder = self.build()
+        a, b, cond = fn.args
+        other = ir.Function(fn.module, fn.ftype, 'g')
+        call = builder.call(fn, (a, b, cond))
+        self.assertEqual(fn.uses, [call])
+        call.callee = other
+        self.assertEqual(fn.uses, [])
+        self.assertEqual(other.uses, [call])
+        self.assertEqual(a.uses, [call])
+
+    def test_track_uses(self):
+        mod = self.module()
+        fn = ir.Function(mod, ir.FunctionType(int32, (int32, int32)), 'f')
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        a, b = fn.args
+        c = builder.add(a, b, 'c')
+        d = builder.add(c, b, 'd')
+        # Without tracking, the uses are unknown
+        self.assertEqual(c.uses, [])
+        # Enabling tracking indexes the existing instructions
+        mod.track_uses = True
+        self.assertEqual(c.uses, [d])
+        self.assertEqual(b.uses, [c, d])
+        mod.track_uses = False
+        self.assertEqual(c.uses, [])
+        self.assertEqual(b.uses, [])
+
+
+class TestTextCaching(TestBase):
+    """
+    The text of functions and blocks is cached until they are mutated.
+    """
+
+    def build(self):
+        mod = self.module()
+        fnty = ir.FunctionType(int32, (int32, int32))
+        funcs = []
+        for name in ('f', 'g'):
+            fn = ir.Function(mod, fnty, name)
+            builder = ir.IRBuilder(fn.append_basic_block('entry'))
+            a, b = fn.args
+            builder.ret(builder.add(a, b, 'c'))
+            funcs.append((fn, builder))
+        return mod, funcs
+
+    def check_fresh(self, mod):
+        # The module text must be the same as the one of a fresh copy
+        text = str(mod)
+        self.assertEqual(text, str(pickle.loads(pickle.dumps(mod, -1))))
+        return text
+
+    def test_clean_functions_are_reused(self):
+        mod, [(f, fb), (g, gb)] = self.build()
+        str(mod)
+        g_body = g._cached_body
+        self.assertIsNotNone(g_body)
+        fb.position_before(f.entry_basic_block.terminator)
+        fb.mul(*f.args, name='d')
+        self.assertIsNone(f._cached_body)
+        self.assertIs(g._cached_body, g_body)
+        self.assertIn('%"d" = mul i32', self.check_fresh(mod))
+
+    def test_mutations(self):
+        mod, [(f, fb), _] = self.build()
+        a, b = f.args
+        [c, ret] = f.entry_basic_block.instructions
+        str(mod)
+        # Operand replacement
+        ret.replace_usage(c, a)
+        self.assertIn('ret i32 %".1"', self.check_fresh(mod))
+        # Block.replace()
+        d = ir.Instruction(f.entry_basic_block, int32, 'sub', (a, b), 'd')
+        f.entry_basic_block.replace(c, d)
+        self.assertIn('%"d" = sub i32', self.check_fresh(mod))
+        # Metadata
+        c.set_metadata('foo', mod.add_metadata([]))
+        d.set_metadata('foo', mod.add_metadata([]))
+        self.assertIn('!foo !0', self.check_fresh(mod))
+        # Removal
+        fb.remove(d)
+        self.assertNotIn('%"d"', self.check_fresh(mod))
+        # New blocks and phis
+        block = f.append_basic_block('other')
+        fb.position_at_end(block)
+        phi = fb.phi(int32, 'p')
+        self.check_fresh(mod)
+        phi.add_incoming(a, f.entry_basic_block)
+        self.assertIn('[%".1", %"entry"]', self.check_fresh(mod))
+        # Direct mutation of the instruction list
+        del f.entry_basic_block.instructions[:]
+        self.assertIn('entry:\nother:', self.check_fresh(mod))
+
+
 class TestBuildInstructions(TestBase):
     """
     Test IR generation of LLVM instructions through the IRBuilder class.
@@ -594,6 +1042,230 @@ class TestBuildInstructions(TestBase):
                 %"t" = lshr i32 %".1", %".2"
             """)
 
+    def test_emit_many(self):
+        def emit(builder, a, b, ff):
+            x = builder.add(a, b)
+            y = builder.mul(x, b)
+            z = builder.sitofp(y, dbl)
+            builder.zext(a, int32)
+            w = builder.fcmp_ordered('<', z, ff)
+            c = builder.icmp_unsigned('>=', x, y)
+            builder.select(w, a, y)
+            builder.select(c, ff, z)
+
+        # The same instructions as emitted one by one
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block)
+        emit(builder, *builder.function.args[:3])
+        expected = self.descr(block)
+
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block)
+        a, b, ff = builder.function.args[:3]
+        res = builder.emit_many([
+            ('add', (a, b)),
+            ('mul', (0, b)),
+            ('sitofp', (-1,), dbl),
+            ('zext', (a,), int32),
+            ('fcmp', (2, ff), 'olt'),
+            ('icmp', (0, 1), 'uge'),
+            ('select', (4, a, 1)),
+            ('select', (5, ff, 2)),
+        ])
+        self.assertEqual(self.descr(block), expected)
+        self.assertEqual(len(res), 8)
+        self.assertIs(res[3], a)
+        self.assertIsInstance(res[2], ir.CastInstr)
+        self.assertEqual(res[4].op, 'olt')
+        self.assertEqual(res[6].operands, [res[4], a, res[1]])
+        # The builder is positioned after the new instructions
+        builder.ret(res[1])
+        self.assertEqual(block.instructions[-1].opname, 'ret')
+
+        with self.assertRaises(ValueError) as cm:
+            builder.emit_many([('add', (a, ff))])
+        self.assertEqual(str(cm.exception),
+                         "Operands must be the same type, got (i32, double)")
+        with self.assertRaises(ValueError):
+            builder.emit_many([('icmp', (a, b), 'olt')])
+        with self.assertRaises(ValueError):
+            builder.emit_many([('ret', (a,))])
+
+    def test_fold_constants(self):
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block, fold_constants=True)
+        a = builder.function.args[0]
+
+        def check(value, typ, constant):
+            self.assertIsInstance(value, ir.Constant)
+            self.assertEqual(value.type, typ)
+            self.assertEqual(value.constant, constant)
+
+        # Integer arithmetic wraps around
+        check(builder.add(int8(100), int8(100)), int8, -56)
+        check(builder.mul(int8(-1), int8(255)), int8, 1)
+        check(builder.sdiv(int8(-7), int8(2)), int8, -3)
+        check(builder.srem(int8(-7), int8(2)), int8, -1)
+        check(builder.udiv(int8(-7), int8(2)), int8, 124)
+        check(builder.ashr(int8(-128), int8(7)), int8, -1)
+        check(builder.lshr(int8(-128), int8(7)), int8, 1)
+        check(builder.neg(int8(-128)), int8, -128)
+        check(builder.not_(int1(True)), int1, False)
+        # IEEE arithmetic, rounded to the type's precision
+        check(builder.fadd(flt(1.0), flt(2.0 ** -30)), flt, 1.0)
+        check(builder.fadd(dbl(1.0), dbl(2.0 ** -30)), dbl, 1.0 + 2.0 ** -30)
+        check(builder.fdiv(dbl(-1.0), dbl(0.0)), dbl, -math.inf)
+        check(builder.fmul(flt(3e38), flt(10.0)), flt, math.inf)
+        self.assertTrue(math.isnan(builder.fsub(dbl(math.inf),
+                                                dbl(math.inf)).constant))
+        # Comparisons
+        check(builder.icmp_signed('<', int8(-1), int8(0)), int1, True)
+        check(builder.icmp_unsigned('<', int8(-1), int8(0)), int1, False)
+        check(builder.fcmp_ordered('!=', dbl(math.nan), dbl(0.0)), int1,
+              False)
+        check(builder.fcmp_unordered('!=', dbl(math.nan), dbl(0.0)), int1,
+              True)
+        # Casts
+        check(builder.trunc(int32(0x1ff), int8), int8, -1)
+        check(builder.zext(int8(-1), int32), int32, 255)
+        check(builder.sext(int8(-1), int32), int32, -1)
+        check(builder.sitofp(int8(-3), dbl), dbl, -3.0)
+        check(builder.uitofp(int64((1 << 24) + 1), flt), flt, 2.0 ** 24)
+        check(builder.fptosi(dbl(-2.5), int8), int8, -2)
+        check(builder.fptrunc(dbl(0.1), flt), flt, struct.unpack(
+            'f', struct.pack('f', 0.1))[0])
+        self.assertIs(builder.select(int1(False), a, int32(1)).constant, 1)
+        self.assertEqual(builder.emit_many([('add', (int32(1), int32(2))),
+                                            ('icmp', (-1, int32(3)), 'eq')]),
+                         [int32(3), int1(True)])
+        # Poison or undefined results aren't folded
+        builder.add(int8(100), int8(100), flags=['nsw'])
+        builder.shl(int8(1), int8(8))
+        builder.sdiv(int8(-128), int8(-1))
+        builder.urem(int8(1), int8(0))
+        builder.fptoui(dbl(-1.0), int8)
+        builder.fadd(dbl(math.inf), dbl(1.0), flags=['ninf'])
+        # Nor are operations on other values
+        builder.add(a, int32(1))
+        self.check_block(block, """\
+            my_block:
+                %".6" = add nsw i8 100, 100
+                %".7" = shl i8 1, 8
+                %".8" = sdiv i8 -128, -1
+                %".9" = urem i8 1, 0
+                %".10" = fptoui double 0xbff0000000000000 to i8
+                %".11" = fadd ninf double 0x7ff0000000000000, 0x3ff0000000000000
+                %".12" = add i32 %".1", 1
+            """)
+
+    def test_cse(self):
+        func = self.function()
+        block = func.append_basic_block('my_block')
+        builder = ir.IRBuilder(block, cse=True)
+        self.assertTrue(builder.cse)
+        a, b = builder.function.args[:2]
+        c = builder.add(a, b)
+        self.assertIs(builder.add(a, b), c)
+        self.assertIs(builder.add(a, int32(1)), builder.add(a, int32(1)))
+        # Operands, flags, types and conditions are distinguished
+        self.assertIsNot(builder.add(b, a), c)
+        self.assertIsNot(builder.add(a, b, flags=['nsw']), c)
+        self.assertIs(builder.zext(a, int64), builder.zext(a, int64))
+        self.assertIsNot(builder.sext(a, int64), builder.zext(a, int64))
+        d = builder.icmp_signed('<', a, b)
+        self.assertIs(builder.icmp_signed('<', a, b), d)
+        self.assertIsNot(builder.icmp_unsigned('<', a, b), d)
+        self.assertIs(builder.select(d, a, b), builder.select(d, a, b))
+        ptr = builder.function.args[3]
+        self.assertIs(builder.gep(ptr, [a]), builder.gep(ptr, [a]))
+        self.assertIsNot(builder.gep(ptr, [a], inbounds=True),
+                         builder.gep(ptr, [a]))
+        # Batches share the cache
+        self.assertEqual(builder.emit_many([('add', (a, b)),
+                                            ('add', (-1, b)),
+                                            ('add', (-1, b))])[:2],
+                         [c, builder.add(c, b)])
+        # Instructions with side effects are never reused
+        self.assertIsNot(builder.load(ptr), builder.load(ptr))
+        n = len(block.instructions)
+        # The cache is kept when returning to the end of a block...
+        other = func.append_basic_block('other')
+        builder.position_at_end(other)
+        e = builder.add(a, b)
+        self.assertIsNot(e, c)
+        builder.position_at_end(block)
+        self.assertIs(builder.add(a, b), c)
+        # ...but dropped when emitting before existing instructions
+        builder.position_before(c)
+        f = builder.add(a, b)
+        self.assertIsNot(f, c)
+        self.assertEqual(len(block.instructions), n + 1)
+        builder.position_at_end(other)
+        builder.remove(e)
+        self.assertIsNot(builder.add(a, b), e)
+        builder.cse = False
+        self.assertIsNot(builder.add(a, b), builder.add(a, b))
+
+    def test_cse_after_removals(self):
+        # Instructions replaced or removed behind the builder's back
+        # aren't reused
+        func = self.function()
+        block = func.append_basic_block('my_block')
+        builder = ir.IRBuilder(block, cse=True)
+        a, b = func.args[:2]
+        c = builder.add(a, b)
+        d = builder.mul(a, b)
+        builder.ret(d)
+        builder.position_before(block.terminator)
+        self.assertIs(builder.add(a, b), c)
+        self.assertIs(builder.mul(a, b), d)
+        e = ir.Instruction(block, int32, 'sub', [a, b])
+        block.replace(c, e)
+        self.assertNotIn(c, block.instructions)
+        c2 = builder.add(a, b)
+        self.assertIsNot(c2, c)
+        self.assertIs(builder.add(a, b), c2)
+        # c2 is unused and removed
+        _, removed = ir.eliminate_dead_code(func.module)
+        self.assertIn(c2, removed)
+        builder.position_before(block.terminator)
+        c3 = builder.add(a, b)
+        self.assertIsNot(c3, c2)
+        self.assertIn(c3, block.instructions)
+        self.assertEqual(builder.emit_many([('add', (a, b))]), [c3])
+
+    def test_emit_many_uses_and_debug_info(self):
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block)
+        builder.module.track_uses = True
+        a, b = builder.function.args[:2]
+        dbg = builder.module.add_metadata([])
+        builder.debug_metadata = dbg
+        x, y = builder.emit_many([('add', (a, b)), ('sub', (0, a))])
+        self.assertEqual(a.uses, [x, y])
+        self.assertEqual(x.uses, [y])
+        self.assertIs(y.metadata['dbg'], dbg)
+
+    def test_emit_many_same_state(self):
+        # The instructions have the same fields as when built one by one
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block)
+        a, b = builder.function.args[:2]
+        ops = [('add', (a, b)), ('zext', (-1,), int64),
+               ('icmp', (a, b), 'slt'), ('select', (-1, a, b))]
+        batch = builder.emit_many(ops)
+        single = [builder.add(a, b), builder.zext(a, int64),
+                  builder.icmp_signed('<', a, b),
+                  builder.select(builder.icmp_signed('<', a, b), a, b)]
+        for x, y in zip(batch, single):
+            self.assertIs(type(x), type(y))
+            for slot in ('parent', 'type', 'opname', 'operands', 'flags',
+                         'metadata', 'name'):
+                getattr(x, slot)
+            self.assertEqual(x.flags, y.flags)
+            self.assertEqual(x.metadata, y.metadata)
+            self.assertEqual(x.opname, y.opname)
+
     def test_binop_flags(self):
         block = self.block(name='my_block')
         builder = ir.IRBuilder(block)
@@ -1913,6 +2585,97 @@ class TestTypes(TestBase):
         for typ in filter(self.has_logical_equality, self.assorted_types()):
             self.assertEqual(hash(typ), hash(copy.copy(typ)))
 
+    def test_interning(self):
+        # Equal types are the same object
+        context = ir.Context()
+        mytype = context.get_identified_type("MyType")
+        for make in (lambda: ir.IntType(1000),
+                     lambda: ir.PointerType(ir.IntType(8), 1),
+                     lambda: ir.FunctionType(int1, [int8, dbl], True),
+                     lambda: ir.ArrayType(ir.VectorType(flt, 4), 3),
+                     lambda: ir.LiteralStructType([int8, mytype], True),
+                     lambda: ir.VoidType(),
+                     lambda: ir.MetaDataType()):
+            typ = make()
+            self.assertIs(make(), typ)
+            self.assertIs(copy.deepcopy(typ), typ)
+            copied = pickle.loads(pickle.dumps(typ, -1))
+            if isinstance(typ, ir.LiteralStructType):
+                # The pickled copy refers to another struct of the same name
+                self.assertEqual(copied, typ)
+                self.assertEqual(hash(copied), hash(typ))
+            else:
+                self.assertIs(copied, typ)
+        self.assertIsNot(ir.LiteralStructType([int8]),
+                         ir.LiteralStructType([int8], packed=True))
+        self.assertIsNot(ir.PointerType(int8), ir.PointerType(int8, 1))
+        with self.assertRaises(AttributeError) as raises:
+            ir.LiteralStructType([int8]).packed = True
+        self.assertIn("immutable", str(raises.exception))
+
+    def test_interned_fields_read_only(self):
+        # Setting a field would change all the equal types
+        node = ir.Context().get_identified_type("node")
+        for typ, fields in [
+                (ir.IntType(32), ['width']),
+                (ir.PointerType(int8, 1), ['pointee', 'addrspace']),
+                (ir.PointerType(node), ['pointee', 'addrspace']),
+                (ir.FunctionType(int32, [int32]),
+                 ['return_type', 'args', 'var_arg']),
+                (ir.VectorType(flt, 4), ['element', 'count']),
+                (ir.ArrayType(int8, 3), ['element', 'count']),
+                (ir.LiteralStructType([int8, dbl]), ['elements', 'packed'])]:
+            text = str(typ)
+            for field in fields:
+                value = getattr(typ, field)
+                with self.assertRaises(AttributeError) as raises:
+                    setattr(typ, field, value)
+                self.assertIn(repr(field), str(raises.exception))
+                self.assertIn(type(typ).__name__, str(raises.exception))
+                self.assertIs(getattr(typ, field), value)
+            self.assertEqual(str(typ), text)
+
+    def test_interning_doesnt_keep_contexts_alive(self):
+        refs = []
+        for i in range(50):
+            ctx = ir.Context()
+            ptr = ctx.get_identified_type('S').as_pointer()
+            ir.FunctionType(ptr, [ir.ArrayType(ptr, 2)])
+            refs.append(weakref.ref(ctx))
+            del ctx, ptr
+        gc.collect()
+        self.assertEqual([ref for ref in refs if ref() is not None], [])
+
+    def test_interning_identified_structs(self):
+        # Types over same-named structs from different contexts are
+        # distinct objects, but still compare equal by name
+        nodes = []
+        for elem in (int32, dbl):
+            node = ir.Context().get_identified_type("node")
+            node.set_body(elem, node.as_pointer())
+            nodes.append(node)
+        ptr1, ptr2 = [node.as_pointer() for node in nodes]
+        self.assertIsNot(ptr1, ptr2)
+        self.assertEqual(ptr1, ptr2)
+        self.assertEqual(hash(ptr1), hash(ptr2))
+        self.assertIs(ptr1.pointee, nodes[0])
+        self.assertIs(ptr2.pointee, nodes[1])
+        arr1, arr2 = [ir.ArrayType(node, 2) for node in nodes]
+        self.assertIsNot(arr1, arr2)
+        self.assertIs(ir.ArrayType(nodes[0], 2), arr1)
+        # GEPs walk the body of their own struct
+        for node, elem in zip(nodes, (int32, dbl)):
+            fnty = ir.FunctionType(ir.VoidType(), [node.as_pointer()])
+            func = ir.Function(ir.Module(), fnty, "f")
+            builder = ir.IRBuilder(func.append_basic_block())
+            ptr = builder.gep(func.args[0], [int32(0), int32(0)])
+            self.assertIs(ptr.type.pointee, elem)
+
+    def test_hash_distribution(self):
+        types = [ir.IntType(n) for n in range(1, 65)]
+        types += [ir.ArrayType(int8, n) for n in range(64)]
+        self.assertEqual(len(set(map(hash, types))), len(types))
+
     def test_gep(self):
         def check_constant(tp, i, expected):
             actual = tp.gep(ir.Constant(int32, i))
@@ -2209,6 +2972,117 @@ class TestConstant(TestBase):
         c = ir.Constant(int32, 0).inttoptr(int64.as_pointer())
         self.assertEqual(str(c), 'inttoptr (i32 0 to i64*)')
 
+    def test_equality(self):
+        arr = ir.ArrayType(int8, 3)
+        c = ir.Constant(arr, bytearray(b"abc"))
+        equal = [ir.Constant(arr, bytearray(b"abc"))]
+        unequal = [ir.Constant(arr, bytearray(b"abd")),
+                   ir.Constant(arr, [ir.Constant(int8, x) for x in b"abc"]),
+                   ir.Constant(ir.ArrayType(ir.IntType(9), 3),
+                               bytearray(b"abc")),
+                   ir.Constant(arr, None), ir.Constant(arr, ir.Undefined)]
+        for other in equal:
+            self.assertEqual(c, other)
+            self.assertEqual(hash(c), hash(other))
+        for other in unequal:
+            self.assertNotEqual(c, other)
+        struct = ir.Constant.literal_struct([ir.Constant(int32, 1), c])
+        self.assertEqual(struct,
+                         ir.Constant.literal_struct([ir.Constant(int32, 1), c]))
+        self.assertNotEqual(struct,
+                            ir.Constant.literal_struct([ir.Constant(int32, 2),
+                                                        c]))
+        # Constants are compared and hashed without being formatted
+        for const in [c, struct] + equal + unequal:
+            self.assertFalse(hasattr(const, '_cached_str'))
+            self.assertFalse(hasattr(const, '_cached_refstr'))
+
+    def test_escape_string(self):
+        data = bytes(range(256))
+        expected = "".join(chr(c) if c in _VALID_CHARS else "\\%02x" % c
+                           for c in data)
+        self.assertEqual(_escape_string(data), expected)
+        self.assertEqual(_escape_string(bytearray(data)), expected)
+        self.assertEqual(_escape_string(b"abc"), "abc")
+        self.assertEqual(_escape_string(b""), "")
+        self.assertEqual("".join(_iter_escaped_chunks(data, 7)), expected)
+
+    def test_from_ndarray(self):
+        c = ir.Constant.from_ndarray(array.array('i', [1, -2, 3]))
+        self.assertEqual(c.type, ir.ArrayType(int32, 3))
+        self.assertEqual(str(c), "[3 x i32] [i32 1, i32 -2, i32 3]")
+        c = ir.Constant.from_ndarray(array.array('d', [1.5, -2.0]))
+        self.assertEqual(str(c), "[2 x double] [double 0x3ff8000000000000, "
+                                 "double 0xc000000000000000]")
+        c = ir.Constant.from_ndarray(array.array('f', [0.1]))
+        self.assertEqual(str(c), "[1 x float] [float 0x3fb99999a0000000]")
+        c = ir.Constant.from_ndarray(bytearray(b'ab"'))
+        self.assertEqual(str(c), '[3 x i8] c"ab\\22"')
+        # Multidimensional data
+        c = ir.Constant.from_ndarray(
+            memoryview(struct.pack('4h', 1, 2, 3, -4)).cast('B')
+            .cast('h', (2, 2)))
+        self.assertEqual(c.type, ir.ArrayType(ir.ArrayType(int16, 2), 2))
+        self.assertEqual(str(c), "[2 x [2 x i16]] [[2 x i16] [i16 1, i16 2], "
+                                 "[2 x i16] [i16 3, i16 -4]]")
+        # Elements aren't turned into constants
+        self.assertIsInstance(c.constant, ir.DataArray)
+        self.assertEqual(c, ir.Constant(c.type, ir.DataArray(
+            struct.pack('4h', 1, 2, 3, -4), int16, (2, 2))))
+        self.assertNotEqual(c, ir.Constant(c.type, ir.DataArray(
+            struct.pack('4h', 1, 2, 3, 4), int16, (2, 2))))
+        with self.assertRaises(TypeError):
+            ir.Constant.from_ndarray(array.array('u', 'abc'))
+        with self.assertRaises(ValueError):
+            ir.DataArray(b'abc', int16)
+
+    def test_metadata_dedup_cost(self):
+        # Deduplicating metadata made of large constants neither formats
+        # them nor recomputes their keys once they are cached.
+        def make_operands():
+            elems = [ir.Constant(int32, i) for i in range(300)]
+            return [ir.Constant.literal_array(elems), "payload"]
+
+        computed = []
+        orig_get_key = ir.Constant._get_key
+
+        def get_key(constant):
+            if constant._key is None:
+                computed.append(constant)
+            return orig_get_key(constant)
+
+        orig_format = ir.IntType.format_constant
+
+        def format_constant(typ, val):
+            self.fail("constant formatted while deduplicating metadata")
+
+        mod = self.module()
+        ir.Constant._get_key = get_key
+        ir.IntType.format_constant = format_constant
+        try:
+            first = mod.add_metadata(make_operands())
+            self.assertEqual(len(computed), 301)
+            second = make_operands()
+            self.assertIs(mod.add_metadata(second), first)
+            self.assertEqual(len(computed), 602)
+            self.assertIs(mod.add_metadata(second), first)
+            self.assertEqual(len(computed), 602)
+        finally:
+            ir.Constant._get_key = orig_get_key
+            ir.IntType.format_constant = orig_format
+
+    def test_key_normalization(self):
+        # Constants of the same type are equal if they describe the same
+        # value, whatever Python type the value was given as
+        self.assertEqual(ir.Constant(dbl, 0), ir.Constant(dbl, 0.0))
+        self.assertEqual(hash(ir.Constant(flt, 2)),
+                         hash(ir.Constant(flt, 2.0)))
+        self.assertNotEqual(ir.Constant(dbl, 0), ir.Constant(dbl, -0.0))
+        self.assertEqual(ir.Constant(int1, True), ir.Constant(int1, 1))
+        # ... but constants of different types never are
+        self.assertNotEqual(ir.Constant(int32, 0), ir.Constant(flt, 0.0))
+        self.assertNotEqual(ir.Constant(int32, 0), ir.Constant(int64, 0))
+
 
 class TestTransforms(TestBase):
     def test_call_transform(self):
@@ -2224,6 +3098,97 @@ class TestTransforms(TestBase):
         self.assertNotEqual(call.callee, foo)
         self.assertEqual(call.callee, bar)
 
+    def test_eliminate_dead_code(self):
+        mod = ir.Module()
+        fnty = ir.FunctionType(int32, (int32, int32, ir.PointerType(int32)))
+        func = ir.Function(mod, fnty, "foo")
+        a, b, ptr = func.args
+        entry = func.append_basic_block('entry')
+        dead = func.append_basic_block('dead')
+        indirect = func.append_basic_block('indirect')
+        exit = func.append_basic_block('exit')
+        builder = ir.IRBuilder(entry)
+        c = builder.add(a, b, 'c')
+        # A chain of unused pure instructions
+        d = builder.mul(c, b, 'd')
+        builder.icmp_signed('<', d, a, 'e')
+        builder.load(ptr, 'f')
+        # Side effects are kept, including atomic loads
+        builder.load_atomic(ptr, 'acquire', 4, 'l')
+        builder.store(c, ptr)
+        builder.branch(exit)
+        builder.position_at_end(dead)
+        g = builder.sub(a, b, 'g')
+        builder.branch(exit)
+        # Blocks whose address is taken are kept
+        builder.position_at_end(indirect)
+        builder.branch(exit)
+        gv = ir.GlobalVariable(mod, int8.as_pointer(), 'addr')
+        gv.initializer = ir.BlockAddress(func, indirect)
+        builder.position_at_end(exit)
+        phi = builder.phi(int32, 'h')
+        phi.add_incoming(c, entry)
+        phi.add_incoming(g, dead)
+        phi.add_incoming(b, indirect)
+        builder.ret(phi)
+
+        blocks, instrs = ir.eliminate_dead_code(mod)
+        self.assertEqual(blocks, [dead])
+        self.assertEqual([instr.name for instr in instrs], ['f', 'e', 'd'])
+        self.check_func_body(func, """\
+            entry:
+              %"c" = add i32 %".1", %".2"
+              %"l" = load atomic i32, i32* %".3" acquire, align 4
+              store i32 %"c", i32* %".3"
+              br label %"exit"
+            indirect:
+              br label %"exit"
+            exit:
+              %"h" = phi i32 [%"c", %"entry"], [%".2", %"indirect"]
+              ret i32 %"h"
+            """)
+        self.assert_valid_ir(mod)
+        self.assertEqual(ir.eliminate_dead_code(mod), ([], []))
+
+    def test_eliminate_dead_code_custom_instructions(self):
+        # Plain instructions are only removed for known pure opnames
+        mod = ir.Module()
+        fnty = ir.FunctionType(ir.VoidType(), (flt,))
+        func = ir.Function(mod, fnty, "foo")
+        block = func.append_basic_block('entry')
+        x = func.args[0]
+        custom = ir.Instruction(block, flt, 'my.op', [x], name='c')
+        block.instructions.append(custom)
+        neg = ir.Instruction(block, flt, 'fneg', [x], name='n')
+        block.instructions.append(neg)
+        builder = ir.IRBuilder(block)
+        add = builder.fadd(x, x, 'a')
+        builder.ret_void()
+        _, instrs = ir.eliminate_dead_code(mod)
+        self.assertEqual(sorted(instr.name for instr in instrs), ['a', 'n'])
+        self.assertEqual(list(block.instructions),
+                         [custom, block.terminator])
+        self.assertNotIn(add, block.instructions)
+
+    def test_eliminate_dead_code_tracked_uses(self):
+        mod = ir.Module()
+        mod.track_uses = True
+        fnty = ir.FunctionType(int32, (int32, int32))
+        func = ir.Function(mod, fnty, "foo")
+        a, b = func.args
+        builder = ir.IRBuilder(func.append_basic_block('entry'))
+        c = builder.add(a, b, 'c')
+        builder.ret(a)
+        dead = func.append_basic_block('dead')
+        builder.position_at_end(dead)
+        builder.ret(builder.sub(b, a, 'd'))
+        self.assertEqual(len(a.uses), 3)
+        blocks, instrs = ir.eliminate_dead_code(mod)
+        self.assertEqual(blocks, [dead])
+        self.assertEqual(instrs, [c])
+        self.assertEqual(len(a.uses), 1)
+        self.assertEqual(len(b.uses), 0)
+
 
 class TestSingleton(TestBase):
     def test_undefined(self):
@@ -2233,5 +3198,482 @@ class TestSingleton(TestBase):
         self.assert_pickle_correctly(ir.Undefined)
 
 
+class TestMemoryUsage(TestBase):
+    """
+    Memory footprint of the IR object model.
+    """
+
+    class DictInstruction(ir.Instruction):
+        # Emulates the former object model: an instance __dict__ and
+        # eagerly created flags and metadata containers.
+        def __init__(self, *args, **kwargs):
+            super(TestMemoryUsage.DictInstruction, self).__init__(*args,
+                                                                  **kwargs)
+            self.flags = []
+            self.metadata = {}
+
+    def bytes_per_instruction(self, cls, count=2000):
+        fn = self.function()
+        block = fn.append_basic_block()
+        a, b = fn.args[:2]
+        instrs = []
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(count):
+                instrs.append(cls(block, int32, "add", (a, b)))
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return (after - before) / count
+
+    def test_bytes_per_instruction(self):
+        slotted = self.bytes_per_instruction(ir.Instruction)
+        with_dict = self.bytes_per_instruction(self.DictInstruction)
+        self.assertLess(slotted, with_dict)
+
+    def test_no_instance_dict(self):
+        block = self.block(name='my_block')
+        builder = ir.IRBuilder(block)
+        a, b = builder.function.args[:2]
+        instr = builder.add(a, b, 'c')
+        self.assertFalse(hasattr(instr, '__dict__'))
+        self.assertFalse(hasattr(a, '__dict__'))
+        self.assertFalse(hasattr(block, '__dict__'))
+        with self.assertRaises(AttributeError):
+            instr.foo = 42
+        # Flags and metadata are created on demand
+        self.assertEqual(instr.flags, [])
+        instr.flags.append('nsw')
+        instr.set_metadata('foo', builder.module.add_metadata([]))
+        self.check_block(block, """\
+            my_block:
+                %"c" = add nsw i32 %".1", %".2", !foo !0
+            """)
+
+    def test_subclass_attributes(self):
+        class MyInstruction(ir.Instruction):
+            pass
+
+        block = self.block()
+        a, b = block.function.args[:2]
+        instr = MyInstruction(block, int32, "add", (a, b))
+        instr.foo = 42
+        self.assertEqual(instr.foo, 42)
+        self.assertIn('add', str(instr))
+
+    def test_pickle_module(self):
+        mod = self.module()
+        fn = ir.Function(mod, ir.FunctionType(int32, [int32, int32]), "f")
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        a, b = fn.args
+        c = builder.add(a, b, 'c')
+        c.flags.append('nsw')
+        builder.ret(c)
+        for proto in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            newmod = pickle.loads(pickle.dumps(mod, protocol=proto))
+            self.assertEqual(str(mod), str(newmod))
+
+
+class TestSerialization(TestBase):
+    """
+    Test Module.serialize() and Module.deserialize().
+    """
+
+    def build_module(self, context):
+        mod = ir.Module(context=context)
+        node = context.get_identified_type('node')
+        node.set_body(int32, node.as_pointer())
+        gv = ir.GlobalVariable(mod, node, 'head')
+        gv.initializer = ir.Constant(node, [int32(1), node.as_pointer()(None)])
+        ir.GlobalVariable(mod, int8.as_pointer(), 'p').initializer = \
+            gv.bitcast(int8.as_pointer())
+        data = ir.Constant.from_ndarray(array.array('d', [1.5, -0.0, 2.0]))
+        ir.GlobalVariable(mod, data.type, 'data').initializer = data
+        msg = ir.Constant(ir.ArrayType(int8, 3), bytearray(b'hi\0'))
+        ir.GlobalVariable(mod, msg.type, 'msg').initializer = msg
+
+        callee = ir.Function(mod, ir.FunctionType(dbl, [dbl]), 'callee')
+        callee.attributes.add('readnone')
+        fn = ir.Function(mod, ir.FunctionType(int32, [int32, dbl]), 'fn')
+        fn.args[0].add_attribute('signext')
+        entry = fn.append_basic_block('entry')
+        loop = fn.append_basic_block('loop')
+        done = fn.append_basic_block('done')
+        builder = ir.IRBuilder(entry)
+        x, y = fn.args
+        c = builder.add(x, int32(1), 'c', flags=['nsw'])
+        c.set_metadata('foo', mod.add_metadata([int32(42), 'bar']))
+        builder.branch(loop)
+        builder.position_at_end(loop)
+        phi = builder.phi(int32)
+        phi.add_incoming(c, entry)
+        z = builder.call(callee, [y], fastmath=('fast',))
+        builder.insert_value(ir.Constant(ir.LiteralStructType([int32, dbl]),
+                                         ir.Undefined), z, 1)
+        sw = builder.switch(phi, done)
+        sw.add_case(int32(3), loop)
+        phi.add_incoming(phi, loop)
+        builder.position_at_end(done)
+        builder.ret(phi)
+        mod.add_named_metadata('named', ['a', None])
+        return mod
+
+    def test_roundtrip(self):
+        context = ir.Context()
+        mod = self.build_module(context)
+        data = mod.serialize()
+        self.assertIsInstance(data, bytes)
+        newmod = ir.Module.deserialize(data, context)
+        self.assertIsNot(newmod, mod)
+        self.assertEqual(str(newmod), str(mod))
+        self.assertIs(newmod.context, context)
+        self.assertIs(newmod.get_global('fn').args[0].type, int32)
+        # Any buffer is accepted
+        newmod = ir.Module.deserialize(memoryview(bytearray(data)), context)
+        self.assertEqual(str(newmod), str(mod))
+        self.assertEqual(str(ir.Module().deserialize(data, context)),
+                         str(mod))
+
+    def test_names(self):
+        # The name scopes are restored, so that names are allocated as in
+        # the original module
+        mod = self.build_module(ir.Context())
+        newmod = ir.Module.deserialize(mod.serialize(), mod.context)
+        for m in (mod, newmod):
+            with self.assertRaises(ir._utils.DuplicatedNameError):
+                ir.Function(m, ir.FunctionType(int32, []), 'fn')
+            block = m.get_global('fn').append_basic_block('loop')
+            builder = ir.IRBuilder(block)
+            builder.add(int32(1), int32(2), 'c')
+            builder.ret_void()
+        self.assertEqual(str(newmod), str(mod))
+        self.assertIn('%"c.1" = add i32 1, 2', str(newmod))
+
+    def test_context(self):
+        mod = self.build_module(ir.Context())
+        data = mod.serialize()
+        # Identified types are created in the given context
+        context = ir.Context()
+        newmod = ir.Module.deserialize(data, context)
+        self.assertEqual(str(newmod), str(mod))
+        node = context.get_identified_type('node')
+        self.assertEqual(node.elements, (int32, node.as_pointer()))
+        # ... which must not define them differently
+        context = ir.Context()
+        context.get_identified_type('node').set_body(int64)
+        with self.assertRaises(ValueError):
+            ir.Module.deserialize(data, context)
+
+    def test_track_uses(self):
+        mod = self.module()
+        mod.track_uses = True
+        fn = ir.Function(mod, ir.FunctionType(int32, [int32]), 'f')
+        builder = ir.IRBuilder(fn.append_basic_block())
+        c = builder.add(fn.args[0], fn.args[0], 'c')
+        builder.ret(c)
+        newmod = ir.Module.deserialize(mod.serialize())
+        self.assertTrue(newmod.track_uses)
+        newfn = newmod.get_global('f')
+        ret = newfn.blocks[0].instructions[1]
+        self.assertEqual(newfn.blocks[0].instructions[0].uses, [ret])
+        newfn.args[0].replace_all_uses_with(int32(2))
+        self.assertIn('%"c" = add i32 2, 2', str(newmod))
+
+    def test_errors(self):
+        mod = self.module()
+        data = mod.serialize()
+        with self.assertRaises(ValueError):
+            ir.Module.deserialize(b'LLVM' + data[4:])
+        with self.assertRaises(ValueError):
+            ir.Module.deserialize(data[:4] + b'\xff\xff' + data[6:])
+        with self.assertRaises(ValueError):
+            ir.Module.deserialize(data[:-10])
+        # Objects which can't be serialized
+        mod.foo = lambda: None
+        with self.assertRaises(TypeError):
+            mod.serialize()
+
+
+class TestVerifier(TestBase):
+    """
+    Test Module.verify().
+    """
+
+    def function(self, module=None, name='f'):
+        module = module or self.module()
+        fnty = ir.FunctionType(int32, [int32, int32.as_pointer()])
+        return ir.Function(module, fnty, name)
+
+    def assert_valid(self, mod):
+        mod.verify()
+        llvm.parse_assembly(str(mod)).verify()
+
+    def assert_invalid(self, mod, msg, check_llvm=True):
+        with self.assertRaises(ir.VerificationError) as cm:
+            mod.verify()
+        self.assertIn(msg, str(cm.exception))
+        if not check_llvm:
+            return
+        # LLVM agrees
+        for fn in mod.functions:
+            for block in fn.blocks:
+                for instr in block.instructions:
+                    instr._clear_string_cache()
+        with self.assertRaises(RuntimeError):
+            llvm.parse_assembly(str(mod)).verify()
+
+    def loop_function(self):
+        fn = self.function()
+        entry = fn.append_basic_block('entry')
+        loop = fn.append_basic_block('loop')
+        done = fn.append_basic_block('done')
+        builder = ir.IRBuilder(entry)
+        n, p = fn.args
+        builder.branch(loop)
+        builder.position_at_end(loop)
+        phi = builder.phi(int32, 'i')
+        phi.add_incoming(int32(0), entry)
+        inc = builder.add(phi, int32(1), 'inc')
+        phi.add_incoming(inc, loop)
+        builder.store(inc, p)
+        builder.cbranch(builder.icmp_signed('<', inc, n), loop, done)
+        builder.position_at_end(done)
+        builder.ret(inc)
+        return fn, builder, phi
+
+    def test_valid(self):
+        fn, builder, phi = self.loop_function()
+        self.assert_valid(fn.module)
+        # Uses in unreachable code need not be dominated
+        dead = fn.append_basic_block('dead')
+        builder.position_at_end(dead)
+        builder.ret(fn.blocks[1].instructions[1])
+        self.assert_valid(fn.module)
+
+    def test_terminators(self):
+        fn = self.function()
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        builder.add(fn.args[0], fn.args[0])
+        self.assert_invalid(fn.module, "block is not terminated")
+        builder.ret(fn.args[0])
+        block = fn.blocks[0]
+        block.instructions.insert(0, ir.Ret(block, "ret", fn.args[0]))
+        # LLVM would parse the instructions after the first "ret" as
+        # another block
+        self.assert_invalid(fn.module, "terminator in the middle",
+                            check_llvm=False)
+
+    def test_phi(self):
+        fn, builder, phi = self.loop_function()
+        del phi.incomings[1]
+        self.assert_invalid(fn.module,
+                            'phi node has no entry for predecessor %"loop"')
+        phi.add_incoming(int32(1), fn.blocks[1])
+        phi.add_incoming(int32(1), fn.blocks[2])
+        self.assert_invalid(fn.module, 'an entry for %"done", which is not')
+        del phi.incomings[2]
+        phi.add_incoming(int64(0), fn.blocks[0])
+        self.assert_invalid(fn.module, "incoming value of type i64")
+        del phi.incomings[2]
+        phi._clear_string_cache()
+        self.assert_valid(fn.module)
+        # Phi nodes come first
+        block = fn.blocks[1]
+        block.instructions.insert(0, block.instructions.pop(1))
+        self.assert_invalid(fn.module, "phi node after a non-phi")
+
+    def test_types(self):
+        fn, builder, phi = self.loop_function()
+        store = fn.blocks[1].instructions[2]
+        store.operands = (int64(1), store.operands[1])
+        self.assert_invalid(fn.module, "stored value doesn't match")
+        store.operands = (int32(1), store.operands[1])
+        ret = fn.blocks[2].instructions[0]
+        ret.operands = [int64(1)]
+        self.assert_invalid(fn.module, "returned value doesn't match")
+
+        fn = self.function()
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        call = builder.call(fn, fn.args)
+        builder.ret(call)
+        call.operands = [fn, fn.args[1], fn.args[1]]
+        self.assert_invalid(fn.module, "argument #1 of type i32*")
+        call.operands = [fn, fn.args[0]]
+        self.assert_invalid(fn.module, "wrong number of arguments")
+
+    def test_dominance(self):
+        fn, builder, phi = self.loop_function()
+        block = fn.blocks[1]
+        # Use before definition in the same block
+        inc = block.instructions[1]
+        store = block.instructions[2]
+        block.instructions[1:3] = [store, inc]
+        self.assert_invalid(fn.module, "used before its definition")
+        block.instructions[1:3] = [inc, store]
+        self.assert_valid(fn.module)
+
+        # Diamond: a value defined on one side is used after the join
+        fn = self.function(name='g')
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        cond = builder.icmp_signed('<', fn.args[0], int32(0))
+        with builder.if_then(cond):
+            val = builder.add(fn.args[0], int32(1), 'val')
+        builder.ret(val)
+        self.assert_invalid(fn.module,
+                            'definition of %"val" doesn\'t dominate its use')
+
+    def test_other_function(self):
+        fn, builder, phi = self.loop_function()
+        other = self.function(fn.module, 'other')
+        builder = ir.IRBuilder(other.append_basic_block('entry'))
+        builder.ret(fn.args[0])
+        with self.assertRaises(ir.VerificationError) as cm:
+            fn.module.verify()
+        self.assertIn("argument of another function", str(cm.exception))
+
+
+class TestDeferredBodies(TestBase):
+    """
+    Test functions with a deferred body.
+    """
+
+    def build_module(self):
+        mod = self.module()
+        fnty = ir.FunctionType(int32, [int32])
+        built = []
+
+        def body(fn):
+            built.append(fn.name)
+            builder = ir.IRBuilder(fn.append_basic_block('entry'))
+            res = fn.args[0]
+            for callee in callees.get(fn.name, ()):
+                res = builder.call(mod.get_global(callee), [res])
+            builder.ret(res)
+
+        callees = {'main': ['helper'], 'helper': ['helper', 'leaf']}
+        for name in ('main', 'helper', 'leaf', 'unused'):
+            fn = ir.Function(mod, fnty, name)
+            if name != 'main':
+                fn.linkage = 'internal'
+            fn.defer_body(body)
+        return mod, built
+
+    def test_export(self):
+        mod, built = self.build_module()
+        self.assertEqual(built, [])
+        self.assertTrue(mod.get_global('leaf').is_deferred)
+        self.assertFalse(mod.get_global('leaf').is_declaration)
+        # The exported function is built, then the functions it calls
+        # (including itself)
+        asm = str(mod)
+        self.assertEqual(built, ['main', 'helper', 'leaf'])
+        self.assertNotIn('unused', asm)
+        self.assertIn('call i32 @"leaf"', asm)
+        self.assertTrue(mod.get_global('unused').is_deferred)
+        self.assertEqual(''.join(mod.iter_text_chunks()), asm)
+        llvm.parse_assembly(asm).verify()
+        mod.verify()
+        # Building a function explicitly adds it
+        mod.get_global('unused').materialize()
+        self.assertEqual(built, ['main', 'helper', 'leaf', 'unused'])
+        self.assertIn('define internal i32 @"unused"', str(mod))
+
+    def test_call(self):
+        mod, built = self.build_module()
+        fn = ir.Function(mod, ir.FunctionType(int32, [int32]), 'caller')
+        builder = ir.IRBuilder(fn.append_basic_block('entry'))
+        builder.call(mod.get_global('leaf'), fn.args)
+        self.assertEqual(built, ['leaf'])
+        self.assertFalse(mod.get_global('leaf').is_deferred)
+        with self.assertRaises(ValueError):
+            fn.defer_body(lambda fn: None)
+
+    def test_referenced_as_value(self):
+        # Internal functions used as values rather than called are built
+        # too, e.g. callbacks passed as arguments, stored or used in a
+        # global's initializer
+        mod = self.module()
+        cbty = ir.FunctionType(ir.VoidType(), [])
+        built = []
+
+        def body(fn):
+            built.append(fn.name)
+            ir.IRBuilder(fn.append_basic_block('entry')).ret_void()
+
+        cbs = []
+        for name in ('cb', 'stored', 'table_cb', 'unused'):
+            cb = ir.Function(mod, cbty, name)
+            cb.linkage = 'internal'
+            cb.defer_body(body)
+            cbs.append(cb)
+        cb, stored, table_cb, _ = cbs
+        register = ir.Function(
+            mod, ir.FunctionType(ir.VoidType(), [int8.as_pointer()]),
+            'register')
+        main = ir.Function(mod, ir.FunctionType(ir.VoidType(), []), 'main')
+        builder = ir.IRBuilder(main.append_basic_block('entry'))
+        builder.call(register, [builder.bitcast(cb, int8.as_pointer())])
+        slot = builder.alloca(cbty.as_pointer())
+        builder.store(stored, slot)
+        builder.ret_void()
+        table = ir.GlobalVariable(mod, ir.ArrayType(int8.as_pointer(), 1),
+                                  'table')
+        table.initializer = ir.Constant(table.value_type,
+                                        [table_cb.bitcast(int8.as_pointer())])
+        self.assertEqual(built, [])
+        asm = str(mod)
+        self.assertEqual(sorted(built), ['cb', 'stored', 'table_cb'])
+        self.assertIn('define internal void @"cb"', asm)
+        self.assertNotIn('unused', asm)
+        llvm.parse_assembly(asm).verify()
+        mod.verify()
+        m = llvm.parse_bitcode(mod.as_bitcode())
+        self.assertEqual(sorted(f.name for f in m.functions),
+                         ['cb', 'main', 'register', 'stored', 'table_cb'])
+
+    def test_failing_body(self):
+        # A callback which raises leaves the function deferred, rather
+        # than turning it into a declaration
+        mod = self.module()
+        mod.track_uses = True
+        fn = ir.Function(mod, ir.FunctionType(int32, [int32]), 'h')
+        calls = []
+
+        def body(fn):
+            calls.append(fn)
+            builder = ir.IRBuilder(fn.append_basic_block('entry'))
+            builder.add(fn.args[0], fn.args[0])
+            if len(calls) == 1:
+                raise ZeroDivisionError
+            builder.ret(fn.args[0])
+
+        fn.defer_body(body)
+        with self.assertRaises(ZeroDivisionError):
+            str(mod)
+        self.assertTrue(fn.is_deferred)
+        self.assertEqual(fn.blocks, [])
+        self.assertEqual(fn.args[0].uses, [])
+        asm = str(mod)
+        self.assertEqual(len(calls), 2)
+        self.assertIn('define i32 @"h"', asm)
+        llvm.parse_assembly(asm).verify()
+
+    def test_bitcode(self):
+        mod, built = self.build_module()
+        bc = mod.as_bitcode()
+        self.assertEqual(built, ['main', 'helper', 'leaf'])
+        m = llvm.parse_bitcode(bc)
+        self.assertEqual(sorted(f.name for f in m.functions),
+                         ['helper', 'leaf', 'main'])
+
+    def test_serialize(self):
+        mod, built = self.build_module()
+        data = mod.serialize()
+        # The bodies can't be serialized, so they are all built
+        self.assertEqual(sorted(built), ['helper', 'leaf', 'main', 'unused'])
+        self.assertEqual(str(ir.Module.deserialize(data)), str(mod))
+
+
 if __name__ == '__main__':
     unittest.main()